@@ -0,0 +1,116 @@
+'''
+   Times building the Paths table of an APFS volume db from DirEntries, with
+   ApfsFileSystemParser.populate_paths_table() against the recursive query
+   used earlier, on a synthetic volume. Each is run in its own process, to
+   also get its peak memory use (max RSS). The two Paths tables are then
+   compared.
+
+   Usage: python benchmarks/bench_apfs_paths.py [num_entries] [repeat]
+'''
+import collections
+import hashlib
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_folder)
+
+from plugins.helpers.apfs_reader import ApfsFileSystemParser
+from plugins.helpers.writer import DataType, SqliteWriter
+
+recursive_query = 'INSERT INTO "vol_Paths" SELECT * FROM ( WITH RECURSIVE under_root(path,name,cnid) AS '\
+                  '( VALUES(\'\',\'root\',2) UNION ALL SELECT under_root.path || \'/\' || "vol_DirEntries".name, '\
+                  '"vol_DirEntries".name, "vol_DirEntries".cnid FROM "vol_DirEntries" JOIN under_root ON '\
+                  '"vol_DirEntries".parent_cnid=under_root.cnid ORDER BY 1 ) SELECT CNID, Path FROM under_root)'
+
+def CreateVolumeDb(db_path, num_entries, max_depth=16):
+    '''DirEntries of a tree with about 1 in 8 items being folders, at most max_depth
+       deep (as on a real volume), a few hard links & orphans'''
+    rng = random.Random(31)
+    writer = SqliteWriter()
+    writer.OpenSqliteDb(db_path)
+    dir_info = collections.OrderedDict([('CNID', DataType.INTEGER), ('Parent_CNID', DataType.INTEGER), ('Name', DataType.TEXT)])
+    writer.CreateTable(dir_info, 'vol_DirEntries')
+    folders = [2]
+    depths = { 2: 0 }
+    rows = [[2, 1, 'root']]
+    for cnid in range(16, num_entries + 16):
+        parent = folders[-rng.randint(1, min(len(folders), 200))] # mostly near recently created folders
+        while depths[parent] >= max_depth:
+            parent = rng.choice(folders)
+        if rng.random() < 0.125:
+            folders.append(cnid)
+            depths[cnid] = depths[parent] + 1
+            name = 'folder_{}'.format(cnid)
+        else:
+            name = 'file_{}.{}'.format(cnid, rng.choice(('plist', 'db', 'txt', 'jpg')))
+        rows.append([cnid, parent, name])
+        if rng.random() < 0.001:
+            rows.append([cnid, rng.choice(folders), name + '_link']) # file hard link
+        if len(rows) >= 100000:
+            writer.WriteRows(rows, 'vol_DirEntries')
+            rows = []
+    rows.append([num_entries + 100, num_entries + 99, 'orphan'])
+    writer.WriteRows(rows, 'vol_DirEntries')
+    writer.CloseDb()
+
+def BuildPaths(db_path, method):
+    writer = SqliteWriter()
+    writer.OpenSqliteDb(db_path)
+    writer.CreateTable(collections.OrderedDict([('CNID', DataType.INTEGER), ('Path', DataType.TEXT)]), 'vol_Paths')
+    start = time.perf_counter()
+    if method == 'query':
+        writer.RunQuery(recursive_query, True)
+        writer.RunQuery('UPDATE "vol_Paths" SET path = \'/\' where cnid = 2;', True)
+    else:
+        ApfsFileSystemParser.populate_paths_table(types.SimpleNamespace(name='vol', dbo=writer))
+    elapsed = time.perf_counter() - start
+    writer.CloseDb()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024 # KB on linux
+    print(elapsed, max_rss)
+
+def GetPathsDigest(db_path):
+    writer = SqliteWriter()
+    writer.OpenSqliteDb(db_path)
+    hasher = hashlib.sha256()
+    for row in writer.conn.execute('SELECT CNID, Path FROM vol_Paths ORDER BY CNID, Path'):
+        hasher.update(repr(row).encode('utf8'))
+    writer.CloseDb()
+    return hasher.hexdigest()
+
+def Main(num_entries, repeat):
+    temp_folder = tempfile.mkdtemp()
+    try:
+        source_db_path = os.path.join(temp_folder, 'source.db')
+        print('Creating volume db with {} DirEntries'.format(num_entries))
+        CreateVolumeDb(source_db_path, num_entries)
+        digests = []
+        for name, method in (('Recursive query (earlier)', 'query'), ('populate_paths_table', 'python')):
+            results = []
+            for _ in range(repeat):
+                db_path = os.path.join(temp_folder, method + '.db')
+                shutil.copyfile(source_db_path, db_path)
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--build', db_path, method],
+                                        capture_output=True, text=True, check=True).stdout.split()
+                results.append((float(output[0]), int(output[1])))
+            elapsed, max_rss = min(results)
+            print('{:<28} {:>8.2f} s   max RSS {:>7.1f} MB'.format(name, elapsed, max_rss / 1048576))
+            digests.append(GetPathsDigest(db_path))
+        print('Paths tables are {}'.format('identical' if digests[0] == digests[1] else 'DIFFERENT'))
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--build':
+        BuildPaths(sys.argv[2], sys.argv[3])
+    else:
+        Main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000, int(sys.argv[2]) if len(sys.argv) > 2 else 3)
@@ -0,0 +1,158 @@
+'''
+   Compares the combined System+Data volume built as views (the current
+   ApfsFileSystemParser.create_linked_volume_tables()) with the earlier one,
+   which copied all rows of both volumes into new tables and indexed them.
+   On a synthetic APFS db, it reports the time to create the combined
+   volume, the growth of the db file, and the lookup latency of
+   GetFileMetadataByPath (best of 5 passes), GetFileMetadataByCnid and
+   ListItemsInFolder on it.
+
+   Usage: python benchmarks/bench_combined_volume.py [num_items] [num_lookups]
+'''
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_folder)
+
+import plugins.helpers.apfs as apfs
+from plugins.helpers.apfs_reader import ApfsFileSystemParser, ApfsSysDataLinkedVolume, ApfsVolume, DataCache
+from plugins.helpers.writer import SqliteWriter
+
+firmlinks = { '/Users': 'Users', '/Applications': 'Applications', '/Library': 'Library' }
+
+def GetParser(name, writer):
+    volume = types.SimpleNamespace(name=name, container=types.SimpleNamespace(apfs=apfs.Apfs), encryption_key=None)
+    return ApfsFileSystemParser(volume, writer)
+
+def CreateVolume(parser, top_folders, num_items, first_cnid, rng, max_depth=16):
+    '''Fill the volume tables with a synthetic tree, returns list of (cnid, path, is_folder)'''
+    parser.create_tables()
+    items = [(2, '/', True)]
+    folders = [(2, '')]
+    for name in top_folders:
+        folders.append((first_cnid, '/' + name))
+        items.append((first_cnid, '/' + name, True))
+        first_cnid += 1
+    for cnid in range(first_cnid, first_cnid + num_items):
+        parent_cnid, parent_path = folders[-rng.randint(1, min(len(folders), 100))]
+        while parent_path.count('/') >= max_depth:
+            parent_cnid, parent_path = rng.choice(folders)
+        is_folder = rng.random() < 0.125
+        path = '{}/item_{}'.format(parent_path, cnid)
+        items.append((cnid, path, is_folder))
+        if is_folder:
+            folders.append((cnid, path))
+    parents = { path: cnid for cnid, path, is_folder in items if is_folder }
+    inodes, dir_entries, paths, extents = [], [], [], []
+    for cnid, path, is_folder in items:
+        parent_cnid = 1 if cnid == 2 else parents[path.rsplit('/', 1)[0] or '/']
+        name = 'root' if cnid == 2 else path.rsplit('/', 1)[1]
+        size = 0 if is_folder else rng.randint(1, 100000)
+        mode = 0o40755 if is_folder else 0o100644
+        inodes.append([0, 1, cnid, parent_cnid, cnid, name, 0, 0, 0, 0, 0, 1, 0, 501, 20, mode, size, size, 0, '', None])
+        if cnid != 2:
+            dir_entries.append([0, 1, cnid, parent_cnid, 0, 8 if not is_folder else 4, name, '', None])
+        paths.append([cnid, path])
+        if not is_folder:
+            extents.append([0, 1, cnid, 0, size, rng.randint(100, 1000000), '', None])
+    for table_type, rows in (('Inodes', inodes), ('DirEntries', dir_entries), ('Paths', paths), ('Extents', extents)):
+        for index in range(0, len(rows), 100000):
+            parser.dbo.WriteRows(rows[index:index + 100000], parser.name + '_' + table_type)
+    parser.create_indexes()
+    return items
+
+def CreateCopiedVolumeTables(parser, sys_vol, data_vol, firmlink_paths):
+    '''The earlier create_linked_volume_tables(), copying rows into new tables'''
+    paths = ['"' + x + '"' for x in firmlink_paths]
+    query = ' SELECT p.CNID, Parent_CNID, p.Path FROM "{0}_Paths" p INNER JOIN "{0}_Inodes" i ON p.CNID=i.CNID'\
+            ' WHERE PATH IN ({1});'.format(sys_vol.name, ",".join(paths))
+    success, cursor, error = parser.dbo.RunQuery(query)
+    cnids = '1,2,3' + ''.join(',' + str(row[0]) for row in cursor)
+    parser.create_tables()
+    view_query = 'INSERT INTO "{4}_{0}" select {5} FROM (select * from "{1}_{0}" UNION ALL select * from "{2}_{0}" WHERE cnid not in ({3}) )'
+    for table_type, column_info in (('Hardlinks', parser.hardlink_info), ('Extents', parser.extent_info), ('Attributes', parser.attr_info),
+            ('Inodes', parser.inode_info), ('DirEntries', parser.dir_info), ('DirStats', parser.dir_stats_info),
+            ('Compressed_Files', parser.compressed_info), ('Paths', parser.paths_info)):
+        columns = ','.join([x for x in column_info]) if table_type == 'Paths' else ','.join([x for x in column_info][:-1]) + ',NULL'
+        parser.run_query(view_query.format(table_type, data_vol.name, sys_vol.name, cnids, parser.name, columns), True)
+    parser.create_indexes()
+
+def GetVolume(volume_class, name, writer):
+    '''A volume object that only reads from the db'''
+    volume = volume_class.__new__(volume_class)
+    volume.name = name
+    volume.dbo = writer
+    volume.files_meta_cache = DataCache()
+    return volume
+
+def TimeLookups(volume, items, num_lookups, rng):
+    files = [x for x in items if x[1] in firmlinks] + rng.sample(items, num_lookups) # firmlinked folders have their parents fixed up
+    folders = rng.sample([x for x in items if x[2]], max(1, num_lookups // 10))
+    results = {}
+    results['path_time'] = float('inf')
+    for _ in range(5): # best of 5, the by path lookups are quick, a single pass is too noisy
+        start = time.perf_counter()
+        results['path'] = [(x.cnid, x.parent_cnid) for x in (volume.GetFileMetadataByPath(path) for cnid, path, is_folder in files)]
+        results['path_time'] = min(results['path_time'], (time.perf_counter() - start) / len(files))
+    start = time.perf_counter()
+    results['cnid'] = [volume.GetFileMetadataByCnid(cnid).path for cnid, path, is_folder in files]
+    results['cnid_time'] = (time.perf_counter() - start) / len(files)
+    start = time.perf_counter()
+    results['list'] = [sorted(x['name'] for x in volume.ListItemsInFolder(path)) for cnid, path, is_folder in folders]
+    results['list_time'] = (time.perf_counter() - start) / len(folders)
+    return results
+
+def Main(num_items, num_lookups):
+    temp_folder = tempfile.mkdtemp()
+    try:
+        source_db_path = os.path.join(temp_folder, 'source.db')
+        writer = SqliteWriter()
+        writer.OpenSqliteDb(source_db_path)
+        rng = random.Random(32)
+        print('Creating System ({0}) & Data ({1}) volumes'.format(num_items // 5, num_items - num_items // 5))
+        sys_items = CreateVolume(GetParser('Sys', writer), ['System', 'usr', 'Users', 'Applications', 'Library'], num_items // 5, 100, rng)
+        data_items = CreateVolume(GetParser('Data', writer), ['Users', 'Applications', 'Library', 'private'], num_items - num_items // 5, 10000000, rng)
+        writer.CloseDb()
+        firmlinked = set(firmlinks)
+        items = [x for x in sys_items if x[0] > 2 and x[1] not in firmlinked] + [x for x in data_items if x[0] > 2]
+
+        results = []
+        for label in ('Copied tables (earlier)', 'Views'):
+            db_path = os.path.join(temp_folder, 'combined.db')
+            shutil.copyfile(source_db_path, db_path)
+            writer = SqliteWriter()
+            writer.OpenSqliteDb(db_path)
+            parser = GetParser('Combined', writer)
+            sys_vol, data_vol = types.SimpleNamespace(name='Sys'), types.SimpleNamespace(name='Data')
+            start = time.perf_counter()
+            if label == 'Views':
+                parser.create_linked_volume_tables(sys_vol, data_vol, list(firmlinks), firmlinks)
+            else:
+                parser.run_query('PRAGMA case_sensitive_like = true', False)
+                CreateCopiedVolumeTables(parser, sys_vol, data_vol, list(firmlinks))
+            create_time = time.perf_counter() - start
+            growth = os.path.getsize(db_path) - os.path.getsize(source_db_path)
+            if label == 'Views':
+                volume = GetVolume(ApfsSysDataLinkedVolume, 'Combined', writer)
+                volume.sys_vol, volume.data_vol = GetVolume(ApfsVolume, 'Sys', writer), GetVolume(ApfsVolume, 'Data', writer)
+                volume.firmlinks_paths = list(firmlinks)
+            else:
+                volume = GetVolume(ApfsVolume, 'Combined', writer)
+            result = TimeLookups(volume, items, num_lookups, random.Random(33))
+            writer.CloseDb()
+            print('{:<24} create {:>7.2f} s   db +{:>7.1f} MB   by path {:>6.3f} ms   by cnid {:>6.3f} ms   list folder {:>7.3f} ms'.format(
+                label, create_time, growth / 1048576, result['path_time'] * 1000, result['cnid_time'] * 1000, result['list_time'] * 1000))
+            results.append(result)
+        same = all(results[0][key] == results[1][key] for key in ('path', 'cnid', 'list'))
+        print('Lookup results are {}'.format('identical' if same else 'DIFFERENT'))
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == '__main__':
+    Main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000, int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
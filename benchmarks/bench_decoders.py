@@ -0,0 +1,55 @@
+'''
+   Times the decoders in plugins/helpers/decoders.py against the earlier
+   per-item loops (tests/decoders_reference.py) on random input.
+
+   Usage: python benchmarks/bench_decoders.py [repeat]
+'''
+import os
+import random
+import struct
+import sys
+import timeit
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_folder)
+sys.path.insert(0, os.path.join(repo_folder, 'tests'))
+
+import decoders_reference as reference
+from plugins.helpers import decoders
+
+def Compare(name, new_func, old_func, number, repeat):
+    new_time = min(timeit.repeat(new_func, number=number, repeat=repeat))
+    old_time = min(timeit.repeat(old_func, number=number, repeat=repeat))
+    print('{:<40} old {:>9.2f} ms   new {:>9.2f} ms   {:>6.1f}x'.format(name, old_time * 1000, new_time * 1000, old_time / new_time))
+
+def Main(repeat):
+    rng = random.Random(1)
+    block = rng.randbytes(4096)
+    Compare('Fletcher64 (4KB block) x100', lambda: [decoders.Fletcher64(block, 4096) for _ in range(100)],
+            lambda: [reference.Fletcher64(block, 4096) for _ in range(100)], 1, repeat)
+    if decoders.numpy_available:
+        decoders.numpy_available = False
+        Compare('Fletcher64 (4KB block, no numpy) x100', lambda: [decoders.Fletcher64(block, 4096) for _ in range(100)],
+                lambda: [reference.Fletcher64(block, 4096) for _ in range(100)], 1, repeat)
+        decoders.numpy_available = True
+
+    nums = [bytes([rng.choice((0x05, 0x85, 0xC5, 0xE5, 0xF5, 0xF9, 0xFF))]) + rng.randbytes(8) for _ in range(10000)]
+    Compare('ReadVarSizeNum x10000', lambda: [decoders.ReadVarSizeNum(x) for x in nums],
+            lambda: [reference.ReadVarSizeNum(x) for x in nums], 1, repeat)
+
+    record_struct = struct.Struct('<QIqi')
+    buffer = b''.join(('/Users/user/Library/Caches/item{}'.format(x).encode() + b'\0' + rng.randbytes(record_struct.size))
+                      for x in range(20000))
+    Compare('IterCStringRecords (20000 fsevents)', lambda: list(decoders.IterCStringRecords(buffer, 0, len(buffer), record_struct)),
+            lambda: list(reference.IterCStringRecords(buffer, 0, len(buffer), '<QIqi')), 1, repeat)
+
+    refs = rng.randbytes(2 * 5000)
+    Compare('UnpackBigEndianUints (5000 refs)', lambda: decoders.UnpackBigEndianUints(refs, 2, 5000),
+            lambda: reference.UnpackBigEndianUints(refs, 2, 5000), 1, repeat)
+
+    pixels = rng.randbytes(256 * 256 * 4)
+    Compare('ConvertBGRAtoRGBA (256x256)', lambda: decoders.ConvertBGRAtoRGBA(pixels),
+            lambda: reference.ConvertBGRAtoRGBA(pixels), 1, repeat)
+
+if __name__ == '__main__':
+    Main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
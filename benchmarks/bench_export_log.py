@@ -0,0 +1,99 @@
+'''
+   Times writing the export log (Exported_Files_Log.db) with a commit per
+   row, with the earlier buffered writer (flushed only by count, rollback
+   journal) and with the current SqliteWriter(asynchronous=True), which
+   also flushes by time and uses WAL. First the writer alone, then
+   MountedMacInfo.ExportFile() over a synthetic folder of small files.
+   The modes are run in turn, repeat times, and the best time is shown.
+
+   Usage: python benchmarks/bench_export_log.py [num_rows] [num_files] [repeat]
+'''
+import collections
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_folder)
+
+from plugins.helpers.macinfo import MountedMacInfo, OutputParams
+from plugins.helpers.writer import DataType, SqliteWriter
+
+column_info = collections.OrderedDict([ ('SourcePath', DataType.TEXT), ('ExportPath', DataType.TEXT),
+                                        ('InodeModifiedTime', DataType.DATE), ('ModifiedTime', DataType.DATE),
+                                        ('CreatedTime', DataType.DATE), ('AccessedTime', DataType.DATE),
+                                        ('SHA256', DataType.TEXT) ])
+
+def CreateExportLogger(db_path, mode):
+    '''As mac_apt.SetupExportLogger() does, for mode 'per_row', 'buffered' (earlier) or 'current' '''
+    writer = SqliteWriter(asynchronous=(mode != 'per_row'))
+    writer.OpenSqliteDb(SqliteWriter.CreateSqliteDb(db_path))
+    if mode == 'buffered':
+        writer.conn.execute('PRAGMA journal_mode=DELETE')
+        writer.conn.execute('PRAGMA synchronous=FULL')
+        writer.async_flush_interval = float('inf')
+    writer.CreateTable(column_info, 'ExportedFileInfo')
+    return writer
+
+def TimeWriter(db_path, mode, num_rows):
+    writer = CreateExportLogger(db_path, mode)
+    start = time.perf_counter()
+    for index in range(num_rows):
+        writer.WriteRow(['/private/var/db/uuidtext/{:02X}/{:030X}'.format(index % 256, index), 'UnifiedLogs/uuidtext/{}'.format(index),
+                         None, None, None, None, None])
+    writer.CloseDb()
+    return time.perf_counter() - start
+
+def TimeExport(temp_folder, source_folder, mode, num_files):
+    output_params = OutputParams()
+    output_params.output_path = os.path.join(temp_folder, 'output_' + mode)
+    output_params.export_path = os.path.join(output_params.output_path, 'Export')
+    os.makedirs(output_params.export_path)
+    output_params.export_log_sqlite = CreateExportLogger(os.path.join(output_params.export_path, 'Exported_Files_Log.db'), mode)
+    mac_info = MountedMacInfo(source_folder, output_params)
+    start = time.perf_counter()
+    for index in range(num_files):
+        mac_info.ExportFile('/private/var/db/uuidtext/{:02X}/file_{}'.format(index % 256, index), 'UnifiedLogs', '', False)
+    output_params.export_log_sqlite.CloseDb()
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(output_params.output_path)
+    return elapsed
+
+def Measure(modes, function, repeat):
+    '''Returns { mode : best time } running function(mode) for all modes in turn, repeat times'''
+    times = collections.defaultdict(list)
+    for _ in range(repeat):
+        for name, mode in modes:
+            times[mode].append(function(mode))
+    return { mode: min(x) for mode, x in times.items() }
+
+def Main(num_rows, num_files, repeat):
+    logging.disable(logging.WARNING) # MountedMacInfo warns about created times on linux
+    temp_folder = tempfile.mkdtemp()
+    try:
+        modes = (('Commit per row', 'per_row'), ('Buffered, by count (earlier)', 'buffered'), ('Buffered, count/time + WAL', 'current'))
+        print('Export log, {} rows'.format(num_rows))
+        times = Measure(modes, lambda mode: TimeWriter(os.path.join(temp_folder, mode + '.db'), mode, num_rows), repeat)
+        for name, mode in modes:
+            print('  {:<30} {:>8.2f} s   {:>9.0f} rows/s'.format(name, times[mode], num_rows / times[mode]))
+
+        source_folder = os.path.join(temp_folder, 'source')
+        for index in range(num_files):
+            folder = os.path.join(source_folder, 'private', 'var', 'db', 'uuidtext', '{:02X}'.format(index % 256))
+            if index < 256:
+                os.makedirs(folder)
+            with open(os.path.join(folder, 'file_{}'.format(index)), 'wb') as f:
+                f.write(os.urandom(512))
+        print('ExportFile(), {} files of 512 bytes'.format(num_files))
+        times = Measure(modes, lambda mode: TimeExport(temp_folder, source_folder, mode, num_files), repeat)
+        for name, mode in modes:
+            print('  {:<30} {:>8.2f} s   {:>9.0f} files/s'.format(name, times[mode], num_files / times[mode]))
+    finally:
+        shutil.rmtree(temp_folder)
+
+if __name__ == '__main__':
+    Main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 3)
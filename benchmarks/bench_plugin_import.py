@@ -0,0 +1,72 @@
+'''
+   Times plugin.ImportPlugins() (plugins read from the plugin registry and
+   imported lazily) against importing every plugin module, as was done
+   earlier. Each measurement is made in a new python process, so imports
+   are not cached; 'cold' is without a plugins/plugin_registry.json file.
+
+   Usage: python benchmarks/bench_plugin_import.py [repeat]
+'''
+import os
+import subprocess
+import sys
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+registry_path = os.path.join(repo_folder, 'plugins', 'plugin_registry.json')
+
+setup = '''
+import contextlib, io, os, sys, time
+sys.path.insert(0, {repo_folder!r})
+start_modules = len(sys.modules)
+start = time.perf_counter()
+'''.format(repo_folder=repo_folder)
+
+lazy_code = setup + '''
+import plugin
+plugins = []
+plugin.ImportPlugins(plugins, 'MACOS')
+print(time.perf_counter() - start, len(plugins), len(sys.modules) - start_modules)
+'''
+
+# The earlier ImportPlugins(), which imported every plugin module
+eager_code = setup + '''
+import plugin
+for name in ('pytsk3', 'pyewf', 'pyvmdk', 'pyaff4'): # plugin.py imported these
+    try:
+        __import__(name)
+    except ImportError:
+        pass
+plugin_path = os.path.join({repo_folder!r}, 'plugins')
+sys.path.append(plugin_path)
+plugins = []
+with contextlib.redirect_stdout(io.StringIO()):
+    for filename in os.listdir(plugin_path):
+        if filename.endswith('.py') and not filename.startswith('_'):
+            try:
+                module = __import__(filename.replace('.py', ''))
+                if plugin.IsPluginValidForMode(module, 'MACOS') and plugin.IsValidPlugin(module):
+                    plugins.append(module)
+            except Exception:
+                pass
+print(time.perf_counter() - start, len(plugins), len(sys.modules) - start_modules)
+'''.format(repo_folder=repo_folder)
+
+def Run(code, remove_registry=False):
+    if remove_registry and os.path.exists(registry_path):
+        os.remove(registry_path)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), int(output[1]), int(output[2])
+
+def Measure(name, code, repeat, remove_registry=False):
+    results = [Run(code, remove_registry) for _ in range(repeat)]
+    elapsed, num_plugins, num_modules = min(results)
+    print('{:<32} {:>8.3f} s   {:>3} plugins   {:>5} modules imported'.format(name, elapsed, num_plugins, num_modules))
+    return elapsed
+
+def Main(repeat):
+    eager_time = Measure('Import all plugins (earlier)', eager_code, repeat)
+    Measure('Registry, cold (no registry)', lazy_code, repeat, remove_registry=True)
+    lazy_time = Measure('Registry, warm', lazy_code, repeat)
+    print('Speedup (warm) {:.1f}x'.format(eager_time / lazy_time))
+
+if __name__ == '__main__':
+    Main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,107 @@
+'''
+   Times spotlight_parser.GetFullPath() against the earlier recursive
+   RecursiveGetFullPath() (copied below) resolving the full paths of all
+   items of a synthetic spotlight store, as spotlight.WriteFullPaths()
+   does. Then compares their output and resolves a very deep chain of
+   folders, on which the recursive version fails.
+
+   Usage: python benchmarks/bench_spotlight_paths.py [num_items] [repeat]
+'''
+import copy
+import logging
+import os
+import random
+import sys
+import time
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_folder)
+
+from plugins.helpers import spotlight_parser
+
+log = logging.getLogger('BENCHMARK')
+
+def RecursiveGetFullPath(item, items_list, suppress_error_messages=False):
+    '''The earlier spotlight_parser.RecursiveGetFullPath()'''
+    # item = [id, parent_id, name, full_path, date]
+    if item[3]:
+        return item[3]
+    if item[0] == 1: #is this plist?
+        return 'plist'
+    name = item[2]
+    if item[0] == 2: # This is root
+        if name == '':
+            name = '/'
+        item[3] = name
+        return name
+    search_id = item[1]
+
+    if search_id == 0:
+        search_id = 2 # root
+    ret_path = ''
+    found_item = items_list.get(search_id, None)
+
+    if found_item != None:
+        parent_path = RecursiveGetFullPath(found_item, items_list)
+        ret_path = (parent_path + '/' + name) if parent_path != '/' else (parent_path + name)
+        found_item[3] = parent_path
+    elif search_id == 2: # root
+        ret_path = ('/' + name) if name else '/'
+    else:
+        if not suppress_error_messages:
+            log.debug ('Err, could not find path for id {} '.format(search_id))
+        ret_path = '..NOT-FOUND../' + name
+    return ret_path
+
+def CreateItems(num_items, rng, max_depth=16):
+    '''Items dict { id : [id, parent_id, name, full_path, date] } of a random tree, at
+       most max_depth deep, about 1 in 8 items being folders, a few with missing parents'''
+    items = { 2: [2, 0, '', '', None] }
+    folders = [2]
+    depths = { 2: 0 }
+    for item_id in range(100, num_items + 100):
+        parent_id = folders[-rng.randint(1, min(len(folders), 200))]
+        while depths[parent_id] >= max_depth:
+            parent_id = rng.choice(folders)
+        if rng.random() < 0.0001:
+            parent_id = item_id + num_items * 2 # missing parent
+        elif rng.random() < 0.125:
+            folders.append(item_id)
+            depths[item_id] = depths[parent_id] + 1
+        items[item_id] = [item_id, parent_id, 'item_{}'.format(item_id), '', None]
+    ids = list(items) # spotlight stores don't list parents before children
+    rng.shuffle(ids)
+    return { item_id: items[item_id] for item_id in ids }
+
+def ResolveAll(get_full_path, items):
+    start = time.perf_counter()
+    paths = [get_full_path(v, items, True) for v in items.values() if v[2]]
+    return time.perf_counter() - start, paths
+
+def Main(num_items, repeat):
+    print('Creating {} items'.format(num_items))
+    items = CreateItems(num_items, random.Random(42))
+    results = {}
+    for name, function in (('RecursiveGetFullPath (earlier)', RecursiveGetFullPath), ('GetFullPath', spotlight_parser.GetFullPath)):
+        runs = [ResolveAll(function, copy.deepcopy(items)) for _ in range(repeat)]
+        elapsed = min(x[0] for x in runs)
+        results[name] = runs[0][1]
+        print('{:<32} {:>8.2f} s   {:>6.2f} us/item'.format(name, elapsed, elapsed * 1000000 / num_items))
+    print('Paths are {}'.format('identical' if len(set(map(tuple, results.values()))) == 1 else 'DIFFERENT'))
+
+    depth = 5000
+    chain = { 2: [2, 0, '', '', None] }
+    for item_id in range(100, 100 + depth):
+        chain[item_id] = [item_id, item_id - 1 if item_id > 100 else 2, 'f', '', None]
+    for name, function in (('RecursiveGetFullPath (earlier)', RecursiveGetFullPath), ('GetFullPath', spotlight_parser.GetFullPath)):
+        items = copy.deepcopy(chain)
+        start = time.perf_counter()
+        try:
+            path = function(items[99 + depth], items)
+            result = '{:.3f} s, path has {} parts'.format(time.perf_counter() - start, path.count('/'))
+        except RecursionError:
+            result = 'RecursionError'
+        print('{:<32} {}-deep chain: {}'.format(name, depth, result))
+
+if __name__ == '__main__':
+    Main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000, int(sys.argv[2]) if len(sys.argv) > 2 else 3)
@@ -0,0 +1,97 @@
+'''
+   Copyright (c) 2017 Yogesh Khatri
+
+   This file is part of mac_apt (macOS Artifact Parsing Tool).
+   Usage or distribution of this software/code is subject to the
+   terms of the MIT License.
+
+   extract_exported_files.py
+   -------------------------
+   When mac_apt is run with the --export_store option, exported files
+   are saved in a deduplicated & compressed store (Export_Store.pack)
+   instead of as individual files. This script writes them back out,
+   to the same relative paths they would have had under Export.
+
+   For usage information, run:
+     python extract_exported_files.py -h
+'''
+
+import argparse
+import fnmatch
+import logging
+import os
+import sqlite3
+import sys
+
+from plugins.helpers.export_store import ExportStoreReader, pack_file_name
+
+log = logging.getLogger('MAIN.EXTRACT_EXPORTED_FILES')
+
+def GetExportedFiles(export_path, path_filter):
+    '''Returns list of (ExportPath, SHA256) from the export log, only for files in the store'''
+    db_path = os.path.join(export_path, 'Exported_Files_Log.db')
+    conn = sqlite3.connect('file:{}?mode=ro'.format(db_path), uri=True)
+    try:
+        files = conn.execute('SELECT ExportPath, SHA256 FROM ExportedFileInfo WHERE SHA256 IS NOT NULL').fetchall()
+    finally:
+        conn.close()
+    if path_filter:
+        files = [f for f in files if fnmatch.fnmatch(f[0], path_filter)]
+    return files
+
+def ExtractFiles(export_path, output_path, path_filter, list_only):
+    '''Returns number of files that failed to extract'''
+    try:
+        files = GetExportedFiles(export_path, path_filter)
+    except sqlite3.Error as ex:
+        log.error('Could not read Exported_Files_Log.db from {}, error was {}'.format(export_path, str(ex)))
+        return 1
+    if list_only:
+        for export_path_rel, sha256 in files:
+            print('{}\t{}'.format(sha256, export_path_rel))
+        return 0
+    reader = ExportStoreReader(export_path)
+    if not reader.Open():
+        return 1
+    failed = 0
+    try:
+        for export_path_rel, sha256 in files:
+            destination_path = os.path.join(output_path, *export_path_rel.split('/'))
+            try:
+                os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+            except OSError as ex:
+                log.error('Could not create folder for {}, error was {}'.format(destination_path, str(ex)))
+                failed += 1
+                continue
+            if reader.ExtractFile(sha256, destination_path):
+                log.debug('Extracted {}'.format(export_path_rel))
+            else:
+                failed += 1
+    finally:
+        reader.Close()
+    log.info('Extracted {} of {} files to {}'.format(len(files) - failed, len(files), output_path))
+    return failed
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Extracts files saved in a mac_apt export store (created with --export_store)')
+    arg_parser.add_argument('export_path', help='Path to Export folder in mac_apt output (or the mac_apt output folder)')
+    arg_parser.add_argument('-o', '--output_path', help='Folder where files will be extracted (Default is the Export folder itself)')
+    arg_parser.add_argument('-f', '--filter', help='Only extract files whose export path matches this wildcard pattern (Eg: "SAFARI/*History.db*")')
+    arg_parser.add_argument('-l', '--list', action="store_true", help='Only list the files (SHA256 and export path), do not extract')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s-%(message)s', level=logging.INFO)
+
+    export_path = args.export_path
+    if not os.path.exists(os.path.join(export_path, pack_file_name)) and \
+        os.path.exists(os.path.join(export_path, 'Export', pack_file_name)):
+        export_path = os.path.join(export_path, 'Export')
+    if not os.path.exists(os.path.join(export_path, pack_file_name)):
+        sys.exit('No export store ({}) found in {}'.format(pack_file_name, args.export_path))
+
+    output_path = args.output_path if args.output_path else export_path
+    failed = ExtractFiles(export_path, output_path, args.filter, args.list)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
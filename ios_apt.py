@@ -17,6 +17,7 @@
 
 import argparse
 import logging
+import multiprocessing
 import os
 import sys
 import textwrap
@@ -25,6 +26,7 @@ import traceback
 import plugins.helpers.macinfo as macinfo
 
 from plugins.helpers.writer import *
+from plugins.helpers.export_store import ExportStore
 from plugin import *
 from version import __VERSION
 
@@ -78,139 +80,165 @@ def SetupExportLogger(output_params):
     writer.OpenSqliteDb(export_sqlite_path)
     column_info = collections.OrderedDict([ ('SourcePath',DataType.TEXT), ('ExportPath',DataType.TEXT),
                                             ('InodeModifiedTime',DataType.DATE),('ModifiedTime',DataType.DATE),
-                                            ('CreatedTime',DataType.DATE),('AccessedTime',DataType.DATE) ])
+                                            ('CreatedTime',DataType.DATE),('AccessedTime',DataType.DATE),
+                                            ('SHA256',DataType.TEXT) ])
     writer.CreateTable(column_info, 'ExportedFileInfo')
     output_params.export_log_sqlite = writer
 
 ## Main program ##
-plugins = []
-plugin_count = ImportPlugins(plugins, 'IOS')
-if plugin_count == 0:
-    sys.exit ("No plugins could be added ! Exiting..")
-
-plugin_name_list = ['ALL']
-plugins_info = f"The following {len(plugins)} plugins are available:"
-for plugin in plugins:
-    plugins_info += "\n    {:<20}{}".format(plugin.__Plugin_Name, textwrap.fill(plugin.__Plugin_Description, subsequent_indent=' '*24, initial_indent=' '*24, width=80)[24:])
-    plugin_name_list.append(plugin.__Plugin_Name)
-
-plugins_info += "\n    " + "-"*76 + "\n" +\
-                 " "*4 + "ALL" + " "*17 + "Runs all plugins"
-arg_parser = argparse.ArgumentParser(description='ios_apt is a framework to process forensic artifacts on an iOS full file system extraction.\n'\
-                                                 f'You are running {__PROGRAMNAME} version {__VERSION}\n\n'\
-                                                 'Note: The default output is now sqlite, no need to specify it now',
-                                    epilog=plugins_info, formatter_class=argparse.RawTextHelpFormatter)
-arg_parser.add_argument('-i', '--input_path', help='Path to root folder of ios image') # Not optional !
-arg_parser.add_argument('-o', '--output_path', help='Path where output files will be created') # Not optional !
-arg_parser.add_argument('-x', '--xlsx', action="store_true", help='Save output in excel spreadsheet(s)')
-arg_parser.add_argument('-c', '--csv', action="store_true", help='Save output as CSV files')
-arg_parser.add_argument('-t', '--tsv', action="store_true", help='Save output as TSV files (tab separated)')
-arg_parser.add_argument('-j', '--jsonl', action="store_true", help='Save output as JSONL files')
-arg_parser.add_argument('-l', '--log_level', help='Log levels: INFO, DEBUG, WARNING, ERROR, CRITICAL (Default is INFO)')
-arg_parser.add_argument('plugin', nargs="+", help="Plugins to run (space separated). 'ALL' will process every available plugin")
-args = arg_parser.parse_args()
-
-plugins_to_run = [x.upper() for x in args.plugin]  # convert all plugin names entered by user to uppercase
-process_all = IsItemPresentInList(plugins_to_run, 'ALL')
-if not process_all:
-    #Check for invalid plugin names or ones not Found
-    if not CheckUserEnteredPluginNames(plugins_to_run, plugins):
-        sys.exit("Exiting -> Invalid plugin name entered.")
-
-# Check outputs, create output files
-if args.output_path:
-    if (os.name != 'nt'):
-        if args.output_path.startswith('~/') or args.output_path == '~': # for linux/mac, translate ~ to user profile folder
-            args.output_path = os.path.expanduser(args.output_path)
-    print ("Output path was : {}".format(args.output_path))
-    if not CheckOutputPath(args.output_path):
-        sys.exit("Exiting -> Output path not valid!")
-else:
-    sys.exit("Exiting -> No output_path provided, the -o option is mandatory!")
-
-output_params = macinfo.OutputParams()
-output_params.output_path = args.output_path
-SetupExportLogger(output_params)
-
-if args.log_level:
-    args.log_level = args.log_level.upper()
-    if not args.log_level in ['INFO','DEBUG','WARNING','ERROR','CRITICAL']: # TODO: change to just [info, debug, error]
-        sys.exit("Exiting -> Invalid input type for log level. Valid values are INFO, DEBUG, WARNING, ERROR, CRITICAL")
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support() # for pyinstaller builds, plugins may use worker processes
+
+    plugins = []
+    plugin_count = ImportPlugins(plugins, 'IOS')
+    if plugin_count == 0:
+        sys.exit ("No plugins could be added ! Exiting..")
+
+    plugin_name_list = ['ALL']
+    plugins_info = f"The following {len(plugins)} plugins are available:"
+    for plugin in plugins:
+        plugins_info += "\n    {:<20}{}".format(plugin.__Plugin_Name, textwrap.fill(plugin.__Plugin_Description, subsequent_indent=' '*24, initial_indent=' '*24, width=80)[24:])
+        plugin_name_list.append(plugin.__Plugin_Name)
+
+    plugins_info += "\n    " + "-"*76 + "\n" +\
+                     " "*4 + "ALL" + " "*17 + "Runs all plugins"
+    arg_parser = argparse.ArgumentParser(description='ios_apt is a framework to process forensic artifacts on an iOS full file system extraction.\n'\
+                                                     f'You are running {__PROGRAMNAME} version {__VERSION}\n\n'\
+                                                     'Note: The default output is now sqlite, no need to specify it now',
+                                        epilog=plugins_info, formatter_class=argparse.RawTextHelpFormatter)
+    arg_parser.add_argument('-i', '--input_path', help='Path to root folder of ios image') # Not optional !
+    arg_parser.add_argument('-o', '--output_path', help='Path where output files will be created') # Not optional !
+    arg_parser.add_argument('-x', '--xlsx', action="store_true", help='Save output in excel spreadsheet(s)')
+    arg_parser.add_argument('--xlsx_deferred', action="store_true", help='With -x, create the XLSX file at the end of the run (from the sqlite output), which is faster')
+    arg_parser.add_argument('-c', '--csv', action="store_true", help='Save output as CSV files')
+    arg_parser.add_argument('-t', '--tsv', action="store_true", help='Save output as TSV files (tab separated)')
+    arg_parser.add_argument('-j', '--jsonl', action="store_true", help='Save output as JSONL files')
+    arg_parser.add_argument('--jsonl_compression', choices=['gz', 'zstd'], help='Compress JSONL files as they are written (zstd needs zstandard)')
+    arg_parser.add_argument('--parquet', action="store_true", help='Save output as Parquet files (needs pyarrow)')
+    arg_parser.add_argument('--export_store', choices=['zstd', 'zlib'], help='Save exported files deduplicated & compressed (zstd needs zstandard) in Export_Store.pack, get them back with extract_exported_files.py')
+    arg_parser.add_argument('--no_spotlight_data_txt', action="store_true", help='Spotlight plugin will not write the <store>_data.txt dump of all items, which is slow for large stores')
+    arg_parser.add_argument('-l', '--log_level', help='Log levels: INFO, DEBUG, WARNING, ERROR, CRITICAL (Default is INFO)')
+    arg_parser.add_argument('plugin', nargs="+", help="Plugins to run (space separated). 'ALL' will process every available plugin")
+    args = arg_parser.parse_args()
+
+    plugins_to_run = [x.upper() for x in args.plugin]  # convert all plugin names entered by user to uppercase
+    process_all = IsItemPresentInList(plugins_to_run, 'ALL')
+    if not process_all:
+        #Check for invalid plugin names or ones not Found
+        if not CheckUserEnteredPluginNames(plugins_to_run, plugins):
+            sys.exit("Exiting -> Invalid plugin name entered.")
+
+    # Check outputs, create output files
+    if args.output_path:
+        if (os.name != 'nt'):
+            if args.output_path.startswith('~/') or args.output_path == '~': # for linux/mac, translate ~ to user profile folder
+                args.output_path = os.path.expanduser(args.output_path)
+        print ("Output path was : {}".format(args.output_path))
+        if not CheckOutputPath(args.output_path):
+            sys.exit("Exiting -> Output path not valid!")
+    else:
+        sys.exit("Exiting -> No output_path provided, the -o option is mandatory!")
+
+    output_params = macinfo.OutputParams()
+    output_params.output_path = args.output_path
+    SetupExportLogger(output_params)
+
+    if args.log_level:
+        args.log_level = args.log_level.upper()
+        if not args.log_level in ['INFO','DEBUG','WARNING','ERROR','CRITICAL']: # TODO: change to just [info, debug, error]
+            sys.exit("Exiting -> Invalid input type for log level. Valid values are INFO, DEBUG, WARNING, ERROR, CRITICAL")
+        else:
+            if args.log_level == "INFO": args.log_level = logging.INFO
+            elif args.log_level == "DEBUG": args.log_level = logging.DEBUG
+            elif args.log_level == "WARNING": args.log_level = logging.WARNING
+            elif args.log_level == "ERROR": args.log_level = logging.ERROR
+            elif args.log_level == "CRITICAL": args.log_level = logging.CRITICAL
     else:
-        if args.log_level == "INFO": args.log_level = logging.INFO
-        elif args.log_level == "DEBUG": args.log_level = logging.DEBUG
-        elif args.log_level == "WARNING": args.log_level = logging.WARNING
-        elif args.log_level == "ERROR": args.log_level = logging.ERROR
-        elif args.log_level == "CRITICAL": args.log_level = logging.CRITICAL
-else:
-    args.log_level = logging.INFO
-log = CreateLogger(os.path.join(args.output_path, "Log." + str(time.strftime("%Y%m%d-%H%M%S")) + ".txt"), args.log_level, args.log_level) # Create logging infrastructure
-log.setLevel(args.log_level)
-log.info("Started {}, version {}".format(__PROGRAMNAME, __VERSION))
-log.info("Dates and times are in UTC unless the specific artifact being parsed saves it as local time!")
-log.debug(' '.join(sys.argv))
-LogLibraryVersions(log)
-LogPlatformInfo(log)
-
-if args.input_path:
-    if os.path.isdir(args.input_path):
-        ios_info = macinfo.MountedIosInfo(args.input_path, output_params)
-        if not FindIosFiles(ios_info):
-            sys.exit(":( Could not find an iOS installation on path provided. Make sure you provide the path to the root folder."
-                        " This folder should contain folders 'bin', 'System', 'private', 'Library' and others. ")
-        ios_info._GetAppDetails()
+        args.log_level = logging.INFO
+    log = CreateLogger(os.path.join(args.output_path, "Log." + str(time.strftime("%Y%m%d-%H%M%S")) + ".txt"), args.log_level, args.log_level) # Create logging infrastructure
+    log.setLevel(args.log_level)
+    log.info("Started {}, version {}".format(__PROGRAMNAME, __VERSION))
+    log.info("Dates and times are in UTC unless the specific artifact being parsed saves it as local time!")
+    log.debug(' '.join(sys.argv))
+    LogLibraryVersions(log)
+    LogPlatformInfo(log)
+
+    if args.input_path:
+        if os.path.isdir(args.input_path):
+            ios_info = macinfo.MountedIosInfo(args.input_path, output_params)
+            if not FindIosFiles(ios_info):
+                sys.exit(":( Could not find an iOS installation on path provided. Make sure you provide the path to the root folder."
+                            " This folder should contain folders 'bin', 'System', 'private', 'Library' and others. ")
+            ios_info._GetAppDetails()
+        else:
+            sys.exit("Exiting -> Provided input path is not a folder! - " + args.input_path)
     else:
-        sys.exit("Exiting -> Provided input path is not a folder! - " + args.input_path)
-else:
-    sys.exit("Exiting -> No input file provided, the -i option is mandatory. Please provide a file to process!")
-
-try:
-    log.debug("Trying to create db @ " + os.path.join(output_params.output_path, "ios_apt.db"))
-    output_params.output_db_path = SqliteWriter.CreateSqliteDb(os.path.join(output_params.output_path, "ios_apt.db"))
-    output_params.write_sql = True
-except Exception as ex:
-    log.exception('Exception occurred when tried to create Sqlite db')
-    sys.exit('Exiting -> Cannot create sqlite db!')
-
-if args.xlsx: 
+        sys.exit("Exiting -> No input file provided, the -i option is mandatory. Please provide a file to process!")
+
     try:
-        xlsx_path = os.path.join(output_params.output_path, "ios_apt.xlsx")
-        output_params.xlsx_writer = ExcelWriter()
-        log.debug("Trying to create xlsx file @ " + xlsx_path)
-        output_params.xlsx_writer.CreateXlsxFile(xlsx_path)
-        output_params.write_xlsx = True
+        log.debug("Trying to create db @ " + os.path.join(output_params.output_path, "ios_apt.db"))
+        output_params.output_db_path = SqliteWriter.CreateSqliteDb(os.path.join(output_params.output_path, "ios_apt.db"))
+        output_params.write_sql = True
     except Exception as ex:
-        log.info('XLSX file could not be created at : ' + xlsx_path)
-        log.exception('Exception occurred when trying to create XLSX file')
+        log.exception('Exception occurred when tried to create Sqlite db')
+        sys.exit('Exiting -> Cannot create sqlite db!')
 
-if args.csv:
-    output_params.write_csv  = True
-if args.tsv:
-    output_params.write_tsv  = True
-if args.jsonl:
-    output_params.write_jsonl = True
-
-# At this point, all looks good, lets process the input file
-# Start processing plugin now!
-
-time_processing_started = time.time()
-
-for plugin in plugins:
-    if process_all or IsItemPresentInList(plugins_to_run, plugin.__Plugin_Name):
-        log.info("-"*50)
-        log.info("Running plugin " + plugin.__Plugin_Name)
+    if args.xlsx: 
         try:
-            plugin.Plugin_Start_Ios(ios_info)
+            xlsx_path = os.path.join(output_params.output_path, "ios_apt.xlsx")
+            output_params.xlsx_writer = ExcelWriter()
+            output_params.xlsx_writer.deferred = args.xlsx_deferred
+            log.debug("Trying to create xlsx file @ " + xlsx_path)
+            output_params.xlsx_writer.CreateXlsxFile(xlsx_path)
+            output_params.write_xlsx = True
         except Exception as ex:
-            log.exception ("An exception occurred while running plugin - {}".format(plugin.__Plugin_Name))
-log.info("-"*50)
-
-if args.xlsx:
-    output_params.xlsx_writer.CommitAndCloseFile()
-if output_params.export_log_sqlite:
-    output_params.export_log_sqlite.CloseDb()
-
-time_processing_ended = time.time()
-run_time = time_processing_ended - time_processing_started
-log.info("Finished in time = {}".format(time.strftime('%H:%M:%S', time.gmtime(run_time))))
-log.info("Review the Log file and report any ERRORs or EXCEPTIONS to the developers")
+            log.info('XLSX file could not be created at : ' + xlsx_path)
+            log.exception('Exception occurred when trying to create XLSX file')
+
+    if args.csv:
+        output_params.write_csv  = True
+    if args.tsv:
+        output_params.write_tsv  = True
+    if args.jsonl:
+        output_params.write_jsonl = True
+        output_params.jsonl_compression = args.jsonl_compression
+    if args.parquet:
+        if ParquetWriter.IsAvailable():
+            output_params.write_parquet = True
+        else:
+            log.error('Parquet output was requested, but pyarrow is not installed (pip install pyarrow). Parquet files will not be created!')
+    output_params.write_spotlight_data_txt = not args.no_spotlight_data_txt
+    if args.export_store:
+        output_params.export_store = ExportStore(output_params.export_path, args.export_store)
+        if not output_params.export_store.Open():
+            log.error('Export store could not be created, exported files will be saved as individual files')
+            output_params.export_store = None
+
+    # At this point, all looks good, lets process the input file
+    # Start processing plugin now!
+
+    time_processing_started = time.time()
+
+    for plugin in plugins:
+        if process_all or IsItemPresentInList(plugins_to_run, plugin.__Plugin_Name):
+            log.info("-"*50)
+            log.info("Running plugin " + plugin.__Plugin_Name)
+            try:
+                plugin.Plugin_Start_Ios(ios_info)
+            except Exception as ex:
+                log.exception ("An exception occurred while running plugin - {}".format(plugin.__Plugin_Name))
+    log.info("-"*50)
+
+    if args.xlsx:
+        output_params.xlsx_writer.CommitAndCloseFile()
+    ios_info.CloseInodeIndex()
+    if output_params.export_log_sqlite:
+        output_params.export_log_sqlite.CloseDb()
+    if output_params.export_store:
+        output_params.export_store.Close()
+
+    time_processing_ended = time.time()
+    run_time = time_processing_ended - time_processing_started
+    log.info("Finished in time = {}".format(time.strftime('%H:%M:%S', time.gmtime(run_time))))
+    log.info("Review the Log file and report any ERRORs or EXCEPTIONS to the developers")
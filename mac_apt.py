@@ -20,6 +20,7 @@
 import argparse
 import collections
 import logging
+import multiprocessing
 import os
 import sys
 import textwrap
@@ -37,6 +38,8 @@ from plugins.helpers.apfs_reader import ApfsContainer, ApfsDbInfo
 from plugins.helpers.apple_sparse_image import AppleSparseImage
 from plugins.helpers.apple_disk_image import AppleDiskImage
 from plugins.helpers.disk_report import *
+from plugins.helpers.export_store import ExportStore
+from plugins.helpers.run_manifest import RunManifest
 from plugins.helpers.writer import *
 from plugins.helpers.extract_vr_zip import extract_zip
 from plugins.helpers.extract_uac import extract_uac_zip, extract_uac_tar
@@ -309,11 +312,12 @@ def GetApfsContainerUuid(img, container_start_offset):
 def FindMacOsPartitionInApfsContainer(img, vol_info, container_size, container_start_offset, container_uuid):
     global mac_info
     mac_info = macinfo.ApfsMacInfo(mac_info.output_params, mac_info.password, mac_info.dont_decrypt)
+    mac_info.snapshot_name = args.snapshot if args.snapshot else ''
     mac_info.pytsk_image = img   # Must be populated
     mac_info.vol_info = vol_info # Must be populated
     mac_info.is_apfs = True
     mac_info.macos_partition_start_offset = container_start_offset # apfs container offset
-    mac_info.apfs_container = ApfsContainer(img, container_size, container_start_offset)
+    mac_info.apfs_container = ApfsContainer(img, container_size, container_start_offset, args.verify_checksums)
     # Check if this is 10.15 style System + Data volume?
     for vol in mac_info.apfs_container.volumes:
         if vol.role == vol.container.apfs.VolumeRoleType.system.value:
@@ -336,10 +340,17 @@ def FindMacOsPartitionInApfsContainer(img, vol_info, container_size, container_s
             existing_db = SqliteWriter()     # open & check if it has the correct data
             existing_db.OpenSqliteDb(apfs_sqlite_path)
             apfs_db_info = ApfsDbInfo(existing_db)
-            if apfs_db_info.CheckVerInfo() and apfs_db_info.CheckVolInfoAndGetVolEncKey(mac_info.apfs_container.volumes):
+            snapshot_infos = apfs_db_info.GetSnapshotInfo(mac_info.snapshot_name) if mac_info.snapshot_name else {}
+            if apfs_db_info.CheckVerInfo() and apfs_db_info.CheckVolInfoAndGetVolEncKey(mac_info.apfs_container.volumes) \
+                and (snapshot_infos is not None) \
+                and (apfs_db_info.HasChecksumInfo() or not args.verify_checksums):
                 # all good, db is up to date, use it
                 use_existing_db = True
                 mac_info.apfs_db = existing_db
+                if snapshot_infos:
+                    mac_info.LoadSnapshotVolumes(snapshot_infos)
+                elif mac_info.snapshot_name:
+                    mac_info.LogSnapshotNotFound()
                 if mac_info.apfs_sys_volume:
                     mac_info.apfs_data_volume.dbo = mac_info.apfs_db
                     mac_info.apfs_sys_volume.dbo = mac_info.apfs_db
@@ -363,6 +374,8 @@ def FindMacOsPartitionInApfsContainer(img, vol_info, container_size, container_s
                 mac_info.ReadApfsVolumes()
                 apfs_db_info = ApfsDbInfo(mac_info.apfs_db)
                 apfs_db_info.WriteVolInfo(mac_info.apfs_container.volumes)
+                if args.verify_checksums:
+                    apfs_db_info.WriteChecksumFailures(mac_info.apfs_container)
                 if mac_info.apfs_sys_volume:
                     mac_info.apfs_data_volume.dbo = mac_info.apfs_db
                     mac_info.apfs_sys_volume.dbo = mac_info.apfs_db
@@ -384,8 +397,8 @@ def FindMacOsPartitionInApfsContainer(img, vol_info, container_size, container_s
             for vol in mac_info.apfs_container.volumes:
                 #if vol.num_blocks_used * vol.container.block_size < 3000000000: # < 3 GB, cannot be a macOS root volume
                 #    continue
-                mac_info.macos_FS = vol
                 vol.dbo = mac_info.apfs_db
+                mac_info.macos_FS = mac_info.GetVolumeForProcessing(vol)
                 if FindMacOsFiles(mac_info):
                     return True
         # Did not find macOS installation
@@ -447,7 +460,8 @@ def SetupExportLogger(output_params):
     writer.OpenSqliteDb(export_sqlite_path)
     column_info = collections.OrderedDict([ ('SourcePath', DataType.TEXT), ('ExportPath', DataType.TEXT),
                                             ('InodeModifiedTime', DataType.DATE), ('ModifiedTime', DataType.DATE),
-                                            ('CreatedTime', DataType.DATE), ('AccessedTime', DataType.DATE) ])
+                                            ('CreatedTime', DataType.DATE), ('AccessedTime', DataType.DATE),
+                                            ('SHA256', DataType.TEXT) ])
     writer.CreateTable(column_info, 'ExportedFileInfo')
     output_params.export_log_sqlite = writer
 
@@ -461,287 +475,330 @@ def ReadPasswordFromFile(path):
 
 ## Main program ##
 
-plugins = []
-log = None
-plugin_count = ImportPlugins(plugins, 'MACOS')
-if plugin_count == 0:
-    Exit("No plugins could be added ! Exiting..")
-
-plugin_name_list = ['ALL', 'FAST']
-plugins_info = f"The following {len(plugins)} plugins are available:"
-
-for plugin in plugins:
-    plugins_info += "\n    {:<20}{}".format(plugin.__Plugin_Name, textwrap.fill(plugin.__Plugin_Description, subsequent_indent=' '*24, initial_indent=' '*24, width=80)[24:])
-    plugin_name_list.append(plugin.__Plugin_Name)
-
-plugins_info += "\n    " + "-"*76 + "\n" +\
-                 " "*4 + "FAST" + " "*16 + "Runs all plugins except IDEVICEBACKUPS, SPOTLIGHT, UNIFIEDLOGEXPORT\n" + \
-                 " "*4 + "ALL" + " "*17 + "Runs all plugins\n" +\
-                 "\nIt is now possible to disable certain plugins from FAST or ALL by appending - to the name\n" +\
-                 "Eg: 'ALL IDEVICEBACKUPS- WIFI-' will run ALL plugins except IDEVICEBACKUPS and WIFI"
-arg_parser = argparse.ArgumentParser(description='mac_apt is a framework to process macOS forensic artifacts\n'
-                                                 f'You are running {__PROGRAMNAME} version {__VERSION}\n\n'
-                                                 'Note: The default output is now sqlite, no need to specify it now',
-                                    epilog=plugins_info, formatter_class=argparse.RawTextHelpFormatter)
-arg_parser.add_argument('input_type', help='Specify Input type as either AFF4, AXIOMZIP, DD, DMG, E01, MOUNTED, SPARSE, UAC, VMDK or VR')
-arg_parser.add_argument('input_path', help='Path to macOS image/volume')
-arg_parser.add_argument('-o', '--output_path', help='Path where output files will be created')
-arg_parser.add_argument('-x', '--xlsx', action="store_true", help='Save output in Excel spreadsheet')
-arg_parser.add_argument('-c', '--csv', action="store_true", help='Save output as CSV files')
-arg_parser.add_argument('-t', '--tsv', action="store_true", help='Save output as TSV files (tab separated)')
-arg_parser.add_argument('-j', '--jsonl', action="store_true", help='Save output as JSONL files')
-arg_parser.add_argument('-l', '--log_level', help='Log levels: INFO, DEBUG, WARNING, ERROR, CRITICAL (Default is INFO)')#, choices=['INFO','DEBUG','WARNING','ERROR','CRITICAL'])
-arg_parser.add_argument('-p', '--password', help='Personal Recovery Key(PRK) or Password for any user (for decrypting encrypted volume).')
-arg_parser.add_argument('-pf', '--password_file', help='Text file containing Personal Recovery Key(PRK) or Password')
-arg_parser.add_argument('-d', '--dont_decrypt', default=False, action="store_true", help='Don\'t decrypt as image is already decrypted!')
-#arg_parser.add_argument('-u', '--use_tsk', action="store_true", help='Use sleuthkit instead of native HFS+ parser (This is slower!)')
-arg_parser.add_argument('plugin', nargs="+", help="Plugins to run (space separated). FAST will run most plugins")
-args = arg_parser.parse_args()
-
-if args.output_path:
-    if (os.name != 'nt'):
-        if args.output_path.startswith('~/') or args.output_path == '~': # for linux/mac, translate ~ to user profile folder
-            args.output_path = os.path.expanduser(args.output_path)
-
-    args.output_path = os.path.abspath(args.output_path)
-    print("Output path was : {}".format(args.output_path))
-    if not CheckOutputPath(args.output_path):
-        Exit()
-else:
-    args.output_path = os.path.abspath('.') # output to same folder as script.
+if __name__ == '__main__':
+    multiprocessing.freeze_support() # for pyinstaller builds, plugins may use worker processes
+
+    plugins = []
+    log = None
+    plugin_count = ImportPlugins(plugins, 'MACOS')
+    if plugin_count == 0:
+        Exit("No plugins could be added ! Exiting..")
+
+    plugin_name_list = ['ALL', 'FAST']
+    plugins_info = f"The following {len(plugins)} plugins are available:"
 
-if args.log_level:
-    args.log_level = args.log_level.upper()
-    if args.log_level not in ['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL']: # TODO: change to just [info, debug, error]
-        Exit("Invalid input type for log level. Valid values are INFO, DEBUG, WARNING, ERROR, CRITICAL")
+    for plugin in plugins:
+        plugins_info += "\n    {:<20}{}".format(plugin.__Plugin_Name, textwrap.fill(plugin.__Plugin_Description, subsequent_indent=' '*24, initial_indent=' '*24, width=80)[24:])
+        plugin_name_list.append(plugin.__Plugin_Name)
+
+    plugins_info += "\n    " + "-"*76 + "\n" +\
+                     " "*4 + "FAST" + " "*16 + "Runs all plugins except IDEVICEBACKUPS, SPOTLIGHT, UNIFIEDLOGEXPORT\n" + \
+                     " "*4 + "ALL" + " "*17 + "Runs all plugins\n" +\
+                     "\nIt is now possible to disable certain plugins from FAST or ALL by appending - to the name\n" +\
+                     "Eg: 'ALL IDEVICEBACKUPS- WIFI-' will run ALL plugins except IDEVICEBACKUPS and WIFI"
+    arg_parser = argparse.ArgumentParser(description='mac_apt is a framework to process macOS forensic artifacts\n'
+                                                     f'You are running {__PROGRAMNAME} version {__VERSION}\n\n'
+                                                     'Note: The default output is now sqlite, no need to specify it now',
+                                        epilog=plugins_info, formatter_class=argparse.RawTextHelpFormatter)
+    arg_parser.add_argument('input_type', help='Specify Input type as either AFF4, AXIOMZIP, DD, DMG, E01, MOUNTED, SPARSE, UAC, VMDK or VR')
+    arg_parser.add_argument('input_path', help='Path to macOS image/volume')
+    arg_parser.add_argument('-o', '--output_path', help='Path where output files will be created')
+    arg_parser.add_argument('-x', '--xlsx', action="store_true", help='Save output in Excel spreadsheet')
+    arg_parser.add_argument('--xlsx_deferred', action="store_true", help='With -x, create the XLSX file at the end of the run (from the sqlite output), which is faster')
+    arg_parser.add_argument('-c', '--csv', action="store_true", help='Save output as CSV files')
+    arg_parser.add_argument('-t', '--tsv', action="store_true", help='Save output as TSV files (tab separated)')
+    arg_parser.add_argument('-j', '--jsonl', action="store_true", help='Save output as JSONL files')
+    arg_parser.add_argument('--jsonl_compression', choices=['gz', 'zstd'], help='Compress JSONL files as they are written (zstd needs zstandard)')
+    arg_parser.add_argument('--parquet', action="store_true", help='Save output as Parquet files (needs pyarrow)')
+    arg_parser.add_argument('--export_store', choices=['zstd', 'zlib'], help='Save exported files deduplicated & compressed (zstd needs zstandard) in Export_Store.pack, get them back with extract_exported_files.py')
+    arg_parser.add_argument('--no_spotlight_data_txt', action="store_true", help='Spotlight plugin will not write the <store>_data.txt dump of all items, which is slow for large stores')
+    arg_parser.add_argument('-l', '--log_level', help='Log levels: INFO, DEBUG, WARNING, ERROR, CRITICAL (Default is INFO)')#, choices=['INFO','DEBUG','WARNING','ERROR','CRITICAL'])
+    arg_parser.add_argument('-p', '--password', help='Personal Recovery Key(PRK) or Password for any user (for decrypting encrypted volume).')
+    arg_parser.add_argument('-pf', '--password_file', help='Text file containing Personal Recovery Key(PRK) or Password')
+    arg_parser.add_argument('-d', '--dont_decrypt', default=False, action="store_true", help='Don\'t decrypt as image is already decrypted!')
+    arg_parser.add_argument('-s', '--snapshot', help='Name of APFS snapshot to process, it is parsed in addition to the live volume and plugins run on it (only for APFS images)')
+    arg_parser.add_argument('--incremental', default=False, action="store_true", help='Skip plugins whose inputs are unchanged since a previous run in the same output folder, their earlier output is re-exported instead')
+    arg_parser.add_argument('--verify-checksums', dest='verify_checksums', default=False, action="store_true", help='Verify checksum of every APFS metadata block parsed, failures are saved in APFS_Volumes.db')
+    #arg_parser.add_argument('-u', '--use_tsk', action="store_true", help='Use sleuthkit instead of native HFS+ parser (This is slower!)')
+    arg_parser.add_argument('plugin', nargs="+", help="Plugins to run (space separated). FAST will run most plugins")
+    args = arg_parser.parse_args()
+
+    if args.output_path:
+        if (os.name != 'nt'):
+            if args.output_path.startswith('~/') or args.output_path == '~': # for linux/mac, translate ~ to user profile folder
+                args.output_path = os.path.expanduser(args.output_path)
+
+        args.output_path = os.path.abspath(args.output_path)
+        print("Output path was : {}".format(args.output_path))
+        if not CheckOutputPath(args.output_path):
+            Exit()
     else:
-        if args.log_level == "INFO": args.log_level = logging.INFO
-        elif args.log_level == "DEBUG": args.log_level = logging.DEBUG
-        elif args.log_level == "WARNING": args.log_level = logging.WARNING
-        elif args.log_level == "ERROR": args.log_level = logging.ERROR
-        elif args.log_level == "CRITICAL": args.log_level = logging.CRITICAL
-else:
-    args.log_level = logging.INFO
-log = CreateLogger(os.path.join(args.output_path, "Log." + str(time.strftime("%Y%m%d-%H%M%S")) + ".txt"), args.log_level, args.log_level) # Create logging infrastructure
-log.setLevel(args.log_level)
-log.info("Started {}, version {}".format(__PROGRAMNAME, __VERSION))
-log.info("Dates and times are in UTC unless the specific artifact being parsed saves it as local time!")
-log.debug(' '.join(sys.argv))
-LogLibraryVersions(log)
-LogPlatformInfo(log)
-
-# Check inputs
-if not CheckInputType(args.input_type):
-    Exit("Exiting -> 'input_type' " + args.input_type + " not recognized")
-if args.input_type.upper() not in ('MOUNTED'):
-    if not os.path.exists(args.input_path):
-        Exit("Exiting -> 'input_path' " + args.input_path + " does not exist!")
-else:
-    if not os.path.isdir(args.input_path):
-        Exit("Exiting -> 'input_path' " + args.input_path + " is not a folder! For mounted images, input_path should be the folder where the image is mounted.")
-
-plugins_to_run = list()
-plugins_not_to_run = list()
-for plugin_name in [x.upper() for x in args.plugin]:  # convert all plugin names entered by user to uppercase
-    if plugin_name.endswith('-'):
-        plugins_not_to_run.append(plugin_name[:-1])
+        args.output_path = os.path.abspath('.') # output to same folder as script.
+
+    if args.log_level:
+        args.log_level = args.log_level.upper()
+        if args.log_level not in ['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL']: # TODO: change to just [info, debug, error]
+            Exit("Invalid input type for log level. Valid values are INFO, DEBUG, WARNING, ERROR, CRITICAL")
+        else:
+            if args.log_level == "INFO": args.log_level = logging.INFO
+            elif args.log_level == "DEBUG": args.log_level = logging.DEBUG
+            elif args.log_level == "WARNING": args.log_level = logging.WARNING
+            elif args.log_level == "ERROR": args.log_level = logging.ERROR
+            elif args.log_level == "CRITICAL": args.log_level = logging.CRITICAL
+    else:
+        args.log_level = logging.INFO
+    log = CreateLogger(os.path.join(args.output_path, "Log." + str(time.strftime("%Y%m%d-%H%M%S")) + ".txt"), args.log_level, args.log_level) # Create logging infrastructure
+    log.setLevel(args.log_level)
+    log.info("Started {}, version {}".format(__PROGRAMNAME, __VERSION))
+    log.info("Dates and times are in UTC unless the specific artifact being parsed saves it as local time!")
+    log.debug(' '.join(sys.argv))
+    LogLibraryVersions(log)
+    LogPlatformInfo(log)
+
+    # Check inputs
+    if not CheckInputType(args.input_type):
+        Exit("Exiting -> 'input_type' " + args.input_type + " not recognized")
+    if args.input_type.upper() not in ('MOUNTED'):
+        if not os.path.exists(args.input_path):
+            Exit("Exiting -> 'input_path' " + args.input_path + " does not exist!")
     else:
-        plugins_to_run.append(plugin_name)
-
-if IsItemPresentInList(plugins_to_run, 'ALL'):
-    plugins_to_run = plugin_name_list
-    plugins_to_run.remove('ALL')
-    plugins_to_run.remove('FAST')
-else:
-    if IsItemPresentInList(plugins_to_run, 'FAST'): # check for FAST
+        if not os.path.isdir(args.input_path):
+            Exit("Exiting -> 'input_path' " + args.input_path + " is not a folder! For mounted images, input_path should be the folder where the image is mounted.")
+
+    plugins_to_run = list()
+    plugins_not_to_run = list()
+    for plugin_name in [x.upper() for x in args.plugin]:  # convert all plugin names entered by user to uppercase
+        if plugin_name.endswith('-'):
+            plugins_not_to_run.append(plugin_name[:-1])
+        else:
+            plugins_to_run.append(plugin_name)
+
+    if IsItemPresentInList(plugins_to_run, 'ALL'):
         plugins_to_run = plugin_name_list
         plugins_to_run.remove('ALL')
         plugins_to_run.remove('FAST')
-        for plugin in ('IDEVICEBACKUPS', 'SPOTLIGHT', 'UNIFIEDLOGEXPORT'):
-            plugins_not_to_run.append(plugin)
     else:
-        #Check for invalid plugin names or ones not Found
-        if not CheckUserEnteredPluginNames(plugins_to_run + plugins_not_to_run, plugins):
-            Exit("Exiting -> Invalid plugin name entered.")
-
-for plugin_name in plugins_not_to_run:
-    if IsItemPresentInList(plugins_to_run, plugin_name):
-        plugins_to_run.remove(plugin_name)
-
-log.info(f'Plugins to run: {", ".join(plugins_to_run)}')
-log.info(f'Plugins not to run: {", ".join(plugins_not_to_run)}')
-
-# Check outputs, create output files
-output_params = macinfo.OutputParams()
-output_params.output_path = args.output_path
-SetupExportLogger(output_params)
-
-try:
-    sqlite_path = os.path.join(output_params.output_path, "mac_apt.db")
-    output_params.output_db_path = SqliteWriter.CreateSqliteDb(sqlite_path)
-    output_params.write_sql = True
-except Exception as ex:
-    log.info('Sqlite db could not be created at : ' + sqlite_path)
-    log.exception('Exception occurred when trying to create Sqlite db')
-    Exit()
-
-if args.xlsx:
+        if IsItemPresentInList(plugins_to_run, 'FAST'): # check for FAST
+            plugins_to_run = plugin_name_list
+            plugins_to_run.remove('ALL')
+            plugins_to_run.remove('FAST')
+            for plugin in ('IDEVICEBACKUPS', 'SPOTLIGHT', 'UNIFIEDLOGEXPORT'):
+                plugins_not_to_run.append(plugin)
+        else:
+            #Check for invalid plugin names or ones not Found
+            if not CheckUserEnteredPluginNames(plugins_to_run + plugins_not_to_run, plugins):
+                Exit("Exiting -> Invalid plugin name entered.")
+
+    for plugin_name in plugins_not_to_run:
+        if IsItemPresentInList(plugins_to_run, plugin_name):
+            plugins_to_run.remove(plugin_name)
+
+    log.info(f'Plugins to run: {", ".join(plugins_to_run)}')
+    log.info(f'Plugins not to run: {", ".join(plugins_not_to_run)}')
+
+    # Check outputs, create output files
+    output_params = macinfo.OutputParams()
+    output_params.output_path = args.output_path
+    SetupExportLogger(output_params)
+
     try:
-        xlsx_path = os.path.join(output_params.output_path, "mac_apt.xlsx")
-        output_params.xlsx_writer = ExcelWriter()
-        output_params.xlsx_writer.CreateXlsxFile(xlsx_path)
-        output_params.write_xlsx = True
+        sqlite_path = os.path.join(output_params.output_path, "mac_apt.db")
+        output_params.output_db_path = SqliteWriter.CreateSqliteDb(sqlite_path)
+        output_params.write_sql = True
     except Exception as ex:
-        log.info('XLSX file could not be created at : ' + xlsx_path)
-        log.exception('Exception occurred when trying to create XLSX file')
-
-if args.csv:
-    output_params.write_csv = True
-if args.tsv:
-    output_params.write_tsv = True
-if args.jsonl:
-    output_params.write_jsonl = True
-
-# At this point, all looks good, lets mount the image
-img = None
-found_macos = False
-mac_info = None
-time_processing_started = time.time()
-try:
-    if args.input_type.upper() == 'E01':
-        img = GetImgInfoObjectForE01(args.input_path)
-        mac_info = macinfo.MacInfo(output_params)
-    elif args.input_type.upper() == 'VMDK':
-        img = GetImgInfoObjectForVMDK(args.input_path)
-        mac_info = macinfo.MacInfo(output_params)
-    elif args.input_type.upper() == 'UAC':
-        if os.path.isfile(args.input_path):
-            uac_extraction_folder = os.path.join(output_params.export_path, 'Extraction')
-            if args.input_path.lower().endswith('.zip'):
-                success, metadata_collection = extract_uac_zip(args.input_path, uac_extraction_folder)
-                if success:
-                    mac_info = macinfo.MountedUacZip(uac_extraction_folder, metadata_collection, output_params)
-                    found_macos = FindMacOsFiles(mac_info)
+        log.info('Sqlite db could not be created at : ' + sqlite_path)
+        log.exception('Exception occurred when trying to create Sqlite db')
+        Exit()
+
+    if args.xlsx:
+        try:
+            xlsx_path = os.path.join(output_params.output_path, "mac_apt.xlsx")
+            output_params.xlsx_writer = ExcelWriter()
+            output_params.xlsx_writer.deferred = args.xlsx_deferred
+            output_params.xlsx_writer.CreateXlsxFile(xlsx_path)
+            output_params.write_xlsx = True
+        except Exception as ex:
+            log.info('XLSX file could not be created at : ' + xlsx_path)
+            log.exception('Exception occurred when trying to create XLSX file')
+
+    if args.csv:
+        output_params.write_csv = True
+    if args.tsv:
+        output_params.write_tsv = True
+    if args.jsonl:
+        output_params.write_jsonl = True
+        output_params.jsonl_compression = args.jsonl_compression
+    if args.parquet:
+        if ParquetWriter.IsAvailable():
+            output_params.write_parquet = True
+        else:
+            log.error('Parquet output was requested, but pyarrow is not installed (pip install pyarrow). Parquet files will not be created!')
+    output_params.write_spotlight_data_txt = not args.no_spotlight_data_txt
+    if args.export_store:
+        output_params.export_store = ExportStore(output_params.export_path, args.export_store)
+        if not output_params.export_store.Open():
+            log.error('Export store could not be created, exported files will be saved as individual files')
+            output_params.export_store = None
+    if args.incremental:
+        output_params.run_manifest = RunManifest(output_params.output_path, args.input_type, args.input_path)
+
+    # At this point, all looks good, lets mount the image
+    img = None
+    found_macos = False
+    mac_info = None
+    time_processing_started = time.time()
+    try:
+        if args.input_type.upper() == 'E01':
+            img = GetImgInfoObjectForE01(args.input_path)
+            mac_info = macinfo.MacInfo(output_params)
+        elif args.input_type.upper() == 'VMDK':
+            img = GetImgInfoObjectForVMDK(args.input_path)
+            mac_info = macinfo.MacInfo(output_params)
+        elif args.input_type.upper() == 'UAC':
+            if os.path.isfile(args.input_path):
+                uac_extraction_folder = os.path.join(output_params.export_path, 'Extraction')
+                if args.input_path.lower().endswith('.zip'):
+                    success, metadata_collection = extract_uac_zip(args.input_path, uac_extraction_folder)
+                    if success:
+                        mac_info = macinfo.MountedUacZip(uac_extraction_folder, metadata_collection, output_params)
+                        found_macos = FindMacOsFiles(mac_info)
+                    else:
+                        Exit("Exiting -> Could not extract/read UAC zip file!")
+                elif args.input_path.lower().endswith('.tar') or args.input_path.lower().endswith('.tar.gz') or args.input_path.lower().endswith('.tgz'):
+                    success, metadata_collection, xattributes_dict, symlinks_dict = extract_uac_tar(args.input_path, uac_extraction_folder)
+                    if success:
+                        mac_info = macinfo.MountedUacTar(uac_extraction_folder, metadata_collection, output_params, xattributes_dict, symlinks_dict)
+                        found_macos = FindMacOsFiles(mac_info)
+                    else:
+                        Exit("Exiting -> Could not extract/read UAC tar file!")
                 else:
-                    Exit("Exiting -> Could not extract/read UAC zip file!")
-            elif args.input_path.lower().endswith('.tar') or args.input_path.lower().endswith('.tar.gz') or args.input_path.lower().endswith('.tgz'):
-                success, metadata_collection, xattributes_dict, symlinks_dict = extract_uac_tar(args.input_path, uac_extraction_folder)
+                    log.error("Unsupported UAC archive format! Only .zip, .tar, .tar.gz and .tgz are supported!")
+            else:
+                Exit("Exiting -> Cannot browse mounted image at " + args.input_path)
+        elif args.input_type.upper() == 'VR':
+            if os.path.isfile(args.input_path):
+                zip_extraction_folder = os.path.join(output_params.export_path, 'Extraction')
+                success, metadata_collection = extract_zip(args.input_path, zip_extraction_folder)
                 if success:
-                    mac_info = macinfo.MountedUacTar(uac_extraction_folder, metadata_collection, output_params, xattributes_dict, symlinks_dict)
+                    mac_info = macinfo.MountedVRZip(zip_extraction_folder, metadata_collection, output_params)
                     found_macos = FindMacOsFiles(mac_info)
                 else:
-                    Exit("Exiting -> Could not extract/read UAC tar file!")
+                    Exit("Exiting -> Could not extract/read zip file!")
             else:
-                log.error("Unsupported UAC archive format! Only .zip, .tar, .tar.gz and .tgz are supported!")
-        else:
-            Exit("Exiting -> Cannot browse mounted image at " + args.input_path)
-    elif args.input_type.upper() == 'VR':
-        if os.path.isfile(args.input_path):
-            zip_extraction_folder = os.path.join(output_params.export_path, 'Extraction')
-            success, metadata_collection = extract_zip(args.input_path, zip_extraction_folder)
-            if success:
-                mac_info = macinfo.MountedVRZip(zip_extraction_folder, metadata_collection, output_params)
+                Exit("Exiting -> Cannot browse mounted image at " + args.input_path)
+        elif args.input_type.upper() == 'AFF4':
+            img = GetImgInfoObjectForAff4(args.input_path)
+            mac_info = macinfo.MacInfo(output_params)
+        elif args.input_type.upper() == 'SPARSE':
+            img = GetImgInfoObjectForSparse(args.input_path)
+            mac_info = macinfo.MacInfo(output_params)
+        elif args.input_type.upper() == 'DMG':
+            if os.path.isfile(args.input_path) and AppleDiskImage.is_compressed(args.input_path):
+                img = GetImgInfoObjectForDMG(args.input_path)
+            else:
+                # Uncompressed / raw DMG
+                img = pytsk3.Img_Info(args.input_path)
+            mac_info = macinfo.MacInfo(output_params)
+        elif args.input_type.upper() == 'DD':
+            img = pytsk3.Img_Info(args.input_path)  # Works for split dd images too!
+            mac_info = macinfo.MacInfo(output_params)
+        elif args.input_type.upper() == 'MOUNTED':
+            if os.path.isdir(args.input_path):
+                mac_info = macinfo.MountedMacInfo(args.input_path, output_params)
                 found_macos = FindMacOsFiles(mac_info)
             else:
-                Exit("Exiting -> Could not extract/read zip file!")
-        else:
-            Exit("Exiting -> Cannot browse mounted image at " + args.input_path)
-    elif args.input_type.upper() == 'AFF4':
-        img = GetImgInfoObjectForAff4(args.input_path)
-        mac_info = macinfo.MacInfo(output_params)
-    elif args.input_type.upper() == 'SPARSE':
-        img = GetImgInfoObjectForSparse(args.input_path)
-        mac_info = macinfo.MacInfo(output_params)
-    elif args.input_type.upper() == 'DMG':
-        if os.path.isfile(args.input_path) and AppleDiskImage.is_compressed(args.input_path):
-            img = GetImgInfoObjectForDMG(args.input_path)
-        else:
-            # Uncompressed / raw DMG
-            img = pytsk3.Img_Info(args.input_path)
-        mac_info = macinfo.MacInfo(output_params)
-    elif args.input_type.upper() == 'DD':
-        img = pytsk3.Img_Info(args.input_path)  # Works for split dd images too!
-        mac_info = macinfo.MacInfo(output_params)
-    elif args.input_type.upper() == 'MOUNTED':
-        if os.path.isdir(args.input_path):
-            mac_info = macinfo.MountedMacInfo(args.input_path, output_params)
-            found_macos = FindMacOsFiles(mac_info)
-        else:
-            Exit("Exiting -> Cannot browse mounted image at " + args.input_path)
-    elif args.input_type.upper() == 'AXIOMZIP':
-        if os.path.isfile(args.input_path):
-            mac_info = macinfo.ZipMacInfo(args.input_path, output_params)
-            found_macos = FindMacOsFiles(mac_info)
-        else:
-            Exit("Exiting -> Cannot read Axiom Targeted collection zip image at " + args.input_path)
-    log.info("Opened image " + args.input_path)
-except Exception as ex:
-    log.exception("Failed to load image.")
-    Exit()
-
-if args.password_file:
-    try:
-        mac_info.password = ReadPasswordFromFile(args.password_file)
-    except OSError as ex:
-        log.error(f"Failed to read password from file {args.password_file}\n Error Details are: " + str(ex))
+                Exit("Exiting -> Cannot browse mounted image at " + args.input_path)
+        elif args.input_type.upper() == 'AXIOMZIP':
+            if os.path.isfile(args.input_path):
+                mac_info = macinfo.ZipMacInfo(args.input_path, output_params)
+                found_macos = FindMacOsFiles(mac_info)
+            else:
+                Exit("Exiting -> Cannot read Axiom Targeted collection zip image at " + args.input_path)
+        log.info("Opened image " + args.input_path)
+    except Exception as ex:
+        log.exception("Failed to load image.")
         Exit()
-elif args.password:
-    mac_info.password = args.password
-
-if args.input_type.upper() not in ('MOUNTED', 'AXIOMZIP', 'VR', 'UAC'):
-    mac_info.pytsk_image = img
-    mac_info.use_native_hfs_parser = True #False if args.use_tsk else True
-    mac_info.dont_decrypt = True if args.dont_decrypt else False
-
-    if IsApfsContainer(img, 0):
-        log.debug("Found container at offset zero in image, must be a container image")
-        uuid = GetApfsContainerUuid(img, 0)
-        log.info('Found an APFS container with uuid: {}'.format(str(uuid).upper()))
-        found_macos = FindMacOsPartitionInApfsContainer(img, None, img.get_size(), 0, uuid)
-    elif IsHFSVolume(img, 0):
-        found_macos = IsMacOsPartition(img, 0, mac_info)
-    if not found_macos: # must be a full disk image
-        try:
-            vol_info = pytsk3.Volume_Info(img)
-            vs_info = vol_info.info # TSK_VS_INFO object
-            mac_info.vol_info = vol_info
-            found_macos = FindMacOsPartition(img, vol_info, vs_info)
-            Disk_Info(mac_info, args.input_path).Write()
-        except Exception as ex:
-            log.exception("Error while trying to read partitions on disk")
 
-# Start processing plugins now!
-if found_macos:
-    if not mac_info.is_apfs:
-        mac_info.hfs_native.Initialize(mac_info.pytsk_image, mac_info.macos_partition_start_offset)
-    for plugin in plugins:
-        if IsItemPresentInList(plugins_to_run, plugin.__Plugin_Name):
-            log.info("-"*50)
-            log.info("Running plugin " + plugin.__Plugin_Name)
-            time_plugin_started = time.time()
+    if args.password_file:
+        try:
+            mac_info.password = ReadPasswordFromFile(args.password_file)
+        except OSError as ex:
+            log.error(f"Failed to read password from file {args.password_file}\n Error Details are: " + str(ex))
+            Exit()
+    elif args.password:
+        mac_info.password = args.password
+
+    if args.input_type.upper() not in ('MOUNTED', 'AXIOMZIP', 'VR', 'UAC'):
+        mac_info.pytsk_image = img
+        mac_info.use_native_hfs_parser = True #False if args.use_tsk else True
+        mac_info.dont_decrypt = True if args.dont_decrypt else False
+
+        if IsApfsContainer(img, 0):
+            log.debug("Found container at offset zero in image, must be a container image")
+            uuid = GetApfsContainerUuid(img, 0)
+            log.info('Found an APFS container with uuid: {}'.format(str(uuid).upper()))
+            found_macos = FindMacOsPartitionInApfsContainer(img, None, img.get_size(), 0, uuid)
+        elif IsHFSVolume(img, 0):
+            found_macos = IsMacOsPartition(img, 0, mac_info)
+        if not found_macos: # must be a full disk image
             try:
-                plugin.Plugin_Start(mac_info)
+                vol_info = pytsk3.Volume_Info(img)
+                vs_info = vol_info.info # TSK_VS_INFO object
+                mac_info.vol_info = vol_info
+                found_macos = FindMacOsPartition(img, vol_info, vs_info)
+                Disk_Info(mac_info, args.input_path).Write()
             except Exception as ex:
-                log.exception("An exception occurred while running plugin - {}".format(plugin.__Plugin_Name))
-            time_plugin_ended = time.time()
-            run_time = time_plugin_ended - time_plugin_started
-            log.info(f"{plugin.__Plugin_Name} plugin ran for {time.strftime('%H:%M:%S', time.gmtime(run_time))}")
-else:
-    log.warning(":( Could not find a partition having a macOS installation on it")
-
-log.info("-"*50)
-
-# Final cleanup
-if img is not None:
-    img.close()
-if args.xlsx:
-    output_params.xlsx_writer.CommitAndCloseFile()
-if mac_info.is_apfs and mac_info.apfs_db is not None:
-    mac_info.apfs_db.CloseDb()
-if output_params.export_log_sqlite:
-    output_params.export_log_sqlite.CloseDb()
-
-time_processing_ended = time.time()
-run_time = time_processing_ended - time_processing_started
-log.info("Finished in time = {}".format(time.strftime('%H:%M:%S', time.gmtime(run_time))))
-log.info("Review the Log file and report any ERRORs or EXCEPTIONS to the developers")
+                log.exception("Error while trying to read partitions on disk")
+
+    # Start processing plugins now!
+    if found_macos:
+        if not mac_info.is_apfs:
+            mac_info.hfs_native.Initialize(mac_info.pytsk_image, mac_info.macos_partition_start_offset)
+        run_manifest = output_params.run_manifest
+        for plugin in plugins:
+            if IsItemPresentInList(plugins_to_run, plugin.__Plugin_Name):
+                log.info("-"*50)
+                if run_manifest and run_manifest.IsPluginUnchanged(plugin.__Plugin_Name, mac_info, output_params.output_db_path):
+                    log.info("Inputs unchanged since last run, re-exporting earlier output of plugin " + plugin.__Plugin_Name)
+                    if run_manifest.ReExportPlugin(plugin.__Plugin_Name, output_params):
+                        continue
+                    log.info("Re-export failed, will run plugin instead")
+                log.info("Running plugin " + plugin.__Plugin_Name)
+                time_plugin_started = time.time()
+                if run_manifest:
+                    run_manifest.StartPlugin(plugin.__Plugin_Name, output_params)
+                plugin_completed = False
+                try:
+                    plugin.Plugin_Start(mac_info)
+                    plugin_completed = True
+                except Exception as ex:
+                    log.exception("An exception occurred while running plugin - {}".format(plugin.__Plugin_Name))
+                if run_manifest:
+                    run_manifest.EndPlugin(mac_info, plugin_completed)
+                time_plugin_ended = time.time()
+                run_time = time_plugin_ended - time_plugin_started
+                log.info(f"{plugin.__Plugin_Name} plugin ran for {time.strftime('%H:%M:%S', time.gmtime(run_time))}")
+    else:
+        log.warning(":( Could not find a partition having a macOS installation on it")
+
+    log.info("-"*50)
+
+    # Final cleanup
+    if img is not None:
+        img.close()
+    if args.xlsx:
+        output_params.xlsx_writer.CommitAndCloseFile()
+    if mac_info.is_apfs and mac_info.apfs_db is not None:
+        mac_info.apfs_db.CloseDb()
+    if isinstance(mac_info, macinfo.MountedMacInfo):
+        mac_info.CloseInodeIndex()
+    if output_params.export_log_sqlite:
+        output_params.export_log_sqlite.CloseDb()
+    if output_params.export_store:
+        output_params.export_store.Close()
+    SqliteWriterService.StopAll() # Wait for pending plugin output to be written to mac_apt.db
+
+    time_processing_ended = time.time()
+    run_time = time_processing_ended - time_processing_started
+    log.info("Finished in time = {}".format(time.strftime('%H:%M:%S', time.gmtime(run_time))))
+    log.info("Review the Log file and report any ERRORs or EXCEPTIONS to the developers")
@@ -22,6 +22,7 @@
 
 import argparse
 import logging
+import multiprocessing
 import os
 import plugins.helpers.macinfo as macinfo
 import sys
@@ -30,6 +31,7 @@ import time
 import traceback
 from plugins.helpers.writer import *
 from plugins.helpers.disk_report import *
+from plugins.helpers.export_store import ExportStore
 from plugin import *
 from version import __VERSION
 
@@ -82,179 +84,205 @@ def SetupExportLogger(output_params):
     writer.OpenSqliteDb(export_sqlite_path)
     column_info = collections.OrderedDict([ ('SourcePath', DataType.TEXT), ('ExportPath', DataType.TEXT),
                                             ('InodeModifiedTime', DataType.DATE), ('ModifiedTime', DataType.DATE),
-                                            ('CreatedTime', DataType.DATE), ('AccessedTime', DataType.DATE) ])
+                                            ('CreatedTime', DataType.DATE), ('AccessedTime', DataType.DATE),
+                                            ('SHA256', DataType.TEXT) ])
     writer.CreateTable(column_info, 'ExportedFileInfo')
     output_params.export_log_sqlite = writer
 
 ## Main program ##
 
-plugins = []
-log = None
-plugin_count = ImportPlugins(plugins, 'MACOS')
-if plugin_count == 0:
-    Exit("No plugins could be added ! Exiting..")
-
-plugin_name_list = ['ALL', 'FAST']
-plugins_info = f"The following {len(plugins)} plugins are available:"
-
-for plugin in plugins:
-    plugins_info += "\n    {:<20}{}".format(plugin.__Plugin_Name, textwrap.fill(plugin.__Plugin_Description, subsequent_indent=' '*24, initial_indent=' '*24, width=80)[24:])
-    plugin_name_list.append(plugin.__Plugin_Name)
-
-plugins_info += "\n    " + "-"*76 + "\n" +\
-                 " "*4 + "FAST" + " "*16 + "Runs all plugins except IDEVICEBACKUPS, SPOTLIGHT, UNIFIEDLOGEXPORT\n" + \
-                 " "*4 + "ALL" + " "*17 + "Runs all plugins\n" +\
-                 "\nIt is now possible to disable certain plugins from FAST or ALL by appending - to the name\n" +\
-                 "Eg: 'ALL IDEVICEBACKUPS- WIFI-' will run ALL plugins except IDEVICEBACKUPS and WIFI"
-arg_parser = argparse.ArgumentParser(description='mac_apt is a framework to process macOS forensic artifacts\n'
-                                                 f'You are running {__PROGRAMNAME} version {__VERSION}\n\n'
-                                                 'Note: The default output is now sqlite, no need to specify it now',
-                                    epilog=plugins_info, formatter_class=argparse.RawTextHelpFormatter)
-arg_parser.add_argument('input_sys_path', help='Path to root folder of mounted SYSTEM image/volume')
-arg_parser.add_argument('input_data_path', help='Path to root folder of mounted DATA image/volume')
-arg_parser.add_argument('-o', '--output_path', help='Path where output files will be created')
-arg_parser.add_argument('-x', '--xlsx', action="store_true", help='Save output in Excel spreadsheet')
-arg_parser.add_argument('-c', '--csv', action="store_true", help='Save output as CSV files')
-arg_parser.add_argument('-t', '--tsv', action="store_true", help='Save output as TSV files (tab separated)')
-arg_parser.add_argument('-j', '--jsonl', action="store_true", help='Save output as JSONL files')
-arg_parser.add_argument('-l', '--log_level', help='Log levels: INFO, DEBUG, WARNING, ERROR, CRITICAL (Default is INFO)')#, choices=['INFO','DEBUG','WARNING','ERROR','CRITICAL'])
-arg_parser.add_argument('plugin', nargs="+", help="Plugins to run (space separated). 'FAST' will run most plugins")
-args = arg_parser.parse_args()
-
-if args.output_path:
-    if (os.name != 'nt'):
-        if args.output_path.startswith('~/') or args.output_path == '~': # for linux/mac, translate ~ to user profile folder
-            args.output_path = os.path.expanduser(args.output_path)
-    print("Output path was : {}".format(args.output_path))
-    if not CheckOutputPath(args.output_path):
-        Exit()
-else:
-    args.output_path = os.path.abspath('.') # output to same folder as script.
+if __name__ == '__main__':
+    multiprocessing.freeze_support() # for pyinstaller builds, plugins may use worker processes
+
+    plugins = []
+    log = None
+    plugin_count = ImportPlugins(plugins, 'MACOS')
+    if plugin_count == 0:
+        Exit("No plugins could be added ! Exiting..")
+
+    plugin_name_list = ['ALL', 'FAST']
+    plugins_info = f"The following {len(plugins)} plugins are available:"
+
+    for plugin in plugins:
+        plugins_info += "\n    {:<20}{}".format(plugin.__Plugin_Name, textwrap.fill(plugin.__Plugin_Description, subsequent_indent=' '*24, initial_indent=' '*24, width=80)[24:])
+        plugin_name_list.append(plugin.__Plugin_Name)
 
-if args.log_level:
-    args.log_level = args.log_level.upper()
-    if args.log_level not in ['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL']: # TODO: change to just [info, debug, error]
-        Exit("Invalid input type for log level. Valid values are INFO, DEBUG, WARNING, ERROR, CRITICAL")
+    plugins_info += "\n    " + "-"*76 + "\n" +\
+                     " "*4 + "FAST" + " "*16 + "Runs all plugins except IDEVICEBACKUPS, SPOTLIGHT, UNIFIEDLOGEXPORT\n" + \
+                     " "*4 + "ALL" + " "*17 + "Runs all plugins\n" +\
+                     "\nIt is now possible to disable certain plugins from FAST or ALL by appending - to the name\n" +\
+                     "Eg: 'ALL IDEVICEBACKUPS- WIFI-' will run ALL plugins except IDEVICEBACKUPS and WIFI"
+    arg_parser = argparse.ArgumentParser(description='mac_apt is a framework to process macOS forensic artifacts\n'
+                                                     f'You are running {__PROGRAMNAME} version {__VERSION}\n\n'
+                                                     'Note: The default output is now sqlite, no need to specify it now',
+                                        epilog=plugins_info, formatter_class=argparse.RawTextHelpFormatter)
+    arg_parser.add_argument('input_sys_path', help='Path to root folder of mounted SYSTEM image/volume')
+    arg_parser.add_argument('input_data_path', help='Path to root folder of mounted DATA image/volume')
+    arg_parser.add_argument('-o', '--output_path', help='Path where output files will be created')
+    arg_parser.add_argument('-x', '--xlsx', action="store_true", help='Save output in Excel spreadsheet')
+    arg_parser.add_argument('--xlsx_deferred', action="store_true", help='With -x, create the XLSX file at the end of the run (from the sqlite output), which is faster')
+    arg_parser.add_argument('-c', '--csv', action="store_true", help='Save output as CSV files')
+    arg_parser.add_argument('-t', '--tsv', action="store_true", help='Save output as TSV files (tab separated)')
+    arg_parser.add_argument('-j', '--jsonl', action="store_true", help='Save output as JSONL files')
+    arg_parser.add_argument('--jsonl_compression', choices=['gz', 'zstd'], help='Compress JSONL files as they are written (zstd needs zstandard)')
+    arg_parser.add_argument('--parquet', action="store_true", help='Save output as Parquet files (needs pyarrow)')
+    arg_parser.add_argument('--export_store', choices=['zstd', 'zlib'], help='Save exported files deduplicated & compressed (zstd needs zstandard) in Export_Store.pack, get them back with extract_exported_files.py')
+    arg_parser.add_argument('--no_spotlight_data_txt', action="store_true", help='Spotlight plugin will not write the <store>_data.txt dump of all items, which is slow for large stores')
+    arg_parser.add_argument('-l', '--log_level', help='Log levels: INFO, DEBUG, WARNING, ERROR, CRITICAL (Default is INFO)')#, choices=['INFO','DEBUG','WARNING','ERROR','CRITICAL'])
+    arg_parser.add_argument('plugin', nargs="+", help="Plugins to run (space separated). 'FAST' will run most plugins")
+    args = arg_parser.parse_args()
+
+    if args.output_path:
+        if (os.name != 'nt'):
+            if args.output_path.startswith('~/') or args.output_path == '~': # for linux/mac, translate ~ to user profile folder
+                args.output_path = os.path.expanduser(args.output_path)
+        print("Output path was : {}".format(args.output_path))
+        if not CheckOutputPath(args.output_path):
+            Exit()
     else:
-        if args.log_level == "INFO": args.log_level = logging.INFO
-        elif args.log_level == "DEBUG": args.log_level = logging.DEBUG
-        elif args.log_level == "WARNING": args.log_level = logging.WARNING
-        elif args.log_level == "ERROR": args.log_level = logging.ERROR
-        elif args.log_level == "CRITICAL": args.log_level = logging.CRITICAL
-else:
-    args.log_level = logging.INFO
-log = CreateLogger(os.path.join(args.output_path, "Log." + str(time.strftime("%Y%m%d-%H%M%S")) + ".txt"), args.log_level, args.log_level) # Create logging infrastructure
-log.setLevel(args.log_level)
-log.info("Started {}, version {}".format(__PROGRAMNAME, __VERSION))
-log.info("Dates and times are in UTC unless the specific artifact being parsed saves it as local time!")
-log.debug(' '.join(sys.argv))
-#LogLibraryVersions(log)
-LogPlatformInfo(log)
-
-# Check inputs
-if not os.path.isdir(args.input_sys_path):
-    Exit('Exiting -> Invalid SYSTEM volume path entered -  {}'.format(args.input_sys_path))
-if not os.path.isdir(args.input_data_path):
-    Exit('Exiting -> Invalid DATA volume path entered -  {}'.format(args.input_data_path))
-
-plugins_to_run = list()
-plugins_not_to_run = list()
-for plugin_name in [x.upper() for x in args.plugin]:  # convert all plugin names entered by user to uppercase
-    if plugin_name.endswith('-'):
-        plugins_not_to_run.append(plugin_name[:-1])
+        args.output_path = os.path.abspath('.') # output to same folder as script.
+
+    if args.log_level:
+        args.log_level = args.log_level.upper()
+        if args.log_level not in ['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL']: # TODO: change to just [info, debug, error]
+            Exit("Invalid input type for log level. Valid values are INFO, DEBUG, WARNING, ERROR, CRITICAL")
+        else:
+            if args.log_level == "INFO": args.log_level = logging.INFO
+            elif args.log_level == "DEBUG": args.log_level = logging.DEBUG
+            elif args.log_level == "WARNING": args.log_level = logging.WARNING
+            elif args.log_level == "ERROR": args.log_level = logging.ERROR
+            elif args.log_level == "CRITICAL": args.log_level = logging.CRITICAL
     else:
-        plugins_to_run.append(plugin_name)
-
-if IsItemPresentInList(plugins_to_run, 'ALL'):
-    plugins_to_run = plugin_name_list
-    plugins_to_run.remove('ALL')
-    plugins_to_run.remove('FAST')
-else:
-    if IsItemPresentInList(plugins_to_run, 'FAST'): # check for FAST
+        args.log_level = logging.INFO
+    log = CreateLogger(os.path.join(args.output_path, "Log." + str(time.strftime("%Y%m%d-%H%M%S")) + ".txt"), args.log_level, args.log_level) # Create logging infrastructure
+    log.setLevel(args.log_level)
+    log.info("Started {}, version {}".format(__PROGRAMNAME, __VERSION))
+    log.info("Dates and times are in UTC unless the specific artifact being parsed saves it as local time!")
+    log.debug(' '.join(sys.argv))
+    #LogLibraryVersions(log)
+    LogPlatformInfo(log)
+
+    # Check inputs
+    if not os.path.isdir(args.input_sys_path):
+        Exit('Exiting -> Invalid SYSTEM volume path entered -  {}'.format(args.input_sys_path))
+    if not os.path.isdir(args.input_data_path):
+        Exit('Exiting -> Invalid DATA volume path entered -  {}'.format(args.input_data_path))
+
+    plugins_to_run = list()
+    plugins_not_to_run = list()
+    for plugin_name in [x.upper() for x in args.plugin]:  # convert all plugin names entered by user to uppercase
+        if plugin_name.endswith('-'):
+            plugins_not_to_run.append(plugin_name[:-1])
+        else:
+            plugins_to_run.append(plugin_name)
+
+    if IsItemPresentInList(plugins_to_run, 'ALL'):
         plugins_to_run = plugin_name_list
         plugins_to_run.remove('ALL')
         plugins_to_run.remove('FAST')
-        for plugin in ('IDEVICEBACKUPS', 'SPOTLIGHT', 'UNIFIEDLOGEXPORT'):
-            plugins_not_to_run.append(plugin)
     else:
-        #Check for invalid plugin names or ones not Found
-        if not CheckUserEnteredPluginNames(plugins_to_run + plugins_not_to_run, plugins):
-            Exit("Exiting -> Invalid plugin name entered.")
-
-for plugin_name in plugins_not_to_run:
-    if IsItemPresentInList(plugins_to_run, plugin_name):
-        plugins_to_run.remove(plugin_name)
-
-log.info(f'Plugins to run: {", ".join(plugins_to_run)}')
-log.info(f'Plugins not to run: {", ".join(plugins_not_to_run)}')
-
-# Check outputs, create output files
-output_params = macinfo.OutputParams()
-output_params.output_path = args.output_path
-SetupExportLogger(output_params)
-
-try:
-    sqlite_path = os.path.join(output_params.output_path, "mac_apt.db")
-    output_params.output_db_path = SqliteWriter.CreateSqliteDb(sqlite_path)
-    output_params.write_sql = True
-except Exception as ex:
-    log.info('Sqlite db could not be created at : ' + sqlite_path)
-    log.exception('Exception occurred when trying to create Sqlite db')
-    Exit()
-
-if args.xlsx:
+        if IsItemPresentInList(plugins_to_run, 'FAST'): # check for FAST
+            plugins_to_run = plugin_name_list
+            plugins_to_run.remove('ALL')
+            plugins_to_run.remove('FAST')
+            for plugin in ('IDEVICEBACKUPS', 'SPOTLIGHT', 'UNIFIEDLOGEXPORT'):
+                plugins_not_to_run.append(plugin)
+        else:
+            #Check for invalid plugin names or ones not Found
+            if not CheckUserEnteredPluginNames(plugins_to_run + plugins_not_to_run, plugins):
+                Exit("Exiting -> Invalid plugin name entered.")
+
+    for plugin_name in plugins_not_to_run:
+        if IsItemPresentInList(plugins_to_run, plugin_name):
+            plugins_to_run.remove(plugin_name)
+
+    log.info(f'Plugins to run: {", ".join(plugins_to_run)}')
+    log.info(f'Plugins not to run: {", ".join(plugins_not_to_run)}')
+
+    # Check outputs, create output files
+    output_params = macinfo.OutputParams()
+    output_params.output_path = args.output_path
+    SetupExportLogger(output_params)
+
     try:
-        xlsx_path = os.path.join(output_params.output_path, "mac_apt.xlsx")
-        output_params.xlsx_writer = ExcelWriter()
-        output_params.xlsx_writer.CreateXlsxFile(xlsx_path)
-        output_params.write_xlsx = True
+        sqlite_path = os.path.join(output_params.output_path, "mac_apt.db")
+        output_params.output_db_path = SqliteWriter.CreateSqliteDb(sqlite_path)
+        output_params.write_sql = True
     except Exception as ex:
-        log.info('XLSX file could not be created at : ' + xlsx_path)
-        log.exception('Exception occurred when trying to create XLSX file')
-
-if args.csv:
-    output_params.write_csv = True
-if args.tsv:
-    output_params.write_tsv = True
-if args.jsonl:
-    output_params.write_jsonl = True
-
-# At this point, all looks good, lets mount the image
-found_macos = False
-mac_info = None
-time_processing_started = time.time()
-try:
-    log.info("Opened images ")
-    mac_info = macinfo.MountedMacInfoSeperateSysData(args.input_sys_path, args.input_data_path, output_params)
-    found_macos = FindMacOsFiles(mac_info)
-except Exception as ex:
-    log.exception("Failed to browse image. Error Details are: " + str(ex))
-    Exit()
-
-# Start processing plugins now!
-if found_macos:
-    for plugin in plugins:
-        if IsItemPresentInList(plugins_to_run, plugin.__Plugin_Name):
-            log.info("-"*50)
-            log.info("Running plugin " + plugin.__Plugin_Name)
-            try:
-                plugin.Plugin_Start(mac_info)
-            except Exception as ex:
-                log.exception("An exception occurred while running plugin - {}".format(plugin.__Plugin_Name))
-else:
-    log.warning(":( Could not find a partition having a macOS installation on it")
-
-log.info("-"*50)
-
-# Final cleanup
-if args.xlsx:
-    output_params.xlsx_writer.CommitAndCloseFile()
-if mac_info.is_apfs and mac_info.apfs_db is not None:
-    mac_info.apfs_db.CloseDb()
-if output_params.export_log_sqlite:
-    output_params.export_log_sqlite.CloseDb()
-
-time_processing_ended = time.time()
-run_time = time_processing_ended - time_processing_started
-log.info("Finished in time = {}".format(time.strftime('%H:%M:%S', time.gmtime(run_time))))
-log.info("Review the Log file and report any ERRORs or EXCEPTIONS to the developers")
+        log.info('Sqlite db could not be created at : ' + sqlite_path)
+        log.exception('Exception occurred when trying to create Sqlite db')
+        Exit()
+
+    if args.xlsx:
+        try:
+            xlsx_path = os.path.join(output_params.output_path, "mac_apt.xlsx")
+            output_params.xlsx_writer = ExcelWriter()
+            output_params.xlsx_writer.deferred = args.xlsx_deferred
+            output_params.xlsx_writer.CreateXlsxFile(xlsx_path)
+            output_params.write_xlsx = True
+        except Exception as ex:
+            log.info('XLSX file could not be created at : ' + xlsx_path)
+            log.exception('Exception occurred when trying to create XLSX file')
+
+    if args.csv:
+        output_params.write_csv = True
+    if args.tsv:
+        output_params.write_tsv = True
+    if args.jsonl:
+        output_params.write_jsonl = True
+        output_params.jsonl_compression = args.jsonl_compression
+    if args.parquet:
+        if ParquetWriter.IsAvailable():
+            output_params.write_parquet = True
+        else:
+            log.error('Parquet output was requested, but pyarrow is not installed (pip install pyarrow). Parquet files will not be created!')
+    output_params.write_spotlight_data_txt = not args.no_spotlight_data_txt
+    if args.export_store:
+        output_params.export_store = ExportStore(output_params.export_path, args.export_store)
+        if not output_params.export_store.Open():
+            log.error('Export store could not be created, exported files will be saved as individual files')
+            output_params.export_store = None
+
+    # At this point, all looks good, lets mount the image
+    found_macos = False
+    mac_info = None
+    time_processing_started = time.time()
+    try:
+        log.info("Opened images ")
+        mac_info = macinfo.MountedMacInfoSeperateSysData(args.input_sys_path, args.input_data_path, output_params)
+        found_macos = FindMacOsFiles(mac_info)
+    except Exception as ex:
+        log.exception("Failed to browse image. Error Details are: " + str(ex))
+        Exit()
+
+    # Start processing plugins now!
+    if found_macos:
+        for plugin in plugins:
+            if IsItemPresentInList(plugins_to_run, plugin.__Plugin_Name):
+                log.info("-"*50)
+                log.info("Running plugin " + plugin.__Plugin_Name)
+                try:
+                    plugin.Plugin_Start(mac_info)
+                except Exception as ex:
+                    log.exception("An exception occurred while running plugin - {}".format(plugin.__Plugin_Name))
+    else:
+        log.warning(":( Could not find a partition having a macOS installation on it")
+
+    log.info("-"*50)
+
+    # Final cleanup
+    if args.xlsx:
+        output_params.xlsx_writer.CommitAndCloseFile()
+    if mac_info.is_apfs and mac_info.apfs_db is not None:
+        mac_info.apfs_db.CloseDb()
+    if isinstance(mac_info, macinfo.MountedMacInfo):
+        mac_info.CloseInodeIndex()
+    if output_params.export_log_sqlite:
+        output_params.export_log_sqlite.CloseDb()
+    if output_params.export_store:
+        output_params.export_store.Close()
+
+    time_processing_ended = time.time()
+    run_time = time_processing_ended - time_processing_started
+    log.info("Finished in time = {}".format(time.strftime('%H:%M:%S', time.gmtime(run_time))))
+    log.info("Review the Log file and report any ERRORs or EXCEPTIONS to the developers")
@@ -11,21 +11,90 @@
    errors. There are also some common functions used by both the main
    framework as well as the single plugin one.
 '''
+import ast
+import hashlib
+import json
 import logging
 import os
 import sys
 import platform
-import pyewf
-import pytsk3
-import pyvmdk
-import pyaff4
 import traceback
 
+plugin_info_attributes = ['__Plugin_Name', '__Plugin_Friendly_Name', '__Plugin_Version', '__Plugin_Description', \
+                          '__Plugin_Author', '__Plugin_Author_Email', '__Plugin_Modes', '__Plugin_ArtifactOnly_Usage']
+plugin_registry_file_name = 'plugin_registry.json'
+
+class LazyPlugin:
+    '''Stands in for a plugin module, holding only its __Plugin_* variables 
+       (read from the plugin registry). The actual module (and all its
+       dependencies) is imported only when something else is accessed on
+       it, like Plugin_Start().
+    '''
+    def __init__(self, module_name, plugin_info):
+        self._module_name = module_name
+        self._module = None
+        for attr, value in plugin_info.items():
+            setattr(self, attr, value)
+
+    def __getattr__(self, name):
+        # Only called for attributes not already set on the object
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        if self._module is None:
+            self._module = __import__(self._module_name)
+        return getattr(self._module, name)
+
+def ReadPluginInfo(source):
+    '''Returns dictionary of __Plugin_* variables parsed from plugin source code
+       (without importing it), or None if any value is not a plain literal.'''
+    plugin_info = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and \
+            isinstance(node.targets[0], ast.Name) and node.targets[0].id in plugin_info_attributes:
+            try:
+                plugin_info[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                return None
+    return plugin_info
+
+def LoadPluginRegistry(plugin_path, filenames):
+    '''Returns registry dictionary { filename : { 'sha1':xx, 'info':{ plugin_info } }, .. }
+       for the plugin files, re-reading only those that changed since the registry 
+       file (plugin_registry.json) was last saved. Registry is saved if it changed.'''
+    registry_path = os.path.join(plugin_path, plugin_registry_file_name)
+    old_registry = {}
+    try:
+        with open(registry_path, 'r', encoding='utf8') as f:
+            old_registry = json.load(f)
+    except (OSError, ValueError):
+        pass
+    registry = {}
+    for filename in filenames:
+        try:
+            with open(os.path.join(plugin_path, filename), 'rb') as f:
+                source = f.read()
+            sha1 = hashlib.sha1(source).hexdigest()
+            entry = old_registry.get(filename, None)
+            if entry is None or entry.get('sha1', '') != sha1:
+                entry = { 'sha1': sha1, 'info': ReadPluginInfo(source) }
+        except (OSError, SyntaxError, ValueError):
+            entry = { 'sha1': '', 'info': None } # Will be imported directly, so the error shows
+        registry[filename] = entry
+    if registry != old_registry:
+        try:
+            with open(registry_path, 'w', encoding='utf8') as f:
+                json.dump(registry, f, indent=1)
+        except OSError: # Perhaps read-only location (compiled bundle), registry will just be rebuilt every time
+            pass
+    return registry
+
 def ImportPlugins(plugins, mode):
     ''' Imports plugins contained in the 'plugins' folder. 
         Args: 
             mode: One of 'IOS', 'MACOS' or 'ARTIFACTONLY'
         Returns a list containing all plugin names that satisfy the mode
+        Plugins listed in the plugin registry are not imported here, instead 
+        LazyPlugin objects are returned, which import them on first use.
     '''
     #print ("Trying to import plugins")
     if getattr(sys, 'frozen', False):
@@ -38,27 +107,31 @@ def ImportPlugins(plugins, mode):
     sys.path.append(plugin_path)
 
     try:
-        dir_list = os.listdir(plugin_path)
+        dir_list = [filename for filename in os.listdir(plugin_path) if filename.endswith(".py") and not filename.startswith("_")]
+        registry = LoadPluginRegistry(plugin_path, dir_list)
         for filename in dir_list:
-            if filename.endswith(".py") and not filename.startswith("_"):
-                #print ("Found plugin --> %s" % filename)
-                try:
+            #print ("Found plugin --> %s" % filename)
+            try:
+                plugin_info = registry[filename]['info']
+                if plugin_info and len(plugin_info) == len(plugin_info_attributes):
+                    plugin = LazyPlugin(filename.replace(".py", ""), plugin_info)
+                else:
                     plugin = __import__(filename.replace(".py", ""))
-                    #print ("Plugin name is ----> " + plugin.__Plugin_Name)
-                    if not IsPluginValidForMode(plugin, mode): 
-                        continue
-                    if IsValidPlugin(plugin):
-                        plugins.append(plugin)
-                    else:
-                        print ("Failed to import plugin - {}\nPlugin is missing a required variable".format(filename))
-                except Exception as ie: #ImportError, SyntaxError, ..
-                    exc_type, ex, tb = sys.exc_info()
-                    imported_tb_info = traceback.extract_tb(tb)[-1]
-                    fail_filename = imported_tb_info[0]
-                    line_number = imported_tb_info[1]
-                    print ("!!Error in plugin '" + filename + "' - " + str(exc_type.__name__) + " - " + str(ie))
-                    print ("Failed to import plugin - {} ! Check code!".format(filename))
+                #print ("Plugin name is ----> " + plugin.__Plugin_Name)
+                if not IsPluginValidForMode(plugin, mode): 
                     continue
+                if IsValidPlugin(plugin):
+                    plugins.append(plugin)
+                else:
+                    print ("Failed to import plugin - {}\nPlugin is missing a required variable".format(filename))
+            except Exception as ie: #ImportError, SyntaxError, ..
+                exc_type, ex, tb = sys.exc_info()
+                imported_tb_info = traceback.extract_tb(tb)[-1]
+                fail_filename = imported_tb_info[0]
+                line_number = imported_tb_info[1]
+                print ("!!Error in plugin '" + filename + "' - " + str(exc_type.__name__) + " - " + str(ie))
+                print ("Failed to import plugin - {} ! Check code!".format(filename))
+                continue
     except Exception as ex:
         print ("Does plugin directory exist?\n Exception:\n" +str(ex))
     plugins.sort(key=lambda plugin: plugin.__Plugin_Name) # So plugins are in same order regardless of platform!
@@ -66,8 +139,7 @@ def ImportPlugins(plugins, mode):
 
 def IsValidPlugin(plugin):
     '''Check to see if required plugin variables are present'''
-    for attr in ['__Plugin_Name', '__Plugin_Friendly_Name', '__Plugin_Version', '__Plugin_Description', \
-                '__Plugin_Author', '__Plugin_Author_Email', '__Plugin_Modes', '__Plugin_ArtifactOnly_Usage']:
+    for attr in plugin_info_attributes:
         try:
             val = getattr(plugin, attr)
         except Exception:
@@ -141,12 +213,17 @@ def CreateLogger(log_file_path, log_file_level=logging.DEBUG, log_console_level=
     return logger
 
 def LogLibraryVersions(log):
-    '''Log the versions of libraries used'''
+    '''Log the versions of libraries used (only those already loaded by the caller)'''
     log.info('Python version = {}'.format(sys.version))
-    log.info('Pytsk  version = {}'.format(pytsk3.get_version()))
-    log.info('Pyewf  version = {}'.format(pyewf.get_version()))
-    log.info('Pyvmdk version = {}'.format(pyvmdk.get_version()))
-    log.info('PyAFF4 version = {}'.format(pyaff4._version.raw_versions()['version']))
+    if 'pytsk3' in sys.modules:
+        log.info('Pytsk  version = {}'.format(sys.modules['pytsk3'].get_version()))
+    if 'pyewf' in sys.modules:
+        log.info('Pyewf  version = {}'.format(sys.modules['pyewf'].get_version()))
+    if 'pyvmdk' in sys.modules:
+        log.info('Pyvmdk version = {}'.format(sys.modules['pyvmdk'].get_version()))
+    if 'pyaff4' in sys.modules:
+        import pyaff4._version
+        log.info('PyAFF4 version = {}'.format(pyaff4._version.raw_versions()['version']))
 
 def LogPlatformInfo(log):
     if getattr(sys, 'frozen', False):
@@ -7,18 +7,20 @@
 
 '''
 
+import collections
+import datetime
 import os
 import struct
-import datetime
 
 from plugins.helpers.macinfo import *
+from plugins.helpers.process_pool import GetWorkerCount, ProcessPool
 from plugins.helpers.writer import *
 
 import logging
 
 __Plugin_Name = "ASL"
 __Plugin_Friendly_Name = "Asl"
-__Plugin_Version = "1.2"
+__Plugin_Version = "1.3"
 __Plugin_Description = 'Reads macOS ASL (Apple System Log) from asl.log, asl.db, and ".asl" files.'
 __Plugin_Author = "Yuya Hashimoto"
 __Plugin_Author_Email = "yhashimoto0707@gmail.com"
@@ -51,6 +53,9 @@ _DB_TYPE_STRCONT = 5
 _ASL_FILE_TYPE_STR = 1
 
 _ASL_LEVEL = ["Emergency", "Alert", "Critical", "Error", "Warning", "Notice", "Info", "Debug"]
+_EPOCH = datetime.datetime.fromtimestamp(0)
+
+_WRITE_BATCH_SIZE = 50000 # msgs sent to the writer at a time
 
 data_name_text = "asl_text"
 data_description_text = "asl.log (in text format) entries"
@@ -107,69 +112,58 @@ class AslText:
 class AslLegacy:
 #  The file format is based on the description in asl_legacy1.h.
 #  (https://github.com/apple-oss-distributions/Libc/blob/Libc-825.25/gen/asl_legacy1.h)
+#  All records are 80 bytes, decoded from the file data in memory.
 
-    def get_msg(self):
+    def get_msg(self, id, pos):
+
+        _type_of_rec, _next_rec, _id, _ruid, \
+        _rgid, _time, _host, _sender, _facility, \
+        _level, _pid, _uid, _gid, _message, _flags = struct.unpack_from(">BIQ2I4Q4IQH", self.data, pos)
+
+        _kvs = self._get_asl_kvs(_next_rec) if _next_rec != 0 else {}
+
+        return [_EPOCH + datetime.timedelta(seconds=_time), self._get_asl_str(_host), self._get_asl_str(_sender),
+                self._get_asl_str(_facility), _ASL_LEVEL[_level] if int(_level) < len(_ASL_LEVEL) else "",
+                int(_pid), int(_uid), int(_gid), int(id), self._get_asl_str(_message),
+                str(_kvs) if len(_kvs) > 0 else "", self.file]
+
+    def _get_asl_kvs(self, rec):
+
+        _kvs = {}
+        _seen = set()
+        while rec != 0 and rec not in _seen:
+            _seen.add(rec)
+            _pos = rec * 80
+            _type_of_rec, _next_rec, _count = struct.unpack_from(">B2I", self.data, _pos)
+            if _type_of_rec == _DB_TYPE_KVLIST:
+                for i in range(_count):
+                    _k, _v = struct.unpack_from(">2Q", self.data, _pos + 9 + 8 * 2 * i)
+                    _kvs[self._get_asl_str(_k)] = self._get_asl_str(_v)
+            rec = _next_rec
 
-        _file = self.file
-        _time = self.time
-        _host = self.host
-        _sender = self.sender
-        _facility = self.facility
-        _level = self.level
-        _pid = self.pid
-        _uid = self.uid
-        _gid = self.gid
-        _message = self.message
-        _id = self.id
-        if len(self.kvs) > 0:
-            _kvs = str(self.kvs)
-        else:
-            _kvs = ""
-        _type_of_rec = self.type_of_rec
-        _next_rec = self.next_rec
-        _ruid = self.ruid
-        _rgid = self.rgid
-
-        return [_time, _host, _sender, _facility, _level, int(_pid), int(_uid), int(_gid), int(_id), _message, _kvs, _file]
-        
-    def _get_asl_kvs(self, rec, kvs):
-
-        _pos = rec * 80
-        self.fd.seek(_pos)
-
-        _type_of_rec, _next_rec, _count = struct.unpack(">B2I", self.fd.read(9))
-        _kvs = kvs
-        if _type_of_rec == _DB_TYPE_KVLIST:
-            for i in range(_count):
-                self.fd.seek(_pos + 9 + 8 * 2 * i)
-                _k, _v = struct.unpack(">2Q", self.fd.read(16))
-                _kvs[self._get_asl_str(_k)] = self._get_asl_str(_v)
-
-        if _next_rec != 0:
-            _kvs = self._get_asl_kvs(_next_rec, _kvs)
-            
         return _kvs
 
     def _get_str_cont(self, rec, len):
 
-        _str = ""
-        _pos = rec * 80
-        self.fd.seek(_pos)
-        _type_of_rec, _next_rec = struct.unpack(">BI", self.fd.read(5))
+        _parts = []
+        _seen = set()
+        while rec != 0 and len > 0 and rec not in _seen:
+            _seen.add(rec)
+            _pos = rec * 80
+            _type_of_rec, _next_rec = struct.unpack_from(">BI", self.data, _pos)
+            if len > 75:
+                _parts.append(self.data[_pos + 5:_pos + 80])
+                len = len - 75
+            else:
+                _parts.append(self.data[_pos + 5:_pos + 4 + len])
+                len = 0
+            rec = _next_rec
 
-        if len > 75:
-            _str = self.fd.read(75).decode(errors="ignore")
-            len = len - 75
-        else:
-            _str = self.fd.read(len -1).decode(errors="ignore")
-            len = 0
-
-        if _next_rec != 0:
-            _str = _str + self._get_str_cont(_next_rec, len)
-        
-        return _str
+        return b"".join(_parts)
 
     def _get_asl_str(self, val):
+        if val in self.str_cache:
+            return self.str_cache[val]
         _str = ""
         if val not in self.str_ids:
             if val & 0x8000000000000000 != 0:
@@ -178,248 +172,155 @@ class AslLegacy:
                 _str = _bytes[1:1+_len].decode(errors="ignore")
         else:
             _pos = self.str_ids[val]
-            self.fd.seek(_pos)
-            _type_of_rec, _next_rec, _id, _refcount = struct.unpack(">BIQI", self.fd.read(17))
+            _type_of_rec, _next_rec, _id, _refcount, _hash, _length = struct.unpack_from(">BIQI4sI", self.data, _pos)
 
             if _type_of_rec == _DB_TYPE_STRING and _id == val:
-                _hash = self.fd.read(4).hex()
-                _length, = struct.unpack(">I", self.fd.read(4))
-
-                self.fd.seek(_pos+25)
                 if _length > 55:
-                    _str = self.fd.read(55).decode(errors="ignore")
+                    _bytes = self.data[_pos + 25:_pos + 80]
                     _length = _length - 55
                 else:
-                    _str = self.fd.read(_length-1).decode(errors="ignore")
+                    _bytes = self.data[_pos + 25:_pos + 24 + _length]
                     _length = 0
 
                 if _next_rec != 0:
-                    _str = _str + self._get_str_cont(_next_rec, _length)
+                    _bytes = _bytes + self._get_str_cont(_next_rec, _length)
+                _str = _bytes.decode(errors="ignore")
             else:
                 log.error('Type or ID Not Match')
 
+        self.str_cache[val] = _str
         return _str
 
-    def __init__(self, file, fd, str_ids, id, pos):
+    def __init__(self, file, data, str_ids):
 
         self.file = file
-        self.fd = fd
+        self.data = data
         self.str_ids = str_ids
-        self.pos = pos
-        self.fd.seek(self.pos)
-
-        _type_of_rec, _next_rec, _id, _ruid, \
-        _rgid, _time, _host, _sender, _facility, \
-        _level, _pid, _uid, _gid, _message, _flags = struct.unpack(">BIQ2I4Q4IQH", self.fd.read(79))
-
-        _host = self._get_asl_str(_host)
-        _sender = self._get_asl_str(_sender)
-        _facility = self._get_asl_str(_facility)
-        _message = self._get_asl_str(_message)
-
-        self.type_of_rec = _type_of_rec
-        self.id = id
-        self.next_rec = _next_rec
-        self.ruid = _ruid
-        self.rgid = _rgid
-        self.time = datetime.datetime.fromtimestamp(0) + datetime.timedelta(seconds=_time)
-        self.host = _host
-        self.sender = _sender
-        self.facility = _facility
-        self.message = _message
-        self.level = _ASL_LEVEL[_level] if int(_level) < len(_ASL_LEVEL) else ""
-        self.pid = _pid
-        self.uid = _uid
-        self.gid = _gid
-        self.flags = _flags
-
-        self.kvs = {}
-        if self.next_rec != 0:
-            self.kvs = self._get_asl_kvs(self.next_rec, {})
+        self.str_cache = {}
 
 
 class AslVer2:
 #  The file format is based on the description in asl_file.h.
 #  (https://github.com/apple-oss-distributions/Libc/blob/Libc-825.25/gen/asl_file.h)
+#  Records are decoded from the file data in memory, strings are cached as
+#  the same ones (host, sender, facility, ..) are referenced by many records.
 
-    def get_msg(self):
+    def get_msg(self, pos):
+        '''Returns (msg, offset of next record)'''
 
-        _file = self.file
-        _timestamp = self.timestamp
-        _nano = self.nano
-        _host = self.host
-        _sender = self.sender
-        _facility = self.facility
-        _level = self.level
-        _pid = self.pid
-        _uid = self.uid
-        _gid = self.gid
-        _refpid = self.refpid
-        _message = self.message
-        _flags = self.flags
-        _id = self.id
-        _session = self.session
-        _refproc = self.refproc
-
-        if len(self.kvs) > 0:
-            _kvs = str(self.kvs)
-        else:
-            _kvs = ""
+        _len, _next_rec, _id, _time, _nano, \
+        _level, _flags, _pid, _uid, _gid, _ruid, \
+        _rgid, _refpid, _kv_count, _host, _sender, \
+        _facility, _message, _refproc, _session = struct.unpack_from(">I3QI2H7I6Q", self.data, pos + 2)
 
-        _ruid = self.ruid
-        _rgid = self.rgid
-        return [_timestamp, int(_nano), int(_id), int(_flags), _host,
-                _sender, _facility, _level, int(_pid), int(_uid), int(_gid),
-                _refproc, int(_refpid), _message, _session, _kvs, _file]
+        _kvs = {}
+        for i in range(_kv_count//2):
+            _k, _v = struct.unpack_from(">2Q", self.data, pos + 114 + 16 * i)
+            _kvs[self._get_asl_str(_k)] = self._get_asl_str(_v)
+
+        return [_EPOCH + datetime.timedelta(seconds=_time), int(_nano), int(_id), int(_flags), self._get_asl_str(_host),
+                self._get_asl_str(_sender), self._get_asl_str(_facility), _ASL_LEVEL[_level] if int(_level) < len(_ASL_LEVEL) else "",
+                int(_pid), int(_uid), int(_gid), self._get_asl_str(_refproc), int(_refpid), self._get_asl_str(_message),
+                self._get_asl_str(_session), str(_kvs) if len(_kvs) > 0 else "", self.file], _next_rec
 
     def _get_asl_str(self, val):
+        if val in self.str_cache:
+            return self.str_cache[val]
         _str = ""
         if val == 0:
             return _str
 
         if val & 0x8000000000000000 == 0:
-            self.fd.seek(val)
             try:
-                _type_of_rec, = struct.unpack(">H",self.fd.read(2))
+                _type_of_rec, _len = struct.unpack_from(">HI", self.data, val)
             except struct.error:
                 log.error(f'Struct Error, not enough data to unpack?, offset was: {val}')
                 return _str
             if _type_of_rec != _ASL_FILE_TYPE_STR:
                 log.error('Type Not Match')
             else:
-                _len, = struct.unpack(">I", self.fd.read(4))
-                _str = self.fd.read(_len - 1).decode(errors="ignore")
+                _str = self.data[val + 6:val + 5 + _len].decode(errors="ignore")
         else:
             _bytes = struct.pack(">Q", val)
             _len = _bytes[0] & 0x7F
             _str = _bytes[1:1+_len].decode(errors="ignore")
+        self.str_cache[val] = _str
         return _str
 
-    def __init__(self, file, fd, pos):
+    def __init__(self, file, data):
 
         self.file = file
-        self.pos = pos
-        self.fd = fd
-
-        self.fd.seek(self.pos+2)
-        _len, _next_rec, _id, _time, _nano, \
-        _level, _flags, _pid, _uid, _gid, _ruid, \
-        _rgid, _refpid, _kv_count, _host, _sender, \
-        _facility, _message, _refproc, _session = struct.unpack(">I3QI2H7I6Q", self.fd.read(112))
-
-        _kvs = {}
-        for i in range(_kv_count//2):
-            self.fd.seek(pos+114 + 16 *i)
-            _k, _v = struct.unpack(">2Q", self.fd.read(16))
-            _kvs[self._get_asl_str(_k)] = self._get_asl_str(_v)
-
-        _host = self._get_asl_str(_host)
-        _sender = self._get_asl_str(_sender)
-        _refproc = self._get_asl_str(_refproc)
-        _facility = self._get_asl_str(_facility)
-        _message = self._get_asl_str(_message)
-        _session = self._get_asl_str(_session)
-
-        self.id = _id
-        self.timestamp = datetime.datetime.fromtimestamp(0) + datetime.timedelta(seconds=_time)
-        self.nano = _nano
-        self.level = _ASL_LEVEL[_level] if int(_level) < len(_ASL_LEVEL) else ""
-        self.flags = _flags
-        self.pid = _pid
-        self.uid = _uid
-        self.gid = _gid
-        self.ruid = _ruid
-        self.rgid = _rgid
-        self.refpid = _refpid
-        self.host = _host
-        self.sender = _sender
-        self.facility = _facility
-        self.message = _message
-        self.refproc = _refproc
-        self.session = _session
-        self.kvs = _kvs
+        self.data = data
+        self.str_cache = {}
 
 class Asl:
 
     def get_version(self):
         return self.version
 
-    def __init__(self, fd, size, file):
+    def __init__(self, data, file):
+        '''data is the entire file contents'''
         self.version = -1
-        try:
-            _fd = fd
-            _size = size
-        except Exception as ex:
-            log.exception("Could not open file '{0}' ({1})".format(file, ex))
-            return
-
         self.file = file
-        self.fd = _fd
-        self.size = _size
+        self.data = data
+        self.size = len(data)
 
-        _cookie = self.fd.read(_ASL_DB_COOKIE_LEN)
-        if _cookie == _ASL_DB_COOKIE:
-            self.fd.seek(_DB_HEADER_VERS_OFFSET)
-            self.version, = struct.unpack(">I", self.fd.read(4))
+        if data[:_ASL_DB_COOKIE_LEN] == _ASL_DB_COOKIE:
+            self.version, = struct.unpack_from(">I", data, _DB_HEADER_VERS_OFFSET)
 
             if self.version == _DB_VERSION_LEGACY_1:
-                self.max_id, = struct.unpack(">Q", self.fd.read(8))
-                self.fd.read(56)
-
-                self.msg_ids = {}
-                self.str_ids = {}
-                _pos = self.fd.tell()
-                while _pos < self.size:
-                    self.fd.seek(_pos)
-                    _type_of_rec, = struct.unpack(">B",self.fd.read(1))
-                    if _type_of_rec == _DB_TYPE_MESSAGE:
-                        self.fd.seek(_pos + 5)
-                        _id, = struct.unpack(">Q", self.fd.read(8))
-                        self.msg_ids[_id] = _pos
-                    elif _type_of_rec == _DB_TYPE_STRING:
-                        self.fd.seek(_pos + 5)
-                        _id, = struct.unpack(">Q", self.fd.read(8))
-                        self.str_ids[_id] = _pos
-                    _pos += 80
-                self.msg_ids = dict(sorted(self.msg_ids.items()))
+                self.max_id, = struct.unpack_from(">Q", data, 16)
 
             elif self.version == _DB_VERSION_2:
-                self.first_rec, td = struct.unpack(">Qq", self.fd.read(16))
+                self.first_rec, td = struct.unpack_from(">Qq", data, 16)
                 try:
                     timedelta = datetime.timedelta(seconds=td)
-                    self.time = datetime.datetime.fromtimestamp(0) + timedelta
+                    self.time = _EPOCH + timedelta
                 except:
                     log.exception('Time exception')
-                self.string_cache_size, = struct.unpack(">I", self.fd.read(4))
-                self.fd.read(1)
-                self.last_rec, = struct.unpack(">Q", self.fd.read(8))
-                self.fd.read(35)
-                self.msg_pos = []
-                self.msg_pos.append(self.first_rec)
-                _current_rec = self.first_rec
-
-                while _current_rec != self.last_rec:
-                    self.fd.seek(_current_rec + 6)
-                    _next_rec, = struct.unpack(">Q", self.fd.read(8))
-                    self.msg_pos.append(_next_rec)
-                    _current_rec = _next_rec
+                self.string_cache_size, = struct.unpack_from(">I", data, 32)
+                self.last_rec, = struct.unpack_from(">Q", data, 37)
 
-        else:
-            self.fd.seek(0)
-            if self.fd.read(5).decode(errors="ignore") == "[Time":
-                self.version = _DB_VERSION_TXT
-            self.fd.seek(0)
+        elif data[:5] == b"[Time":
+            self.version = _DB_VERSION_TXT
 
     def __iter__(self):
+        '''Yields msg (list of values) for each record, in a single forward pass'''
         if self.version == _DB_VERSION_TXT:
-            for l in self.fd: # BUG? won't work as file is opened in 'b' mode
-                yield AslText(self.file, l)
-        if self.version == _DB_VERSION_LEGACY_1:
-            for id, pos in self.msg_ids.items():
-                yield AslLegacy(self.file, self.fd, self.str_ids, id, pos)
+            for l in self.data.splitlines():
+                if l.strip():
+                    yield AslText(self.file, l).get_msg()
+
+        elif self.version == _DB_VERSION_LEGACY_1:
+            # Index message & string records, messages are then read in ID order
+            msg_ids = {}
+            str_ids = {}
+            for _pos in range(80, self.size - 12, 80):
+                _type_of_rec = self.data[_pos]
+                if _type_of_rec == _DB_TYPE_MESSAGE:
+                    _id, = struct.unpack_from(">Q", self.data, _pos + 5)
+                    msg_ids[_id] = _pos
+                elif _type_of_rec == _DB_TYPE_STRING:
+                    _id, = struct.unpack_from(">Q", self.data, _pos + 5)
+                    str_ids[_id] = _pos
+            legacy = AslLegacy(self.file, self.data, str_ids)
+            for id in sorted(msg_ids):
+                yield legacy.get_msg(id, msg_ids[id])
+
         elif self.version == _DB_VERSION_2:
-            for pos in self.msg_pos:
-                yield AslVer2(self.file, self.fd, pos)
+            ver2 = AslVer2(self.file, self.data)
+            _current_rec = self.first_rec
+            _seen = set()
+            while _current_rec != 0:
+                if _current_rec + 114 > self.size or _current_rec in _seen:
+                    log.error(f'Bad record offset {_current_rec} in {self.file}')
+                    break
+                _seen.add(_current_rec)
+                msg, _next_rec = ver2.get_msg(_current_rec)
+                yield msg
+                if _current_rec == self.last_rec:
+                    break
+                _current_rec = _next_rec
 
 def CreateXlsxFile(output_path):
 
@@ -443,6 +344,8 @@ def CopyOutputParams(output_params):
     op_copy.write_sql = output_params.write_sql
     op_copy.write_xlsx = output_params.write_xlsx
     op_copy.write_jsonl = output_params.write_jsonl
+    op_copy.jsonl_compression = output_params.jsonl_compression
+    op_copy.write_parquet = output_params.write_parquet
     if op_copy.write_xlsx:
         op_copy.xlsx_writer = CreateXlsxFile(op_copy.output_path)
     else:
@@ -451,6 +354,7 @@ def CopyOutputParams(output_params):
     op_copy.output_db_path = output_params.output_db_path
     op_copy.export_path = output_params.export_path
     op_copy.export_log_sqlite = output_params.export_log_sqlite
+    op_copy.export_store = output_params.export_store
     op_copy.timezone = output_params.timezone
     return op_copy
 
@@ -467,52 +371,81 @@ def CreateSqliteDb(output_path, out_params):
         log.exception('Exception occurred when trying to create Sqlite db')
         return False
 
-def Process_Asl_File(mac_info, out_params, asl_file, writer, data_description, data_name, data_type_info):
-
+def Read_Asl_File(mac_info, asl_file):
+    '''Returns the entire file data, or None if it could not be read'''
+    try:
+        if mac_info is None: # for artifact_only
+            with open(asl_file, 'rb') as fd:
+                return fd.read()
+        fd = mac_info.Open(asl_file)
+        if fd:
+            data = fd.read()
+            fd.close()
+            return data
+        log.error(f"Could not open file '{asl_file}': Skipping this file")
+    except Exception as e:
+        log.exception("Could not read file as ASL DB '{0}' ({1}): Skipping this file".format(asl_file, e))
+    return None
+
+def Decode_Asl_Data(data, asl_file):
+    '''Returns list of msgs from the asl file data, this runs in the worker processes'''
     msgs = []
     log.info(f'Reading {asl_file}')
-    if mac_info is None: # for artifact_only
-        try:
-            size = os.path.getsize(asl_file)
-            fd = open(asl_file, 'rb')
-            asl = Asl(fd, size, asl_file)
-        except Exception as e:
-            log.exception("Could not read file as ASL DB '{0}' ({1}): Skipping this file".format(asl_file, e))
-            return
+    try:
+        asl = Asl(data, asl_file)
+        _v = asl.get_version()
+        if _v == _DB_VERSION_TXT or _v == _DB_VERSION_LEGACY_1 or _v == _DB_VERSION_2:
+            for msg in asl:
+                msgs.append(msg)
+    except Exception as e:
+        log.exception("Error reading ASL DB '{0}' ({1}): Only {2} messages were read".format(asl_file, e, len(msgs)))
+    return msgs
+
+def Iter_Decoded_Asl_Files(mac_info, asl_files):
+    '''Yields list of msgs for each file, in the same order as asl_files.
+       Files are read here (from the image) while worker processes decode the earlier ones.'''
+    max_workers = GetWorkerCount(len(asl_files))
+    if max_workers > 1:
+        with ProcessPool(max_workers) as executor:
+            pending = collections.deque()
+            for asl_file in asl_files:
+                data = Read_Asl_File(mac_info, asl_file)
+                if data is None:
+                    continue
+                pending.append(executor.submit(Decode_Asl_Data, data, asl_file))
+                if len(pending) >= max_workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
     else:
-        try:
-            size = mac_info.GetFileSize(asl_file)
-            fd = mac_info.Open(asl_file)
-            asl = Asl(fd, size, asl_file)
-        except Exception as e:
-            log.exception("Could not read file as ASL DB '{0}' ({1}): Skipping this file".format(asl_file, e))
-            return
-
-    _v = asl.get_version()
-    if _v == _DB_VERSION_TXT or _v == _DB_VERSION_LEGACY_1 or _v == _DB_VERSION_2:
-        for msg in asl:
-            msgs.append(msg.get_msg())
+        for asl_file in asl_files:
+            data = Read_Asl_File(mac_info, asl_file)
+            if data is not None:
+                yield Decode_Asl_Data(data, asl_file)
+
+def Process_Asl_Files(mac_info, out_params, asl_files, data_description, data_name, data_type_info):
+
+    writer = ChunkedDataWriter()
+    msgs = []
+    for file_msgs in Iter_Decoded_Asl_Files(mac_info, asl_files):
+        msgs.extend(file_msgs)
+        while len(msgs) >= _WRITE_BATCH_SIZE:
+            writer.WriteListPartial(data_description, data_name, msgs[:_WRITE_BATCH_SIZE], data_type_info, out_params)
+            del msgs[:_WRITE_BATCH_SIZE]
+    if msgs or writer.writer is None:
         writer.WriteListPartial(data_description, data_name, msgs, data_type_info, out_params)
+    writer.FinishWrites()
 
 def Recurse_Process_Asl_Files(mac_info, out_params, asl_files):
 
     if _DB_VERSION_TXT in asl_files:
-        writer = ChunkedDataWriter()
-        for _f in asl_files[_DB_VERSION_TXT]:
-            Process_Asl_File(mac_info, out_params, _f, writer, data_description_text, data_name_text, data_type_info_text)
-        writer.FinishWrites()
+        Process_Asl_Files(mac_info, out_params, asl_files[_DB_VERSION_TXT], data_description_text, data_name_text, data_type_info_text)
 
     if _DB_VERSION_LEGACY_1 in asl_files:
-        writer = ChunkedDataWriter()
-        for _f in asl_files[_DB_VERSION_LEGACY_1]:
-            Process_Asl_File(mac_info, out_params, _f, writer, data_description_legacy, data_name_legacy, data_type_info_legacy)
-        writer.FinishWrites()
+        Process_Asl_Files(mac_info, out_params, asl_files[_DB_VERSION_LEGACY_1], data_description_legacy, data_name_legacy, data_type_info_legacy)
 
     if _DB_VERSION_2 in asl_files:
-        writer = ChunkedDataWriter()
-        for _f in asl_files[_DB_VERSION_2]:
-            Process_Asl_File(mac_info, out_params, _f, writer, data_description_ver2, data_name_ver2, data_type_info_ver2)
-        writer.FinishWrites()
+        Process_Asl_Files(mac_info, out_params, asl_files[_DB_VERSION_2], data_description_ver2, data_name_ver2, data_type_info_ver2)
 
     if out_params.write_xlsx:
         out_params.xlsx_writer.CommitAndCloseFile()
@@ -18,7 +18,7 @@ import sqlite3
 
 from construct import *
 
-from plugins.helpers.common import CommonFunctions
+from plugins.helpers.common import ArtifactReadJobs, CommonFunctions
 from plugins.helpers.macinfo import *
 from plugins.helpers.writer import *
 
@@ -225,19 +225,6 @@ def OpenDb(inputPath):
         log.exception ("Failed to open database, is it a valid DB?")
     return None
 
-def OpenDbFromImage(mac_info, inputPath, user, browser):
-    '''Returns tuple of (connection, wrapper_obj)'''
-    log.info (f"Processing {browser} database for user '{user}' from file {inputPath}")
-    try:
-        sqlite = SqliteWrapper(mac_info)
-        conn = sqlite.connect(inputPath)
-        if conn:
-            log.debug ("Opened database successfully")
-        return conn, sqlite
-    except sqlite3.Error:
-        log.exception ("Failed to open database, is it a valid DB?")
-    return None, None
-
 def ReadTabsFile(chromium_artifacts, f, file_size, user, source):
     '''Reads 'Current/Last Tabs/Sessions' binary format'''
     if source.endswith('Last Tabs') or os.path.basename(source).lower().startswith('tabs_'):
@@ -709,20 +696,19 @@ def PrintAll(browser, chromium_artifacts, output_params, source_path):
 
     WriteList(f"{browser}", f"{browser}", data_list, chromium_info, output_params, source_path)
 
-def ExtractAndReadDb(mac_info, chromium_artifacts, user, file_path, file_size, parser_function, browser):
+def ExtractAndReadDb(jobs, mac_info, chromium_artifacts, user, file_path, file_size, parser_function, browser):
+    '''Exports and copies out db now, parsing is queued in jobs'''
     mac_info.ExportFile(file_path, os.path.join(__Plugin_Name, browser), user + '_')
-    db, wrapper = OpenDbFromImage(mac_info, file_path, user, browser)
-    if db:
-        parser_function(chromium_artifacts, db, file_size, user, file_path)
-        db.close()
+    log.info (f"Processing {browser} database for user '{user}' from file {file_path}")
+    jobs.AddDb(chromium_artifacts, mac_info, file_path,
+               lambda items, db: parser_function(items, db, file_size, user, file_path))
 
-def ExtractAndReadFile(mac_info, chromium_artifacts, user, file_path, file_size, parser_function, browser):
+def ExtractAndReadFile(jobs, mac_info, chromium_artifacts, user, file_path, file_size, parser_function, browser):
+    '''Exports and reads file now, parsing is queued in jobs'''
     mac_info.ExportFile(file_path, os.path.join(__Plugin_Name, browser), user + '_', overwrite=True)
     log.info (f"Processing {browser} file {file_path} for user {user}")
-    f = mac_info.Open(file_path)
-    if f:
-        parser_function(chromium_artifacts, f, file_size, user, file_path)
-        f.close()
+    jobs.AddFile(chromium_artifacts, mac_info, file_path,
+                 lambda items, f: parser_function(items, f, file_size, user, file_path))
 
 def OpenLocalDbAndRead(chromium_artifacts, user, file_path, file_size, parser_function):
     conn = OpenDb(file_path)
@@ -752,6 +738,7 @@ def Plugin_Start(mac_info):
         chromium_artifacts = []
         chromium_extension_artifacts = []
         chromium_accounts = []
+        jobs = ArtifactReadJobs()
         for user in mac_info.users:
             user_name = user.user_name
             if user.home_dir == '/private/var/empty': continue # Optimization, nothing should be here!
@@ -782,27 +769,29 @@ def Plugin_Start(mac_info):
                             if file_entry['size'] == 0:
                                 continue
                             if file_entry['name'] == 'Top Sites':
-                                ExtractAndReadDb(mac_info, chromium_artifacts, user_profile_name, source_path + '/Top Sites', file_entry['size'], ReadTopSitesDb, browser)
+                                ExtractAndReadDb(jobs, mac_info, chromium_artifacts, user_profile_name, source_path + '/Top Sites', file_entry['size'], ReadTopSitesDb, browser)
                             elif file_entry['name'] == 'History':
-                                ExtractAndReadDb(mac_info, chromium_artifacts, user_profile_name, source_path + '/History', file_entry['size'], ReadHistoryDb, browser)
+                                ExtractAndReadDb(jobs, mac_info, chromium_artifacts, user_profile_name, source_path + '/History', file_entry['size'], ReadHistoryDb, browser)
                             elif file_entry['name'] == 'Last Tabs':
-                                ExtractAndReadFile(mac_info, chromium_artifacts, user_profile_name, source_path + '/Last Tabs', file_entry['size'], ReadTabsFile, browser)
+                                ExtractAndReadFile(jobs, mac_info, chromium_artifacts, user_profile_name, source_path + '/Last Tabs', file_entry['size'], ReadTabsFile, browser)
                             elif file_entry['name'] == 'Current Tabs':
-                                ExtractAndReadFile(mac_info, chromium_artifacts, user_profile_name, source_path + '/Current Tabs', file_entry['size'], ReadTabsFile, browser)
+                                ExtractAndReadFile(jobs, mac_info, chromium_artifacts, user_profile_name, source_path + '/Current Tabs', file_entry['size'], ReadTabsFile, browser)
                             elif file_entry['name'] == 'Last Session':
-                                ExtractAndReadFile(mac_info, chromium_artifacts, user_profile_name, source_path + '/Last Session', file_entry['size'], ReadTabsFile, browser)
+                                ExtractAndReadFile(jobs, mac_info, chromium_artifacts, user_profile_name, source_path + '/Last Session', file_entry['size'], ReadTabsFile, browser)
                             elif file_entry['name'] == 'Current Session':
-                                ExtractAndReadFile(mac_info, chromium_artifacts, user_profile_name, source_path + '/Current Session', file_entry['size'], ReadTabsFile, browser)
+                                ExtractAndReadFile(jobs, mac_info, chromium_artifacts, user_profile_name, source_path + '/Current Session', file_entry['size'], ReadTabsFile, browser)
                             elif file_entry['name'] == 'Preferences':
-                                ExtractAndReadFile(mac_info, chromium_accounts, user_profile_name, source_path + '/Preferences', file_entry['size'], ReadPreferencesFile, browser)
-                                ExtractAndReadFile(mac_info, chromium_artifacts, user_profile_name, source_path + '/Preferences', file_entry['size'], ReadProfileInfo, browser)
+                                ExtractAndReadFile(jobs, mac_info, chromium_accounts, user_profile_name, source_path + '/Preferences', file_entry['size'], ReadPreferencesFile, browser)
+                                ExtractAndReadFile(jobs, mac_info, chromium_artifacts, user_profile_name, source_path + '/Preferences', file_entry['size'], ReadProfileInfo, browser)
                             elif file_entry['name'] == 'Secure Preferences':
-                                ExtractAndReadFile(mac_info, chromium_extension_artifacts, user_profile_name, source_path + '/Secure Preferences', file_entry['size'], ReadSecurePreferencesFile, browser)
+                                ExtractAndReadFile(jobs, mac_info, chromium_extension_artifacts, user_profile_name, source_path + '/Secure Preferences', file_entry['size'], ReadSecurePreferencesFile, browser)
                             elif file_entry['name'] == 'Last Version':
-                                ExtractAndReadFile(mac_info, chromium_artifacts, user_profile_name, source_path + '/Last Version', file_entry['size'], ReadVersion, browser)
+                                ExtractAndReadFile(jobs, mac_info, chromium_artifacts, user_profile_name, source_path + '/Last Version', file_entry['size'], ReadVersion, browser)
                         else: # Folder
                             if file_entry['name'] == 'Extensions':
-                                ProcessExtensions(mac_info, chromium_artifacts, user_profile_name, source_path + '/Extensions', browser)
+                                extension_items = []
+                                ProcessExtensions(mac_info, extension_items, user_profile_name, source_path + '/Extensions', browser)
+                                jobs.AddItems(chromium_artifacts, extension_items)
                             elif file_entry['name'] == 'Sessions':
                                 sessions_path = os.path.join(source_path, "Sessions")
                                 sessions_files_list = mac_info.ListItemsInFolder(sessions_path, EntryType.FILES, include_dates=False)
@@ -811,7 +800,8 @@ def Plugin_Start(mac_info):
                                         continue
                                     filename = file_entry['name'].lower()
                                     if filename.startswith('tabs_') or filename.startswith('session_'):
-                                        ExtractAndReadFile(mac_info, chromium_artifacts, user_profile_name, sessions_path + f"/{file_entry['name']}", file_entry['size'], ReadTabsFile, browser)
+                                        ExtractAndReadFile(jobs, mac_info, chromium_artifacts, user_profile_name, sessions_path + f"/{file_entry['name']}", file_entry['size'], ReadTabsFile, browser)
+        jobs.Finish()
 
         if len(chromium_artifacts) > 0:
             PrintAll(browser, chromium_artifacts, mac_info.output_params, chromium_profile_base_path)
@@ -28,6 +28,7 @@ from plugins.helpers.macinfo import *
 from plugins.helpers.writer import *
 
 import binascii
+import collections
 import logging
 import sqlite3
 
@@ -292,42 +293,95 @@ def GetChunkFileInfoStandalone(chunk_path):
             dirs[:] = []
     return files_info
 
-def ExtractChunksReconstructFile(mac_info, export_path, files_info, chunk_meta_info, used_cids):
+class ChunkFileHandles:
+    '''Keeps a bounded number of chunk storage files open, so that chunks of
+       many revisions stored in the same file do not re-open it every time.
+       Opening a file from an image can be expensive (it may be copied out
+       to a temp file), hence the reuse.'''
+
+    def __init__(self, mac_info, files_info, max_open=8):
+        self.mac_info = mac_info
+        self.files_info = files_info
+        self.max_open = max_open
+        self.handles = collections.OrderedDict() # { chunk_file_name : file handle }
+
+    def Get(self, chunk_file_name):
+        '''Returns open handle for chunk file, or None if it could not be opened'''
+        f = self.handles.get(chunk_file_name, None)
+        if f is not None:
+            self.handles.move_to_end(chunk_file_name)
+            return f
+        file_path = self.files_info[chunk_file_name][0]
+        try:
+            if self.mac_info is None:
+                f = open(file_path, 'rb')
+            else:
+                f = self.mac_info.Open(file_path)
+        except OSError as ex:
+            log.error(f'Failed to open {file_path}, error was {str(ex)}')
+            f = None
+        if f is None:
+            return None
+        if len(self.handles) >= self.max_open:
+            _, old_f = self.handles.popitem(last=False)
+            old_f.close()
+        self.handles[chunk_file_name] = f
+        return f
+
+    def CloseAll(self):
+        for f in self.handles.values():
+            f.close()
+        self.handles.clear()
+
+def ExtractChunksReconstructFile(handles, export_path, files_info, chunk_meta_info, used_cids):
     '''Returns file size written
        Format of chunk_meta_info is [(row['ft_rowid'], row['hex_cid'], row['offset'], row['dataLen']), ..]
+       Output positions of all chunks are computed first, then chunks are read
+       grouped by chunk file in order of their offset in it, and written to
+       their place in the (preallocated) output file.
     '''
     size_written = 0
+    out_pos = 0
+    reads = {} # { chunk_file_name : [(offset, data_len, hex_cid, out_pos), ..] }
+    zero_fill_size = 0
+    for chunk_meta in chunk_meta_info:
+        if chunk_meta is not None:
+            chunk_file_name, hex_cid, offset, data_len = chunk_meta
+            if chunk_file_name in files_info:
+                file_size = files_info[chunk_file_name][1]
+                if file_size > 0:
+                    reads.setdefault(chunk_file_name, []).append((offset, data_len, hex_cid, out_pos))
+                    out_pos += max(data_len - 25, 0)
+            else:
+                log.error('File size was zero, writing zeroes!')
+                out_pos += data_len
+                zero_fill_size += data_len
+        else:
+            log.error('Chunk data info missing, skipping this, file will be out of sync!')
+
     with open(export_path, 'wb') as f:
         log.debug(f'Writing {export_path}')
-        for chunk_meta in chunk_meta_info:
-            if chunk_meta is not None:
-                chunk_file_name = chunk_meta[0]
-                hex_cid = chunk_meta[1]
-                offset = chunk_meta[2]
-                data_len = chunk_meta[3]
-                if chunk_file_name in files_info:
-                    file_path, file_size = files_info[chunk_meta[0]]
-                    if file_size > 0:
-                        if mac_info is None:
-                            cf = open(file_path, 'rb')
-                        else:
-                            cf = mac_info.Open(file_path)
-                        cf.seek(offset)
-                        data = cf.read(data_len)
-                        cf_cid = binascii.hexlify(data[4:25]).decode('utf8').upper()
-                        if cf_cid != hex_cid:
-                            log.error(f'cid did not match {cf_cid} != {hex_cid}')
-                            continue
-                        else:
-                            size_written += f.write(data[25:])
-                            used_cids.add(hex_cid)
-                        if mac_info is None and cf is not None:
-                            cf.close()
-                else:
-                    log.error('File size was zero, writing zeroes!')
-                    size_written += f.write(b'\x00'*data_len)
-            else:
-                log.error('Chunk data info missing, skipping this, file will be out of sync!')
+        # Gaps (missing chunk files, bad chunks) are left as zeroes
+        f.truncate(out_pos)
+        size_written += zero_fill_size
+        for chunk_file_name, chunk_reads in reads.items():
+            cf = handles.Get(chunk_file_name)
+            if cf is None:
+                continue
+            chunk_reads.sort()
+            for offset, data_len, hex_cid, chunk_out_pos in chunk_reads:
+                cf.seek(offset)
+                data = cf.read(data_len)
+                # Chunk header is 4 byte size (big endian) followed by 21 byte cid
+                cf_cid = binascii.hexlify(data[4:25]).decode('utf8').upper()
+                if cf_cid != hex_cid:
+                    log.error(f'cid did not match {cf_cid} != {hex_cid}')
+                    continue
+                if struct.unpack('>I', data[0:4])[0] != data_len:
+                    log.warning(f'Chunk size in header did not match dataLen={data_len} for cid {hex_cid}')
+                f.seek(chunk_out_pos)
+                size_written += f.write(data[25:])
+                used_cids.add(hex_cid)
     return size_written
 
 def ExtractOrphanChunksToFiles(mac_info, used_cids, files_info, export_path):
@@ -376,6 +430,7 @@ def ExtractOrphanChunksToFiles(mac_info, used_cids, files_info, export_path):
 
 def ProcessRevisionsAndExtract(mac_info, revisions, chunk_info, chunk_files, export_path):
     used_cids = set()
+    handles = ChunkFileHandles(mac_info, chunk_files)
 
     if revisions:
         if mac_info is not None:
@@ -412,11 +467,12 @@ def ProcessRevisionsAndExtract(mac_info, revisions, chunk_info, chunk_files, exp
                         out_file_name += ".jpg"
                 out_file_path = CommonFunctions.GetNextAvailableFileName(os.path.join(export_path, f'{rev.gen_id}_{out_file_name}'))
                 rev.extracted_path = out_file_path
-                size_written = ExtractChunksReconstructFile(mac_info, out_file_path, chunk_files, chunks_meta_info, used_cids)
+                size_written = ExtractChunksReconstructFile(handles, out_file_path, chunk_files, chunks_meta_info, used_cids)
                 if size_written != rev.generation_size:
                     log.warning(f'Size mismatch occurred. Expected {rev.generation_size} Got {size_written}')
             else:
                 log.warning(f'Did not find rev_storage_inode={rev.rev_storage_inode} in chunk db')
+    handles.CloseAll()
     ExtractOrphanChunksToFiles(mac_info, used_cids, chunk_files, export_path)
 
 def Plugin_Start(mac_info):
@@ -437,6 +493,7 @@ def Plugin_Start(mac_info):
             chunk_files = GetChunkFileInfo(mac_info, chunk_path)
             export_path = os.path.join(mac_info.output_params.output_path, "DocRevisionsExtracted")
             os.makedirs(export_path, exist_ok=True)
+            mac_info.RecordOtherOutput(export_path)
             ProcessRevisionsAndExtract(mac_info, revisions, chunk_info, chunk_files, export_path)
             break
     
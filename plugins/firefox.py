@@ -12,7 +12,7 @@ import logging
 from plugins.helpers import macinfo
 
 from enum import IntEnum
-from plugins.helpers.common import CommonFunctions
+from plugins.helpers.common import ArtifactReadJobs, CommonFunctions
 from plugins.helpers.macinfo import *
 from plugins.helpers.writer import *
 
@@ -98,33 +98,17 @@ def OpenDb(inputPath):
         log.exception ("Failed to open database, is it a valid DB?")
     return None
 
-def OpenDbFromImage(mac_info, inputPath):
-    '''Returns tuple of (connection, wrapper_obj)'''
-    try:
-        sqlite = SqliteWrapper(mac_info)
-        conn = sqlite.connect(inputPath)
-        if conn:
-            log.debug ("Opened database successfully")
-        return conn, sqlite
-    except sqlite3.Error as ex:
-        log.exception ("Failed to open database, is it a valid DB?")
-    return None, None
-
-def ExtractAndReadDb(mac_info, firefox_artifacts, user, file_path, parser_function):
+def ExtractAndReadDb(jobs, mac_info, firefox_artifacts, user, file_path, parser_function):
+    '''Exports and copies out db now, parsing is queued in jobs'''
     if mac_info.IsValidFilePath(file_path):
         mac_info.ExportFile(file_path, __Plugin_Name, user + '_')
-        db, wrapper = OpenDbFromImage(mac_info, file_path)
-        if db:
-            parser_function(firefox_artifacts, db, user, file_path)
-            db.close()
+        jobs.AddDb(firefox_artifacts, mac_info, file_path, lambda items, db: parser_function(items, db, user, file_path))
 
-def ExtractAndReadFile(mac_info, firefox_artifacts, user, file_path, parser_function):
+def ExtractAndReadFile(jobs, mac_info, firefox_artifacts, user, file_path, parser_function):
+    '''Exports and reads file now, parsing is queued in jobs'''
     if mac_info.IsValidFilePath(file_path):
         mac_info.ExportFile(file_path, __Plugin_Name, user + '_')
-        f = mac_info.Open(file_path)
-        if f:
-            parser_function(firefox_artifacts, f, user, file_path)
-            f.close()
+        jobs.AddFile(firefox_artifacts, mac_info, file_path, lambda items, f: parser_function(items, f, user, file_path))
 
 def OpenLocalDbAndRead(firefox_artifacts, user, file_path, parser_function):
     conn = OpenDb(file_path)
@@ -255,6 +239,7 @@ def Plugin_Start(mac_info):
     firefox_form_artifacts = []
     processed_paths = []
     firefox_path = '{}/Library/Application Support/Firefox/Profiles'
+    jobs = ArtifactReadJobs()
 
     for user in mac_info.users:
         if user.home_dir == '/private/var/empty': continue # Optimization, nothing should be here!
@@ -271,10 +256,11 @@ def Plugin_Start(mac_info):
                 formhistory_db_path = f'{source_path}/{profile_name}/formhistory.sqlite'
                 extensions_json_path = f'{source_path}/{profile_name}/extensions.json'
 
-                ExtractAndReadDb(mac_info, firefox_artifacts, user_name, places_db_path, process_places)
-                ExtractAndReadDb(mac_info, firefox_form_artifacts, user_name, formhistory_db_path, process_formhistory)
-                ExtractAndReadFile(mac_info, firefox_artifacts, user_name, extensions_json_path, process_extensions)
-                
+                ExtractAndReadDb(jobs, mac_info, firefox_artifacts, user_name, places_db_path, process_places)
+                ExtractAndReadDb(jobs, mac_info, firefox_form_artifacts, user_name, formhistory_db_path, process_formhistory)
+                ExtractAndReadFile(jobs, mac_info, firefox_artifacts, user_name, extensions_json_path, process_extensions)
+    jobs.Finish()
+
     if len(firefox_artifacts) > 0:
         PrintAll(firefox_artifacts, mac_info.output_params, '')
     else:
@@ -7,9 +7,11 @@
 
 '''
 
+from plugins.helpers.decoders import IterCStringRecords
 from plugins.helpers.macinfo import *
 from plugins.helpers.writer import *
 import logging
+import sqlite3
 import zlib
 import struct
 
@@ -103,6 +105,7 @@ FlagValues = {
 data_writer = ChunkedDataWriter()
 out_params = None
 total_logs_processed = 0
+file_ids = set() # Distinct File_IDs seen, resolved to their current paths at the end
 
 # [log_id, log_event_flag, log_filepath, log_file_id, log_unknown, source_date, source]
 def PrintAll(logs):
@@ -126,8 +129,61 @@ def PrintAll(logs):
                     x[3], x[4], x[5], x[6]
                   ]
         fsevent_list.append(e_item)
+        if x[3]:
+            file_ids.add(x[3])
     data_writer.WriteListPartial("fsevents information", "FsEvents", fsevent_list, fsevent_info, out_params, '')
 
+def WriteCurrentPaths(mac_info):
+    '''Looks up all distinct File_IDs (inode numbers) seen in the fsevents in the 
+       APFS db, to get the current path of the file/folder, if it still exists. 
+       The IDs are loaded into a temp table and resolved with a single JOIN, and
+       written out to FsEvents_Current_Paths. In sqlite, a view FsEvents_With_Current_Paths
+       joins this to the FsEvents table.'''
+    if not file_ids:
+        return
+    apfs_db_path = mac_info.output_params.apfs_db_path
+    if not (mac_info.is_apfs and apfs_db_path):
+        log.debug('Not an APFS image, File_IDs will not be resolved to current paths')
+        return
+    mac_info.RecordApfsDbInput()
+    vol_name = mac_info.macos_FS.name
+    log.info('Resolving {} distinct File_IDs to current paths'.format(len(file_ids)))
+    current_paths = []
+    conn = None
+    try:
+        conn = sqlite3.connect('file:{}?mode=ro'.format(apfs_db_path), uri=True)
+        conn.execute('CREATE TEMP TABLE FileIDs (File_ID INTEGER PRIMARY KEY)')
+        conn.executemany('INSERT INTO temp.FileIDs VALUES (?)', ((file_id,) for file_id in file_ids))
+        # A file with hard links will have multiple paths
+        query = 'SELECT f.File_ID, group_concat(p.Path, ", "), '\
+                ' EXISTS (SELECT 1 FROM "{0}_Inodes" i WHERE i.CNID=f.File_ID) '\
+                ' FROM temp.FileIDs f LEFT JOIN "{0}_Paths" p ON p.CNID=f.File_ID '\
+                ' GROUP BY f.File_ID'.format(vol_name)
+        current_paths = [list(row) for row in conn.execute(query)]
+    except sqlite3.Error:
+        log.exception('Failed to resolve File_IDs from APFS db')
+    finally:
+        if conn:
+            conn.close()
+    if not current_paths:
+        return
+    current_path_info = [ ('File_ID',DataType.INTEGER),('Current_Path',DataType.TEXT),('Exists_Now',DataType.INTEGER) ]
+    writer = None
+    try:
+        writer = DataWriter(mac_info.output_params, "FsEvents_Current_Paths", current_path_info, '/.fseventsd')
+        writer.WriteRows(current_paths)
+        if writer.sql and data_writer.writer and data_writer.writer.sql:
+            query = 'CREATE VIEW "FsEvents_With_Current_Paths" AS SELECT e.*, c.Current_Path, c.Exists_Now FROM "{}" e '\
+                    'LEFT JOIN "{}" c ON c.File_ID=e.File_ID'.format(data_writer.writer.sql_writer.table_name, writer.sql_writer.table_name)
+            success, cursor, error_message = writer.sql_writer.RunQuery(query, writing=True)
+            if not success:
+                log.error('Failed to create view FsEvents_With_Current_Paths, error was {}'.format(error_message))
+    except (OSError, sqlite3.Error):
+        log.exception('Failed to write current paths for File_IDs')
+    finally:
+        if writer:
+            writer.FinishWrites()
+
 def GetEventFlagsString(flags, flag_values):
     '''Get string names of all flags set'''
     list_flags = []
@@ -136,21 +192,9 @@ def GetEventFlagsString(flags, flag_values):
             list_flags.append(v)
     return '|'.join(list_flags)
 
-def ReadCString(buffer, buffer_size, start_pos):
-    '''
-    Reads null-terminated string starting at start_pos in buffer.
-    Returns tuple (string, end_pos)
-    '''
-    string = ""
-    end_pos = buffer[start_pos:].find(b'\0')
-    if end_pos == -1: # Null not found
-        end_pos = len(buffer)
-        string = buffer[start_pos:].decode("utf-8", "backslashreplace")
-    else:
-        string = buffer[start_pos:start_pos + end_pos].decode("utf-8", "backslashreplace")
-    end_pos += start_pos
-
-    return string, end_pos + 1
+v1_record_struct = struct.Struct("<QI")
+v2_record_struct = struct.Struct("<QIq")
+v3_record_struct = struct.Struct("<QIqi")
 
 def ParseData(buffer, logs, source_date, source):
     '''Process buffer to extract log data and return number of logs processed'''
@@ -174,25 +218,17 @@ def ParseData(buffer, logs, source_date, source):
     pos = 12
 
     try:
+        end = min(buffer_size, file_size) # buffer size is always larger, this skips the junk data at its end
         if is_version3:
-            while pos < min(buffer_size, file_size): # buffer size is always larger, this skips the junk data at its end
-                log_filepath, pos = ReadCString(buffer, buffer_size, pos)
-                log_id, log_event_flag, log_file_id, log_unknown = struct.unpack("<QIqi", buffer[pos:pos+24])
-                pos += 24
+            for pos, log_filepath, (log_id, log_event_flag, log_file_id, log_unknown) in IterCStringRecords(buffer, pos, end, v3_record_struct):
                 num_logs_processed += 1
                 logs.append([log_id, log_event_flag, log_filepath, log_file_id, log_unknown, source_date, source])
-        if is_version2:
-            while pos < min(buffer_size, file_size): # buffer size is always larger, this skips the junk data at its end
-                log_filepath, pos = ReadCString(buffer, buffer_size, pos)
-                log_id, log_event_flag, log_file_id = struct.unpack("<QIq", buffer[pos:pos+20])
-                pos += 20
+        elif is_version2:
+            for pos, log_filepath, (log_id, log_event_flag, log_file_id) in IterCStringRecords(buffer, pos, end, v2_record_struct):
                 num_logs_processed += 1
                 logs.append([log_id, log_event_flag, log_filepath, log_file_id, None, source_date, source])
         else:
-            while pos < min(buffer_size, file_size):
-                log_filepath, pos = ReadCString(buffer, buffer_size, pos)
-                log_id, log_event_flag = struct.unpack("<QI", buffer[pos:pos+12])
-                pos += 12
+            for pos, log_filepath, (log_id, log_event_flag) in IterCStringRecords(buffer, pos, end, v1_record_struct):
                 num_logs_processed += 1
                 logs.append([log_id, log_event_flag, log_filepath, None, None, source_date, source])
     except (ValueError, IndexError, struct.error):
@@ -273,6 +309,7 @@ def Plugin_Start(mac_info):
     global total_logs_processed
     global out_params
     out_params = mac_info.output_params
+    file_ids.clear()
     logs = []
 
     file_list = mac_info.ListItemsInFolder('/.fseventsd', EntryType.FILES, True)
@@ -298,6 +335,7 @@ def Plugin_Start(mac_info):
     if total_logs_processed > 0:
         log.info(f'{total_logs_processed} logs found')
         data_writer.FinishWrites()
+        WriteCurrentPaths(mac_info)
     else:
         log.info('No fsevents found')
 
@@ -436,8 +436,8 @@ class Apfs(KaitaiStruct):
             if (self._parent.node_type & BTNODE_LEAF) == 0: # non-leaf nodes
                 if _on == 2: #extent
                     self._m_data = self._io.read_u8le() # paddr ?
-                elif _on in (3, 4, 5, 6, 7, 8, 9, 10, 12, 13):
-                    self._m_data = self._io.read_u8le() # unknown val
+                elif _on in (1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13):
+                    self._m_data = self._io.read_u8le() # unknown val (child oid for physical trees like snap_meta_tree)
                     #log.debug("In non-leaf node, got kind 0x{:X}, treetype={}".format(_on, self._parent._parent.header.subtype))
                 else:
                     log.debug("Should not go here, got kind 0x{:X}, treetype={}".format(_on, self._parent._parent.header.subtype))
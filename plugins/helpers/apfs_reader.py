@@ -7,9 +7,13 @@
 
 '''
 
+import array
+import bisect
 import collections
+import gc
 import logging
 import os
+import sqlite3
 import struct
 import zlib
 from uuid import UUID
@@ -22,6 +26,7 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from kaitaistruct import BytesIO, KaitaiStream
 from kaitaistruct import __version__ as ks_version
+from plugins.helpers.decoders import Fletcher64
 from plugins.helpers.common import *
 from plugins.helpers.writer import DataType
 
@@ -66,15 +71,24 @@ class ApfsDbInfo:
 
     def __init__(self, db_writer):
         self.db_writer = db_writer # SqliteWriter object
-        self.version = 7 # This will change if db structure changes in future
+        self.version = 8 # This will change if db structure changes in future
         self.ver_table_name = 'Version_Info'
         self.vol_table_name = 'Volumes_Info'
+        self.snap_table_name = 'Snapshots_Info'
+        self.checksum_table_name = 'Checksum_Failures'
         self.version_info = collections.OrderedDict([('Version',DataType.INTEGER)])
         self.volume_info = collections.OrderedDict([('Name',DataType.TEXT),('UUID',DataType.TEXT),
                                                     ('Files',DataType.INTEGER),('Folders',DataType.INTEGER),
                                                     ('Snapshots',DataType.INTEGER),
                                                     ('Created',DataType.INTEGER),('Updated',DataType.INTEGER),
                                                     ('Role',DataType.INTEGER),('VEK',DataType.BLOB)])
+        self.snapshot_info = collections.OrderedDict([('Volume_UUID',DataType.TEXT),('Name',DataType.TEXT),
+                                                    ('XID',DataType.INTEGER),('Created',DataType.INTEGER),
+                                                    ('Table_Prefix',DataType.TEXT)])
+        self.checksum_failure_info = collections.OrderedDict([('Block_Num',DataType.INTEGER),('OID',DataType.INTEGER),
+                                                    ('XID',DataType.INTEGER),('Type',DataType.INTEGER),
+                                                    ('Subtype',DataType.INTEGER),('Stored_Checksum',DataType.TEXT),
+                                                    ('Computed_Checksum',DataType.TEXT)])
 
     def WriteVersionInfo(self):
         self.db_writer.CreateTable(self.version_info, self.ver_table_name)
@@ -90,6 +104,48 @@ class ApfsDbInfo:
                         vol.time_created, vol.time_updated, vol.role, vol.encryption_key])
         self.db_writer.WriteRows(data, self.vol_table_name)
 
+    def WriteSnapshotInfo(self, snapshot_volumes, snapshot_name):
+        '''Write info about parsed snapshots (ApfsSnapshotVolume objects) to seperate table.
+           If no volume had the snapshot, a row with no Volume_UUID records that.'''
+        self.db_writer.CreateTable(self.snapshot_info, self.snap_table_name)
+        data = []
+        for vol in snapshot_volumes:
+            data.append([vol.uuid, vol.snapshot.name, vol.snapshot.xid, vol.snapshot.time_created, vol.name])
+        if not data:
+            data.append(['', snapshot_name, 0, 0, ''])
+        self.db_writer.WriteRows(data, self.snap_table_name)
+
+    def WriteChecksumFailures(self, container):
+        '''Write checksum failures seen during parsing to seperate table. An empty
+           table indicates that all metadata blocks parsed were verified as good.'''
+        self.db_writer.CreateTable(self.checksum_failure_info, self.checksum_table_name)
+        # Checksums are u64, too big for sqlite INTEGER, so stored as hex
+        data = [row[:5] + ['{:016X}'.format(x) for x in row[5:]] for row in container.checksum_failures.values()]
+        if data:
+            self.db_writer.WriteRows(data, self.checksum_table_name)
+        log.info('Checksum verified {} metadata blocks, {} failed'.format(container.num_blocks_verified, len(data)))
+
+    def HasChecksumInfo(self):
+        '''Returns True if db was created with checksum verification on'''
+        return CommonFunctions.TableExists(self.db_writer.conn, self.checksum_table_name)
+
+    def GetSnapshotInfo(self, snapshot_name):
+        '''Returns dictionary { volume_uuid : (xid, table_prefix), .. } of parsed snapshots having snapshot_name,
+           which is empty if no volume had it. Returns None if this db was not searched for snapshot_name.'''
+        if not CommonFunctions.TableExists(self.db_writer.conn, self.snap_table_name):
+            return None
+        snapshots = {}
+        searched = False
+        query = 'SELECT Volume_UUID, XID, Table_Prefix FROM "{}" WHERE Name=?'.format(self.snap_table_name)
+        try:
+            for row in self.db_writer.conn.execute(query, (snapshot_name,)):
+                searched = True
+                if row[0]:
+                    snapshots[row[0]] = (row[1], row[2])
+        except sqlite3.Error as ex:
+            log.error('Error querying snapshot info from db: ' + str(ex))
+        return snapshots if searched else None
+
     def CheckVerInfo(self):
         '''Returns true if info in db matches current version number'''
         query = 'SELECT Version FROM "{}"'.format(self.ver_table_name)
@@ -184,6 +240,13 @@ class ApfsFileSystemParser:
                                                     ('DBG_BLK_PATH',DataType.TEXT),('DB_ID',(DataType.INTEGER,"PRIMARY KEY AUTOINCREMENT"))]) 
         ## Optimization for search
         self.blocks_read = set()
+        self.leaf_blocks_read = set()
+
+        ## For snapshot parsing, leaf blocks already ingested are not decoded again
+        self.track_block_rows = False # If set, DB_ID ranges of rows from each leaf block are recorded
+        self.block_row_ranges = {} # key=block_num, value={ table_type: (first DB_ID, last DB_ID) }
+        self.rows_written = { 'Hardlinks':0, 'Extents':0, 'Inodes':0, 'Attributes':0, 'DirEntries':0, 'DirStats':0 }
+        self.omap_root = None # omap node tree from the live parse, reused for snapshots
 
         self.container_type_files = self.container.apfs.ObjType.fstree.value
         self.container_type_location = self.container.apfs.ObjType.omap.value
@@ -227,44 +290,45 @@ class ApfsFileSystemParser:
         else:
             log.error('Failed to get CNIDs for firmlinks. Error was : ' + error)
             return False
-        self.create_tables()
-        hardlinks_columns = ','.join([x for x in self.hardlink_info][:-1])
-        extents_columns = ','.join([x for x in self.extent_info][:-1])
-        attributes_columns = ','.join([x for x in self.attr_info][:-1])
-        inodes_columns = ','.join([x for x in self.inode_info][:-1])
-        dir_entries_columns = ','.join([x for x in self.dir_info][:-1])
-        dir_stats_columns = ','.join([x for x in self.dir_stats_info][:-1])
-        compressed_files_columns = ','.join([x for x in self.compressed_info][:-1])
-        paths_columns = ','.join([x for x in self.paths_info])
-
-        view_query = 'INSERT INTO "{4}_{0}" '\
-                    'select {5} FROM ('\
-                    'select * from "{1}_{0}" UNION ALL '\
-                    'select * from "{2}_{0}" WHERE cnid not in ({3}) )'
-        for table_type, columns in collections.OrderedDict([('Hardlinks', hardlinks_columns + ',NULL'),('Extents', extents_columns + ',NULL'),
-                ('Attributes', attributes_columns + ',NULL'), ('Inodes', inodes_columns + ',NULL'), ('DirEntries', dir_entries_columns + ',NULL'),
-                ('DirStats', dir_stats_columns + ',NULL'), ('Compressed_Files', compressed_files_columns + ',NULL'), 
-                ('Paths', paths_columns)]).items():
-            query = view_query.format(table_type, data_vol.name, sys_vol.name, cnids, self.name, columns)
+        # The combined volume's tables are views over the data & system volume 
+        # tables, nothing is copied. Firmlinked folders on the data volume must
+        # appear under their parent on the system volume, these new parents are
+        # kept in the small Parent_Fixups table and substituted in the views.
+        fixups_table = self.name + '_Parent_Fixups'
+        query = 'CREATE TABLE "{}" (CNID INTEGER PRIMARY KEY, Parent_CNID INTEGER)'.format(fixups_table)
+        if not self.run_query(query, True): return False
+        try:
+            cursor = self.dbo.conn.cursor()
+            for path, parent_cnid in sys_inode_paths_and_parents.items():
+                cursor.execute('INSERT OR REPLACE INTO "{}" SELECT CNID, ? FROM "{}_Paths" WHERE Path = ?'.format(fixups_table, data_vol.name),
+                                (int(parent_cnid), path))
+            self.dbo.conn.commit()
+        except sqlite3.Error as ex:
+            log.error('Failed to populate {}, error was {}'.format(fixups_table, str(ex)))
+            return False
+
+        view_query = 'CREATE VIEW "{0}_{1}" AS '\
+                     'SELECT * FROM "{2}_{1}" UNION ALL '\
+                     'SELECT * FROM "{3}_{1}" WHERE CNID NOT IN ({4})'
+        fixup_view_query = 'CREATE VIEW "{0}_{1}" AS '\
+                     'SELECT * FROM "{2}_{1}" WHERE CNID NOT IN (SELECT CNID FROM "{5}") UNION ALL '\
+                     'SELECT {6} FROM "{2}_{1}" d INNER JOIN "{5}" f ON d.CNID=f.CNID UNION ALL '\
+                     'SELECT * FROM "{3}_{1}" WHERE CNID NOT IN ({4})'
+        for table_type, column_info in collections.OrderedDict([('Hardlinks', self.hardlink_info),('Extents', self.extent_info),
+                ('Attributes', self.attr_info), ('Inodes', self.inode_info), ('DirEntries', self.dir_info),
+                ('DirStats', self.dir_stats_info), ('Compressed_Files', self.compressed_info), 
+                ('Paths', self.paths_info)]).items():
+            if 'Parent_CNID' in column_info:
+                columns = ','.join(['f.Parent_CNID' if x == 'Parent_CNID' else 'd.' + x for x in column_info])
+                query = fixup_view_query.format(self.name, table_type, data_vol.name, sys_vol.name, cnids, fixups_table, columns)
+            else:
+                query = view_query.format(self.name, table_type, data_vol.name, sys_vol.name, cnids)
             if not self.run_query(query, True): return False
         # if is_beta:
         #     # Just a dumb hack, remove all '/Device' from the start of all paths.
         #     query = 'UPDATE "{0}_Paths" SET Path = substr(Path, 8) WHERE Path LIKE "/Device/%"'.format(self.name)
         #     if not self.run_query(query, True): return False
 
-        query_inodes = 'UPDATE "{}_Inodes" SET Parent_CNID={} WHERE CNID IN '\
-                        '(SELECT CNID FROM "{}_Paths" WHERE PATH LIKE {}); '
-        query_indexes= 'UPDATE "{}_DirEntries" SET Parent_CNID={} WHERE CNID IN '\
-                        '(SELECT CNID FROM "{}_Paths" WHERE PATH LIKE {}); '
-        query_hlinks = 'UPDATE "{}_Hardlinks" SET Parent_CNID={} WHERE CNID IN '\
-                        '(SELECT CNID FROM "{}_Paths" WHERE PATH LIKE {}); '
-        update_query = ''
-        for path, parent_cnid in sys_inode_paths_and_parents.items():
-            update_query += query_inodes.format(self.name, parent_cnid, data_vol.name, path)
-            update_query += query_indexes.format(self.name, parent_cnid, data_vol.name, path)
-            update_query += query_hlinks.format(self.name, parent_cnid, data_vol.name, path)
-
-        self.create_indexes()
         return True
 
     def AddToStats(self, entry_type):
@@ -278,7 +342,18 @@ class ApfsFileSystemParser:
             if item_count:
                 log.info('{} Type={}  Count={}'.format(self.name, str(entry_type)[10:], item_count))
 
+    def get_row_counts(self):
+        '''Returns total rows (written + pending) for each table type'''
+        return { 'Hardlinks': self.rows_written['Hardlinks'] + len(self.hardlink_records),
+                 'Extents': self.rows_written['Extents'] + len(self.extent_records),
+                 'Inodes': self.rows_written['Inodes'] + len(self.inode_records),
+                 'Attributes': self.rows_written['Attributes'] + len(self.attr_records),
+                 'DirEntries': self.rows_written['DirEntries'] + len(self.dir_records),
+                 'DirStats': self.rows_written['DirStats'] + len(self.dir_stats_records) }
+
     def write_records(self):
+        if self.track_block_rows:
+            self.rows_written = self.get_row_counts()
         if  self.hardlink_records: 
             self.dbo.WriteRows(self.hardlink_records, self.name + '_Hardlinks')
         if self.extent_records:
@@ -426,6 +501,8 @@ class ApfsFileSystemParser:
         my_root = Node('my_root', oid=root_block.header.oid, xid=root_block.header.xid)
         self.RecurseReadTree(self.volume.root_block_num, root_block, my_root, False, self.volume.root_tree_oid, 0, 0)
         log.debug(RenderTree(my_root))
+        if self.track_block_rows:
+            self.omap_root = my_root
         inode_tree = self.create_obj_id_tree(my_root)
         log.debug(RenderTree(inode_tree))
 
@@ -447,8 +524,75 @@ class ApfsFileSystemParser:
         self.create_other_tables_and_indexes()
         self.PrintStats()
 
-    def read_inode_volume_blocks(self, inode_tree, noheader):
-        processed_blocks = set()
+    def read_snapshot_records(self, live_parser):
+        '''Parse a snapshot of a volume. self.volume must be an ApfsSnapshotVolume and 
+           live_parser the parser that just read the live volume (with track_block_rows set).
+           Only leaf blocks not already ingested for the live volume are read and decoded, 
+           rows from shared blocks are copied from the live volume's tables.
+           Returns tuple (num_shared_blocks, num_decoded_blocks)
+        '''
+        self.create_tables()
+        if self.encryption_key:
+            self.volume.SetupDecryption(self.encryption_key)
+        snapshot = self.volume.snapshot
+        inode_tree = self.create_obj_id_tree(live_parser.omap_root, self.volume.root_tree_oid, snapshot.xid)
+        shared_blocks = self.read_inode_volume_blocks(inode_tree, self.volume.is_sealed, live_parser.block_row_ranges)
+        num_decoded = len(self.leaf_blocks_read) - len(shared_blocks)
+        log.info(f'Snapshot "{snapshot.name}" (xid={snapshot.xid}) of volume {self.volume.volume_name} has '\
+                 f'{len(shared_blocks)} leaf blocks shared with live volume, {num_decoded} blocks were decoded')
+
+        if self.num_records_read_batch > 0:
+            self.num_records_read_batch = 0
+            self.write_records()
+            self.clear_records()
+        self.copy_shared_block_rows(live_parser, shared_blocks)
+
+        if self.volume.is_sealed: # Extents are stored in fext_tree
+            live_vol = self.volume.parent_volume
+            if self.volume.fext_tree_oid == live_vol.fext_tree_oid:
+                extent_columns = ','.join([x for x in self.extent_info][:-1])
+                query = f'INSERT INTO "{self.name}_Extents" SELECT {extent_columns},NULL FROM "{live_vol.name}_Extents"'
+                self.run_query(query, True)
+            else:
+                extents_tree = self.container.read_block(self.volume.fext_tree_oid)
+                self.read_entries(self.volume.fext_tree_oid, extents_tree, False, self.volume.root_tree_oid, 0, 0)
+                if self.num_records_read_batch > 0:
+                    self.num_records_read_batch = 0
+                    self.write_records()
+                    self.clear_records()
+
+        self.create_other_tables_and_indexes()
+        self.PrintStats()
+        return len(shared_blocks), num_decoded
+
+    def copy_shared_block_rows(self, live_parser, shared_blocks):
+        '''Copy rows belonging to shared_blocks from live volume tables into this volume's tables'''
+        table_infos = { 'Hardlinks':self.hardlink_info, 'Extents':self.extent_info, 'Inodes':self.inode_info, 
+                        'Attributes':self.attr_info, 'DirEntries':self.dir_info, 'DirStats':self.dir_stats_info }
+        for table_type, column_info in table_infos.items():
+            # Coalesce DB_ID ranges, consecutive leaf blocks usually have consecutive rows
+            ranges = sorted([live_parser.block_row_ranges[block_num][table_type] for block_num in shared_blocks \
+                                if table_type in live_parser.block_row_ranges[block_num]])
+            merged = []
+            for first, last in ranges:
+                if merged and first <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], last)
+                else:
+                    merged.append([first, last])
+            columns = ','.join([x for x in column_info][:-1])
+            for index in range(0, len(merged), 500):
+                where_clause = ' OR '.join([f'DB_ID BETWEEN {first} AND {last}' for first, last in merged[index:index + 500]])
+                query = f'INSERT INTO "{self.name}_{table_type}" SELECT {columns},NULL FROM "{live_parser.name}_{table_type}" WHERE {where_clause}'
+                if not self.run_query(query, True, f'{self.name}_{table_type}'):
+                    break
+
+    def read_inode_volume_blocks(self, inode_tree, noheader, shared_block_ranges=None):
+        '''Read all leaf blocks of the inode tree. If shared_block_ranges (from a previous
+           parse) is provided, blocks found in it are not read, instead they are returned
+           in a list, so their rows can be copied over.
+        '''
+        processed_blocks = self.leaf_blocks_read
+        shared_blocks = []
         for node in anytree.PreOrderIter(inode_tree, filter_=lambda n: n.is_leaf==True):
             if not hasattr(node, 'block_number'):  # Something went wrong during tree creation
                 log.error(f'Node is missing block_number attribute, skipping it!')
@@ -460,18 +604,34 @@ class ApfsFileSystemParser:
                     continue
                 else:
                     processed_blocks.add(block_number)
+                if shared_block_ranges is not None and block_number in shared_block_ranges:
+                    shared_blocks.append(block_number)
+                    continue
+                if self.track_block_rows:
+                    counts_before = self.get_row_counts()
                 block = self.volume.read_vol_block(block_number, self.encryption_key, noheader=noheader)
                 self.read_entries_for_block(block_number, block, noheader, node.name, node.xid)
+                if self.track_block_rows:
+                    counts_after = self.get_row_counts()
+                    self.block_row_ranges[block_number] = { table_type: (counts_before[table_type] + 1, count) \
+                                    for table_type, count in counts_after.items() if count > counts_before[table_type] }
             else:
                 log.error('Block number was 0 (invalid), cannot read!')
+        return shared_blocks
 
-    def create_obj_id_tree(self, my_root):
+    def create_obj_id_tree(self, my_root, root_oid=None, max_xid=None):
+        '''Build tree of fs-tree nodes starting at root_oid (default is volume's root tree).
+           If max_xid is specified, only omap mappings with xid <= max_xid are used, this
+           gives the tree as it was at that transaction (snapshot).
+        '''
         p_root = Node('x')
-        self.RecurseAddNodes(my_root, p_root, self.volume.root_tree_oid)
+        self.RecurseAddNodes(my_root, p_root, self.volume.root_tree_oid if root_oid is None else root_oid, max_xid)
         return p_root
 
-    def RecurseAddNodes(self, my_root, x_root, oid):
+    def RecurseAddNodes(self, my_root, x_root, oid, max_xid=None):
         nodes = self.find_nodes_in_tree(oid, my_root, True)
+        if max_xid is not None:
+            nodes = [node for node in nodes if node.xid <= max_xid]
         if not nodes:
             log.error(f'ERROR, no nodes found for oid={oid}!')
             return
@@ -489,9 +649,11 @@ class ApfsFileSystemParser:
             for obj_node in n.children:
                 x = Node(obj_node.name, parent=x_root, obj_id=obj_node.obj_id, kind=obj_node.kind)
                 if level > 1:
-                    self.RecurseAddNodes(my_root, x, x.name)
+                    self.RecurseAddNodes(my_root, x, x.name, max_xid)
                 else: # level=1 OR for very small volumes, level=0 (we populated for BTNODE_ROOT & BTNODE_LEAF)
                     x_nodes = self.find_nodes_in_tree(x.name, my_root, True)
+                    if max_xid is not None:
+                        x_nodes = [x_node for x_node in x_nodes if x_node.xid <= max_xid]
                     if x_nodes:
                         x_xids = [x_node.xid for x_node in x_nodes]
                         largest_xid = max(x_xids)
@@ -589,25 +751,125 @@ class ApfsFileSystemParser:
         '''Populate paths table in db, create compressed_files table and create indexes for faster queries'''
 
         self.populate_compressed_files_table()
-        
-        insert_query = "INSERT INTO \"{0}_Paths\" SELECT * FROM " \
-                        "( WITH RECURSIVE " \
-                        "  under_root(path,name,cnid) AS " \
-                        "  (  VALUES('','root',2) " \
-                        "    UNION ALL " \
-                        "    SELECT under_root.path || '/' || \"{0}_DirEntries\".name, " \
-                        "\"{0}_DirEntries\".name, \"{0}_DirEntries\".cnid " \
-                        "       FROM \"{0}_DirEntries\" JOIN under_root ON " \
-                        "       \"{0}_DirEntries\".parent_cnid=under_root.cnid " \
-                        "   ORDER BY 1 " \
-                        ") SELECT CNID, Path FROM under_root);"
-                        
-        query = insert_query.format(self.name)
-        self.run_query(query, True)
-        self.run_query("UPDATE \"{}_Paths\" SET path = '/' where cnid = 2;".format(self.name), True)
-
+        self.populate_paths_table()
         self.create_indexes()
 
+    def populate_paths_table(self, batch_size=100000):
+        '''Build full paths of all items from the DirEntries table and write them to the
+           Paths table. DirEntries is read once, sorted by parent, so the children of a 
+           folder are a contiguous range of the arrays read. It is then walked depth first
+           from root (cnid 2), giving the same rows as the recursive query used earlier.
+           So a folder with hard links has its contents listed under each of its paths.
+           A folder that is its own ancestor (cycle) is not expanded again, as the query 
+           would have looped forever. Entries not reachable from root or from cnid 1 
+           (parent of root & private-dir) are orphans and are only counted and logged.
+        '''
+        query = 'SELECT CNID, Parent_CNID, Name FROM "{}_DirEntries" ORDER BY Parent_CNID'.format(self.name)
+        success, cursor, error = self.dbo.RunQuery(query)
+        if not success:
+            log.error('Error reading DirEntries for building paths: ' + error)
+            return
+        # Millions of tuples are created here & kept till the end, garbage collection would
+        # repeatedly scan them all and find nothing to free.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            cnids = array.array('q')
+            parent_cnids = array.array('q')
+            names = []
+            while True:
+                entries = cursor.fetchmany(batch_size)
+                if not entries:
+                    break
+                entry_cnids, entry_parent_cnids, entry_names = zip(*entries)
+                cnids.extend(entry_cnids)
+                parent_cnids.extend(entry_parent_cnids)
+                names.extend(entry_names)
+            num_entries = len(cnids)
+            folders = set(parent_cnids) # folders having children
+            visited = bytearray(num_entries)
+
+            def get_children(parent_cnid):
+                '''Returns (start, end) index range of the children of parent_cnid'''
+                start = bisect.bisect_left(parent_cnids, parent_cnid)
+                return start, bisect.bisect_right(parent_cnids, parent_cnid, start)
+
+            table_name = self.name + '_Paths'
+            rows = [(2, '/')]
+            num_cycles = 0
+            # Walk from root writing paths, a stack of (folder cnid, iterator over its (cnid, path) subfolders)
+            stack = []
+            ancestors = set()
+            cnid, path = 2, ''
+            while True:
+                if cnid in ancestors:
+                    num_cycles += 1
+                    log.warning('Folder cnid={} at {} is its own ancestor, there is a cycle in the tree'.format(cnid, path))
+                else:
+                    start, end = get_children(cnid)
+                    visited[start:end] = b'\x01' * (end - start)
+                    prefix = path + '/'
+                    child_rows = list(zip(cnids[start:end], [prefix + name for name in names[start:end]]))
+                    rows += child_rows
+                    if len(rows) >= batch_size:
+                        self.dbo.WriteRows(rows, table_name)
+                        rows = []
+                    ancestors.add(cnid)
+                    stack.append((cnid, iter([row for row in child_rows if row[0] in folders])))
+                while stack: # Get next folder to expand
+                    subfolder = next(stack[-1][1], None)
+                    if subfolder:
+                        cnid, path = subfolder
+                        break
+                    ancestors.discard(stack.pop()[0])
+                else:
+                    break
+            if rows:
+                self.dbo.WriteRows(rows, table_name)
+
+            def mark_visited(start_cnids, expanded):
+                '''Mark all entries under start_cnids as visited, expanding each folder once'''
+                stack = [cnid for cnid in start_cnids if cnid not in expanded]
+                expanded.update(stack)
+                while stack:
+                    start, end = get_children(stack.pop())
+                    visited[start:end] = b'\x01' * (end - start)
+                    for cnid in cnids[start:end]:
+                        if cnid in folders and cnid not in expanded:
+                            expanded.add(cnid)
+                            stack.append(cnid)
+
+            mark_visited([1], {2}) # Root's own entry and private-dir
+            num_orphans = num_entries - visited.count(1)
+            if num_orphans:
+                # Orphaned subtrees hang off a parent missing from DirEntries. Whatever is left after
+                # marking those is in (or under) a folder cycle that is detached from root.
+                all_cnids = set(cnids)
+                orphan_parents = [parent_cnid for parent_cnid in folders if parent_cnid not in all_cnids and parent_cnid not in (1, 2)]
+                expanded = {2}
+                mark_visited(orphan_parents, expanded)
+                parent_of = { cnids[index]: parent_cnids[index] for index in range(num_entries) if not visited[index] }
+                num_detached_cycles = 0
+                for index in range(num_entries):
+                    if visited[index]:
+                        continue
+                    # Go up till a folder repeats, that one is on the cycle
+                    cnid = cnids[index]
+                    seen = set()
+                    while cnid not in seen:
+                        seen.add(cnid)
+                        cnid = parent_of[cnid]
+                    num_detached_cycles += 1
+                    mark_visited([cnid], expanded)
+                log.warning('{} DirEntries in {} are orphans (not reachable from root), in {} orphaned subtree(s) and {} detached '
+                            'folder cycle(s). No paths were created for these. Folder cycles found under root = {}'.format(
+                            num_orphans, self.name, len(orphan_parents), num_detached_cycles, num_cycles))
+            else:
+                log.debug('Paths created for all {} DirEntries in {}'.format(num_entries, self.name))
+        finally:
+            if gc_enabled:
+                gc.enable()
+
     def read_entries_for_block(self, block_num, block, no_blk_hdr_force_subtype_fs_tree=False, sealed_oid=0, sealed_xid=0):
         '''Read file system entries(inodes) from leaf nodes ONLY and add to database. Only pass leaf nodes here'''
         if no_blk_hdr_force_subtype_fs_tree:
@@ -897,6 +1159,14 @@ class ApfsExtendedAttribute:
         return self._real_data
 
 class ApfsVolume:
+    file_metadata_columns = "a.name as xName, a.flags as xFlags, a.data as xData, a.Logical_uncompressed_size as xSize, "\
+            " a.Extent_CNID as xCNID, a.XID as xXID, ex.Offset as xExOff, ex.Size as xExSize, ex.Block_Num as xBlock_Num, "\
+            " p.CNID, p.Path, i.Parent_CNID, i.Extent_CNID, i.XID as iXID, i.Name, i.Created, i.Modified, i.Changed, i.Accessed, i.Flags, "\
+            " i.Links_or_Children, i.BSD_flags, i.UID, i.GID, i.Mode, i.Logical_Size, i.Physical_Size, "\
+            " e.XID as eXID, e.Offset as Extent_Offset, e.Size as Extent_Size, e.Block_Num as Extent_Block_Num, "\
+            " c.Uncompressed_size, c.Data, c.Extent_Logical_Size, "\
+            " ec.Offset as compressed_Extent_Offset, ec.Size as compressed_Extent_Size, ec.Block_Num as compressed_Extent_Block_Num "
+
     def __init__(self, apfs_container, name=""):
         self.container = apfs_container
         self.root_tree_oid = 0
@@ -910,6 +1180,7 @@ class ApfsVolume:
         self.num_folders = 0
         self.num_symlinks = 0
         self.num_snapshots = 0
+        self.snap_meta_tree_oid = 0
         self.time_created = None
         self.time_updated = None
         self.uuid = ''
@@ -967,11 +1238,11 @@ class ApfsVolume:
 
         if not data:
             return None
-        if key is None:
-            block = self.apfs.Block(KaitaiStream(BytesIO(data)), self.apfs, self.apfs, noheader)
-        else:
-            decrypted_block = self.decrypt_vol_block(data, block_num, key)
-            block = self.apfs.Block(KaitaiStream(BytesIO(decrypted_block)), self.apfs, self.apfs, noheader)
+        if key is not None:
+            data = self.decrypt_vol_block(data, block_num, key)
+        if self.container.verify_checksums and not noheader: # noheader blocks have no checksum
+            self.container.verify_block_checksum(block_num, data)
+        block = self.apfs.Block(KaitaiStream(BytesIO(data)), self.apfs, self.apfs, noheader)
         return block
 
     def read_volume_info(self, volume_super_block_num):
@@ -989,6 +1260,7 @@ class ApfsVolume:
         self.num_folders = super_block.body.num_folders
         self.num_symlinks = super_block.body.num_symlinks
         self.num_snapshots = super_block.body.num_snapshots
+        self.snap_meta_tree_oid = super_block.body.snap_meta_tree_oid.value
         self.time_created = super_block.body.time_created
         self.time_updated = super_block.body.last_mod_time
         self.uuid = self.ReadUUID(super_block.body.volume_uuid)
@@ -1021,6 +1293,30 @@ class ApfsVolume:
         self.root_block_num = vol_omap.body.tree_oid
         log.debug ("root_block_num = {}".format(self.root_block_num))
 
+    def ReadSnapshotList(self):
+        '''Returns a list of ApfsSnapshotInfo objects read from the snapshot metadata tree, sorted by xid'''
+        snapshots = []
+        if self.num_snapshots == 0 or self.snap_meta_tree_oid == 0:
+            return snapshots
+        try:
+            block = self.container.read_block(self.snap_meta_tree_oid)
+            self._ReadSnapshotMetaTree(block, snapshots)
+        except (ValueError, EOFError, OSError):
+            log.exception(f'Failed to read snapshot metadata tree for volume {self.volume_name}')
+        snapshots.sort(key=lambda x: x.xid)
+        return snapshots
+
+    def _ReadSnapshotMetaTree(self, block, snapshots):
+        '''Walk the (physical) snapshot metadata b-tree and collect snapshot records'''
+        if block is None:
+            return
+        for entry in block.body.entries:
+            if block.body.level > 0:
+                self._ReadSnapshotMetaTree(self.container.read_block(entry.data), snapshots)
+            elif entry.key.type_entry == self.apfs.EntryType.snap_metadata.value:
+                rec = entry.data
+                snapshots.append(ApfsSnapshotInfo(rec.name, entry.key.obj_id, rec.sblock_oid, rec.create_time, rec.change_time))
+
     def ReadUUID(self, uuid_bytes):
         '''Return a string from binary uuid blob'''
         uuid =  UUID(bytes=uuid_bytes)
@@ -1129,7 +1425,7 @@ class ApfsVolume:
         return apfs_file
 
     def CopyOutFile(self, path, destination_path):
-        '''Copy out file to disk'''
+        '''Copy out file to disk (or to a writable file-like object)'''
         retval = False
         if not path:
             return False
@@ -1137,7 +1433,7 @@ class ApfsVolume:
         log.debug('Trying to copy out ' + path)
         if apfs_file:
             try:
-                with open(destination_path, 'wb') as out_file:
+                with CommonFunctions.OpenFileForWriting(destination_path) as out_file:
                     out_file.write(apfs_file.readAll())
                     final_file_size = out_file.tell()
                     out_file.flush()
@@ -1146,7 +1442,7 @@ class ApfsVolume:
                     if final_file_size != apfs_file.meta.logical_size and not apfs_file.meta.is_symlink:
                         log.error ("File Size mismatch, Should be {}, but is {} for file: {}".format(apfs_file.meta.logical_size, final_file_size, path))
             except OSError:
-                log.exception ("Failed to create file for writing - " + destination_path)
+                log.exception ("Failed to create file for writing - {}".format(destination_path))
         else:
             log.debug("Failed to find file for export: " + path)
         return retval
@@ -1200,8 +1496,7 @@ class ApfsVolume:
         cnid = int(cnid)
         if cnid <= 0:
             return None
-        where_clause = " where p.CNID={} ".format(cnid)
-        return self.GetFileMetadata(where_clause)
+        return self.GetFileMetadata(" where p.CNID=? ", (cnid,))
 
     def GetFileMetadataByPath(self, path):
         '''Returns ApfsFileMeta object from database given path and db handle'''
@@ -1209,24 +1504,15 @@ class ApfsVolume:
             return None
         if not path.startswith('/'): 
             path = '/' + path
-        path = path.replace("'", "''") # if path contains single quote, replace with double to escape it!
-        where_clause = " where p.Path = '{}' ".format(path)
-        return self.GetFileMetadata(where_clause)
+        return self.GetFileMetadata(" where p.Path = ? ", (path,))
 
     def GetFilePathFromCnid(self, cnid):
         apfs_file_meta = self.GetFileMetadataByCnid(cnid)
         return apfs_file_meta.path
 
-    def GetFileMetadata(self, where_clause):
-        '''Returns ApfsFileMeta object from database. A where_clause specifies either cnid or path to find'''
-
-        query = "SELECT a.name as xName, a.flags as xFlags, a.data as xData, a.Logical_uncompressed_size as xSize, "\
-                " a.Extent_CNID as xCNID, a.XID as xXID, ex.Offset as xExOff, ex.Size as xExSize, ex.Block_Num as xBlock_Num, "\
-                " p.CNID, p.Path, i.Parent_CNID, i.Extent_CNID, i.XID as iXID, i.Name, i.Created, i.Modified, i.Changed, i.Accessed, i.Flags, "\
-                " i.Links_or_Children, i.BSD_flags, i.UID, i.GID, i.Mode, i.Logical_Size, i.Physical_Size, "\
-                " e.XID as eXID, e.Offset as Extent_Offset, e.Size as Extent_Size, e.Block_Num as Extent_Block_Num, "\
-                " c.Uncompressed_size, c.Data, c.Extent_Logical_Size, "\
-                " ec.Offset as compressed_Extent_Offset, ec.Size as compressed_Extent_Size, ec.Block_Num as compressed_Extent_Block_Num "\
+    def GetFileMetadataQuery(self, columns, where_clause):
+        '''Returns query for columns of files (with their extents, compressed extents & xattributes) in the where_clause'''
+        query = "SELECT {1}"\
                 " from \"{0}_Paths\" as p "\
                 " left join \"{0}_Inodes\" as i on i.CNID = p.CNID "\
                 " left join \"{0}_Extents\" as e on e.CNID = i.Extent_CNID "\
@@ -1234,11 +1520,22 @@ class ApfsVolume:
                 " left join \"{0}_Extents\" as ec on ec.CNID = c.Extent_CNID "\
                 " left join \"{0}_Attributes\" as a on a.CNID = p.CNID "\
                 " left join \"{0}_Extents\" as ex on ex.CNID = a.Extent_CNID "\
-                " {1}  and i.Name is not null "\
-                " order by Extent_Offset, compressed_Extent_Offset, xName, xExOff"
+                " {2} "
+        return query.format(self.name, columns, where_clause)
+
+    def GetFileMetadata(self, where_clause, params=()):
+        '''Returns ApfsFileMeta object from database. A where_clause specifies either cnid or path to find,
+           any ? in it are bound to params. As the query text is then the same for every file, sqlite 
+           does not have to compile it again for each lookup, which is most of the time taken.'''
+
+        return self.ReadFileMetadata(self.GetFileMetadataQuery(self.file_metadata_columns, where_clause + " and i.Name is not null "), params)
+
+    def ReadFileMetadata(self, query, params=()):
+        '''Returns ApfsFileMeta object for the file in the rows of query (from GetFileMetadataQuery)'''
+        query = "SELECT * FROM ({}) order by Extent_Offset, compressed_Extent_Offset, xName, xExOff".format(query)
         # This query gets file metadata as well as extents for file. If compressed, it gets compressed extents.
         # It gets XAttributes, except decmpfs and ResourceFork (we already got those in _Compressed_Files table)
-        success, cursor, error_message = self.dbo.RunQuery(query.format(self.name, where_clause), return_named_objects=True)
+        success, cursor, error_message = self.dbo.RunQuery(query, return_named_objects=True, params=params)
         if success:
             apfs_file_meta = None
             #extent_cnid = 0
@@ -1354,16 +1651,8 @@ class ApfsVolume:
 
     def GetManyFileMetadataCountOnly(self, where_clause):
         '''Only returns a count of items. A where_clause specifies either cnid or path to find'''
-        query = "SELECT count(DISTINCT p.cnid)"\
-                " from \"{0}_Paths\" as p "\
-                " left join \"{0}_Inodes\" as i on i.CNID = p.CNID "\
-                " left join \"{0}_Extents\" as e on e.CNID = i.Extent_CNID "\
-                " left join \"{0}_Compressed_Files\" as c on c.CNID = i.CNID "\
-                " left join \"{0}_Extents\" as ec on ec.CNID = c.Extent_CNID "\
-                " left join \"{0}_Attributes\" as a on a.CNID = p.CNID "\
-                " left join \"{0}_Extents\" as ex on ex.CNID = a.Extent_CNID "\
-                " {1} "
-        success, cursor, error_message = self.dbo.RunQuery(query.format(self.name, where_clause))
+        query = "SELECT sum(Count) FROM ({})".format(self.GetFileMetadataQuery("count(DISTINCT p.cnid) as Count", where_clause))
+        success, cursor, error_message = self.dbo.RunQuery(query)
         if success:
             for row in cursor:
                 return row[0]
@@ -1373,26 +1662,12 @@ class ApfsVolume:
     def GetManyFileMetadata(self, where_clause):
         '''Returns ApfsFileMeta object from database. A where_clause specifies either cnid or path to find'''
         #apfs_file_meta_list = []
-        query = "SELECT a.name as xName, a.flags as xFlags, a.data as xData, a.Logical_uncompressed_size as xSize, "\
-                " a.Extent_CNID as xCNID, a.XID as xXID, ex.Offset as xExOff, ex.Size as xExSize, ex.Block_Num as xBlock_Num, "\
-                " p.CNID, p.Path, i.Parent_CNID, i.Extent_CNID, i.XID as iXID, i.Name, i.Created, i.Modified, i.Changed, i.Accessed, i.Flags, "\
-                " i.Links_or_Children, i.BSD_flags, i.UID, i.GID, i.Mode, i.Logical_Size, i.Physical_Size, "\
-                " e.XID as eXID, e.Offset as Extent_Offset, e.Size as Extent_Size, e.Block_Num as Extent_Block_Num, "\
-                " c.Uncompressed_size, c.Data, c.Extent_Logical_Size, "\
-                " ec.Offset as compressed_Extent_Offset, ec.Size as compressed_Extent_Size, ec.Block_Num as compressed_Extent_Block_Num "\
-                " from \"{0}_Paths\" as p "\
-                " left join \"{0}_Inodes\" as i on i.CNID = p.CNID "\
-                " left join \"{0}_Extents\" as e on e.CNID = i.Extent_CNID "\
-                " left join \"{0}_Compressed_Files\" as c on c.CNID = i.CNID "\
-                " left join \"{0}_Extents\" as ec on ec.CNID = c.Extent_CNID "\
-                " left join \"{0}_Attributes\" as a on a.CNID = p.CNID "\
-                " left join \"{0}_Extents\" as ex on ex.CNID = a.Extent_CNID "\
-                " {1} and i.Name is not null "\
-                " order by p.Path, p.CNID, Extent_Offset, compressed_Extent_Offset, xName, xExOff"
+        query = "SELECT * FROM ({}) order by Path, CNID, Extent_Offset, compressed_Extent_Offset, xName, xExOff"\
+                "".format(self.GetFileMetadataQuery(self.file_metadata_columns, where_clause + " and i.Name is not null "))
         # This query gets file metadata as well as extents for file. If compressed, it gets compressed extents.
         # It gets XAttributes, except decmpfs and ResourceFork (we already got those in _Compressed_Files table)
         # Sometimes, there are old items in dirEntries but not present in inodes or elsewhere, "i.Name is not null" removes these.
-        success, cursor, error_message = self.dbo.RunQuery(query.format(self.name, where_clause), return_named_objects=True)
+        success, cursor, error_message = self.dbo.RunQuery(query, return_named_objects=True)
         if success:
             apfs_file_meta = None
             #extent_cnid = 0
@@ -1521,8 +1796,8 @@ class ApfsVolume:
         return items
 
 class ApfsSysDataLinkedVolume(ApfsVolume):
-    def __init__(self, sys_vol, data_vol):
-        ApfsVolume.__init__(self, sys_vol.container, 'Combined')
+    def __init__(self, sys_vol, data_vol, name='Combined'):
+        ApfsVolume.__init__(self, sys_vol.container, name)
         self.sys_vol = sys_vol
         self.data_vol = data_vol
         self.firmlinks_paths = []
@@ -1565,21 +1840,112 @@ class ApfsSysDataLinkedVolume(ApfsVolume):
         else:
             log.error('firmlinks file is missing! Cannot proceed!')
     
+    def GetFileMetadataQueries(self, columns, where_clause):
+        '''
+        The combined volume's tables are views, sqlite cannot use the indexes of the
+        underlying tables when these are joined, so the query is run on the data and
+        system volume tables instead. CNIDs are unique across the two volumes, the 
+        firmlinked folders' parents (all on the data volume) are substituted and the
+        system volume's firmlink folders excluded, just as in the views.
+        Returns the (data volume query, system volume query).
+        '''
+        fixups_join = ' left join "{}_Parent_Fixups" as f on f.CNID = p.CNID '.format(self.name)
+        data_columns = columns.replace('i.Parent_CNID', 'ifnull(f.Parent_CNID, i.Parent_CNID) as Parent_CNID')
+        firmlink_paths = ",".join(["'" + x.replace("'", "''") + "'" for x in self.firmlinks_paths])
+        sys_where_clause = where_clause + " and p.CNID NOT IN (1,2,3) and p.Path NOT IN ({}) ".format(firmlink_paths)
+        return (self.data_vol.GetFileMetadataQuery(data_columns, fixups_join + where_clause),
+                self.sys_vol.GetFileMetadataQuery(columns, sys_where_clause))
+
+    def GetFileMetadataQuery(self, columns, where_clause):
+        '''Returns query for columns of files on both volumes in the where_clause'''
+        return " UNION ALL ".join(self.GetFileMetadataQueries(columns, where_clause))
+
+    def GetFileMetadata(self, where_clause, params=()):
+        '''Returns ApfsFileMeta object from database, the system volume is only queried if not found on the data volume'''
+        # Most files are on the data volume, querying both (as a UNION ALL) would double the cost of most lookups
+        for query in self.GetFileMetadataQueries(self.file_metadata_columns, where_clause + " and i.Name is not null "):
+            apfs_file_meta = self.ReadFileMetadata(query, params)
+            if apfs_file_meta:
+                return apfs_file_meta
+        return None
+
     def GetUnderlyingVolume(self, file_id):
         '''Return the volume object given file's inode number(file_id)'''
         if (file_id & 0x0FFFFFFF00000000) == 0x0FFFFFFF00000000:
             return self.sys_vol
         return self.data_vol
 
+class ApfsSnapshotInfo:
+    '''Snapshot metadata as read from a volume's snapshot metadata tree'''
+    def __init__(self, name, xid, sblock_oid, time_created, time_changed):
+        self.name = name
+        self.xid = xid
+        self.sblock_oid = sblock_oid # physical block of the volume superblock as of snapshot
+        self.time_created = time_created
+        self.time_changed = time_changed
+
+class ApfsSnapshotVolume(ApfsVolume):
+    '''
+    A volume as it was at the time of a snapshot. Its records live in 
+    tables named <parent_vol>_Snap_<xid>_*, so all the ApfsVolume query
+    methods work unchanged on it.
+    '''
+    def __init__(self, parent_volume, snapshot):
+        ApfsVolume.__init__(self, parent_volume.container, f'{parent_volume.name}_Snap_{snapshot.xid}')
+        self.parent_volume = parent_volume
+        self.snapshot = snapshot
+        self.volume_name = parent_volume.volume_name
+        self.uuid = parent_volume.uuid
+        self.role = parent_volume.role
+        self.is_sealed = parent_volume.is_sealed
+        self.is_encrypted = parent_volume.is_encrypted
+        self.linked_data_uuid = parent_volume.linked_data_uuid
+        self.omap_oid = parent_volume.omap_oid
+        self.root_block_num = parent_volume.root_block_num
+        self.root_tree_oid = parent_volume.root_tree_oid
+        self.fext_tree_oid = getattr(parent_volume, 'fext_tree_oid', 0)
+        self.num_blocks_used = parent_volume.num_blocks_used
+        self.num_files = parent_volume.num_files
+        self.num_folders = parent_volume.num_folders
+        self.num_symlinks = parent_volume.num_symlinks
+        self.time_created = parent_volume.time_created
+        self.time_updated = snapshot.time_changed
+        self.encryption_key = parent_volume.encryption_key
+        if self.encryption_key:
+            self.SetupDecryption(self.encryption_key)
+        self.dbo = parent_volume.dbo
+        if snapshot.sblock_oid:
+            self._ReadSnapshotSuperblock(snapshot.sblock_oid)
+
+    def _ReadSnapshotSuperblock(self, sblock_oid):
+        '''Read the volume superblock saved with the snapshot, it has the fs tree root as of that xid'''
+        try:
+            super_block = self.container.read_block(sblock_oid)
+            if super_block is None or super_block.header.type_block.value != 13: # volumesuperblock
+                log.warning(f'Snapshot superblock at {sblock_oid} is not a volume superblock, using live volume info')
+                return
+            self.root_tree_oid = super_block.body.root_tree_oid
+            self.num_blocks_used = super_block.body.fs_alloc_count
+            self.num_files = super_block.body.num_files
+            self.num_folders = super_block.body.num_folders
+            self.num_symlinks = super_block.body.num_symlinks
+            if self.is_sealed:
+                self.fext_tree_oid = super_block.body.fext_tree_oid
+        except (ValueError, EOFError, OSError):
+            log.exception(f'Failed to read snapshot superblock at block {sblock_oid}')
+
 class ApfsContainer:
 
-    def __init__(self, image_file, apfs_container_size, offset=0):
+    def __init__(self, image_file, apfs_container_size, offset=0, verify_checksums=False):
         self.img = image_file
         self.apfs_container_offset = offset
         self.apfs_container_size = apfs_container_size
         self.volumes = []
         self.preboot_volume = None
         self.position = 0 # For self.seek()
+        self.verify_checksums = verify_checksums # If set, every metadata block parsed is checksum verified
+        self.num_blocks_verified = 0
+        self.checksum_failures = {} # { block_num : [block_num, oid, xid, type, subtype, stored_checksum, computed_checksum] }
 
         try:
             self.block_size = 4096 # Default, before real size is read in
@@ -1592,7 +1958,10 @@ class ApfsContainer:
         self.seek(0)
         self.apfs = apfs.Apfs(KaitaiStream(self))
         self.block_size = self.apfs.block_size
-        self.containersuperblock = self.read_block(0)
+        # Block 0 & the checkpoint descriptor area may hold older (stale) superblocks & maps, only
+        # the superblock chosen below is used, so only that is verified in verify_checksums mode.
+        self.containersuperblock = self.read_block(0, False)
+        containersuperblock_num = 0
         if self.fletcher64_verify_block_num(0) != 0:
             log.warning("Superblock checksum failed! Still trying to parse checkpoints to find valid csb!")
 
@@ -1602,7 +1971,7 @@ class ApfsContainer:
         if num_cp_blocks & 0x80000000: # highest bit set in xp_desc_blocks
             raise ValueError("Encountered a tree in checkpoint data, this is not yet implemented!")
 
-        checkpoint_blocks = [self.read_block(base_cp_block_num + i) for i in range(num_cp_blocks)]
+        checkpoint_blocks = [self.read_block(base_cp_block_num + i, False) for i in range(num_cp_blocks)]
 
         max_xid = 0
         max_xid_cp_index = 0
@@ -1619,6 +1988,9 @@ class ApfsContainer:
             log.info("Found newer xid={} @ block num {}".format(max_xid, base_cp_block_num + max_xid_cp_index))
             log.info("Using new XID now..")
             self.containersuperblock = checkpoint_blocks[max_xid_cp_index]
+            containersuperblock_num = base_cp_block_num + max_xid_cp_index
+        if self.verify_checksums:
+            self.verify_block_checksum(containersuperblock_num, self.get_block(containersuperblock_num))
 
         self.is_sw_encrypted = (self.containersuperblock.body.flags == apfs.NX_CRYPTO_SW) # True for encrypted APFS on non-T2 macs
         log.debug(f'self.is_sw_encrypted = {self.is_sw_encrypted}')
@@ -1680,15 +2052,30 @@ class ApfsContainer:
         self.seek(idx * self.block_size)
         return self.read(self.block_size * num_blocks)
 
-    def read_block(self, block_num):
-        """ Parse a single block """
+    def read_block(self, block_num, verify_checksum=True):
+        """ Parse a single block. If verify_checksum is False, it is not verified even in verify_checksums mode """
         data = self.get_block(block_num)
 
         if not data:
             return None
 
+        if self.verify_checksums and verify_checksum:
+            self.verify_block_checksum(block_num, data)
+
         block = self.apfs.Block(KaitaiStream(BytesIO(data)), self.apfs, self.apfs)
         return block
+
+    def verify_block_checksum(self, block_num, data):
+        """Verify checksum of (unencrypted) block data, recording any failure. Returns True if valid"""
+        self.num_blocks_verified += 1
+        computed = self.fletcher64_verify_block_data(data, self.block_size)
+        if computed == 0:
+            return True
+        if block_num not in self.checksum_failures:
+            stored_checksum, oid, xid, obj_type, subtype = struct.unpack('<QQQII', data[0:32])
+            log.warning('Block {} (oid={}, xid={}) failed checksum'.format(block_num, oid, xid))
+            self.checksum_failures[block_num] = [block_num, oid, xid, obj_type & 0xFFFF, subtype, stored_checksum, computed]
+        return False
     
     def fletcher64_verify_block_num(self, block_num):
         """Fletchers checksum verification for block, given block number"""
@@ -1699,31 +2086,7 @@ class ApfsContainer:
 
     def fletcher64_verify_block_data(self, data, block_size):
         """Fletchers checksum verification for block given block data"""
-        cnt = block_size//4 - 2
-        data = struct.unpack('<{}I'.format(block_size//4), data)
-        data_first_two_dwords = data[0:2]
-        data_rest = data[2:]
-
-        sum1 = 0
-        sum2 = 0
-
-        for k in range(cnt):
-            sum1 += data_rest[k]
-            sum2 += sum1
-
-        sum1 = sum1 % 0xFFFFFFFF
-        sum2 = sum2 % 0xFFFFFFFF
-
-        # process first 2 dwords now
-        sum1 += data_first_two_dwords[0]
-        sum2 += sum1
-        sum1 += data_first_two_dwords[1]
-        sum2 += sum1
-
-        sum1 = sum1 % 0xFFFFFFFF
-        sum2 = sum2 % 0xFFFFFFFF
-
-        return ((sum2) << 32) | (sum1)
+        return Fletcher64(data, block_size)
 
 class ApfsExtent:
     __slots__ = ['offset', 'size', 'block_num']
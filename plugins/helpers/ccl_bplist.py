@@ -33,6 +33,11 @@ import os
 import struct
 import datetime
 
+try:
+    from plugins.helpers.decoders import UnpackBigEndianUints
+except ImportError: # running standalone
+    from decoders import UnpackBigEndianUints
+
 __version__ = "0.16"
 __description__ = "Converts Apple binary PList files into a native Python data structure"
 __contact__ = "Alex Caithness"
@@ -114,6 +119,15 @@ def __decode_float(b, signed=True):
     else:
         return struct.unpack(fmt.upper(), b)[0]
 
+def __decode_refs(f, collection_offset_size, count):
+    # Reads all object refs of a collection in one go
+    if collection_offset_size in (1, 2, 4, 8):
+        refs_bytes = f.read(collection_offset_size * count)
+        if len(refs_bytes) != collection_offset_size * count:
+            raise BplistError("Collection object refs truncated at offset {0}".format(f.tell()))
+        return UnpackBigEndianUints(refs_bytes, collection_offset_size, count)
+    return [__decode_multibyte_int(f.read(collection_offset_size), False) for i in range(count)]
+
 def __decode_object(f, offset, collection_offset_size, offset_table):
     # Move to offset and read type
     #print("Decoding object at offset {0}".format(offset))
@@ -215,9 +229,7 @@ def __decode_object(f, offset, collection_offset_size, offset_table):
             int_length = 2 ** (int_type_byte & 0x0F)
             int_bytes = f.read(int_length)
             array_count = __decode_multibyte_int(int_bytes, signed=False)
-        array_refs = []
-        for i in range(array_count):
-            array_refs.append(__decode_multibyte_int(f.read(collection_offset_size), False))
+        array_refs = __decode_refs(f, collection_offset_size, array_count)
         return [__decode_object(f, offset_table[obj_ref], collection_offset_size, offset_table) for obj_ref in array_refs]
     elif type_byte & 0xF0 == 0xC0: # Set  1010 nnnn
         if type_byte & 0x0F != 0x0F:
@@ -234,9 +246,7 @@ def __decode_object(f, offset, collection_offset_size, offset_table):
             int_length = 2 ** (int_type_byte & 0x0F)
             int_bytes = f.read(int_length)
             set_count = __decode_multibyte_int(int_bytes, signed=False)
-        set_refs = []
-        for i in range(set_count):
-            set_refs.append(__decode_multibyte_int(f.read(collection_offset_size), False))
+        set_refs = __decode_refs(f, collection_offset_size, set_count)
         return [__decode_object(f, offset_table[obj_ref], collection_offset_size, offset_table) for obj_ref in set_refs]
     elif type_byte & 0xF0 == 0xD0: # Dict  1011 nnnn
         if type_byte & 0x0F != 0x0F:
@@ -254,13 +264,9 @@ def __decode_object(f, offset, collection_offset_size, offset_table):
             int_length = 2 ** (int_type_byte & 0x0F)
             int_bytes = f.read(int_length)
             dict_count = __decode_multibyte_int(int_bytes, signed=False)
-        key_refs = []
         #print("Dictionary count: {0}".format(dict_count))
-        for i in range(dict_count):
-            key_refs.append(__decode_multibyte_int(f.read(collection_offset_size), False))
-        value_refs = []
-        for i in range(dict_count):
-            value_refs.append(__decode_multibyte_int(f.read(collection_offset_size), False))
+        key_refs = __decode_refs(f, collection_offset_size, dict_count)
+        value_refs = __decode_refs(f, collection_offset_size, dict_count)
         
         dict_result = {}
         for i in range(dict_count):
@@ -9,6 +9,8 @@
 
 import biplist
 import datetime
+import importlib
+import io
 import logging
 import nska_deserialize as nd
 import os
@@ -18,6 +20,8 @@ import sqlite3
 import sys
 #import pytz
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
 from sqlite3 import Error as sqlite3Error
 from urllib.parse import unquote
@@ -36,6 +40,22 @@ class TimeZoneType(IntEnum):
     LOCAL = 1
     UTC = 2
 
+class LazyImport:
+    '''Stands in for a module that is slow to load and not always needed.
+       The module is imported on first attribute access.
+       Eg: xlsxwriter = LazyImport('xlsxwriter')
+    '''
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, name):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return getattr(self._module, name)
+
+macinfo = LazyImport('plugins.helpers.macinfo') # For SqliteWrapper (macinfo imports this module)
+
 class CommonFunctions:
 
     # @staticmethod
@@ -178,6 +198,14 @@ class CommonFunctions:
             log.exception('Invalid type passed to IntFromStr()')
         return integer
 
+    @staticmethod
+    def OpenFileForWriting(destination):
+        '''Returns file opened for writing at destination (a path), or destination itself
+           if that is already a writable file-like object (such as an ExportStoreFile)'''
+        if isinstance(destination, str):
+            return open(destination, 'wb')
+        return destination
+
     @staticmethod
     def GetNextAvailableFileName(filepath):
         '''
@@ -400,4 +428,97 @@ class CommonFunctions:
                             error = 'Not a plist! ' + path + " Error was : " + str(ex)
                     except (biplist.InvalidPlistException, ValueError, plistlib.InvalidFileException) as ex:
                         error = 'Could not read plist: ' + path + " Error was : " + str(ex)
-        return (False, None, error)
\ No newline at end of file
+        return (False, None, error)
+
+class ArtifactReadJobs:
+    '''Reads many small per user/profile artifacts (sqlite dbs, plists, json
+       or binary files) with the parsing done in a bounded thread pool.
+       Reading from the image (copying out to temp or into memory) is always
+       done in the calling thread, as image readers are not thread safe. The
+       parsing then runs in the pool while the plugin moves on to the next
+       user or profile. Each job parses into its own list, these are merged
+       into the destination lists in the order jobs were added, so output is
+       the same as when everything is processed one after the other.
+
+       Usage:
+         jobs = ArtifactReadJobs()
+         jobs.AddDb(items, mac_info, db_path, lambda job_items, db: ReadDb(job_items, db, user))
+         ..
+         jobs.Finish() # items are complete only after this
+    '''
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers if max_workers else min(8, (os.cpu_count() or 1) + 4)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.pending = deque() # [ (destination_list, future or list of items), .. ]
+
+    @staticmethod
+    def _ParseFile(parse_function, data):
+        items = []
+        parse_function(items, io.BytesIO(data))
+        return items
+
+    @staticmethod
+    def _ParseDb(parse_function, sqlite):
+        '''sqlite is the SqliteWrapper object, holding it keeps its temp files alive'''
+        items = []
+        db = CommonFunctions.open_sqlite_db_readonly(sqlite.db_file_path_temp)
+        try:
+            parse_function(items, db)
+        finally:
+            db.close()
+        return items
+
+    def _MergeOldest(self):
+        destination_list, result = self.pending.popleft()
+        if isinstance(result, list):
+            destination_list.extend(result)
+        else:
+            try:
+                destination_list.extend(result.result())
+            except Exception:
+                log.exception('Error while parsing artifact')
+
+    def _Submit(self, destination_list, function, *args):
+        while len(self.pending) >= self.max_workers * 2:
+            self._MergeOldest()
+        self.pending.append((destination_list, self.executor.submit(function, *args)))
+
+    def AddItems(self, destination_list, items):
+        '''Adds items already read in the calling thread, so they keep their place in the output order'''
+        self.pending.append((destination_list, items))
+
+    def AddFile(self, destination_list, mac_info, file_path, parse_function):
+        '''Reads file into memory, parse_function(items, f) gets a file object for it.
+           Returns False if the file could not be opened.'''
+        f = mac_info.Open(file_path)
+        if f is None:
+            return False
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        self._Submit(destination_list, self._ParseFile, parse_function, data)
+        return True
+
+    def AddDb(self, destination_list, mac_info, db_path, parse_function):
+        '''Copies the db (with -wal and -journal) out of the image, parse_function(items, db)
+           gets an sqlite connection to it, closed after it returns.
+           Returns False if the db could not be opened.'''
+        try:
+            sqlite = macinfo.SqliteWrapper(mac_info)
+            conn = sqlite.connect(db_path)
+            if not conn:
+                return False
+            conn.close() # A connection can't be used in another thread, parser opens its own
+        except (sqlite3.Error, OSError):
+            log.exception("Failed to open database {}, is it a valid DB?".format(db_path))
+            return False
+        self._Submit(destination_list, self._ParseDb, parse_function, sqlite)
+        return True
+
+    def Finish(self):
+        '''Waits for all parsing to complete and merges the remaining results'''
+        while self.pending:
+            self._MergeOldest()
+        self.executor.shutdown()
@@ -0,0 +1,142 @@
+'''
+   Copyright (c) 2017 Yogesh Khatri
+
+   This file is part of mac_apt (macOS Artifact Parsing Tool).
+   Usage or distribution of this software/code is subject to the
+   terms of the MIT License.
+
+   decoders.py
+   -----------
+   Pure python decoders for the tight loops run over every block/record 
+   of large images (fletcher checksums, fsevents records, spotlight varints,
+   bplist offset tables and BGRA pixel data). These do the work in fewer,
+   larger operations (struct, int.from_bytes, slicing, str.find) rather 
+   than per item. Fletcher64 uses numpy if it is installed.
+
+   Results must be identical to the earlier per-item loops, which are
+   kept in tests/decoders_reference.py for the parity tests & benchmark.
+'''
+
+import logging
+import struct
+from itertools import accumulate
+
+log = logging.getLogger('MAIN.HELPERS.DECODERS')
+
+try:
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy = None
+    numpy_available = False
+
+_fletcher_weights = {} # { num_words : numpy array [n, n-1, .. 1] }
+
+def _Fletcher64Numpy(data, block_size):
+    '''Vectorised Fletcher64. sum2 is the sum of all running sums, which is
+       the same as weighting each word by the number of sums it is part of.
+       With 64KB max block size, no term or total can overflow uint64.'''
+    words = numpy.frombuffer(data, dtype='<u4', count=block_size//4).astype(numpy.uint64)
+    rest = words[2:]
+    weights = _fletcher_weights.get(len(rest), None)
+    if weights is None:
+        weights = numpy.arange(len(rest), 0, -1, dtype=numpy.uint64)
+        _fletcher_weights[len(rest)] = weights
+    sum1 = int(rest.sum()) % 0xFFFFFFFF
+    sum2 = int(numpy.dot(rest, weights)) % 0xFFFFFFFF
+
+    # process first 2 dwords now
+    sum1 += int(words[0])
+    sum2 += sum1
+    sum1 += int(words[1])
+    sum2 += sum1
+
+    sum1 = sum1 % 0xFFFFFFFF
+    sum2 = sum2 % 0xFFFFFFFF
+    return (sum2 << 32) | sum1
+
+def Fletcher64(data, block_size):
+    '''Fletchers checksum over block_size bytes of data, the checksum
+       (first 2 dwords) is processed last. Returns 0 for a valid block.'''
+    if numpy_available:
+        return _Fletcher64Numpy(data, block_size)
+    words = struct.unpack('<{}I'.format(block_size//4), data)
+    running_sums = list(accumulate(words[2:]))
+    if running_sums:
+        sum1 = running_sums[-1] % 0xFFFFFFFF
+        sum2 = sum(running_sums) % 0xFFFFFFFF
+    else:
+        sum1 = sum2 = 0
+
+    # process first 2 dwords now
+    sum1 += words[0]
+    sum2 += sum1
+    sum1 += words[1]
+    sum2 += sum1
+
+    sum1 = sum1 % 0xFFFFFFFF
+    sum2 = sum2 % 0xFFFFFFFF
+    return (sum2 << 32) | sum1
+
+def _BuildVarSizeNumTable():
+    '''Returns list indexed by first byte of (extra_bytes, high_part)'''
+    table = []
+    for first_byte in range(256):
+        if first_byte == 0xFF: extra, high = 8, 0
+        elif first_byte >= 0xFE: extra, high = 7, 0
+        elif first_byte >= 0xFC: extra, high = 6, 0
+        elif first_byte >= 0xF8: extra, high = 5, 0
+        elif first_byte >= 0xF0: extra, high = 4, first_byte - 0xF0
+        elif first_byte >= 0xE0: extra, high = 3, first_byte - 0xE0
+        elif first_byte >= 0xC0: extra, high = 2, first_byte - 0xC0
+        elif first_byte >= 0x80: extra, high = 1, first_byte - 0x80
+        else:                    extra, high = 0, first_byte
+        table.append((extra, high << (extra * 8)))
+    return table
+
+_var_size_num_table = _BuildVarSizeNumTable()
+
+def ReadVarSizeNumAt(data, pos, end):
+    '''Reads spotlight variable sized number from data[pos:end],
+       Returns num and bytes_read'''
+    extra, high = _var_size_num_table[data[pos]]
+    if extra == 0:
+        return high, 1
+    if pos + extra >= end:
+        raise IndexError('Not enough data to read variable sized number at pos {}'.format(pos))
+    return high + int.from_bytes(data[pos + 1 : pos + extra + 1], 'big'), extra + 1
+
+def ReadVarSizeNum(data):
+    '''Returns num and bytes_read'''
+    return ReadVarSizeNumAt(data, 0, len(data))
+
+def IterCStringRecords(buffer, pos, end, record_struct):
+    '''Iterates over records consisting of a null-terminated utf8 string
+       followed by a fixed size structure, as found in fsevents files.
+       Yields tuple (record_pos, string, unpacked_struct_values)
+    '''
+    find = buffer.find
+    unpack_from = record_struct.unpack_from
+    struct_size = record_struct.size
+    while pos < end:
+        null_pos = find(b'\0', pos)
+        if null_pos == -1: # Null not found
+            null_pos = len(buffer)
+        string = buffer[pos:null_pos].decode("utf-8", "backslashreplace")
+        values = unpack_from(buffer, null_pos + 1)
+        yield pos, string, values
+        pos = null_pos + 1 + struct_size
+
+def UnpackBigEndianUints(data, item_size, count):
+    '''Returns tuple of count big-endian unsigned ints, each item_size bytes'''
+    fmt = {1:'B', 2:'H', 4:'I', 8:'Q'}.get(item_size, None)
+    if fmt:
+        return struct.unpack('>{}{}'.format(count, fmt), data)
+    return tuple(int.from_bytes(data[x : x + item_size], 'big') for x in range(0, count * item_size, item_size))
+
+def ConvertBGRAtoRGBA(data):
+    '''Swaps the B and R bytes of every 4 byte pixel, len(data) must be a multiple of 4'''
+    converted = bytearray(data)
+    converted[0::4] = data[2::4]
+    converted[2::4] = data[0::4]
+    return bytes(converted)
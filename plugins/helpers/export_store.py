@@ -0,0 +1,370 @@
+'''
+   Copyright (c) 2017 Yogesh Khatri
+
+   This file is part of mac_apt (macOS Artifact Parsing Tool).
+   Usage or distribution of this software/code is subject to the
+   terms of the MIT License.
+
+   export_store.py
+   ---------------
+   A content addressed store for exported artifacts. Instead of writing
+   every exported file under Export/<PLUGIN>, file contents are stored
+   just once (by SHA-256) in a single pack file (Export_Store.pack),
+   compressed in 1MB chunks so any part of a file can be read back
+   without decompressing all of it. Files are extracted straight into
+   the store, being hashed & compressed as they are read from the image.
+   The chunk locations (and export paths used) are kept in Export_Store.db,
+   while the usual relative export paths along with the SHA-256 are also
+   recorded in the export log (Exported_Files_Log.db).
+   Use extract_exported_files.py to get files back out.
+'''
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+
+try:
+    import zstandard # Optional, zlib is used if not available
+    zstandard_available = True
+except ImportError:
+    zstandard_available = False
+
+log = logging.getLogger('MAIN.HELPERS.EXPORT_STORE')
+
+pack_file_name = 'Export_Store.pack'
+index_file_name = 'Export_Store.db'
+
+class ExportStore:
+    '''Writes exported files to the store. All methods are thread safe.'''
+
+    version = 1
+    chunk_size = 1048576
+    max_buffered_size = 16777216 # Files smaller than this are hashed before compressing, so duplicates are not compressed at all
+    commit_interval = 1000 # files
+
+    def __init__(self, export_path, compression='zstd'):
+        self.export_path = export_path
+        self.pack_path = os.path.join(export_path, pack_file_name)
+        self.index_path = os.path.join(export_path, index_file_name)
+        if compression == 'zstd' and not zstandard_available:
+            log.warning('zstandard is not installed, using zlib compression for export store instead')
+            compression = 'zlib'
+        self.compression = compression
+        self.compressor = zstandard.ZstdCompressor(level=3) if compression == 'zstd' else None
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pack = None
+        self.pack_offset = 0
+        self.known_hashes = set()
+        self.used_paths = set()
+        self.uncommitted_count = 0
+        # Stats
+        self.files_added = 0
+        self.files_deduplicated = 0
+        self.bytes_added = 0
+        self.bytes_stored = 0
+
+    def Open(self):
+        '''Creates (or opens existing) store in the export folder, returns True if successful'''
+        try:
+            if not os.path.exists(self.export_path):
+                os.makedirs(self.export_path)
+            self.conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS Info (Version INTEGER)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS Blobs (SHA256 TEXT PRIMARY KEY, Size INTEGER, Chunk_Size INTEGER, Num_Chunks INTEGER)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS Chunks (SHA256 TEXT, Chunk_Index INTEGER, Offset INTEGER, Stored_Size INTEGER, Method TEXT, '\
+                              'PRIMARY KEY (SHA256, Chunk_Index)) WITHOUT ROWID')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS Files (Export_Path TEXT PRIMARY KEY, SHA256 TEXT)')
+            row = self.conn.execute('SELECT Version FROM Info').fetchone()
+            if row is None:
+                self.conn.execute('INSERT INTO Info VALUES (?)', (self.version,))
+            elif row[0] != self.version:
+                log.error('Existing export store at {} is version {}, expected {}'.format(self.index_path, row[0], self.version))
+                self.conn.close()
+                self.conn = None
+                return False
+            self.known_hashes = set(row[0] for row in self.conn.execute('SELECT SHA256 FROM Blobs'))
+            # Paths from an earlier run are taken, just as if the files were on disk
+            self.used_paths = set(os.path.join(self.export_path, *row[0].split('/')) for row in self.conn.execute('SELECT Export_Path FROM Files'))
+            self.conn.commit()
+            # Any bytes after the last indexed chunk (from an interrupted run) are just left unused
+            self.pack = open(self.pack_path, 'ab')
+            self.pack_offset = self.pack.tell()
+            log.info('Exported files will be saved to export store at {} ({} compression)'.format(self.pack_path, self.compression))
+            return True
+        except (OSError, sqlite3.Error) as ex:
+            log.error('Failed to create export store at {}, error was {}'.format(self.export_path, str(ex)))
+            self.Close()
+        return False
+
+    def Close(self):
+        with self.lock:
+            if self.pack:
+                self.pack.close()
+                self.pack = None
+            if self.conn:
+                self.conn.commit()
+                self.conn.close()
+                self.conn = None
+                log.info('Export store has {} files added ({} were duplicates), {} bytes were stored as {} bytes'.format(
+                            self.files_added, self.files_deduplicated, self.bytes_added, self.bytes_stored))
+
+    def CreateFile(self, file_path):
+        '''Returns an ExportStoreFile, to write the contents of file_path (a path under
+           the Export folder, from GetNextAvailableFileName()) to'''
+        return ExportStoreFile(self, file_path)
+
+    def GetNextAvailableFileName(self, filepath):
+        '''Same as CommonFunctions.GetNextAvailableFileName(), but checks the paths already
+           used in the store, as nothing is written to the Export folder.'''
+        with self.lock:
+            if filepath in self.used_paths:
+                filepath_without_ext, ext = os.path.splitext(filepath)
+                index = 1
+                fullpath = filepath_without_ext + '{0:02d}'.format(index) + ext
+                while fullpath in self.used_paths:
+                    index += 1
+                    fullpath = filepath_without_ext + '{0:02d}'.format(index) + ext
+                filepath = fullpath
+            self.used_paths.add(filepath)
+        return filepath
+
+    def _CompressChunk(self, data):
+        '''Returns (method, stored_data), chunks that do not compress are stored as is'''
+        if self.compressor:
+            compressed = self.compressor.compress(data)
+            method = 'zstd'
+        else:
+            compressed = zlib.compress(data, 6)
+            method = 'zlib'
+        if len(compressed) >= len(data):
+            return 'none', data
+        return method, compressed
+
+    def _WriteChunk(self, data, chunks):
+        method, stored_data = self._CompressChunk(data)
+        self.pack.write(stored_data)
+        chunks.append((self.pack_offset, len(stored_data), method))
+        self.pack_offset += len(stored_data)
+
+    def _WriteChunks(self, items, chunks):
+        with self.lock:
+            if not self.pack:
+                raise OSError('Export store is closed')
+            for item in items:
+                self._WriteChunk(item, chunks)
+
+    def _DiscardChunks(self, chunks):
+        '''Removes chunks from the end of the pack file. If another file's chunks were
+           written after them, they are just left unused (like after an interrupted run).
+           Lock must be held.'''
+        if not chunks:
+            return
+        start_offset = chunks[0][0]
+        if self.pack_offset == start_offset + sum(stored_size for offset, stored_size, method in chunks):
+            self.pack.truncate(start_offset)
+            self.pack.seek(start_offset)
+            self.pack_offset = start_offset
+        chunks.clear()
+
+    def _AddFile(self, store_file):
+        '''Called by ExportStoreFile.Finish(), returns SHA-256 or None'''
+        with self.lock:
+            if not self.pack:
+                return None
+            chunks = store_file.chunks
+            try:
+                sha256 = store_file.hasher.hexdigest()
+                self.files_added += 1
+                self.bytes_added += store_file.size
+                if sha256 in self.known_hashes:
+                    self._DiscardChunks(chunks) # Already stored
+                    self.files_deduplicated += 1
+                else:
+                    if store_file.pending:
+                        store_file.buffered.append(bytes(store_file.pending))
+                    for item in store_file.buffered:
+                        self._WriteChunk(item, chunks)
+                    self.conn.execute('INSERT INTO Blobs VALUES (?,?,?,?)', (sha256, store_file.size, self.chunk_size, len(chunks)))
+                    self.conn.executemany('INSERT INTO Chunks VALUES (?,?,?,?,?)',
+                                          [(sha256, index, offset, stored_size, method) for index, (offset, stored_size, method) in enumerate(chunks)])
+                    self.known_hashes.add(sha256)
+                    self.bytes_stored += sum(stored_size for offset, stored_size, method in chunks)
+                export_path_rel = os.path.relpath(store_file.file_path, start=self.export_path).replace('\\', '/')
+                self.conn.execute('INSERT OR REPLACE INTO Files VALUES (?,?)', (export_path_rel, sha256))
+                self.uncommitted_count += 1
+                if self.uncommitted_count >= self.commit_interval:
+                    self.pack.flush()
+                    self.conn.commit()
+                    self.uncommitted_count = 0
+                return sha256
+            except (OSError, sqlite3.Error) as ex:
+                log.error('Failed to add {} to export store, error was {}'.format(store_file.file_path, str(ex)))
+                try:
+                    self._DiscardChunks(chunks)
+                except OSError:
+                    pass
+        return None
+
+    def _DiscardFile(self, store_file):
+        with self.lock:
+            if self.pack:
+                try:
+                    self._DiscardChunks(store_file.chunks)
+                except OSError:
+                    pass
+
+class ExportStoreFile:
+    '''A file being extracted into the store, it is written to like a file opened
+       for writing. Data is hashed as it comes in and is cut into chunks, which are
+       held back until the hash is known (so duplicates are not compressed at all),
+       unless the file is too big to hold. Call Finish() once all data is written,
+       or Discard() if extraction failed. close() does nothing.'''
+
+    def __init__(self, store, file_path):
+        self.store = store
+        self.file_path = file_path
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.pending = bytearray() # Data not yet a full chunk
+        self.buffered = [] # Chunks not yet compressed & written
+        self.chunks = [] # (offset, stored_size, method) of chunks written to the pack file
+
+    def __str__(self):
+        return self.file_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.size += len(data)
+        self.pending += data
+        chunk_size = self.store.chunk_size
+        if len(self.pending) >= chunk_size:
+            end = len(self.pending) - len(self.pending) % chunk_size
+            self.buffered.extend(bytes(self.pending[pos:pos + chunk_size]) for pos in range(0, end, chunk_size))
+            del self.pending[:end]
+            if self.size > self.store.max_buffered_size: # Too big to hold, compress as we go
+                self.store._WriteChunks(self.buffered, self.chunks)
+                self.buffered = []
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def Finish(self):
+        '''Adds the file to the store. Returns SHA-256 (hex string) of the contents, or None on failure.'''
+        return self.store._AddFile(self)
+
+    def Discard(self):
+        '''Drops everything written so far, the object can then be written to again from the start'''
+        self.store._DiscardFile(self)
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.pending = bytearray()
+        self.buffered = []
+
+class ExportStoreReader:
+    '''Reads files back from an export store'''
+
+    def __init__(self, export_path):
+        self.pack_path = os.path.join(export_path, pack_file_name)
+        self.index_path = os.path.join(export_path, index_file_name)
+        self.conn = None
+        self.pack = None
+        self.decompressor = None
+        self.last_chunk = (None, None, None) # (sha256, index, data)
+
+    def Open(self):
+        try:
+            self.conn = sqlite3.connect('file:{}?mode=ro'.format(self.index_path), uri=True)
+            self.pack = open(self.pack_path, 'rb')
+            return True
+        except (OSError, sqlite3.Error) as ex:
+            log.error('Failed to open export store at {}, error was {}'.format(self.pack_path, str(ex)))
+            self.Close()
+        return False
+
+    def Close(self):
+        if self.pack:
+            self.pack.close()
+            self.pack = None
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def GetFileSize(self, sha256):
+        '''Returns size of file, or None if it is not in the store'''
+        row = self.conn.execute('SELECT Size FROM Blobs WHERE SHA256=?', (sha256,)).fetchone()
+        return row[0] if row else None
+
+    def _DecompressChunk(self, method, data):
+        if method == 'zstd':
+            if not zstandard_available:
+                raise ValueError('zstandard is needed to read this export store (pip install zstandard)')
+            if self.decompressor is None:
+                self.decompressor = zstandard.ZstdDecompressor()
+            return self.decompressor.decompress(data)
+        elif method == 'zlib':
+            return zlib.decompress(data)
+        return data
+
+    def _ReadChunk(self, sha256, index, offset, stored_size, method):
+        if self.last_chunk[0] == sha256 and self.last_chunk[1] == index:
+            return self.last_chunk[2]
+        self.pack.seek(offset)
+        data = self._DecompressChunk(method, self.pack.read(stored_size))
+        self.last_chunk = (sha256, index, data)
+        return data
+
+    def Read(self, sha256, offset=0, size=-1):
+        '''Read size bytes from offset in the file, reads to the end if size is -1.
+           Only the chunks needed are decompressed. Returns None if file is not in the store.'''
+        row = self.conn.execute('SELECT Size, Chunk_Size FROM Blobs WHERE SHA256=?', (sha256,)).fetchone()
+        if row is None:
+            return None
+        file_size, chunk_size = row
+        if size < 0 or offset + size > file_size:
+            size = max(0, file_size - offset)
+        if size == 0:
+            return b''
+        first_index = offset // chunk_size
+        last_index = (offset + size - 1) // chunk_size
+        data = []
+        for index, chunk_offset, stored_size, method in self.conn.execute('SELECT Chunk_Index, Offset, Stored_Size, Method FROM Chunks '\
+                                    'WHERE SHA256=? AND Chunk_Index BETWEEN ? AND ? ORDER BY Chunk_Index', (sha256, first_index, last_index)):
+            data.append(self._ReadChunk(sha256, index, chunk_offset, stored_size, method))
+        data = b''.join(data)
+        start = offset - first_index * chunk_size
+        return data[start:start + size]
+
+    def ExtractFile(self, sha256, destination_path):
+        '''Writes file out to destination_path, returns True if successful'''
+        try:
+            chunks = self.conn.execute('SELECT Offset, Stored_Size, Method FROM Chunks WHERE SHA256=? ORDER BY Chunk_Index', (sha256,)).fetchall()
+            if not chunks and self.GetFileSize(sha256) is None:
+                log.error('{} not found in export store'.format(sha256))
+                return False
+            with open(destination_path, 'wb') as f:
+                for offset, stored_size, method in chunks:
+                    self.pack.seek(offset)
+                    f.write(self._DecompressChunk(method, self.pack.read(stored_size)))
+            return True
+        except Exception as ex: # OSError, sqlite3.Error, zlib.error, zstandard.ZstdError, ..
+            log.error('Failed to extract {} to {}, error was {}'.format(sha256, destination_path, str(ex)))
+        return False
@@ -0,0 +1,155 @@
+'''
+   Copyright (c) 2017 Yogesh Khatri
+
+   This file is part of mac_apt (macOS Artifact Parsing Tool).
+   Usage or distribution of this software/code is subject to the
+   terms of the MIT License.
+
+   inode_index.py
+   ---------------
+   An inode number -> path index for mounted (or extracted) evidence,
+   for use where /.vol lookups are not available (Linux & Windows).
+   Inodes are indexed per root, as each root (eg: System & Data volumes)
+   may be a separate filesystem with its own inode numbers.
+   The whole tree is listed once (folders scanned in parallel threads)
+   and the index is saved to a sqlite file in the output folder, so
+   later runs against the same mounted folder reuse it.
+'''
+
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+log = logging.getLogger('MAIN.HELPERS.INODE_INDEX')
+
+class InodePathIndex:
+
+    version = 2
+    db_file_name = 'Mounted_Inode_Index.db'
+
+    def __init__(self, output_path, roots, max_workers=None):
+        '''
+           roots = [ (mounted_folder, path_in_image), .. ]
+           Eg: [ ('/mnt/sys', '/'), ('/mnt/data', '/System/Volumes/Data') ]
+        '''
+        self.db_path = os.path.join(output_path, self.db_file_name)
+        self.roots = roots
+        self.max_workers = max_workers
+        self.conn = None
+
+    def _GetRootsInfo(self):
+        '''Returns string identifying the mounted roots, to detect a different mount'''
+        info = []
+        for mounted_folder, path_in_image in self.roots:
+            root_stat = os.stat(mounted_folder)
+            info.append('{}|{}|{}|{}'.format(os.path.abspath(mounted_folder), path_in_image, root_stat.st_ino, root_stat.st_mtime))
+        return '\n'.join(info)
+
+    def Open(self):
+        '''Opens existing index if it was built for the same mounted folders,
+           else builds it. Returns True if the index is usable.'''
+        if self.conn:
+            return True
+        try:
+            roots_info = self._GetRootsInfo()
+            if os.path.exists(self.db_path):
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    row = conn.execute('SELECT Version, Roots FROM Info').fetchone()
+                    if row and row[0] == self.version and row[1] == roots_info:
+                        log.info('Using existing inode index at {}'.format(self.db_path))
+                        self.conn = conn
+                        return True
+                except sqlite3.Error:
+                    pass
+                conn.close()
+                os.remove(self.db_path)
+            self.conn = self._Build(roots_info)
+        except (OSError, sqlite3.Error) as ex:
+            log.error('Failed to create/open inode index at {}, error was {}'.format(self.db_path, str(ex)))
+            self.conn = None
+        return self.conn is not None
+
+    def Close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    @staticmethod
+    def _ScanFolder(root, folder_path, path_in_image, folder_inode):
+        '''Returns (rows, sub_folders) for one folder, symlinks are not followed'''
+        rows = []
+        sub_folders = []
+        try:
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    item_path = path_in_image.rstrip('/') + '/' + entry.name
+                    try:
+                        inode = entry.inode()
+                        rows.append((root, inode, folder_inode, item_path))
+                        if entry.is_dir(follow_symlinks=False):
+                            sub_folders.append((root, entry.path, item_path, inode))
+                    except OSError as ex:
+                        log.debug('Could not read {}, error was {}'.format(entry.path, str(ex)))
+        except OSError as ex:
+            log.debug('Could not list {}, error was {}'.format(folder_path, str(ex)))
+        return rows, sub_folders
+
+    def _Build(self, roots_info):
+        log.info('Creating inode index for mounted image, this may take a while..')
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('CREATE TABLE Info (Version INTEGER, Roots TEXT)')
+        # Root is the index of the mounted folder in self.roots
+        conn.execute('CREATE TABLE Inodes (Root INTEGER, Inode INTEGER, Parent_Inode INTEGER, Path TEXT)')
+        insert_query = 'INSERT INTO Inodes VALUES (?,?,?,?)'
+        num_items = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            for root, (mounted_folder, path_in_image) in enumerate(self.roots):
+                root_inode = os.stat(mounted_folder).st_ino
+                conn.execute(insert_query, (root, root_inode, root_inode, path_in_image))
+                pending.add(executor.submit(self._ScanFolder, root, mounted_folder, path_in_image, root_inode))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rows, sub_folders = future.result()
+                    conn.executemany(insert_query, rows)
+                    num_items += len(rows)
+                    for sub_folder in sub_folders:
+                        pending.add(executor.submit(self._ScanFolder, *sub_folder))
+        # Index is created after the load, it is much faster that way
+        conn.execute('CREATE INDEX Inodes_inode_root ON Inodes (Inode, Root)')
+        conn.execute('INSERT INTO Info VALUES (?,?)', (self.version, roots_info))
+        conn.commit()
+        log.info('Inode index created with {} items'.format(num_items))
+        return conn
+
+    def _GetRow(self, column, inode, root):
+        '''Returns column's value in the row for inode in root (index in self.roots). If root 
+           is None, all roots are searched, but if the inode is in more than one (it is a 
+           different file in each), None is returned, as it can't be known which one is meant.'''
+        if not self.Open():
+            return None
+        if root is not None:
+            row = self.conn.execute('SELECT {} FROM Inodes WHERE Inode=? AND Root=? LIMIT 1'.format(column), (inode, root)).fetchone()
+            return row[0] if row else None
+        rows = self.conn.execute('SELECT Root, {} FROM Inodes WHERE Inode=? ORDER BY Root'.format(column), (inode,)).fetchall()
+        if not rows:
+            return None
+        if rows[0][0] != rows[-1][0]:
+            log.warning('Inode {} is in more than one of the mounted volumes, its path is not known'.format(inode))
+            return None
+        return rows[0][1]
+
+    def GetPath(self, inode, root=None):
+        '''Returns path in image for inode, or empty string if not found.
+           If there are multiple paths (hard links), the first one is returned.'''
+        path = self._GetRow('Path', inode, root)
+        return path if path is not None else ''
+
+    def GetParentInode(self, inode, root=None):
+        '''Returns parent folder's inode number, or None if not found'''
+        return self._GetRow('Parent_Inode', inode, root)
@@ -7,6 +7,8 @@
    
 '''
 
+import collections
+import errno
 import logging
 import os
 import posixpath
@@ -25,21 +27,23 @@ import zipfile
 from io import BytesIO
 from uuid import UUID
 
-from plugins.helpers import decryptor
 from plugins.helpers.apfs_reader import *
-from plugins.helpers.common import CommonFunctions, EntryType
+from plugins.helpers.common import CommonFunctions, EntryType, LazyImport
 from plugins.helpers.darwin_path_generator import GetDarwinPath, GetDarwinPath2
 from plugins.helpers.hfs_alt import HFSVolume
+from plugins.helpers.inode_index import InodePathIndex
 from plugins.helpers.structs import *
 from subprocess import CalledProcessError, run
 
 if sys.platform == 'linux':
-    from plugins.helpers.statx import statx
+    from plugins.helpers.statx import statx, STATX_BTIME
 if sys.platform != "win32": # xattr only works on non-windows platforms (macOS, Linux)
     import xattr
 
 log = logging.getLogger('MAIN.HELPERS.MACINFO')
 
+decryptor = LazyImport('plugins.helpers.decryptor') # Only needed for encrypted APFS volumes
+
 '''
     Common data structures for plugins 
 '''
@@ -51,12 +55,18 @@ class OutputParams:
         self.write_sql = False
         self.write_xlsx = False
         self.write_jsonl = False
+        self.jsonl_compression = None # None, 'gz' or 'zstd'
+        self.write_parquet = False
         self.xlsx_writer = None
         self.output_db_path = ''
         self.export_path = '' # For artifact source files
         self.export_path_rel = '' # Relative export path
         self.export_log_sqlite = None
+        self.export_store = None # ExportStore object, if exported files are to be saved to a deduplicated store
         self.timezone = TimeZoneType.UTC
+        self.run_manifest = None # RunManifest object, if incremental runs are enabled
+        self.apfs_db_path = '' # Path to APFS sqlite db, only set for APFS images
+        self.write_spotlight_data_txt = True # Spotlight plugin writes every item to <store>_data.txt
 
 class UserInfo:
     def __init__ (self):
@@ -183,8 +193,8 @@ class NativeHfsParser:
         if not self.initialized:
             raise ValueError("Volume not loaded!")
         try:
-            log.debug("Trying to export file : " + path + " to " + extract_to_path)
-            with open(extract_to_path, "wb") as f:
+            log.debug("Trying to export file : {} to {}".format(path, extract_to_path))
+            with CommonFunctions.OpenFileForWriting(extract_to_path) as f:
                 self.volume.readFile(path, f)
                 f.close()
                 return True
@@ -345,7 +355,25 @@ class MacInfo:
         self.dont_decrypt = dont_decrypt # To force turning off decryption in case a 3rd party tool has already decrypted image but container and volume flags still say its enc
         self.timezone = 'UTC'
 
+    def _RecordInput(self, path, is_folder=False):
+        '''Note the file/folder read by the running plugin in the run manifest (if enabled)'''
+        if self.output_params.run_manifest is not None:
+            self.output_params.run_manifest.RecordInput(path, is_folder)
+
     # Public functions, plugins can use these
+    def RecordApfsDbInput(self):
+        '''Plugins that query the APFS db (output_params.apfs_db_path) directly should call
+           this, so they are not skipped in an incremental run if the volumes have changed'''
+        if self.output_params.run_manifest is not None and self.output_params.apfs_db_path:
+            self.output_params.run_manifest.RecordDbInput(self.output_params.apfs_db_path, 'Volumes_Info')
+
+    def RecordOtherOutput(self, path):
+        '''Plugins that write output files/folders themselves (not with DataWriter or
+           ExportFile/ExportFolder) should call this, so they are not skipped in an
+           incremental run, as that output cannot be re-created from the database'''
+        if self.output_params.run_manifest is not None:
+            self.output_params.run_manifest.RecordOtherOutput(path)
+
     def GetAbsolutePath(self, current_abs_path, dest_rel_path):
         '''Returns the absolute (full) path to a destination file/folder given the
             current location (path) and a relative path to the destination. This is
@@ -431,7 +459,7 @@ class MacInfo:
         export_path = os.path.join(self.output_params.export_path, subfolder_name, os.path.basename(artifact_path))
         # create folder
         try:
-            if not os.path.exists(export_path):
+            if not os.path.exists(export_path) and not self.output_params.export_store:
                 os.makedirs(export_path)
         except (KeyError, ValueError, TypeError, OSError) as ex:
             log.error ("Exception while creating Export folder " + export_path + "\n Is output folder Writeable?" +
@@ -453,7 +481,7 @@ class MacInfo:
             new_path = os.path.join(export_path, self._GetSafeFilename(entry['name']))
             if entry['type'] == EntryType.FOLDERS:
                 try:
-                    if not os.path.exists(new_path):
+                    if not os.path.exists(new_path) and not self.output_params.export_store:
                         os.mkdir(new_path)
                 except:
                     log.exception("Exception while creating Export folder " + export_path)
@@ -485,7 +513,7 @@ class MacInfo:
         export_path = os.path.join(self.output_params.export_path, subfolder_name)
         # create folder
         try:
-            if not os.path.exists(export_path):
+            if not os.path.exists(export_path) and not self.output_params.export_store:
                 os.makedirs(export_path)
         except Exception as ex:
             log.error ("Exception while creating Export folder " + export_path + "\n Is output folder Writeable?" +
@@ -497,6 +525,8 @@ class MacInfo:
         out_filename = self._GetSafeFilename(out_filename) #filter filenames based on platform (Eg: Windows does not like ?<>/\:*"! in filenames)
         if overwrite:
             file_path = os.path.join(export_path, out_filename)
+        elif self.output_params.export_store:
+            file_path = self.output_params.export_store.GetNextAvailableFileName(os.path.join(export_path, out_filename))
         else:
             file_path = CommonFunctions.GetNextAvailableFileName(os.path.join(export_path, out_filename))
 
@@ -513,13 +543,27 @@ class MacInfo:
 
     def _ExtractFile(self, artifact_path, export_path, mac_times=None):
         '''Internal function, just export, no checks!'''
-        if self.ExtractFile(artifact_path, export_path):
+        self._RecordInput(artifact_path)
+        self.RecordOtherOutput(export_path)
+        export_store = self.output_params.export_store
+        sha256 = None
+        if export_store:
+            # Extract straight into the store, it hashes & compresses the data as it is read
+            store_file = export_store.CreateFile(export_path)
+            if self.ExtractFile(artifact_path, store_file):
+                sha256 = store_file.Finish()
+            else:
+                store_file.Discard()
+            extracted = sha256 is not None
+        else:
+            extracted = self.ExtractFile(artifact_path, export_path)
+        if extracted:
             if not mac_times:
                 mac_times = self.GetFileMACTimes(artifact_path)
             export_path_rel = os.path.relpath(export_path, start=self.output_params.export_path)
             if self.is_windows:
                 export_path_rel = export_path_rel.replace('\\', '/')
-            self.output_params.export_log_sqlite.WriteRow([artifact_path, export_path_rel, mac_times['c_time'], mac_times['m_time'], mac_times['cr_time'], mac_times['a_time']])
+            self.output_params.export_log_sqlite.WriteRow([artifact_path, export_path_rel, mac_times['c_time'], mac_times['m_time'], mac_times['cr_time'], mac_times['a_time'], sha256])
             return True
         else:
             log.info("Failed to export '" + artifact_path + "' to '" + export_path + "'")
@@ -616,6 +660,7 @@ class MacInfo:
         Format of list = [ { 'name':'got.txt', 'type':EntryType.FILES, 'size':10, 'dates': {} }, .. ]
         'path' should be linux style using forward-slash like '/var/db/xxyy/file.tdc'
         '''
+        self._RecordInput(path, is_folder=True)
         if self.use_native_hfs_parser:
             return self.hfs_native.ListItemsInFolder(path, types_to_fetch, include_dates)
         items = [] # List of dictionaries
@@ -649,6 +694,7 @@ class MacInfo:
 
     def Open(self, path):
         '''Open files less than 200 MB, returns open file handle'''
+        self._RecordInput(path)
         if self.use_native_hfs_parser:
             return self.hfs_native.Open(path)
         try:
@@ -689,7 +735,8 @@ class MacInfo:
         return None
 
     def ExtractFile(self, tsk_path, destination_path):
-        '''Extract a file from image to provided destination path'''
+        '''Extract a file from image to provided destination path (or writable file-like
+           object, like an ExportStoreFile)'''
         if self.use_native_hfs_parser:
             return self.hfs_native.ExtractFile(tsk_path, destination_path)
         try:
@@ -699,7 +746,7 @@ class MacInfo:
             BUFF_SIZE = 20 * 1024 * 1024
             offset = 0
             try:
-                with open(destination_path, 'wb') as f:
+                with CommonFunctions.OpenFileForWriting(destination_path) as f:
                     while offset < size:
                         available_to_read = min(BUFF_SIZE, size - offset)
                         try:
@@ -715,7 +762,10 @@ class MacInfo:
                                 log.debug("Trying to read with Native HFS parser")
                                 try:
                                     f.close()
-                                    os.remove(destination_path)
+                                    if isinstance(destination_path, str):
+                                        os.remove(destination_path)
+                                    else:
+                                        destination_path.Discard()
                                     if not self.hfs_native.initialized:
                                         self.hfs_native.Initialize(self.pytsk_image, self.macos_partition_start_offset)
                                     return self.hfs_native.ExtractFile(tsk_path,destination_path)
@@ -730,7 +780,7 @@ class MacInfo:
                     f.close()
                 return True
             except Exception as ex:
-                log.error (" Failed to create file for writing - " + destination_path + "\n" + str(ex))
+                log.error (" Failed to create file for writing - {}\n{}".format(destination_path, str(ex)))
                 log.debug("Exception details:", exc_info=True)
         except Exception as ex:
             if str(ex).find('tsk_fs_file_open: path not found:') > 0:
@@ -1087,16 +1137,28 @@ class ApfsMacInfo(MacInfo):
         self.apfs_data_volume = None # New in 10.15, a separate Data partition
         self.apfs_preboot_volume = None # In macOS 13, it's loaded while running
         self.apfs_update_volume = None  # In macOS 13, it's loaded while running
+        self.snapshot_name = '' # If set, plugins run against this snapshot instead of the live volumes
+        self.apfs_snapshot_volumes = {} # key=volume uuid, value=ApfsSnapshotVolume
+
+    def GetVolumeForProcessing(self, vol):
+        '''Returns the snapshot volume for vol if a snapshot was selected and parsed, else vol'''
+        return self.apfs_snapshot_volumes.get(vol.uuid, vol)
+
+    def _GetCombinedVolume(self):
+        data_vol = self.GetVolumeForProcessing(self.apfs_data_volume)
+        if data_vol is self.apfs_data_volume:
+            return ApfsSysDataLinkedVolume(self.apfs_sys_volume, data_vol)
+        return ApfsSysDataLinkedVolume(self.apfs_sys_volume, data_vol, f'Combined_Snap_{data_vol.snapshot.xid}')
 
     def UseCombinedVolume(self):
-        self.macos_FS = ApfsSysDataLinkedVolume(self.apfs_sys_volume, self.apfs_data_volume)
+        self.macos_FS = self._GetCombinedVolume()
 
     def CreateCombinedVolume(self):
         '''Returns True/False depending on whether system & data volumes could be combined successfully'''
         try:
-            self.macos_FS = ApfsSysDataLinkedVolume(self.apfs_sys_volume, self.apfs_data_volume)
+            self.macos_FS = self._GetCombinedVolume()
             apfs_parser = ApfsFileSystemParser(self.macos_FS, self.apfs_db)
-            return apfs_parser.create_linked_volume_tables(self.apfs_sys_volume, self.apfs_data_volume, self.macos_FS.firmlinks_paths, self.macos_FS.firmlinks)
+            return apfs_parser.create_linked_volume_tables(self.apfs_sys_volume, self.macos_FS.data_vol, self.macos_FS.firmlinks_paths, self.macos_FS.firmlinks)
         except (ValueError, TypeError) as ex:
             log.exception('')
         log.error('Failed to create combined System + Data volume')
@@ -1156,6 +1218,36 @@ class ApfsMacInfo(MacInfo):
                 log.error("Could not open plist to get system version info!")
         return info
 
+    def LoadSnapshotVolumes(self, snapshot_infos):
+        '''Create snapshot volume objects for snapshots already parsed into an existing db.
+           snapshot_infos is dictionary returned by ApfsDbInfo.GetSnapshotInfo()
+        '''
+        for vol in self.apfs_container.volumes:
+            info = snapshot_infos.get(vol.uuid, None)
+            if info:
+                for snapshot in vol.ReadSnapshotList():
+                    if snapshot.xid == info[0]:
+                        snapshot_vol = ApfsSnapshotVolume(vol, snapshot)
+                        snapshot_vol.dbo = self.apfs_db
+                        self.apfs_snapshot_volumes[vol.uuid] = snapshot_vol
+                        break
+
+    def _ReadVolumeRecords(self, vol):
+        '''Parse the volume, and if the selected snapshot exists on it, parse that too'''
+        apfs_parser = ApfsFileSystemParser(vol, self.apfs_db)
+        snapshots = []
+        if self.snapshot_name:
+            snapshots = [x for x in vol.ReadSnapshotList() if x.name == self.snapshot_name]
+            apfs_parser.track_block_rows = len(snapshots) > 0
+        apfs_parser.read_volume_records()
+        for snapshot in snapshots[-1:]: # If names repeat, use the latest one
+            log.info(f'Reading snapshot "{snapshot.name}" of volume {vol.volume_name}')
+            snapshot_vol = ApfsSnapshotVolume(vol, snapshot)
+            snapshot_vol.dbo = self.apfs_db
+            snapshot_parser = ApfsFileSystemParser(snapshot_vol, self.apfs_db)
+            snapshot_parser.read_snapshot_records(apfs_parser)
+            self.apfs_snapshot_volumes[vol.uuid] = snapshot_vol
+
     def ReadApfsVolumes(self):
         '''Read volume information into an sqlite db'''
         decryption_key = None
@@ -1206,15 +1298,21 @@ class ApfsMacInfo(MacInfo):
                                 else:
                                     log.debug(f"Starting decryption of filesystem, VEK={decryption_key.hex().upper()}")
                                     vol.encryption_key = decryption_key
-                                    apfs_parser = ApfsFileSystemParser(vol, self.apfs_db)
-                                    apfs_parser.read_volume_records()
+                                    self._ReadVolumeRecords(vol)
                                     break
                             else:
                                 log.error(f"Failed to read {plist_path}. Error was : {error}")
                         index += 1
             else:
-                apfs_parser = ApfsFileSystemParser(vol, self.apfs_db)
-                apfs_parser.read_volume_records()
+                self._ReadVolumeRecords(vol)
+        if self.snapshot_name:
+            # Written even if not found, so that a rerun can reuse this db
+            ApfsDbInfo(self.apfs_db).WriteSnapshotInfo(self.apfs_snapshot_volumes.values(), self.snapshot_name)
+            if not self.apfs_snapshot_volumes:
+                self.LogSnapshotNotFound()
+
+    def LogSnapshotNotFound(self):
+        log.error(f'No snapshot named "{self.snapshot_name}" was found on any volume, processing live volumes instead!')
 
     def GetFileMACTimes(self, file_path):
         '''Gets MACB and the 5th Index timestamp too'''
@@ -1277,6 +1375,7 @@ class ApfsMacInfo(MacInfo):
 
     def Open(self, path):
         '''Open file and return a file-like object'''
+        self._RecordInput(path)
         return self.macos_FS.open(path)
 
     def ExtractFile(self, tsk_path, destination_path):
@@ -1316,6 +1415,7 @@ class ApfsMacInfo(MacInfo):
 
     def ListItemsInFolder(self, path='/', types_to_fetch=EntryType.FILES_AND_FOLDERS, include_dates=False):
         '''Always returns dates ignoring the 'include_dates' parameter'''
+        self._RecordInput(path, is_folder=True)
         items = []
         all_items = self.macos_FS.ListItemsInFolder(path)
         if all_items:
@@ -1429,10 +1529,20 @@ class MountedFile():
 
 # TODO: Make this class more efficient, perhaps remove some extractions!
 class MountedMacInfo(MacInfo):
+
+    max_cache_items = 50000 # Upper limit on stat & xattr results cached (each)
+
     def __init__(self, root_folder_path, output_params):
         super().__init__(output_params)
         self.macos_root_folder = root_folder_path
         self.volume_inode = None
+        # Mounted evidence is read-only, so stat/xattr results can be reused. On network/FUSE
+        # mounts each syscall is expensive. These caches are keyed by full (resolved) path.
+        self._stat_cache = collections.OrderedDict() # { full_path : os.stat_result }
+        self._xattr_cache = collections.OrderedDict() # { full_path : { xattr_name : value } }
+        self._btime_cache = collections.OrderedDict() # { full_path : created time from statx }, linux only
+        self._btime_available = {} # { st_dev : False if the filesystem does not give created times }
+        self.inode_index = None # InodePathIndex, created on first use where /.vol is not available
         if not self.is_linux and not self.is_windows:
             self.volume_inode = self._get_volume_inode_from_root(root_folder_path)
 
@@ -1468,29 +1578,72 @@ class MountedMacInfo(MacInfo):
         volume_inode = root_stat.st_dev
         return volume_inode
 
-    def _get_creation_time(self, local_path):
+    def _AddToCache(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.max_cache_items:
+            cache.popitem(last=False) # remove oldest
+
+    def _Stat(self, full_path, stat_result=None):
+        '''Returns os.stat() result for full_path (already built), from cache if available.
+           If stat_result is provided (from a DirEntry), it is cached and returned.
+           Raises OSError like os.stat()'''
+        if stat_result is None:
+            stat_result = self._stat_cache.get(full_path, None)
+            if stat_result is not None:
+                self._stat_cache.move_to_end(full_path)
+                return stat_result
+            stat_result = os.stat(full_path)
+        self._AddToCache(self._stat_cache, full_path, stat_result)
+        return stat_result
+
+    def _get_creation_time(self, local_path, stat_result=None):
+        if stat_result is None:
+            stat_result = self._Stat(local_path)
         if self.is_windows:
-            return CommonFunctions.ReadUnixTime(os.path.getctime(local_path))
+            return CommonFunctions.ReadUnixTime(stat_result.st_ctime)
         elif self.is_linux:
-            try:
-                t = statx(local_path).get_btime() # New Linux kernel 4+ has this ability
-            except (OSError, ValueError) as ex:
-                t = 0 # Old linux kernel that does not support statx
+            t = self._GetBirthTimeLinux(local_path, stat_result.st_dev)
             if t != 0:
                 return CommonFunctions.ReadUnixTime(t)
             else: # Either old linux or a version of FUSE that does not populates btime (current does not)!
-                return CommonFunctions.ReadUnixTime(os.path.getmtime(local_path)) # Since this is not possible to fetch in Linux (using python)!
+                return CommonFunctions.ReadUnixTime(stat_result.st_mtime) # Since this is not possible to fetch in Linux (using python)!
         else:
-            return CommonFunctions.ReadUnixTime(os.stat(local_path).st_birthtime)
+            return CommonFunctions.ReadUnixTime(stat_result.st_birthtime)
+
+    def _GetBirthTimeLinux(self, local_path, st_dev):
+        '''Returns created time from statx, or 0 if not available. As FUSE (which
+           most mounts of mac images are) does not populate it, statx is not
+           called again for a filesystem once it did not return a created time.'''
+        if not self._btime_available.get(st_dev, True):
+            return 0
+        t = self._btime_cache.get(local_path, None)
+        if t is not None:
+            self._btime_cache.move_to_end(local_path)
+            return t
+        try:
+            result = statx(local_path) # New Linux kernel 4+ has this ability
+            t = result.get_btime() if (result.stx_mask & STATX_BTIME) else 0
+        except ValueError: # Old linux kernel that does not support statx
+            t = 0
+        except OSError as ex:
+            if ex.errno != errno.ENOSYS:
+                return 0 # Just this file
+            t = 0 # Old linux kernel that does not support statx
+        if t == 0:
+            self._btime_available[st_dev] = False
+        else:
+            self._AddToCache(self._btime_cache, local_path, t)
+        return t
 
     def GetFileMACTimes(self, file_path):
         file_path = self.BuildFullPath(file_path)
         times = { 'c_time':None, 'm_time':None, 'cr_time':None, 'a_time':None }
         try:
-            times['c_time'] = None if self.is_windows else CommonFunctions.ReadUnixTime(os.path.getctime(file_path))
-            times['m_time'] = CommonFunctions.ReadUnixTime(os.path.getmtime(file_path))
-            times['cr_time'] = self._get_creation_time(file_path)
-            times['a_time'] = CommonFunctions.ReadUnixTime(os.path.getatime(file_path))
+            stat_result = self._Stat(file_path)
+            times['c_time'] = None if self.is_windows else CommonFunctions.ReadUnixTime(stat_result.st_ctime)
+            times['m_time'] = CommonFunctions.ReadUnixTime(stat_result.st_mtime)
+            times['cr_time'] = self._get_creation_time(file_path, stat_result)
+            times['a_time'] = CommonFunctions.ReadUnixTime(stat_result.st_atime)
         except OSError as ex:
             log.exception('Error trying to get MAC times')
         return times
@@ -1517,9 +1670,9 @@ class MountedMacInfo(MacInfo):
         return self.IsValidFilePath(path)
 
     def _GetFileSizeNoPathMod(self, full_path, error=None):
-        '''Simply calls os.path.getsize(), BEWARE-does not build full path!'''
+        '''Simply gets size from stat, BEWARE-does not build full path!'''
         try:
-            return os.path.getsize(full_path)
+            return self._Stat(full_path).st_size
         except OSError as ex:
             log.error("Exception in _GetFileSizeNoPathMod() : " + str(ex))
         return error
@@ -1528,16 +1681,27 @@ class MountedMacInfo(MacInfo):
         '''Gets inode number of file/folder at path, returns 0 if error'''
         inode_number = 0
         try:
-            inode_number = os.stat(path).st_ino
+            inode_number = self._Stat(self.BuildFullPath(path)).st_ino
         except (FileNotFoundError, PermissionError) as ex:
             log.error(f"Exception in GetFileInodeNumber() : Path was {path}, Error was {ex}")
         return inode_number
+
+    def _GetInodeIndexRoots(self):
+        '''Returns list of (mounted_folder, path_in_image) to be indexed'''
+        return [(self.macos_root_folder, '/')]
+
+    def CloseInodeIndex(self):
+        '''Closes the inode index db, if it was used'''
+        if self.inode_index:
+            self.inode_index.Close()
     
     def GetFilePathFromInodeNumber(self, file_inode):
         '''Searches for file/folder with given inode number under search_path, returns full path if found, else empty string'''
-        # This only works on macOS
+        # /.vol lookup only works on macOS, elsewhere an index of the mounted folder is built on first use
         if self.volume_inode is None:
-            return ''
+            if self.inode_index is None:
+                self.inode_index = InodePathIndex(self.output_params.output_path, self._GetInodeIndexRoots())
+            return self.inode_index.GetPath(file_inode)
         file_path = ''
         volfs_path = f"/.vol/{self.volume_inode}/{file_inode}"
         try:
@@ -1560,7 +1724,7 @@ class MountedMacInfo(MacInfo):
     def GetFileSize(self, full_path, error=None):
         '''Builds full path, then gets size'''
         try:
-            return os.path.getsize(self.BuildFullPath(full_path))
+            return self._Stat(self.BuildFullPath(full_path)).st_size
         except OSError as ex:
             log.debug("Exception in GetFileSize() : " + str(ex) + " Perhaps file does not exist: " + full_path)
         return error
@@ -1576,6 +1740,9 @@ class MountedMacInfo(MacInfo):
             log.warning('ERR: Windows does not support extended attributes.')
             return None
         path = self.BuildFullPath(path)
+        xattrs = self._xattr_cache.get(path, None)
+        if xattrs is not None:
+            return xattrs.get(att_name, None)
         try:
             return xattr.getxattr(path, att_name)
         except OSError as ex:
@@ -1587,10 +1754,15 @@ class MountedMacInfo(MacInfo):
         if sys.platform == "win32":
             log.warning('ERR: Windows does not support extended attributes.')
             return xattrs
+        path = self.BuildFullPath(path)
+        cached_xattrs = self._xattr_cache.get(path, None)
+        if cached_xattrs is not None:
+            return dict(cached_xattrs)
         try:
             xattrs_all = xattr.xattr(path)
             for att_name in xattrs_all:
                 xattrs[att_name] = xattr.getxattr(path, att_name)
+            self._AddToCache(self._xattr_cache, path, dict(xattrs))
         except OSError as ex:
             log.error(f"Failed to retrieve attributes for {path}, error was: {str(ex)}")
         return xattrs
@@ -1602,21 +1774,29 @@ class MountedMacInfo(MacInfo):
         'path' should be linux style using forward-slash like '/var/db/xxyy/file.tdc'
         and starting at root /
         '''
+        self._RecordInput(path, is_folder=True)
         items = [] # List of dictionaries
         try:
             mounted_path = self.BuildFullPath(path)
-            dir = os.listdir(mounted_path)
-            for entry in dir:
+            with os.scandir(mounted_path) as dir_entries:
+                dir_entries = list(dir_entries)
+            for dir_entry in dir_entries:
+                entry = dir_entry.name
                 # Exclude the mounted encase <file>.Stream which is uncompressed stream of file,
                 #  not needed as we have the actual file
                 if entry.find('\xB7Stream') >= 0 or entry.find('\xB7Resource') >= 0:
                     log.debug(f'Excluding {entry} as it is raw stream not FILE. If you think this should be included, let the developers know!')
                     continue
-                newpath = os.path.join(mounted_path, entry)
-                entry_type = EntryType.FOLDERS if os.path.isdir(newpath) else EntryType.FILES
-                item = { 'name':entry, 'type':entry_type, 'size':self._GetFileSizeNoPathMod(newpath, 0)}
+                # DirEntry caches its stat, so the type, size & dates below need just one stat call
+                entry_type = EntryType.FOLDERS if dir_entry.is_dir() else EntryType.FILES
+                try:
+                    size = self._Stat(dir_entry.path, dir_entry.stat()).st_size
+                except OSError as ex:
+                    log.error("Exception in ListItemsInFolder() : " + str(ex))
+                    size = 0
+                item = { 'name':entry, 'type':entry_type, 'size':size}
                 if include_dates: 
-                    item['dates'] = self.GetFileMACTimes(path + '/' + entry)
+                    item['dates'] = self.GetFileMACTimes(posixpath.join(path, entry))
                 if types_to_fetch == EntryType.FILES_AND_FOLDERS:
                     items.append( item )
                 elif types_to_fetch == EntryType.FILES and entry_type == EntryType.FILES:
@@ -1651,6 +1831,7 @@ class MountedMacInfo(MacInfo):
         return target_path
 
     def Open(self, path):
+        self._RecordInput(path)
         try:
             mounted_path = self.BuildFullPath(path)
             log.debug("Trying to open file : " + mounted_path)
@@ -1668,7 +1849,7 @@ class MountedMacInfo(MacInfo):
             BUFF_SIZE = 20 * 1024 * 1024
             offset = 0
             try:
-                with open(destination_path, 'wb') as f:
+                with CommonFunctions.OpenFileForWriting(destination_path) as f:
                     while offset < size:
                         available_to_read = min(BUFF_SIZE, size - offset)
                         data = source_file.read(available_to_read)
@@ -1677,7 +1858,7 @@ class MountedMacInfo(MacInfo):
                         f.write(data)
                     f.flush()
             except (OSError) as ex:
-                log.exception ("Failed to create file for writing at " + destination_path)
+                log.exception ("Failed to create file for writing at {}".format(destination_path))
                 source_file.close()
                 return False
             source_file.close()
@@ -1692,7 +1873,7 @@ class MountedMacInfo(MacInfo):
         '''
         success, uid, gid = False, 0, 0
         try:
-            stat = os.stat(path)
+            stat = self._Stat(path)
             uid = str(CommonFunctions.convert_32bit_num_to_signed(stat.st_uid))
             gid = str(CommonFunctions.convert_32bit_num_to_signed(stat.st_gid))
             success = True
@@ -1940,8 +2121,12 @@ class MountedMacInfoSeperateSysData(MountedMacInfo):
         self.firmlinks = {}
         self.firmlinks_paths =[]
         self.max_firmlink_depth = 0
+        self.firmlinks_trie = {} # { path_component : { path_component : .. , None : dest }, .. }
         self._ParseFirmlinks()
 
+    def _GetInodeIndexRoots(self):
+        return [(self.sys_volume_folder, '/'), (self.data_volume_folder, '/System/Volumes/Data')]
+
     def _ParseFirmlinks(self):
         '''Read the firmlink path mappings between System & Data volumes'''
         firmlink_file_path = '/usr/share/firmlinks'
@@ -1971,6 +2156,12 @@ class MountedMacInfoSeperateSysData(MountedMacInfo):
         self.firmlinks['/System/Volumes/Data'] = ''
         self.firmlinks_paths.append('/System/Volumes/Data')
         f.close()
+        # Prefix tree of firmlink sources, the key None in a node holds the destination
+        for source, dest in self.firmlinks.items():
+            node = self.firmlinks_trie
+            for folder_name in source[1:].split('/'):
+                node = node.setdefault(folder_name, {})
+            node[None] = dest
 
     def BuildFullPath(self, path_in_image):
         r'''
@@ -1985,22 +2176,21 @@ class MountedMacInfoSeperateSysData(MountedMacInfo):
         path_parts = path_in_image[1:].split('/')
         path = ''
         vol_folder = self.sys_volume_folder
+        # Walk the firmlinks trie, the deepest firmlink matching the path wins
+        node = self.firmlinks_trie
         for index, folder_name in enumerate(path_parts):
-            #log.debug("index={}, folder_name={}".format(index, folder_name))
-            if index >= self.max_firmlink_depth:
+            node = node.get(folder_name, None)
+            if node is None:
                 break
-            else:
-                #log.debug("Searched for {}".format('/' + '/'.join(path_parts[:index + 1])))
-                dest = self.firmlinks.get('/' + '/'.join(path_parts[:index + 1]), None)
-                if dest != None:
-                    found_in_firmlink = True
-                    vol_folder = self.data_volume_folder
-                    path = dest
-                    if index + 1 < len(path_parts):
-                        rest_of_path = '/'.join(path_parts[index + 1:])
-                        path += '/' + rest_of_path
-                    elif path == '':
-                        path = '/'
+            dest = node.get(None, None)
+            if dest != None:
+                vol_folder = self.data_volume_folder
+                path = dest
+                if index + 1 < len(path_parts):
+                    rest_of_path = '/'.join(path_parts[index + 1:])
+                    path += '/' + rest_of_path
+                elif path == '':
+                    path = '/'
 
         full_path = ''
         if path == '': path = path_in_image
@@ -2117,6 +2307,7 @@ class ZipMacInfo(MacInfo):
         'path' should be linux style using forward-slash like '/var/db/xxyy/file.tdc'
         and starting at root /
         '''
+        self._RecordInput(path, is_folder=True)
         items = [] # List of dictionaries
         if path[-1] != '/':
             path += '/'
@@ -2160,6 +2351,7 @@ class ZipMacInfo(MacInfo):
         return target_path
 
     def Open(self, path):
+        self._RecordInput(path)
         try:
             log.debug("Trying to open file : " + path)
             file = self.zip_file.open(path[1:])
@@ -2177,7 +2369,7 @@ class ZipMacInfo(MacInfo):
             BUFF_SIZE = 20 * 1024 * 1024
             offset = 0
             try:
-                with open(destination_path, 'wb') as f:
+                with CommonFunctions.OpenFileForWriting(destination_path) as f:
                     while offset < size:
                         available_to_read = min(BUFF_SIZE, size - offset)
                         data = source_file.read(available_to_read)
@@ -2186,7 +2378,7 @@ class ZipMacInfo(MacInfo):
                         f.write(data)
                     f.flush()
             except (OSError) as ex:
-                log.exception ("Failed to create file for writing at " + destination_path)
+                log.exception ("Failed to create file for writing at {}".format(destination_path))
                 source_file.close()
                 return False
             source_file.close()
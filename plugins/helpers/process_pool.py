@@ -0,0 +1,67 @@
+'''
+   Copyright (c) 2017 Yogesh Khatri
+
+   This file is part of mac_apt (macOS Artifact Parsing Tool).
+   Usage or distribution of this software/code is subject to the
+   terms of the MIT License.
+
+   process_pool.py
+   ---------------
+   A process pool for plugins that decode many independent items in
+   parallel. Workers are always spawned, never forked, as fork is not
+   safe on macOS and the main process runs other threads (such as the
+   sqlite writer service). So the worker function, its arguments and
+   the initializer must be picklable, ie, defined at the top level of
+   a module. Log messages from workers are sent back to this process
+   and go to the usual log file and console.
+'''
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+
+log = logging.getLogger('MAIN.HELPERS.PROCESS_POOL')
+
+def GetWorkerCount(num_items, max_workers=None):
+    '''Returns number of worker processes to use for num_items,
+       a value of 1 means the work should be done in this process.
+    '''
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    return max(1, min(max_workers, num_items))
+
+class _WorkerLogHandler(logging.Handler):
+    '''Hands log records received from workers to the logger of the same name here'''
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+def _InitWorker(log_queue, log_level, initializer, initargs):
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    logging.getLogger('MAIN').setLevel(log_level)
+    if initializer:
+        initializer(*initargs)
+
+class ProcessPool(ProcessPoolExecutor):
+    '''ProcessPoolExecutor using spawned workers, which log through this process.
+       Use it as a context manager, or call shutdown() when done.
+    '''
+    def __init__(self, max_workers, initializer=None, initargs=()):
+        context = multiprocessing.get_context('spawn')
+        self._log_queue = context.Queue()
+        self._log_listener = QueueListener(self._log_queue, _WorkerLogHandler())
+        self._log_listener.start()
+        log_level = logging.getLogger('MAIN').getEffectiveLevel()
+        log.debug('Starting {} worker processes'.format(max_workers))
+        super().__init__(max_workers, context, _InitWorker, (self._log_queue, log_level, initializer, initargs))
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        super().shutdown(wait, cancel_futures=cancel_futures)
+        if self._log_listener:
+            self._log_listener.stop()
+            self._log_listener = None
+            self._log_queue.close()
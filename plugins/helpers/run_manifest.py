@@ -0,0 +1,312 @@
+'''
+   Copyright (c) 2017 Yogesh Khatri
+
+   This file is part of mac_apt (macOS Artifact Parsing Tool).
+   Usage or distribution of this software/code is subject to the
+   terms of the MIT License.
+
+   run_manifest.py
+   ---------------
+   Keeps a manifest (mac_apt_manifest.json) in the output folder recording,
+   for every plugin run, the artifacts it read (files & folders along with
+   their size, times, inode and hash, and tables it queried directly from
+   the APFS db) and the output tables it produced (with column types).
+   On a re-run with the same output folder, plugins whose inputs have not
+   changed can be skipped, their previous output tables are then simply
+   re-exported from the older mac_apt.db into the current output formats.
+   Plugins that export files or write other output (not via DataWriter)
+   are never skipped, as that output cannot be re-created from the db.
+'''
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+from plugins.helpers.common import EntryType
+from plugins.helpers.writer import DataType, DataWriter
+
+log = logging.getLogger('MAIN.HELPERS.RUN_MANIFEST')
+
+class RunManifest:
+
+    version = 1
+    manifest_file_name = 'mac_apt_manifest.json'
+    max_hash_size = 20971520 # Files larger than 20MB are not hashed, only size/times/inode compared
+
+    def __init__(self, output_path, input_type, input_path):
+        self.path = os.path.join(output_path, self.manifest_file_name)
+        self.input_info = { 'type': input_type.upper(), 'path': os.path.abspath(input_path),
+                            'size': None, 'm_time': None }
+        if os.path.isfile(input_path): # image file, not a mounted folder
+            self.input_info['size'] = os.path.getsize(input_path)
+            self.input_info['m_time'] = os.path.getmtime(input_path)
+        self.previous_plugins = self._LoadPrevious()
+        self.plugins = {}
+        self.current_plugin = None
+        self.current_entry = None
+        self.suspend_recording = False
+        self.output_folders = []
+        self.output_folder_items = set()
+
+    def _LoadPrevious(self):
+        '''Returns plugin entries from an existing manifest, if it was created for the same input'''
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') != self.version:
+                log.info('Run manifest version is different, it will not be used')
+            elif manifest.get('input') != self.input_info:
+                log.info('Run manifest is for a different (or modified) input, it will not be used')
+            else:
+                return manifest.get('plugins', {})
+        except (OSError, ValueError) as ex:
+            log.error('Failed to read run manifest {}, error was {}'.format(self.path, str(ex)))
+        return {}
+
+    def Save(self):
+        plugins = dict(self.previous_plugins)
+        plugins.update(self.plugins)
+        manifest = { 'version': self.version, 'input': self.input_info, 'plugins': plugins }
+        try:
+            with open(self.path, 'w', encoding='utf8') as f:
+                json.dump(manifest, f, indent=1)
+        except OSError as ex:
+            log.error('Failed to write run manifest {}, error was {}'.format(self.path, str(ex)))
+
+    def StartPlugin(self, plugin_name, output_params):
+        self.current_plugin = plugin_name
+        self.current_entry = { 'db_path': os.path.abspath(output_params.output_db_path), 'completed': False,
+                                'files': {}, 'folders': {}, 'db_tables': {}, 'outputs': [], 'other_outputs': False }
+        self.output_folders = [output_params.output_path, output_params.export_path]
+        self.output_folder_items = self._ListOutputFolders()
+
+    def _ListOutputFolders(self):
+        '''Returns set of paths of all items (top level only) in the output & export folders'''
+        items = set()
+        for folder in self.output_folders:
+            if folder and os.path.isdir(folder):
+                items.update(os.path.join(folder, name) for name in os.listdir(folder))
+        return items
+
+    def EndPlugin(self, mac_info, completed):
+        '''Fingerprint all inputs read by the plugin and save manifest'''
+        plugin_name = self.current_plugin
+        entry = self.current_entry
+        self.current_plugin = None
+        self.current_entry = None
+        entry['completed'] = completed
+        if self.previous_plugins.get(plugin_name, {}).get('other_outputs', False):
+            entry['other_outputs'] = True # Its output folders may already exist now, so not seen as new
+        else:
+            # Anything new in output folders, other than DataWriter files (or the db's -wal/-journal),
+            # was written by the plugin directly
+            output_names = tuple(output['name'] + '.' for output in entry['outputs']) + (os.path.basename(entry['db_path']),)
+            for path in self._ListOutputFolders() - self.output_folder_items:
+                if not os.path.basename(path).startswith(output_names):
+                    log.debug('{} created {}, it will not be skipped in later runs'.format(plugin_name, path))
+                    entry['other_outputs'] = True
+                    break
+        self.suspend_recording = True
+        try:
+            for path in entry['files']:
+                entry['files'][path] = self.GetFileFingerprint(mac_info, path)
+            for path in entry['folders']:
+                entry['folders'][path] = self.GetFolderFingerprint(mac_info, path)
+            for db_path, tables in entry['db_tables'].items():
+                for table_name in tables:
+                    tables[table_name] = self.GetTableFingerprint(db_path, table_name)
+        finally:
+            self.suspend_recording = False
+        self.plugins[plugin_name] = entry
+        self.Save()
+
+    def RecordInput(self, path, is_folder=False):
+        '''Called (via MacInfo) for every file opened/exported and folder listed'''
+        if self.current_entry is None or self.suspend_recording:
+            return
+        if is_folder:
+            self.current_entry['folders'].setdefault(path, None)
+        else:
+            self.current_entry['files'].setdefault(path, None)
+
+    def RecordDbInput(self, db_path, table_name):
+        '''Called (via MacInfo) when a plugin queries a table of an sqlite db (like the APFS db) directly'''
+        if self.current_entry is None or self.suspend_recording:
+            return
+        self.current_entry['db_tables'].setdefault(os.path.abspath(db_path), {}).setdefault(table_name, None)
+
+    def RecordOutput(self, name, table_name, column_info, db_path):
+        '''Called by DataWriter when it creates an output table/file'''
+        if self.current_entry is None:
+            return
+        if table_name and os.path.abspath(db_path) != self.current_entry['db_path']:
+            # Plugin has its own db (like ASL, SPOTLIGHT), re-export would not recreate it
+            self.current_entry['other_outputs'] = True
+        columns = []
+        for col, data_type in column_info.items():
+            if isinstance(data_type, (tuple, list)): # (DataType, extra keyword)
+                columns.append([col, data_type[0].name, data_type[1]])
+            else:
+                columns.append([col, data_type.name])
+        self.current_entry['outputs'].append({ 'name': name, 'table': table_name, 'columns': columns })
+
+    def RecordOtherOutput(self, path):
+        '''Called (via MacInfo) when the plugin exports a file, or writes output not using DataWriter.
+           Such a plugin is always run again, as its output cannot be re-created from the db.'''
+        if self.current_entry is None or self.suspend_recording:
+            return
+        self.current_entry['other_outputs'] = True
+
+    def GetFileFingerprint(self, mac_info, path):
+        '''Returns [size, m_time, inode, sha256] of file, all None if it does not exist'''
+        if not mac_info.IsValidFilePath(path):
+            return [None, None, None, None]
+        size = mac_info.GetFileSize(path)
+        m_time = mac_info.GetFileMACTimes(path).get('m_time', None)
+        inode = mac_info.GetFileInodeNumber(path)
+        sha256 = None
+        if size is not None and size <= self.max_hash_size:
+            try:
+                f = mac_info.Open(path)
+                if f:
+                    hasher = hashlib.sha256()
+                    data = f.read(1048576)
+                    while data:
+                        hasher.update(data)
+                        data = f.read(1048576)
+                    f.close()
+                    sha256 = hasher.hexdigest()
+            except Exception as ex:
+                log.debug('Could not hash {}, error was {}'.format(path, str(ex)))
+        return [size, str(m_time) if m_time is not None else None, inode, sha256]
+
+    def GetFolderFingerprint(self, mac_info, path):
+        '''Returns a digest of names & sizes of items in folder, None if it does not exist'''
+        if not mac_info.IsValidFolderPath(path):
+            return None
+        hasher = hashlib.sha256()
+        items = mac_info.ListItemsInFolder(path, EntryType.FILES_AND_FOLDERS, False)
+        for name, size in sorted((item['name'], item.get('size', 0) or 0) for item in items):
+            hasher.update('{}|{}\n'.format(name, size).encode('utf8', 'backslashreplace'))
+        return hasher.hexdigest()
+
+    def GetTableFingerprint(self, db_path, table_name):
+        '''Returns a digest of all rows of table, None if db or table does not exist'''
+        if not os.path.isfile(db_path):
+            return None
+        conn = None
+        try:
+            conn = sqlite3.connect('file:{}?mode=ro'.format(db_path), uri=True)
+            hasher = hashlib.sha256()
+            for row in conn.execute('SELECT * FROM "{}"'.format(table_name)):
+                hasher.update(repr(row).encode('utf8', 'backslashreplace'))
+            return hasher.hexdigest()
+        except sqlite3.Error as ex:
+            log.debug('Could not read table {} from {}, error was {}'.format(table_name, db_path, str(ex)))
+        finally:
+            if conn:
+                conn.close()
+        return None
+
+    def IsPluginUnchanged(self, plugin_name, mac_info, current_db_path):
+        '''Returns True if plugin ran to completion earlier, and none of its inputs have changed since'''
+        entry = self.previous_plugins.get(plugin_name, None)
+        if not entry or not entry.get('completed', False):
+            return False
+        if entry.get('other_outputs', True):
+            log.debug('{} exports files or writes output other than tables, it cannot be skipped'.format(plugin_name))
+            return False
+        if os.path.abspath(current_db_path) == entry['db_path'] or not os.path.exists(entry['db_path']):
+            return False
+        self.suspend_recording = True
+        try:
+            for path, fingerprint in entry['files'].items():
+                if self.GetFileFingerprint(mac_info, path) != fingerprint:
+                    log.debug('{} input changed: {}'.format(plugin_name, path))
+                    return False
+            for path, fingerprint in entry['folders'].items():
+                if self.GetFolderFingerprint(mac_info, path) != fingerprint:
+                    log.debug('{} input folder changed: {}'.format(plugin_name, path))
+                    return False
+            for db_path, tables in entry.get('db_tables', {}).items():
+                for table_name, fingerprint in tables.items():
+                    if self.GetTableFingerprint(db_path, table_name) != fingerprint:
+                        log.debug('{} input table changed: {} in {}'.format(plugin_name, table_name, db_path))
+                        return False
+        finally:
+            self.suspend_recording = False
+        return True
+
+    def ReExportPlugin(self, plugin_name, output_params):
+        '''Copy a skipped plugin's earlier output tables into the current outputs.
+           Returns True if successful.'''
+        previous_entry = self.previous_plugins[plugin_name]
+        self.StartPlugin(plugin_name, output_params)
+        self.current_entry['files'] = previous_entry['files']
+        self.current_entry['folders'] = previous_entry['folders']
+        self.current_entry['db_tables'] = previous_entry.get('db_tables', {})
+        success = True
+        conn = None
+        try:
+            conn = sqlite3.connect('file:{}?mode=ro'.format(previous_entry['db_path']), uri=True)
+            for output in previous_entry['outputs']:
+                if not output['table']:
+                    log.error('Previous output {} of {} was not saved to sqlite, cannot re-export'.format(output['name'], plugin_name))
+                    success = False
+                    break
+                self._ReExportTable(conn, output, output_params)
+        except (OSError, sqlite3.Error) as ex:
+            log.exception('Failed to re-export output of {}'.format(plugin_name))
+            success = False
+        finally:
+            if conn:
+                conn.close()
+        entry = self.current_entry
+        self.current_plugin = None
+        self.current_entry = None
+        entry['completed'] = success
+        self.plugins[plugin_name] = entry
+        self.Save()
+        return success
+
+    def _ReExportTable(self, conn, output, output_params):
+        table_name = output['table']
+        if output.get('columns'):
+            column_info = []
+            for col, data_type, *extra_keyword in output['columns']:
+                column_info.append((col, (DataType[data_type], extra_keyword[0]) if extra_keyword else DataType[data_type]))
+        else: # older manifest, types as declared in sqlite (DATE columns are TEXT there)
+            column_info = []
+            for row in conn.execute('PRAGMA table_info("{}")'.format(table_name)):
+                col_type = row[2].upper()
+                column_info.append((row[1], DataType[col_type] if col_type in DataType.__members__ else DataType.TEXT))
+        # Dates were stored as text in sqlite, convert back so other writers format them as dates
+        date_cols = [index for index, (col, data_type) in enumerate(column_info) \
+                        if (data_type[0] if isinstance(data_type, tuple) else data_type) == DataType.DATE]
+        writer = DataWriter(output_params, output['name'], column_info)
+        try:
+            cursor = conn.execute('SELECT * FROM "{}"'.format(table_name))
+            rows = cursor.fetchmany(100000)
+            while rows:
+                rows = [list(row) for row in rows]
+                for row in rows:
+                    for index in date_cols:
+                        row[index] = self._ToDate(row[index])
+                writer.WriteRows(rows)
+                rows = cursor.fetchmany(100000)
+        finally:
+            writer.FinishWrites()
+
+    @staticmethod
+    def _ToDate(value):
+        if isinstance(value, str) and value:
+            try:
+                return datetime.datetime.fromisoformat(value)
+            except ValueError:
+                pass
+        return value
@@ -13,36 +13,37 @@ import sqlite3
 
 log = logging.getLogger('MAIN.HELPERS.SPOTLIGHT_FILTER')
 
-def get_columns_with_data(db, bundle_id, table_name, columns_info):
-    '''Given a bundle_id and table, this will filter out empty columns
-       and return a list of column names that have data'''
-    cols_with_data = []
-    select_items = ''
+def column_has_data(col_name, data):
+    '''Given the aggregate (total() or max()) of a column, returns False if column is empty'''
+    if (data is None) or (data == 0.0) or (data == '') or \
+       (data == '00' and col_name == "Parent_ID_hex"): # EMPTY col
+        return False
+    return True
+
+def get_columns_with_data(db, table_name, columns_info):
+    '''This will filter out empty columns for every bundle_id in table, in a
+       single pass over the table (one GROUP BY query aggregating all columns).
+       Returns dictionary { bundle_id : [ list of column names that have data ] }'''
+    bundles_with_column_info = {}
+    columns = []
+    select_items = []
 
     for c, c_type in columns_info.items():
-        if c == bundle_id: continue
+        columns.append(c)
         if c_type == 'INTEGER':
-            select_items += f'total("{c}") "{c}",'
+            select_items.append(f'total("{c}")')
         else: # c_type == 'TEXT':
-            select_items += f'max("{c}") "{c}",'
+            select_items.append(f'max("{c}")')
 
-    select_items = select_items.rstrip(',')
-
-    query = f'SELECT {select_items} FROM "{table_name}" WHERE _kMDItemBundleID ="{bundle_id}"'
+    query = f'SELECT _kMDItemBundleID, {",".join(select_items)} FROM "{table_name}" '\
+             'WHERE _kMDItemBundleID NOT LIKE "" GROUP BY _kMDItemBundleID'
     cursor = db.execute(query)
-    for row in cursor: # There will only be 1 row
-        for c in columns_info:
-            if c == bundle_id: continue
-            data = row[c]
-            if (data is None) or (data == 0.0) or (data == '') or \
-               (data == '00' and c == "Parent_ID_hex"): # EMPTY col
-                pass
-            else:
-                cols_with_data.append(c)
-
-    #print (len(cols_with_data))
+    for row in cursor: # One row per bundle_id
+        bundle_id = row[0]
+        bundles_with_column_info[bundle_id] = [c for index, c in enumerate(columns, 1) \
+                                                if c != bundle_id and column_has_data(c, row[index])]
     cursor.close()
-    return cols_with_data
+    return bundles_with_column_info
 
 def create_views_for_ios_db(path_to_db, base_table_name):
 
@@ -67,32 +68,16 @@ def create_views_for_ios_db(path_to_db, base_table_name):
         db.close()
         return False
 
-    # 2. Get Bundle IDs and Content Types
-    bundles = {}
+    # 2. For each bundleid, identify empty columns/fields (one pass over the table)
 
-    query = f'select _kMDItemBundleID, kMDItemContentType from "{base_table_name}" WHERE _kMDItemBundleID NOT LIKE "" GROUP BY _kMDItemBundleID, kMDItemContentType'
     try:
-        cursor = db.execute(query)
-        for row in cursor:
-            existing = bundles.get(row['_kMDItemBundleID'], None)
-            if existing:
-                existing.append(row['kMDItemContentType'])
-            else:
-                bundles[row['_kMDItemBundleID']] = [row['kMDItemContentType']]
-        cursor.close()
+        bundles_with_column_info = get_columns_with_data(db, base_table_name, columns_info)
     except sqlite3.Error as ex:
-        log.exception(f"Error getting bundle ids and content types for table {base_table_name}")
+        log.exception(f"Error finding columns with data for table {base_table_name}")
         db.close()
         return False
 
-    # 3. For each bundleid, identify empty columns/fields
-
-    bundles_with_column_info = {}
-    for bundle_id in bundles:
-        cols_with_data = get_columns_with_data(db, bundle_id, base_table_name, columns_info)
-        bundles_with_column_info[bundle_id] = cols_with_data
-
-    # # 4. Add separate table for each bundle
+    # # 3. Add separate table for each bundle
     #
     # for bundle_id, cols in bundles_with_column_info.items():
     #     selected_fields = ",".join([f'"{c}"' for c in cols])
@@ -100,8 +85,9 @@ def create_views_for_ios_db(path_to_db, base_table_name):
     #     new_table_name = base_table_name + "_" + bundle_id
     #     query = f'CREATE TABLE {new_table_name} AS SELECT {selected_fields} FROM "Spotlight-store.db"'
 
-    # 4. Add separate view for each bundle
+    # 3. Add separate view for each bundle
     view_count = 0
+    db.execute('BEGIN') # All views in one transaction
     for bundle_id, cols in bundles_with_column_info.items():
         selected_fields = ",".join([f'"{c}"' for c in cols])
         new_table_name = base_table_name + "_" + bundle_id
@@ -112,6 +98,7 @@ def create_views_for_ios_db(path_to_db, base_table_name):
             view_count += 1
         except sqlite3.Error as ex:
             log.exception(f"Error adding view for table {base_table_name}. Query was {query}")
+    db.commit()
 
     db.close()
     log.info(f"{view_count} views added for table {base_table_name}")
@@ -56,6 +56,11 @@ import sys
 import logging
 from enum import IntEnum
 
+try:
+    from plugins.helpers.decoders import ReadVarSizeNum, ReadVarSizeNumAt
+except ImportError: # running standalone
+    from decoders import ReadVarSizeNum, ReadVarSizeNumAt
+
 lzfse_capable = False
 
 try:
@@ -141,7 +146,7 @@ class FileMetaDataListing:
     
     def ReadVarSizeNum(self):
         '''Returns num and bytes_read'''
-        num, bytes_read = SpotlightStore.ReadVarSizeNum(self.data[self.pos : min(self.size, 9 + self.pos)])
+        num, bytes_read = ReadVarSizeNumAt(self.data, self.pos, min(self.size, 9 + self.pos))
         self.pos += bytes_read
         return num, bytes_read
 
@@ -734,39 +739,7 @@ class SpotlightStore:
     @staticmethod
     def ReadVarSizeNum(data):
         '''Returns num and bytes_read'''
-        first_byte = data[0] #struct.unpack("B", data[0:1])[0]
-        extra = 0
-        use_lower_nibble = True
-        if first_byte == 0:
-            return 0, 1
-        elif (first_byte & 0xF0) == 0xF0: # 4 or more
-            use_lower_nibble = False
-            if (first_byte & 0x0F)==0x0F: extra = 8
-            elif (first_byte & 0x0E)==0x0E: extra = 7
-            elif (first_byte & 0x0C)==0x0C: extra = 6
-            elif (first_byte & 0x08)==0x08: extra = 5
-            else: 
-                extra = 4
-                use_lower_nibble = True
-                first_byte -= 0xF0
-        elif (first_byte & 0xE0) == 0xE0:
-            extra = 3
-            first_byte -= 0xE0
-        elif (first_byte & 0xC0) == 0xC0:
-            extra = 2
-            first_byte -=0xC0
-        elif (first_byte & 0x80) == 0x80:
-            extra = 1
-            first_byte -= 0x80
-
-        if extra:
-            num = 0
-            #num += sum(struct.unpack('B', data[x:x+1])[0] << (extra - x) * 8 for x in range(1, extra + 1))
-            num += sum(data[x] << (extra - x) * 8 for x in range(1, extra + 1))
-            if use_lower_nibble:
-                num = num + (first_byte << (extra*8))
-            return num, extra + 1
-        return first_byte, extra + 1
+        return ReadVarSizeNum(data)
 
     def ReadOffsets(self, offsets_content):
         ''' Read offsets and index information from dbStr-x.map.offsets file data.
@@ -948,9 +921,24 @@ class SpotlightStore:
         return False
 
     def ParseMetadataBlocks(self, output_file, items, items_to_compare=None, process_items_func=None):
-        '''Parses block, return number of items written (after deduplication if items_to_compare!=None)'''
-        # Index = [last_id_in_block, offset_index, dest_block_size]
+        '''Parses block, return number of items written (after deduplication if items_to_compare!=None)
+           If output_file is None, items are not printed out as text.'''
         total_items_written = 0
+        for items_in_block in self.IterMetadataBlocks(items, items_to_compare):
+            total_items_written += len(items_in_block)
+            if process_items_func:
+                process_items_func(items_in_block, self)
+            if output_file:
+                for md_item in items_in_block:
+                    md_item.Print(output_file)
+        return total_items_written
+
+    def IterMetadataBlocks(self, items, items_to_compare=None):
+        '''Generator, parses metadata blocks one at a time and yields list of
+           items (FileMetaDataListing) from each block (after deduplication if 
+           items_to_compare!=None). Nothing is held beyond the current block,
+           other than the entries added to 'items'.'''
+        # Index = [last_id_in_block, offset_index, dest_block_size]
         for index in self.block0.indexes:
             #go to offset and parse
             seek_offset = index[1] * 0x1000
@@ -1046,7 +1034,6 @@ class SpotlightStore:
                         if items_to_compare and self.ItemExistsInDictionary(items_to_compare, md_item): pass # if md_item exists in compare_dict, skip it, else add
                         else:
                             items_in_block.append(md_item)
-                            total_items_written += 1
                             name = md_item.GetFileName()
                             existing_item = items.get(md_item.id, None)
                             if existing_item != None:
@@ -1074,7 +1061,6 @@ class SpotlightStore:
                         if items_to_compare and self.ItemExistsInDictionary(items_to_compare, md_item): pass # if md_item exists in compare_dict, skip it, else add
                         else:
                             items_in_block.append(md_item)
-                            total_items_written += 1
                             name = md_item.GetFileName()
                             existing_item = items.get(md_item.id, None)
                             if existing_item != None:
@@ -1094,13 +1080,7 @@ class SpotlightStore:
                     pos += item_size + 4
                     count += 1
 
-            if process_items_func:
-                process_items_func(items_in_block, self)
-
-            for md_item in items_in_block:
-                md_item.Print(output_file)
-                
-        return total_items_written
+            yield items_in_block
 
     def ParseBlockSequence(self, initial_index, type, dictionary):
         '''Follow the sequence of next_block_index to parse all blocks in the chain'''
@@ -1155,37 +1135,59 @@ class SpotlightStore:
                 raise ValueError("Block size mismatch!")
             self.Seek(self.pos + self.block_size)
         
-def RecursiveGetFullPath(item, items_list, suppress_error_messages=False):
-    '''Return full path to given item, here items_list is dictionary'''
+def GetFullPath(item, items_list, suppress_error_messages=False):
+    '''Return full path to given item, here items_list is dictionary.
+       This walks up the parents (iteratively) only until one with a known
+       path is reached, and saves the path of every item on the way, so 
+       its siblings and children don't walk up again. A loop in the parent
+       ids is reported, and such paths begin with '..LOOP..'
+    '''
     # item = [id, parent_id, name, full_path, date]
     if item[3]:
         return item[3]
     if item[0] == 1: #is this plist?
         return 'plist'
-    name = item[2]
-    if item[0] == 2: # This is root
-        if name == '':
-            name = '/'
-        item[3] = name
-        return name
-    search_id = item[1]
-
-    if search_id == 0:
-        search_id = 2 # root
-    ret_path = ''
-    found_item = items_list.get(search_id, None)
-
-    if found_item != None:
-        parent_path = RecursiveGetFullPath(found_item, items_list)
-        ret_path = (parent_path + '/' + name) if parent_path != '/' else (parent_path + name)
-        found_item[3] = parent_path
-    elif search_id == 2: # root
-        ret_path = ('/' + name) if name else '/'
-    else:
-        if not suppress_error_messages:
-            log.debug ('Err, could not find path for id {} '.format(search_id))
-        ret_path = '..NOT-FOUND../' + name
-    return ret_path
+    chain = [] # items whose path is not known yet, child first
+    seen_ids = set()
+    current = item
+    while True:
+        if current[3]:
+            parent_path = current[3]
+            break
+        elif current[0] == 1: # plist
+            parent_path = 'plist'
+            break
+        elif current[0] == 2: # This is root
+            parent_path = current[2] if current[2] else '/'
+            current[3] = parent_path
+            break
+        elif current[0] in seen_ids:
+            log.warning('Loop found in parent ids of item id {}, at id {}'.format(item[0], current[0]))
+            parent_path = '..LOOP..'
+            break
+        seen_ids.add(current[0])
+        chain.append(current)
+        search_id = current[1]
+        if search_id == 0:
+            search_id = 2 # root
+        found_item = items_list.get(search_id, None)
+        if found_item != None:
+            current = found_item
+        elif search_id == 2: # root
+            parent_path = '/'
+            break
+        else:
+            if not suppress_error_messages:
+                log.debug ('Err, could not find path for id {} '.format(search_id))
+            parent_path = '..NOT-FOUND..'
+            break
+    for current in reversed(chain):
+        name = current[2]
+        parent_path = (parent_path + '/' + name) if parent_path != '/' else (parent_path + name)
+        current[3] = parent_path
+    return parent_path
+
+RecursiveGetFullPath = GetFullPath # older name
 
 def GetFileData(path):
     data = b''
@@ -1274,7 +1276,7 @@ def ProcessStoreDb(input_file_path, output_path, file_name_prefix='store'):
                 for k, v in items.items():
                     name = v[2]
                     if name:
-                        fullpath = RecursiveGetFullPath(v, items)
+                        fullpath = GetFullPath(v, items)
                         to_write = str(k) + '\t' + fullpath + '\r\n'
                         output_paths_file.write(to_write.encode('utf-8', 'backslashreplace'))
 
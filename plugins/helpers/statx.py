@@ -100,19 +100,29 @@ SYSCALLS = {
 AT_FDCWD = -100 # fcntl.h
 AT_SYMLINK_NOFOLLOW = 0x100 # fcntl.h
 STATX_ALL = 0xfff # stat.h
+STATX_BTIME = 0x800 # stat.h
 SYS_STATX = SYSCALLS[platform.machine()]
 
+_syscall = None # libc syscall(), loaded once on first use
+
+
+def _GetSyscall():
+    global _syscall
+    if _syscall is None:
+        lib = ctypes.CDLL(None, use_errno=True)
+        syscall = lib.syscall
+        # int statx(int dirfd, const char *pathname, int flags, unsigned int mask, struct statx *statxbuf);
+        syscall.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint, ctypes.c_char_p]
+        syscall.restype = ctypes.c_int
+        _syscall = syscall
+    return _syscall
+
 
 def statx(path):
     pathname = path.encode('utf8')
     statxbuf = ctypes.create_string_buffer(ctypes.sizeof(Statx))
 
-    lib = ctypes.CDLL(None, use_errno=True)
-    syscall = lib.syscall
-
-    # int statx(int dirfd, const char *pathname, int flags, unsigned int mask, struct statx *statxbuf);
-    syscall.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint, ctypes.c_char_p]
-    syscall.restype = ctypes.c_int
+    syscall = _GetSyscall()
 
     if syscall(SYS_STATX, AT_FDCWD, pathname, AT_SYMLINK_NOFOLLOW, STATX_ALL, statxbuf):
         e = ctypes.get_errno()
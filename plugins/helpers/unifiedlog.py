@@ -0,0 +1,805 @@
+'''
+   Copyright (c) 2025 Yogesh Khatri
+
+   This file is part of mac_apt (macOS Artifact Parsing Tool).
+   Usage or distribution of this software/code is subject to the
+   terms of the MIT License.
+
+   unifiedlog.py
+   -------------
+   A pure python reader for macOS Unified Logs (tracev3 files), so they
+   can be parsed on any platform without the macOS 'log' utility.
+   It needs the contents of /private/var/db/diagnostics (tracev3 and
+   timesync files) and /private/var/db/uuidtext (uuidtext & dsc files
+   which hold the format strings), the same layout as a .logarchive.
+
+   A tracev3 file is a series of catalogs, each followed by the lz4
+   compressed chunksets it describes. Once its catalog is known, a
+   chunkset can be decoded on its own, so chunksets are decoded in a
+   process pool, one chunkset per task.
+'''
+
+import bisect
+import collections
+import logging
+import mmap
+import os
+import plistlib
+import re
+import struct
+import uuid
+
+import lz4.block
+
+from plugins.helpers.common import CommonFunctions
+from plugins.helpers.process_pool import ProcessPool
+
+log = logging.getLogger('MAIN.HELPERS.UNIFIEDLOG')
+
+# Chunk tags
+CHUNK_HEADER = 0x1000
+CHUNK_FIREHOSE = 0x6001
+CHUNK_OVERSIZE = 0x6002
+CHUNK_STATEDUMP = 0x6003
+CHUNK_SIMPLEDUMP = 0x6004
+CHUNK_CATALOG = 0x600b
+CHUNK_CHUNKSET = 0x600d
+
+# Firehose entry (activity) types
+ACTIVITY_ACTIVITY = 0x2
+ACTIVITY_TRACE = 0x3
+ACTIVITY_NONACTIVITY = 0x4
+ACTIVITY_SIGNPOST = 0x6
+ACTIVITY_LOSS = 0x7
+
+# Firehose entry flags
+FLAG_HAS_CURRENT_AID = 0x0001
+FLAG_HAS_UNIQUE_PID = 0x0010
+FLAG_HAS_LARGE_OFFSET = 0x0020
+FLAG_HAS_PRIVATE_DATA = 0x0100
+FLAG_HAS_SUBSYSTEM = 0x0200 # For activities, this is the 'other' activity id
+FLAG_HAS_TTL = 0x0400
+FLAG_HAS_DATA_REF = 0x0800
+FLAG_HAS_SIGNPOST_NAME = 0x8000
+
+# Formatter types (flags & 0xE), where to look for the format string
+FORMATTER_MAIN_EXE = 0x2
+FORMATTER_SHARED_CACHE = 0x4
+FORMATTER_ABSOLUTE = 0x8
+FORMATTER_UUID_RELATIVE = 0xA
+FORMATTER_LARGE_SHARED_CACHE = 0xC
+
+# Message item types
+ITEMS_NUMBER = (0x00, 0x02)
+ITEMS_PRIVATE_NUMBER = (0x01,)
+ITEMS_PRECISION = (0x10, 0x12)
+ITEMS_STRING = (0x20, 0x22, 0x40, 0x42)
+ITEMS_DATA = (0x30, 0x32, 0xF2)
+ITEMS_PRIVATE = (0x05, 0x21, 0x25, 0x31, 0x35, 0x41, 0x45, 0x85)
+
+log_types = { 0x00:'Default', 0x01:'Info', 0x02:'Debug', 0x10:'Error', 0x11:'Fault' }
+signpost_types = { 0x80:'Signpost Event', 0x81:'Signpost Start', 0x82:'Signpost End',
+                   0xC0:'Signpost Event', 0xC1:'Signpost Start', 0xC2:'Signpost End' }
+
+# Row columns, in order, as returned by the reader
+column_names = ('Time', 'Continuous_Time', 'Boot_UUID', 'Thread_ID', 'PID', 'EUID', 'Type', 'Activity_ID',
+                'Process', 'Library', 'Subsystem', 'Category', 'Message', 'Format_String', 'Source')
+
+def _UuidString(data):
+    return str(uuid.UUID(bytes=bytes(data))).upper()
+
+def _ReadCString(data, offset):
+    end = data.find(b'\0', offset)
+    if end < 0:
+        end = len(data)
+    return bytes(data[offset:end]).decode('utf8', 'backslashreplace')
+
+def _Align8(value):
+    return (value + 7) & ~7
+
+def IterChunks(data, offset=0, end=None):
+    '''Yields (tag, sub_tag, chunk_start, data_start, data_size) for each chunk.
+       Chunks are 8 byte aligned, and begin with a 16 byte preamble.'''
+    if end is None:
+        end = len(data)
+    while offset + 16 <= end:
+        tag, sub_tag, data_size = struct.unpack_from('<IIQ', data, offset)
+        if tag == 0 and data_size == 0:
+            break
+        data_start = offset + 16
+        if data_start + data_size > end:
+            log.debug('Chunk 0x{:X} @ 0x{:X} is truncated'.format(tag, offset))
+            break
+        yield tag, sub_tag, offset, data_start, data_size
+        offset = _Align8(data_start + data_size)
+
+class TimesyncDatabase:
+    '''Reads timesync files, used to convert continuous (mach) times to wall clock times.
+       Each boot has a boot record, followed by sync records with pairs of kernel & wall times.'''
+
+    def __init__(self):
+        self.boots = {} # boot_uuid : [timebase_numerator, timebase_denominator, kernel_times, wall_times]
+
+    def ReadFolder(self, folder_path):
+        for file_name in sorted(os.listdir(folder_path)):
+            if file_name.endswith('.timesync'):
+                path = os.path.join(folder_path, file_name)
+                try:
+                    with open(path, 'rb') as f:
+                        self.ReadData(f.read())
+                except (OSError, struct.error) as ex:
+                    log.error('Failed to read timesync file {}, error was {}'.format(path, str(ex)))
+        for boot in self.boots.values():
+            # keep sync records sorted by kernel time, for bisect
+            pairs = sorted(zip(boot[2], boot[3]))
+            boot[2] = [x[0] for x in pairs]
+            boot[3] = [x[1] for x in pairs]
+
+    def ReadData(self, data):
+        boot = None
+        pos = 0
+        while pos + 32 <= len(data):
+            signature = struct.unpack_from('<H', data, pos)[0]
+            if signature == 0xBBB0: # boot record
+                header_size = struct.unpack_from('<H', data, pos + 2)[0]
+                boot_uuid = _UuidString(data[pos + 8:pos + 24])
+                numerator, denominator, boot_time = struct.unpack_from('<IIq', data, pos + 24)
+                boot = self.boots.setdefault(boot_uuid, [numerator, denominator, [], []])
+                boot[2].append(0)
+                boot[3].append(boot_time)
+                pos += header_size if header_size else 48
+            elif signature == 0x7354: # 'Ts' sync record
+                kernel_time, wall_time = struct.unpack_from('<Qq', data, pos + 8)
+                if boot:
+                    boot[2].append(kernel_time)
+                    boot[3].append(wall_time)
+                pos += 32
+            else:
+                log.debug('Unknown timesync record signature 0x{:X} @ 0x{:X}'.format(signature, pos))
+                break
+
+    def GetTime(self, boot_uuid, continuous_time):
+        '''Returns nanoseconds since 1970, or None if the boot is not known'''
+        boot = self.boots.get(boot_uuid, None)
+        if not boot:
+            return None
+        numerator, denominator, kernel_times, wall_times = boot
+        index = bisect.bisect_right(kernel_times, continuous_time) - 1
+        if index < 0:
+            index = 0
+        return wall_times[index] + (continuous_time - kernel_times[index]) * numerator // denominator
+
+class UuidTextFile:
+    '''A uuidtext file has format strings for one binary, and the binary's path'''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, _, _, num_entries = struct.unpack_from('<IIII', self.data, 0)
+        if signature != 0x66778899:
+            raise ValueError('Wrong signature 0x{:X} for uuidtext file {}'.format(signature, path))
+        self.range_starts = []
+        self.ranges = [] # (range_start, size, file_offset)
+        file_offset = 16 + 8 * num_entries
+        for index in range(num_entries):
+            range_start, size = struct.unpack_from('<II', self.data, 16 + 8 * index)
+            self.ranges.append((range_start, size, file_offset))
+            file_offset += size
+        self.ranges.sort()
+        self.range_starts = [x[0] for x in self.ranges]
+        self.library_path = _ReadCString(self.data, file_offset) if file_offset < len(self.data) else ''
+
+    def GetString(self, offset):
+        index = bisect.bisect_right(self.range_starts, offset) - 1
+        if index >= 0:
+            range_start, size, file_offset = self.ranges[index]
+            if offset < range_start + size:
+                return _ReadCString(self.data, file_offset + offset - range_start)
+        return None
+
+class DscFile:
+    '''A dsc (shared cache strings) file has format strings for all libraries in a dyld shared cache'''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, major, _, num_ranges, num_uuids = struct.unpack_from('<4sHHII', self.data, 0)
+        if signature != b'hcsd':
+            raise ValueError('Wrong signature {} for dsc file {}'.format(signature, path))
+        if major >= 2:
+            range_format, uuid_format = '<QIIQ', '<QI16sI'
+        else:
+            range_format, uuid_format = '<IIII', '<II16sI'
+        range_size = struct.calcsize(range_format)
+        uuid_entry_size = struct.calcsize(uuid_format)
+        pos = 16
+        self.ranges = [] # (range_start, size, file_offset, uuid_index)
+        for _ in range(num_ranges):
+            range_start, file_offset, size, uuid_index = struct.unpack_from(range_format, self.data, pos)
+            self.ranges.append((range_start, size, file_offset, uuid_index))
+            pos += range_size
+        self.ranges.sort()
+        self.range_starts = [x[0] for x in self.ranges]
+        self.library_paths = []
+        for _ in range(num_uuids):
+            _, _, _, path_offset = struct.unpack_from(uuid_format, self.data, pos)
+            self.library_paths.append(_ReadCString(self.data, path_offset))
+            pos += uuid_entry_size
+
+    def GetString(self, offset):
+        '''Returns (format_string, library_path) or (None, '')'''
+        index = bisect.bisect_right(self.range_starts, offset) - 1
+        if index >= 0:
+            range_start, size, file_offset, uuid_index = self.ranges[index]
+            if offset < range_start + size:
+                library_path = self.library_paths[uuid_index] if uuid_index < len(self.library_paths) else ''
+                return _ReadCString(self.data, file_offset + offset - range_start), library_path
+        return None, ''
+
+class FormatStringResolver:
+    '''Looks up format strings in uuidtext & dsc files, files are opened once and cached'''
+
+    def __init__(self, uuidtext_folder):
+        self.uuidtext_folder = uuidtext_folder
+        self.uuidtext_files = {}
+        self.dsc_files = {}
+
+    def GetUuidText(self, file_uuid):
+        if file_uuid in self.uuidtext_files:
+            return self.uuidtext_files[file_uuid]
+        uuid_hex = file_uuid.replace('-', '')
+        path = os.path.join(self.uuidtext_folder, uuid_hex[0:2], uuid_hex[2:])
+        uuidtext = None
+        if os.path.exists(path):
+            try:
+                uuidtext = UuidTextFile(path)
+            except (OSError, ValueError, struct.error) as ex:
+                log.error('Failed to read uuidtext file {}, error was {}'.format(path, str(ex)))
+        self.uuidtext_files[file_uuid] = uuidtext
+        return uuidtext
+
+    def GetDsc(self, file_uuid):
+        if file_uuid in self.dsc_files:
+            return self.dsc_files[file_uuid]
+        path = os.path.join(self.uuidtext_folder, 'dsc', file_uuid.replace('-', ''))
+        dsc = None
+        if os.path.exists(path):
+            try:
+                dsc = DscFile(path)
+            except (OSError, ValueError, struct.error) as ex:
+                log.error('Failed to read dsc file {}, error was {}'.format(path, str(ex)))
+        self.dsc_files[file_uuid] = dsc
+        return dsc
+
+    def GetImagePath(self, file_uuid):
+        uuidtext = self.GetUuidText(file_uuid) if file_uuid else None
+        return uuidtext.library_path if uuidtext else ''
+
+    def GetFormatString(self, process, formatter, formatter_value, offset):
+        '''Returns (format_string, library_path), format_string is None if not found'''
+        if offset & 0x80000000: # dynamic format string
+            return '%s', self.GetImagePath(process.main_uuid)
+        if formatter in (FORMATTER_SHARED_CACHE, FORMATTER_LARGE_SHARED_CACHE):
+            dsc = self.GetDsc(process.dsc_uuid) if process.dsc_uuid else None
+            if dsc:
+                return dsc.GetString(offset)
+            return None, ''
+        if formatter == FORMATTER_UUID_RELATIVE:
+            file_uuid = formatter_value
+        elif formatter == FORMATTER_ABSOLUTE:
+            file_uuid = process.GetUuid(formatter_value)
+        else:
+            file_uuid = process.main_uuid
+        uuidtext = self.GetUuidText(file_uuid) if file_uuid else None
+        if uuidtext:
+            return uuidtext.GetString(offset), uuidtext.library_path
+        return None, ''
+
+class CatalogProcess:
+    '''Process information from a catalog'''
+
+    def __init__(self, pid, euid, main_uuid, dsc_uuid, uuids, subsystems):
+        self.pid = pid
+        self.euid = euid
+        self.main_uuid = main_uuid
+        self.dsc_uuid = dsc_uuid
+        self.uuids = uuids # catalog uuid list
+        self.subsystems = subsystems # { id : (subsystem, category) }
+
+    def GetUuid(self, catalog_uuid_index):
+        if 0 <= catalog_uuid_index < len(self.uuids):
+            return self.uuids[catalog_uuid_index]
+        return ''
+
+def ParseCatalog(data, offset, size):
+    '''Returns { (first_proc_id, second_proc_id) : CatalogProcess }'''
+    subsystem_strings_offset, proc_info_offset, num_procs, _, _ = struct.unpack_from('<HHHHH', data, offset)
+    pos = offset + 24
+    uuids = [_UuidString(data[pos + 16 * i:pos + 16 * (i + 1)]) for i in range(subsystem_strings_offset // 16)]
+    strings = bytes(data[pos + subsystem_strings_offset:pos + proc_info_offset])
+    pos += proc_info_offset
+    processes = {}
+    for _ in range(num_procs):
+        _, _, main_uuid_index, dsc_uuid_index, first_proc_id, second_proc_id, pid, euid, _, num_uuids, _ = \
+            struct.unpack_from('<HHHHQIIIIII', data, pos)
+        pos += 40 + 16 * num_uuids # uuid_info entries are not needed
+        num_subsystems = struct.unpack_from('<I', data, pos)[0]
+        pos += 8
+        subsystems = {}
+        for i in range(num_subsystems):
+            identifier, subsystem_offset, category_offset = struct.unpack_from('<HHH', data, pos + 6 * i)
+            subsystems[identifier] = (_ReadCString(strings, subsystem_offset), _ReadCString(strings, category_offset))
+        pos += _Align8(6 * num_subsystems)
+        main_uuid = uuids[main_uuid_index] if main_uuid_index < len(uuids) else ''
+        dsc_uuid = uuids[dsc_uuid_index] if dsc_uuid_index < len(uuids) else ''
+        processes[(first_proc_id, second_proc_id)] = CatalogProcess(pid, euid, main_uuid, dsc_uuid, uuids, subsystems)
+    return processes
+
+def DecompressChunkset(data):
+    '''Decompresses the lz4 blocks (bv41) of a chunkset'''
+    uncompressed = b''
+    last_uncompressed = b''
+    pos = 0
+    while pos + 8 <= len(data):
+        header = data[pos:pos + 4]
+        if header == b'bv41':
+            uncompressed_size, compressed_size = struct.unpack_from('<II', data, pos + 4)
+            last_uncompressed = lz4.block.decompress(data[pos + 12:pos + 12 + compressed_size], uncompressed_size, dict=last_uncompressed)
+            uncompressed += last_uncompressed
+            pos += 12 + compressed_size
+        elif header == b'bv4-':
+            uncompressed_size = struct.unpack_from('<I', data, pos + 4)[0]
+            last_uncompressed = data[pos + 8:pos + 8 + uncompressed_size]
+            uncompressed += last_uncompressed
+            pos += 8 + uncompressed_size
+        elif header == b'bv4$':
+            break
+        else:
+            log.warning('Unknown chunkset block header {} @ 0x{:X}'.format(header, pos))
+            break
+    return uncompressed
+
+def ReadMessageItems(data, pos, end, private_data=None):
+    '''Reads the message items (arguments for the format string).
+       Returns list of (kind, value) where kind is one of
+       'number', 'string', 'data', 'precision' or 'private'.
+    '''
+    args = []
+    if pos + 2 > end:
+        return args
+    num_items = data[pos + 1]
+    pos += 2
+    items = []
+    for _ in range(num_items):
+        if pos + 2 > end:
+            break
+        item_type, item_size = data[pos], data[pos + 1]
+        pos += 2
+        items.append((item_type, bytes(data[pos:pos + item_size])))
+        pos += item_size
+    strings = bytes(data[pos:end]) # string data follows the items
+    for item_type, value in items:
+        if item_type in ITEMS_NUMBER:
+            args.append(('number', value))
+        elif item_type in ITEMS_PRECISION:
+            args.append(('precision', int.from_bytes(value, 'little')))
+        elif item_type in ITEMS_STRING or item_type in ITEMS_DATA:
+            kind = 'data' if item_type in ITEMS_DATA else 'string'
+            if len(value) >= 4:
+                offset, size = struct.unpack('<HH', value[0:4])
+                args.append((kind, strings[offset:offset + size] if size else None))
+            else:
+                args.append((kind, None))
+        elif item_type in ITEMS_PRIVATE and private_data and len(value) >= 4:
+            offset, size = struct.unpack('<HH', value[0:4])
+            if size:
+                args.append(('data' if item_type in (0x31, 0x35) else 'string', private_data[offset:offset + size]))
+            else:
+                args.append(('private', None))
+        else: # ITEMS_PRIVATE_NUMBER or private strings (with no private data)
+            args.append(('private', None))
+    return args
+
+format_specifier_regex = re.compile(r"%(\{[^}]*\})?([-+ #0']*)(\*|\d+)?(?:\.(\*|\d+))?(hh|h|ll|l|q|j|z|t|L)?([diouxXeEfFgGaAcCsSpP@%m])")
+
+def _FormatNumber(value, annotation, flags, width, precision, conversion):
+    size = len(value)
+    number = int.from_bytes(value, 'little')
+    if conversion in 'di':
+        if size and number >= 1 << (size * 8 - 1):
+            number -= 1 << (size * 8)
+    if 'BOOL' in annotation:
+        return 'YES' if number else 'NO'
+    if 'bool' in annotation:
+        return 'true' if number else 'false'
+    if 'time_t' in annotation:
+        return str(CommonFunctions.ReadUnixTime(number))
+    if 'errno' in annotation:
+        return '[{}: {}]'.format(number, os.strerror(number))
+    if conversion in 'eEfFgGaA':
+        if size == 8:
+            number = struct.unpack('<d', value)[0]
+        elif size == 4:
+            number = struct.unpack('<f', value)[0]
+        conversion = 'f' if conversion in 'aA' else conversion
+    elif conversion == 'p':
+        return '0x{:x}'.format(number)
+    elif conversion in 'cC':
+        return chr(number) if number < 0x110000 else ''
+    elif conversion == 'u':
+        conversion = 'd'
+    spec = '%' + flags + (width or '') + ('.' + precision if precision else '') + conversion
+    try:
+        return spec % number
+    except (TypeError, ValueError):
+        return str(number)
+
+def FormatMessage(format_string, args):
+    '''Formats a printf style os_log format string with the message items'''
+    args = collections.deque(args)
+
+    def Substitute(match):
+        annotation, flags, width, precision, _, conversion = match.groups()
+        if conversion == '%':
+            return '%'
+        if conversion == 'm': # errno, no argument
+            return '%m'
+        flags = flags.replace("'", '')
+        if width == '*':
+            width = str(args.popleft()[1]) if args and args[0][0] == 'precision' else ''
+        if precision == '*':
+            precision = str(args.popleft()[1]) if args and args[0][0] == 'precision' else ''
+        while args and args[0][0] == 'precision' and conversion not in 'sS@P':
+            args.popleft()
+        if not args:
+            return '<decode: missing data>'
+        kind, value = args.popleft()
+        if kind == 'private':
+            return '<private>'
+        if kind == 'precision': # precision for a %.*P or %.*s
+            if not args:
+                return '<decode: missing data>'
+            precision = str(value)
+            kind, value = args.popleft()
+            if kind == 'private':
+                return '<private>'
+        annotation = annotation or ''
+        if value is None:
+            return '(null)'
+        if kind == 'number':
+            return _FormatNumber(value, annotation, flags, width, precision, conversion)
+        if kind == 'data' or conversion == 'P':
+            if 'uuid_t' in annotation and len(value) == 16:
+                return _UuidString(value)
+            return value.hex().upper()
+        text = value.rstrip(b'\0').decode('utf8', 'backslashreplace')
+        if precision and precision.isdigit():
+            text = text[:int(precision)]
+        if width and width.isdigit():
+            text = text.ljust(int(width)) if '-' in flags else text.rjust(int(width))
+        return text
+
+    return format_specifier_regex.sub(Substitute, format_string)
+
+class ChunksetTask:
+    '''All that is needed to decode a chunkset, sent to the worker processes'''
+
+    def __init__(self, tracev3_path, source, offset, size, boot_uuid, timebase, processes):
+        self.tracev3_path = tracev3_path
+        self.source = source
+        self.offset = offset
+        self.size = size
+        self.boot_uuid = boot_uuid
+        self.timebase = timebase # (numerator, denominator)
+        self.processes = processes
+
+class TraceV3File:
+    '''Reads the header & catalogs of a tracev3 file, to create a task for each chunkset'''
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.boot_uuid = ''
+        self.timebase = (1, 1)
+
+    def _ReadHeader(self, data, data_start, data_size):
+        numerator, denominator = struct.unpack_from('<II', data, data_start)
+        if numerator and denominator:
+            self.timebase = (numerator, denominator)
+        pos = data_start + 40
+        end = data_start + data_size
+        while pos + 8 <= end:
+            sub_tag, sub_size = struct.unpack_from('<II', data, pos)
+            if sub_tag == 0x6102 and sub_size >= 16:
+                self.boot_uuid = _UuidString(data[pos + 8:pos + 24])
+            pos += 8 + sub_size
+
+    def IterTasks(self):
+        '''Yields ChunksetTask objects'''
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        processes = {}
+        for tag, _, chunk_start, data_start, data_size in IterChunks(data):
+            if tag == CHUNK_HEADER:
+                self._ReadHeader(data, data_start, data_size)
+            elif tag == CHUNK_CATALOG:
+                try:
+                    processes = ParseCatalog(data, data_start, data_size)
+                except (struct.error, IndexError) as ex:
+                    log.error('Failed to read catalog @ 0x{:X} in {}, error was {}'.format(chunk_start, self.source, str(ex)))
+                    processes = {}
+            elif tag == CHUNK_CHUNKSET:
+                yield ChunksetTask(self.path, self.source, data_start, data_size, self.boot_uuid, self.timebase, processes)
+            else:
+                log.debug('Skipping chunk 0x{:X} @ 0x{:X} in {}'.format(tag, chunk_start, self.source))
+
+unknown_process = CatalogProcess(0, 0, '', '', [], {})
+
+class ChunksetDecoder:
+    '''Decodes the log entries of one chunkset into rows (see column_names)'''
+
+    def __init__(self, task, resolver, timesync):
+        self.task = task
+        self.resolver = resolver
+        self.timesync = timesync
+        self.oversize = {} # (first_proc_id, second_proc_id, data_ref) : (args)
+        self.rows = []
+
+    def GetTime(self, continuous_time):
+        nano_seconds = self.timesync.GetTime(self.task.boot_uuid, continuous_time) if self.timesync else None
+        return CommonFunctions.ReadAPFSTime(nano_seconds) if nano_seconds else ''
+
+    def AddRow(self, continuous_time, thread_id, process, log_type, activity_id, library,
+               subsystem_id, message, format_string):
+        subsystem, category = process.subsystems.get(subsystem_id, ('', '')) if subsystem_id is not None else ('', '')
+        self.rows.append([self.GetTime(continuous_time), continuous_time, self.task.boot_uuid, thread_id,
+                          process.pid, process.euid, log_type, activity_id,
+                          self.resolver.GetImagePath(process.main_uuid), library, subsystem, category,
+                          message, format_string, self.task.source])
+
+    def Decode(self, data):
+        chunks = list(IterChunks(data))
+        # Oversize entries hold the message items for firehose entries with a data_ref
+        for tag, _, _, data_start, data_size in chunks:
+            if tag == CHUNK_OVERSIZE:
+                self.ReadOversize(data, data_start, data_size)
+        for tag, _, chunk_start, data_start, data_size in chunks:
+            try:
+                if tag == CHUNK_FIREHOSE:
+                    self.ReadFirehose(data, data_start, data_size)
+                elif tag == CHUNK_SIMPLEDUMP:
+                    self.ReadSimpledump(data, data_start)
+                elif tag == CHUNK_STATEDUMP:
+                    self.ReadStatedump(data, data_start)
+            except (struct.error, IndexError, ValueError) as ex:
+                log.error('Error reading chunk 0x{:X} @ 0x{:X} in chunkset @ 0x{:X} of {}, error was {}'.format(
+                            tag, chunk_start, self.task.offset, self.task.source, str(ex)))
+        return self.rows
+
+    def ReadOversize(self, data, pos, size):
+        first_proc_id, second_proc_id = struct.unpack_from('<QI', data, pos)
+        data_ref, public_size, private_size = struct.unpack_from('<IHH', data, pos + 24)
+        start = pos + 32
+        private_data = bytes(data[start + public_size:start + public_size + private_size]) if private_size else None
+        self.oversize[(first_proc_id, second_proc_id, data_ref)] = ReadMessageItems(data, start, start + public_size, private_data)
+
+    def ReadFirehose(self, data, pos, size):
+        first_proc_id, second_proc_id = struct.unpack_from('<QI', data, pos)
+        public_data_size, private_data_virtual_offset = struct.unpack_from('<HH', data, pos + 16)
+        base_continuous_time = struct.unpack_from('<Q', data, pos + 24)[0]
+        process = self.task.processes.get((first_proc_id, second_proc_id), unknown_process)
+        private_data = None
+        if private_data_virtual_offset and private_data_virtual_offset < 0x1000:
+            private_size = 0x1000 - private_data_virtual_offset
+            private_data = bytes(data[pos + size - private_size:pos + size])
+        entry_pos = pos + 32
+        end = pos + 16 + public_data_size
+        while entry_pos + 24 <= end:
+            activity_type, log_type, flags, format_location, thread_id, time_delta, time_delta_upper, data_size = \
+                struct.unpack_from('<BBHIQIHH', data, entry_pos)
+            if activity_type == 0:
+                break
+            continuous_time = base_continuous_time + (time_delta | (time_delta_upper << 32))
+            entry_data_start = entry_pos + 24
+            self.ReadFirehoseEntry(data, entry_data_start, entry_data_start + data_size, process, first_proc_id, second_proc_id,
+                                   activity_type, log_type, flags, format_location, thread_id, continuous_time,
+                                   private_data, private_data_virtual_offset)
+            entry_pos = pos + 32 + _Align8(entry_data_start + data_size - pos - 32)
+
+    def _ReadFormatter(self, data, pos, flags):
+        '''Returns (pos, formatter, formatter_value, large_offset)'''
+        formatter = flags & 0xE
+        formatter_value = None
+        large_offset = 0
+        if formatter in (FORMATTER_MAIN_EXE, FORMATTER_SHARED_CACHE):
+            if flags & FLAG_HAS_LARGE_OFFSET:
+                large_offset = struct.unpack_from('<H', data, pos)[0] << 31
+                pos += 2
+        elif formatter == FORMATTER_ABSOLUTE:
+            formatter_value = struct.unpack_from('<H', data, pos)[0]
+            pos += 2
+        elif formatter == FORMATTER_UUID_RELATIVE:
+            formatter_value = _UuidString(data[pos:pos + 16])
+            pos += 16
+        elif formatter == FORMATTER_LARGE_SHARED_CACHE:
+            if flags & FLAG_HAS_LARGE_OFFSET:
+                pos += 2
+            large_offset = (struct.unpack_from('<H', data, pos)[0] >> 1) << 28
+            pos += 2
+        return pos, formatter, formatter_value, large_offset
+
+    def ReadFirehoseEntry(self, data, pos, end, process, first_proc_id, second_proc_id, activity_type, log_type, flags,
+                          format_location, thread_id, continuous_time, private_data, private_data_virtual_offset):
+        activity_id = 0
+        subsystem_id = None
+        entry_private_data = None
+        if activity_type == ACTIVITY_LOSS:
+            _, _, count = struct.unpack_from('<QQQ', data, pos)
+            self.AddRow(continuous_time, thread_id, process, 'Loss', 0, '', None,
+                        'lost {} unreliable messages'.format(count), '')
+            return
+        if activity_type == ACTIVITY_ACTIVITY:
+            if log_type != 0x3: # not a useraction
+                activity_id = struct.unpack_from('<I', data, pos)[0]
+                pos += 8
+            if flags & FLAG_HAS_UNIQUE_PID:
+                pos += 8
+            if flags & FLAG_HAS_CURRENT_AID:
+                pos += 8
+            if flags & FLAG_HAS_SUBSYSTEM: # other_aid for activities
+                pos += 8
+        elif activity_type in (ACTIVITY_NONACTIVITY, ACTIVITY_SIGNPOST):
+            if flags & FLAG_HAS_CURRENT_AID:
+                activity_id = struct.unpack_from('<I', data, pos)[0]
+                pos += 8
+            if flags & FLAG_HAS_PRIVATE_DATA:
+                private_offset, private_size = struct.unpack_from('<HH', data, pos)
+                pos += 4
+                if private_data is not None:
+                    start = private_offset - private_data_virtual_offset
+                    entry_private_data = private_data[start:start + private_size]
+        pos += 4 # pc
+        pos, formatter, formatter_value, large_offset = self._ReadFormatter(data, pos, flags)
+        args = []
+        if activity_type in (ACTIVITY_NONACTIVITY, ACTIVITY_SIGNPOST):
+            if flags & FLAG_HAS_SUBSYSTEM:
+                subsystem_id = struct.unpack_from('<H', data, pos)[0]
+                pos += 2
+            if activity_type == ACTIVITY_SIGNPOST:
+                pos += 8 # signpost id
+                if flags & FLAG_HAS_SIGNPOST_NAME:
+                    pos += 4
+            if flags & FLAG_HAS_TTL:
+                pos += 1
+            if flags & FLAG_HAS_DATA_REF:
+                data_ref = struct.unpack_from('<H', data, pos)[0]
+                pos += 2
+                args = self.oversize.get((first_proc_id, second_proc_id, data_ref), None)
+                if args is None:
+                    log.debug('Oversize data {} not found in chunkset @ 0x{:X} of {}'.format(data_ref, self.task.offset, self.task.source))
+                    args = []
+            else:
+                args = ReadMessageItems(data, pos, end, entry_private_data)
+        format_string, library = self.resolver.GetFormatString(process, formatter, formatter_value, format_location | large_offset)
+        if format_string is None:
+            message = '<decode: format string not found @ 0x{:X}>'.format(format_location | large_offset)
+            format_string = ''
+        else:
+            message = FormatMessage(format_string, args)
+        if activity_type == ACTIVITY_NONACTIVITY:
+            type_name = log_types.get(log_type, 'Unknown 0x{:X}'.format(log_type))
+        elif activity_type == ACTIVITY_SIGNPOST:
+            type_name = signpost_types.get(log_type, 'Signpost')
+        elif activity_type == ACTIVITY_ACTIVITY:
+            type_name = 'Activity'
+        else:
+            type_name = 'Trace'
+        self.AddRow(continuous_time, thread_id, process, type_name, activity_id, library, subsystem_id, message, format_string)
+
+    def ReadSimpledump(self, data, pos):
+        first_proc_id, second_proc_id, continuous_time, thread_id = struct.unpack_from('<QQQQ', data, pos)
+        subsystem_size, message_size = struct.unpack_from('<II', data, pos + 76)
+        subsystem = _ReadCString(data[pos + 84:pos + 84 + subsystem_size], 0)
+        message = _ReadCString(data[pos + 84 + subsystem_size:pos + 84 + subsystem_size + message_size], 0)
+        process = self.task.processes.get((first_proc_id, second_proc_id & 0xFFFFFFFF), unknown_process)
+        sender_uuid = _UuidString(data[pos + 40:pos + 56])
+        self.rows.append([self.GetTime(continuous_time), continuous_time, self.task.boot_uuid, thread_id,
+                          process.pid, process.euid, 'Simpledump', 0,
+                          self.resolver.GetImagePath(process.main_uuid), self.resolver.GetImagePath(sender_uuid),
+                          subsystem, '', message, '', self.task.source])
+
+    def ReadStatedump(self, data, pos):
+        first_proc_id, second_proc_id = struct.unpack_from('<QI', data, pos)
+        continuous_time, activity_id = struct.unpack_from('<QQ', data, pos + 16)
+        data_type, data_size = struct.unpack_from('<II', data, pos + 48)
+        title = _ReadCString(data[pos + 184:pos + 248], 0)
+        state_data = bytes(data[pos + 248:pos + 248 + data_size])
+        if data_type == 1: # plist
+            try:
+                state = str(plistlib.loads(state_data))
+            except (plistlib.InvalidFileException, ValueError):
+                state = state_data.hex().upper()
+        elif data_type == 3: # object
+            state = _ReadCString(state_data, 0)
+        else: # protobuf
+            state = state_data.hex().upper()
+        process = self.task.processes.get((first_proc_id, second_proc_id), unknown_process)
+        self.AddRow(continuous_time, 0, process, 'Statedump', activity_id, '', None,
+                    '{}: {}'.format(title, state) if title else state, '')
+
+# Per process state in the pool, set up once by _InitWorker
+_worker_resolver = None
+_worker_timesync = None
+
+def _InitWorker(uuidtext_folder, timesync):
+    global _worker_resolver
+    global _worker_timesync
+    _worker_resolver = FormatStringResolver(uuidtext_folder)
+    _worker_timesync = timesync
+
+def DecodeChunkset(task):
+    '''Decodes one chunkset, returns list of rows. This runs in the worker processes.'''
+    try:
+        with open(task.tracev3_path, 'rb') as f:
+            f.seek(task.offset)
+            data = DecompressChunkset(f.read(task.size))
+    except (OSError, struct.error, lz4.block.LZ4BlockError) as ex:
+        log.error('Failed to decompress chunkset @ 0x{:X} of {}, error was {}'.format(task.offset, task.source, str(ex)))
+        return []
+    return ChunksetDecoder(task, _worker_resolver, _worker_timesync).Decode(data)
+
+class UnifiedLogReader:
+    '''Reads all tracev3 files from a folder laid out like a .logarchive, ie, with
+       the contents of /private/var/db/diagnostics & /private/var/db/uuidtext merged.
+    '''
+    tracev3_folders = ('Persist', 'Special', 'Signpost', 'HighVolume')
+
+    def __init__(self, logs_folder, max_workers=None):
+        self.logs_folder = logs_folder
+        self.max_workers = max_workers if max_workers else os.cpu_count()
+        self.timesync = TimesyncDatabase()
+
+    def GetTraceV3Files(self):
+        '''Returns list of (path, source) where source is path relative to logs folder'''
+        files = []
+        for folder_name in self.tracev3_folders:
+            folder_path = os.path.join(self.logs_folder, folder_name)
+            if os.path.isdir(folder_path):
+                for file_name in sorted(os.listdir(folder_path)):
+                    if file_name.endswith('.tracev3'):
+                        files.append((os.path.join(folder_path, file_name), folder_name + '/' + file_name))
+        for file_name in sorted(os.listdir(self.logs_folder)):
+            if file_name.endswith('.tracev3'): # logdata.LiveData.tracev3
+                files.append((os.path.join(self.logs_folder, file_name), file_name))
+        return files
+
+    def IterTasks(self):
+        for path, source in self.GetTraceV3Files():
+            try:
+                yield from TraceV3File(path, source).IterTasks()
+            except (OSError, struct.error) as ex:
+                log.error('Failed to read tracev3 file {}, error was {}'.format(path, str(ex)))
+
+    def IterRows(self):
+        '''Yields list of rows for each chunkset, in file order'''
+        timesync_folder = os.path.join(self.logs_folder, 'timesync')
+        if os.path.isdir(timesync_folder):
+            self.timesync.ReadFolder(timesync_folder)
+        else:
+            log.warning('timesync folder not found, log times will be blank')
+        if self.max_workers > 1:
+            max_pending = self.max_workers * 4
+            with ProcessPool(self.max_workers, _InitWorker, (self.logs_folder, self.timesync)) as executor:
+                pending = collections.deque()
+                for task in self.IterTasks():
+                    pending.append(executor.submit(DecodeChunkset, task))
+                    if len(pending) >= max_pending:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+        else:
+            _InitWorker(self.logs_folder, self.timesync)
+            for task in self.IterTasks():
+                yield DecodeChunkset(task)
@@ -7,19 +7,35 @@
    
 '''
 
+import atexit
 import binascii
 import collections
 import csv
-import jsonlines
+import datetime
+import gzip
+import json
 import logging
 import os
+import queue
 import sqlite3
 import sys
-import xlsxwriter
+import threading
+import time
 
 from enum import IntEnum
 from plugins.helpers.common import *
 
+# These are slow to import and only needed for some output types
+xlsxwriter = LazyImport('xlsxwriter')
+pyarrow = LazyImport('pyarrow') # Optional, only for parquet output
+pyarrow_parquet = LazyImport('pyarrow.parquet')
+
+try:
+    import zstandard # Optional, for zstd compressed JSONL output
+    zstandard_available = True
+except ImportError:
+    zstandard_available = False
+
 log = logging.getLogger('MAIN.HELPERS.WRITER')
 
 class DataType(IntEnum):
@@ -37,6 +53,11 @@ class DataWriter:
         if self.tsv: self.tsv_writer.Cleanup()
         if self.sql: self.sql_writer.CloseDb()
         if self.jsonl: self.jsonl_writer.Cleanup()
+        if self.parquet: self.parquet_writer.Cleanup()
+
+    def EndBatch(self):
+        '''Called at end of each batch of rows from ChunkedDataWriter'''
+        if self.parquet: self.parquet_writer.EndBatch()
 
     def __init__(self, output_params, name, column_info, artifact_source=''):
         '''
@@ -67,13 +88,16 @@ class DataWriter:
         self.xlsx_writer = None
         self.sql = False
         self.sql_writer = None
+        self.parquet = False
+        self.parquet_writer = None
+        self.xlsx_deferred = False
         self.sql_db_path = output_params.output_db_path
         self.cols_with_blobs = None
+        self.run_manifest = output_params.run_manifest
 
         if output_params.write_sql:
             self.sql = True
-            self.sql_writer = SqliteWriter()
-            self.sql_writer.OpenSqliteDb(self.sql_db_path)
+            self.sql_writer = SharedSqliteWriter(self.sql_db_path)
         if output_params.write_csv:
             self.csv = True
             self.csv_writer = CsvWriter()
@@ -84,11 +108,18 @@ class DataWriter:
             self.tsv_writer.CreateCsvFile(os.path.join(self.output_path, name + ".tsv"))
         if output_params.write_jsonl:
             self.jsonl = True
-            self.jsonl_writer = JsonlWriter()
+            self.jsonl_writer = JsonlWriter(compression=output_params.jsonl_compression)
             self.jsonl_writer.CreateJsonlFile(os.path.join(self.output_path, name + ".jsonl"))
         if output_params.write_xlsx:
             self.xlsx = True
             self.xlsx_writer = output_params.xlsx_writer
+            if self.xlsx_writer.deferred and self.sql:
+                self.xlsx = False # Sheet is created from the sqlite table at the end
+                self.xlsx_deferred = True
+        if output_params.write_parquet:
+            self.parquet = True
+            self.parquet_writer = ParquetWriter()
+            self.parquet_writer.CreateParquetFile(os.path.join(self.output_path, name + ".parquet"))
 
         self.column_info = collections.OrderedDict(column_info)
         self.column_info_extra_keywords = {} #key=index, value=keyword
@@ -116,16 +147,22 @@ class DataWriter:
     def WriteHeaders(self):
         '''Writes Headings for csv/tsv/jsonl, creates Table for sqlite, creates Sheet for XLSX'''
         if self.csv:
-            self.csv_writer.WriteRow(self.column_info)
+            self.csv_writer.AddHeaders(self.column_info)
         if self.tsv:
-            self.tsv_writer.WriteRow(self.column_info)
+            self.tsv_writer.AddHeaders(self.column_info)
         if self.sql:
             self.sql_writer.CreateTable(self.column_info, self.name, self.column_info_extra_keywords)
+        if self.run_manifest:
+            self.run_manifest.RecordOutput(self.name, self.sql_writer.table_name if self.sql else '', self.column_info, self.sql_db_path)
         if self.jsonl:
             self.jsonl_writer.AddHeaders(self.column_info)
+        if self.parquet:
+            self.parquet_writer.AddHeaders(self.column_info)
         if self.xlsx:
             self.xlsx_writer.CreateSheet(self.name)
             self.xlsx_writer.AddHeaders(self.column_info)
+        elif self.xlsx_deferred:
+            self.xlsx_writer.AddDeferredSheet(self.name, self.sql_db_path, self.sql_writer.table_name, self.column_info)
 
     def BlobToHex(self, blob):
         '''Convert binary data to hex text'''
@@ -153,6 +190,8 @@ class DataWriter:
                     self.sql_writer.WriteRow(row_copy)
                 else:
                     self.sql_writer.WriteRow(row)
+            if self.parquet: # Copies values, so before blobs are modified below
+                self.parquet_writer.WriteRow(row)
             if self.csv or self.tsv or self.jsonl or self.xlsx: # This routine modifies row
                 if self.cols_with_blobs:
                     for col_name, index in self.cols_with_blobs:
@@ -172,6 +211,8 @@ class DataWriter:
                         row_copy[index] = bytes(row_copy[index]) if row_copy[index] else b''
                     self.sql_writer.WriteRow(row_copy)
                 else: self.sql_writer.WriteRow(list_to_write)
+            if self.parquet:
+                self.parquet_writer.WriteRow(list_to_write)
             if self.csv or self.tsv or self.jsonl or self.xlsx:
                 if self.cols_with_blobs:
                     for col_name, index in self.cols_with_blobs:
@@ -203,6 +244,8 @@ class DataWriter:
                     self.sql_writer.WriteRows(rows_copy)
                 else:
                     self.sql_writer.WriteRows(rows)
+            if self.parquet: # Copies values, so before blobs are modified below
+                self.parquet_writer.WriteRows(rows)
             if self.csv or self.tsv or self.jsonl or self.xlsx: # This routine modifies rows
                 if self.cols_with_blobs:
                     for row in rows:
@@ -230,6 +273,8 @@ class DataWriter:
                     self.sql_writer.WriteRows(rows_copy)
                 else:
                     self.sql_writer.WriteRows(list_to_write)
+            if self.parquet:
+                self.parquet_writer.WriteRows(list_to_write)
             if self.csv or self.tsv or self.jsonl or self.xlsx: # This routine modifies list_to_write
                 if self.cols_with_blobs:
                     for list_row in list_to_write:
@@ -248,6 +293,8 @@ class SqliteWriter:
         self.asynchronous = asynchronous # Async mode is quite limited, only works for db with single table!
         self.async_buffer = []
         self.async_buffer_max = 100000
+        self.async_flush_interval = 5 # seconds, buffered rows older than this are written on next write
+        self.async_last_flush = time.time()
         self.table_names = []
         self.table_name  = ''
         self.column_infos = []
@@ -261,6 +308,10 @@ class SqliteWriter:
         try:
             self.conn = sqlite3.connect(self.filepath)
             #self.conn.execute('PRAGMA SYNCHRONOUS=OFF;') # slightly faster!
+            if self.asynchronous:
+                # WAL keeps committed batches safe if we crash, with far fewer fsyncs per commit
+                self.conn.execute('PRAGMA journal_mode=WAL')
+                self.conn.execute('PRAGMA synchronous=NORMAL')
         except (OSError, sqlite3.Error) as ex:
             log.error('Failed to open/create sqlite db at path {}'.format(filepath))
             log.exception('Error details')
@@ -283,10 +334,10 @@ class SqliteWriter:
             new_name = name + '_{0:02d}'.format(index)
         return new_name
 
-    def RunQuery(self, query, writing=False, return_named_objects=False):
+    def RunQuery(self, query, writing=False, return_named_objects=False, params=()):
         '''Execute a query on the database and return results.
            If this is an INSERT/UPDATE/CREATE query, then set writing=true 
-           which internally calls commit().
+           which internally calls commit(). params are bound to the ? in query.
            Return value is tuple (success, cursor, error_message)
         '''
         cursor = None
@@ -296,7 +347,7 @@ class SqliteWriter:
             if return_named_objects: 
                 self.conn.row_factory = sqlite3.Row
             cursor = self.conn.cursor()
-            cursor = self.conn.execute(query)
+            cursor = self.conn.execute(query, params)
             if writing: 
                 self.conn.commit()
             success = True
@@ -365,15 +416,14 @@ class SqliteWriter:
                     cursor.execute(query)
                     self.conn.commit()
                     self.executemany_query = self._CraftExecuteManyQuery(self.table_name, column_info, column_info_extra_keywords)
-                    return
                 except sqlite3.Error as ex:
                     log.error(str(ex))
                     log.exception("error creating table " + self.table_name)
                     raise ex
-                    return
-            log.error(str(ex))
-            log.exception("error creating table " + self.table_name)
-            raise ex
+            else:
+                log.error(str(ex))
+                log.exception("error creating table " + self.table_name)
+                raise ex
         self.table_names.append(self.table_name)
         self.column_infos.append(self.column_info)
         self.executemany_querys.append(self.executemany_query)
@@ -386,18 +436,22 @@ class SqliteWriter:
         '''
         self.WriteRows([row], table_name)
 
-    def WriteRows(self, rows, table_name=None):
+    def WriteRows(self, rows, table_name=None, commit=True):
         '''Write rows to db, where row is tuple or list of 'tuple or list' (in order).
            If a table_name is supplied, it will use the query (column_info) for 
-           that table, else it will use the last created table's column_info
+           that table, else it will use the last created table's column_info.
+           If commit=False, caller is responsible for calling Commit() later.
         '''
         if self.asynchronous:
             self.async_buffer.extend(rows)
-            if len(self.async_buffer) <= self.async_buffer_max:
+            now = time.time()
+            if len(self.async_buffer) <= self.async_buffer_max and \
+                (now - self.async_last_flush) < self.async_flush_interval:
                 return
             else:
                 rows = self.async_buffer
                 self.async_buffer = []
+                self.async_last_flush = now
         try:
             cursor = self.conn.cursor()
             query = self.executemany_query
@@ -409,12 +463,19 @@ class SqliteWriter:
                     log.exception("Could not find table name {}".format(table_name))
                     raise ex
             cursor.executemany(query, rows)
-            self.conn.commit()
+            if commit:
+                self.conn.commit()
         except (sqlite3.Error, OverflowError) as ex:
             log.error(str(ex))
             log.exception("error writing to table " + table_name if table_name else self.table_name)
             #raise ex
 
+    def Commit(self):
+        try:
+            self.conn.commit()
+        except sqlite3.Error as ex:
+            log.exception("error committing to db " + self.filepath)
+
     def CloseDb(self):
         if self.conn != None:
             if self.async_buffer:
@@ -427,6 +488,210 @@ class SqliteWriter:
         if self.conn != None:
             raise ValueError('SqliteWriter destructor, Dear coder, you forgot to close db.')
 
+class FetchedRowsCursor:
+    '''Cursor-like object holding rows already fetched from a query, for
+       returning results from the writer service thread, as the sqlite
+       cursor itself cannot be used from other threads.
+    '''
+    def __init__(self, rows, description):
+        self.rows = rows
+        self.description = description
+        self.rowcount = -1
+        self.pos = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def fetchone(self):
+        if self.pos < len(self.rows):
+            self.pos += 1
+            return self.rows[self.pos - 1]
+        return None
+
+    def fetchmany(self, size=1):
+        rows = self.rows[self.pos:self.pos + size]
+        self.pos += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.rows[self.pos:]
+        self.pos = len(self.rows)
+        return rows
+
+    def close(self):
+        self.rows = []
+        self.pos = 0
+
+class SqliteWriterService:
+    '''Owns the one connection to an output sqlite db (like mac_apt.db) that is
+       shared by all DataWriters writing to it. Requests are queued and run on
+       a background thread, rows are committed in large transactions, so
+       plugins don't wait on sqlite I/O. Use GetService() to get the instance.
+    '''
+    _services = {} # { db_path : SqliteWriterService }
+    _services_lock = threading.Lock()
+    max_queued_requests = 64
+    max_queued_rows = 500000 # Bounded, so a fast plugin cannot fill up memory with rows not yet written
+    max_rows_per_transaction = 500000
+
+    @classmethod
+    def GetService(cls, db_path):
+        with cls._services_lock:
+            service = cls._services.get(db_path, None)
+            if service is None:
+                if not cls._services:
+                    atexit.register(cls.StopAll) # daemon thread, rows must not be lost at exit
+                service = SqliteWriterService(db_path)
+                cls._services[db_path] = service
+            return service
+
+    @classmethod
+    def StopAll(cls):
+        '''Writes all pending rows and closes all dbs, waits till done'''
+        with cls._services_lock:
+            services = list(cls._services.values())
+            cls._services = {}
+        for service in services:
+            service.Stop()
+
+    @classmethod
+    def StopService(cls, db_path):
+        '''Writes all pending rows and closes the db, waits till done. 
+           For dbs not written to any more, so the thread & connection are released.'''
+        with cls._services_lock:
+            service = cls._services.pop(db_path, None)
+        if service:
+            service.Stop()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.requests = queue.Queue(self.max_queued_requests)
+        self.queued_rows = 0 # Rows in write requests not yet written
+        self.queued_rows_changed = threading.Condition()
+        self.writer = SqliteWriter() # Only used from the background thread
+        self.thread = threading.Thread(target=self._Run, name='SqliteWriterService', daemon=True)
+        self.thread.start()
+
+    def _Run(self):
+        rows_in_transaction = 0
+        try:
+            self.writer.OpenSqliteDb(self.db_path)
+        except (OSError, sqlite3.Error):
+            self.writer.conn = None
+        while True:
+            request, args, reply = self.requests.get()
+            result = None
+            try:
+                if self.writer.conn is None:
+                    raise sqlite3.OperationalError('Failed to open sqlite db at path {}'.format(self.db_path))
+                if request == 'write':
+                    self.writer.WriteRows(args[1], args[0], commit=False)
+                    rows_in_transaction += len(args[1])
+                elif request == 'create': # This commits too
+                    result = self.writer.CreateTable(*args)
+                    rows_in_transaction = 0
+                elif request in ('commit', 'stop'):
+                    self.writer.Commit()
+                    rows_in_transaction = 0
+                elif request == 'query': # This commits too
+                    success, cursor, error_message = self.writer.RunQuery(args[0], True, args[1])
+                    result = (success, FetchedRowsCursor(cursor.fetchall(), cursor.description) if success else None, error_message)
+                    self.writer.conn.row_factory = None
+                    rows_in_transaction = 0
+                if rows_in_transaction >= self.max_rows_per_transaction:
+                    self.writer.Commit()
+                    rows_in_transaction = 0
+            except (sqlite3.Error, ValueError) as ex:
+                result = ex
+            if request == 'write':
+                with self.queued_rows_changed:
+                    self.queued_rows -= len(args[1])
+                    self.queued_rows_changed.notify_all()
+            if reply:
+                reply.put(result)
+            elif isinstance(result, Exception):
+                log.error('Error in sqlite writer service for {}: {}'.format(self.db_path, str(result)))
+            if request == 'stop':
+                self.writer.CloseDb()
+                break
+
+    def _Request(self, request, args=None, wait=False):
+        '''Queue request, if wait=True, wait for and return its result'''
+        reply = queue.Queue(1) if wait else None
+        self.requests.put((request, args, reply))
+        if wait:
+            result = reply.get()
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+    def CreateTable(self, column_info, table_name, column_info_extra_keywords=None):
+        '''Returns actual table name created (may be different if table_name existed)'''
+        return self._Request('create', (collections.OrderedDict(column_info), table_name, column_info_extra_keywords), True)
+
+    def WriteRows(self, rows, table_name):
+        '''Queues rows to be written, waits if too many rows are queued already'''
+        num_rows = len(rows)
+        with self.queued_rows_changed:
+            # A batch larger than max_queued_rows is let through when nothing else is queued
+            self.queued_rows_changed.wait_for(lambda: self.queued_rows == 0 or \
+                                                self.queued_rows + num_rows <= self.max_queued_rows)
+            self.queued_rows += num_rows
+        # Copy the rows, as caller may clear/reuse them before they are written
+        self._Request('write', (table_name, [tuple(row) for row in rows]))
+
+    def Commit(self, wait=False):
+        self._Request('commit', None, wait)
+
+    def RunQuery(self, query, return_named_objects=False):
+        '''Runs query after all rows queued before it are written, and commits.
+           Returns tuple (success, FetchedRowsCursor, error_message)'''
+        return self._Request('query', (query, return_named_objects), True)
+
+    def Stop(self):
+        if self.thread.is_alive():
+            self._Request('stop', None, True)
+            self.thread.join()
+
+class SharedSqliteWriter:
+    '''Same interface as SqliteWriter (as used by DataWriter) for writing a 
+       single table, but writes via the SqliteWriterService for the db'''
+    def __init__(self, db_path):
+        self.filepath = db_path
+        self.service = SqliteWriterService.GetService(db_path)
+        self.table_name = ''
+
+    def CreateTable(self, column_info, table_name, column_info_extra_keywords=None):
+        self.table_name = self.service.CreateTable(column_info, table_name, column_info_extra_keywords)
+        return self.table_name
+
+    def WriteRow(self, row):
+        self.WriteRows([row])
+
+    def WriteRows(self, rows):
+        self.service.WriteRows(rows, self.table_name)
+
+    def Commit(self, wait=False):
+        '''Commit rows written so far, if wait=True, wait till they are in the db'''
+        self.service.Commit(wait)
+
+    def RunQuery(self, query, writing=False, return_named_objects=False):
+        '''Same as SqliteWriter.RunQuery(), the cursor returned holds all
+           result rows. The query always runs after the rows already
+           written, and is always committed.'''
+        return self.service.RunQuery(query, return_named_objects)
+
+    def CloseDb(self):
+        '''Nothing to close, the connection is shared. Rows written get committed.'''
+        if self.table_name:
+            self.service.Commit()
+
 class CsvWriter:
     def __init__(self, delete_empty_files=True, is_tsv=False):
         self.filepath = ''
@@ -438,6 +703,7 @@ class CsvWriter:
             self.pycsv_writer = None
         self.file_handle = None
         self.delete_empty_files = delete_empty_files # perhaps a useful option?
+        self.tsv_converters = None # Per column functions, set in AddHeaders()
     
     def CreateCsvFile(self, filepath):
         '''
@@ -447,7 +713,7 @@ class CsvWriter:
         '''
         self.filepath = CommonFunctions.GetNextAvailableFileName(filepath)
         try:
-            self.file_handle = open(self.filepath, 'w', encoding=self.codec, newline='')
+            self.file_handle = open(self.filepath, 'w', encoding=self.codec, newline='', buffering=1048576)
             if not self.is_tsv:
                 self.pycsv_writer = csv.writer(self.file_handle, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL, dialect='excel')
         except (OSError, csv.Error) as ex:
@@ -455,6 +721,24 @@ class CsvWriter:
             log.exception('Error details')
             raise ex
 
+    @staticmethod
+    def _SanitizeItemForTsv(item):
+        return str(item).replace('\r\n', ',').replace('\r', ',').replace('\n', ',').replace('\t', ' ')
+
+    @staticmethod
+    def _NumberToTsv(item):
+        '''Numbers don't need sanitizing, but the column may hold other types too'''
+        if type(item) in (int, float):
+            return str(item)
+        return CsvWriter._SanitizeItemForTsv(item)
+
+    def AddHeaders(self, column_info):
+        '''Writes header row and prepares per column converters from DataType'''
+        if self.is_tsv:
+            self.tsv_converters = [self._NumberToTsv if data_type in (DataType.INTEGER, DataType.REAL) else self._SanitizeItemForTsv \
+                                    for data_type in column_info.values()]
+        self.WriteRow(list(column_info.keys()))
+
     def SanitizeForTsv(self, row):
         '''Remove \r \n \t from each item to write'''
         safe_list = []
@@ -485,8 +769,14 @@ class CsvWriter:
 
     def WriteRows(self, rows):
         if self.is_tsv:
-            for row in rows:
-                self.WriteRowTsv(row)
+            if self.tsv_converters is None:
+                for row in rows:
+                    self.WriteRowTsv(row)
+            else: # Whole batch is converted and written at once
+                converters = self.tsv_converters
+                lines = ["\t".join([convert(item) for convert, item in zip(converters, row)]) for row in rows]
+                lines.append('')
+                self.file_handle.write('\r\n'.join(lines))
         else:
             try:
                 self.pycsv_writer.writerows(rows)
@@ -516,61 +806,96 @@ class CsvWriter:
     #         self.Cleanup()
 
 class JsonlWriter:
-    def __init__(self, delete_empty_files=True):
+    '''Writes rows as json lines. Rows are converted & encoded a batch at a time 
+       and written with a single write call. The file can optionally be compressed
+       on the fly, compression is either None, 'gz' or 'zstd' (needs zstandard,
+       else gz is used).
+    '''
+    def __init__(self, delete_empty_files=True, compression=None):
         self.filepath = ''
-        self.jsonl_writer = None
+        self.file_handle = None
         self.column_info = None
         self.column_names = None
+        self.converters = None
         self.delete_empty_files = delete_empty_files
-    
+        self.compression = compression
+        if compression == 'zstd' and not zstandard_available:
+            log.warning('zstandard is not installed, using gz compression for JSONL output instead')
+            self.compression = 'gz'
+        self.rows_written = 0
+        # Same output as the jsonlines library, which was used earlier
+        self.encode = json.JSONEncoder(ensure_ascii=False).encode
+
     def CreateJsonlFile(self, filepath):
         '''
         Creates a jsonl file with suggested name, 
         if name is not available, get the next available name
         eg: name01.jsonl or name02.jsonl or ..
+        If compressed, extension .gz or .zst is added.
         '''
-        self.filepath = CommonFunctions.GetNextAvailableFileName(filepath)
+        extension = { 'gz':'.gz', 'zstd':'.zst' }.get(self.compression, '')
+        self.filepath = CommonFunctions.GetNextAvailableFileName(filepath + extension)
+        # backslashreplace, as a value that can't be encoded (eg: lone surrogates in carved strings) would
+        # fail the write of the whole batch. It is written as \udcff, which json reads back as the same str.
         try:
-            self.jsonl_writer = jsonlines.open(self.filepath, mode='w')
+            if self.compression == 'zstd':
+                self.file_handle = zstandard.open(self.filepath, 'wt', encoding='utf-8', errors='backslashreplace')
+            elif self.compression == 'gz':
+                self.file_handle = gzip.open(self.filepath, 'wt', encoding='utf-8', errors='backslashreplace', compresslevel=6)
+            else:
+                self.file_handle = open(self.filepath, 'w', encoding='utf-8', errors='backslashreplace', buffering=1048576)
         except (OSError) as ex:
             log.error(f'Failed to create JSONL file at path {self.filepath}')
             log.exception('Error details')
             raise ex
 
+    @staticmethod
+    def _ToJsonValue(v):
+        if v is None:
+            return ''
+        elif isinstance(v, (str, int, float)):
+            return v
+        return str(v)
+
+    @staticmethod
+    def _TextToJsonValue(v):
+        if v.__class__ is str: # Most common case
+            return v
+        return JsonlWriter._ToJsonValue(v)
+
     def AddHeaders(self, column_info):
         self.column_info = column_info
-        self.column_names = self.column_info.keys()
+        self.column_names = list(self.column_info.keys())
+        self.converters = [self._TextToJsonValue if data_type == DataType.TEXT else self._ToJsonValue \
+                            for data_type in column_info.values()]
+
+    def _RowToDict(self, row):
+        if isinstance(row, (list, tuple)):
+            return { name:convert(v) for name, convert, v in zip(self.column_names, self.converters, row) }
+        # must be dict
+        return { k:self._ToJsonValue(v) for k, v in row.items() }
 
     def WriteRow(self, row):
-        try:
-            if isinstance(row, list):
-                #to_write = dict(self.column_info.keys())
-                #for i, k in enumerate(to_write.keys()):
-                #    to_write[k] = row[i]
-                to_write = dict(zip(self.column_names, row))
-                for k, v in to_write.items():
-                    if v is None:
-                        to_write[k] = ''
-                    elif not (isinstance(v, str) or 
-                            isinstance(v, int) or 
-                            isinstance(v, float)):
-                        to_write[k] = str(v)
-            else: # must be dict
-                to_write = dict(row)
-                for k, v in to_write.items():
-                    if v is None:
-                        to_write[k] = ''
-                    elif not (isinstance(v, str) or 
-                            isinstance(v, int) or 
-                            isinstance(v, float)):
-                        to_write[k] = str(v)
-            self.jsonl_writer.write(to_write)
-        except (OSError, TypeError, KeyError, ValueError) as ex:
-            log.exception('Failed to write jsonl row ' + str(row))
+        self.WriteRows([row])
 
     def WriteRows(self, rows):
-        for row in rows:
-            self.WriteRow(row)
+        encode = self.encode
+        try:
+            lines = [encode(self._RowToDict(row)) for row in rows]
+        except (TypeError, KeyError, ValueError):
+            # Convert row by row, so only the bad row is lost, not the whole batch
+            lines = []
+            for row in rows:
+                try:
+                    lines.append(encode(self._RowToDict(row)))
+                except (TypeError, KeyError, ValueError):
+                    log.exception('Failed to write jsonl row')
+        try:
+            lines.append('')
+            self.file_handle.write('\n'.join(lines))
+            self.rows_written += len(lines) - 1
+        except (OSError, ValueError) as ex:
+            log.exception('Failed to write jsonl rows')
 
     def GetFileSize(self):
         '''Return jsonl filesize or None if error'''
@@ -581,14 +906,143 @@ class JsonlWriter:
         return None
     
     def Cleanup(self):
-        if self.jsonl_writer != None:
-            self.jsonl_writer.close()
-        if self.delete_empty_files:
-            file_size = self.GetFileSize()
-            if file_size != None and file_size == 0:
+        if self.file_handle != None:
+            self.file_handle.close()
+            self.file_handle = None
+        if self.delete_empty_files and self.rows_written == 0: # compressed empty files aren't 0 bytes
+            if os.path.exists(self.filepath):
                 log.debug("Deleting empty file : " + self.filepath)
                 os.remove(self.filepath)
 
+class ParquetWriter:
+    '''Writes a table as a parquet file. Rows are buffered as typed columns
+       (as per DataType) and written as compressed row groups. Needs the
+       optional pyarrow package, check IsAvailable() before using.
+    '''
+    row_group_size = 250000 # Max rows buffered before writing a row group
+    min_batch_row_group_size = 20000 # EndBatch() writes a row group only if at least these many rows are buffered
+
+    def __init__(self, delete_empty_files=True, compression='zstd'):
+        self.filepath = ''
+        self.compression = compression
+        self.delete_empty_files = delete_empty_files
+        self.pq_writer = None # Created on first row group, when schema is known
+        self.schema = None
+        self.converters = None
+        self.columns = None # Buffered column values [ [col1_values], [col2_values], .. ]
+        self.column_names = None
+        self.num_buffered_rows = 0
+        self.bad_value_counts = None
+
+    @staticmethod
+    def IsAvailable():
+        try:
+            import pyarrow.parquet
+            return True
+        except ImportError:
+            return False
+
+    def CreateParquetFile(self, filepath):
+        '''
+        Selects name for the parquet file, if name is not available, 
+        get the next available name eg: name01.parquet or ..
+        File is only created when first row group is written.
+        '''
+        self.filepath = CommonFunctions.GetNextAvailableFileName(filepath)
+
+    @staticmethod
+    def _ToInt(value):
+        if value is None or value == '': return None
+        value = int(value)
+        if -0x8000000000000000 <= value <= 0x7FFFFFFFFFFFFFFF:
+            return value
+        raise ValueError('Value does not fit in int64')
+
+    @staticmethod
+    def _ToFloat(value):
+        if value is None or value == '': return None
+        return float(value)
+
+    @staticmethod
+    def _ToText(value):
+        if value is None or isinstance(value, str): return value
+        return str(value)
+
+    @staticmethod
+    def _ToBytes(value):
+        if value is None or value == '': return None
+        if isinstance(value, str): return value.encode('utf8', 'backslashreplace')
+        return bytes(value)
+
+    @staticmethod
+    def _ToDate(value):
+        if value is None or value == '': return None
+        if isinstance(value, datetime.datetime): return value
+        return datetime.datetime.fromisoformat(str(value))
+
+    def AddHeaders(self, column_info):
+        type_map = { DataType.INTEGER: (pyarrow.int64(), self._ToInt),
+                     DataType.REAL: (pyarrow.float64(), self._ToFloat),
+                     DataType.BLOB: (pyarrow.binary(), self._ToBytes),
+                     DataType.DATE: (pyarrow.timestamp('us'), self._ToDate) }
+        fields = []
+        self.converters = []
+        for name, data_type in column_info.items():
+            arrow_type, converter = type_map.get(data_type, (pyarrow.string(), self._ToText))
+            fields.append(pyarrow.field(name, arrow_type))
+            self.converters.append(converter)
+        self.schema = pyarrow.schema(fields)
+        self.column_names = list(column_info.keys())
+        self.columns = [[] for x in self.column_names]
+        self.bad_value_counts = [0] * len(self.column_names)
+
+    def WriteRow(self, row):
+        self.WriteRows([row])
+
+    def WriteRows(self, rows):
+        '''rows is list of lists, values are converted and copied into column buffers'''
+        for index, converter in enumerate(self.converters):
+            column = self.columns[index]
+            for row in rows:
+                try:
+                    column.append(converter(row[index]))
+                except (TypeError, ValueError, OverflowError):
+                    column.append(None)
+                    self.bad_value_counts[index] += 1
+        self.num_buffered_rows += len(rows)
+        if self.num_buffered_rows >= self.row_group_size:
+            self._WriteRowGroup()
+
+    def EndBatch(self):
+        if self.num_buffered_rows >= self.min_batch_row_group_size:
+            self._WriteRowGroup()
+
+    def _WriteRowGroup(self):
+        if self.num_buffered_rows == 0:
+            return
+        try:
+            arrays = [pyarrow.array(column, type=field.type) for column, field in zip(self.columns, self.schema)]
+            table = pyarrow.Table.from_arrays(arrays, schema=self.schema)
+            if self.pq_writer is None:
+                self.pq_writer = pyarrow_parquet.ParquetWriter(self.filepath, self.schema, compression=self.compression)
+            self.pq_writer.write_table(table)
+        except (OSError, pyarrow.ArrowException) as ex:
+            log.exception(f'Failed to write row group to parquet file {self.filepath}')
+        self.columns = [[] for x in self.column_names]
+        self.num_buffered_rows = 0
+
+    def Cleanup(self):
+        if self.columns is not None:
+            self._WriteRowGroup()
+            for name, count in zip(self.column_names, self.bad_value_counts):
+                if count:
+                    log.warning(f'{count} values in column {name} could not be converted to its type, these were written as null in {self.filepath}')
+        if self.pq_writer is not None:
+            self.pq_writer.close()
+            self.pq_writer = None
+        elif not self.delete_empty_files and self.schema is not None:
+            pyarrow_parquet.write_table(self.schema.empty_table(), self.filepath)
+
 class ExcelSheetInfo:
     def __init__(self, name):
         self.name = name
@@ -619,6 +1073,9 @@ class ExcelWriter:
         self.sheet_info_list = []
         self.current_sheet_info = None
         self.max_allowed_rows = 1000000 # Excel limit is 1,048,576
+        self.deferred = False # If True, sheets are only created at the end, from the sqlite tables
+        self.deferred_sheets = [] # [ (sheet_name, db_path, table_name, column_info), .. ]
+        self.width_sample_size = 1000 # Rows sampled from table to estimate column widths
 
     def CreateXlsxFile(self, filepath):
         '''
@@ -744,6 +1201,126 @@ class ExcelWriter:
         for row in rows:
             self.WriteRow(row)
 
+    def AddDeferredSheet(self, sheet_name, db_path, table_name, column_info):
+        self.deferred_sheets.append((sheet_name, db_path, table_name, column_info))
+
+    @staticmethod
+    def _GetDbValueConverters(column_info):
+        '''Returns list of functions to convert values read from sqlite back to 
+           what DataWriter would have sent to the xlsx writer'''
+        def to_date(value):
+            if value is None or value == '' or not isinstance(value, str):
+                return value
+            try:
+                return datetime.datetime.fromisoformat(value)
+            except ValueError:
+                return value
+        def to_hex(value):
+            if isinstance(value, bytes):
+                return binascii.hexlify(value).decode("ascii").upper()
+            return value
+        converters = []
+        for data_type in column_info.values():
+            if data_type == DataType.DATE: converters.append(to_date)
+            elif data_type == DataType.BLOB: converters.append(to_hex)
+            else: converters.append(None)
+        return converters
+
+    @staticmethod
+    def _ReadDbTable(db_path, table_name, converters, chunks, chunk_size=50000):
+        '''Runs in a separate thread, reads & converts rows, puts them in chunks queue.
+           None is put at the end.'''
+        conn = None
+        try:
+            conn = sqlite3.connect(db_path)
+            cursor = conn.execute('SELECT * FROM "{}"'.format(table_name))
+            convert_columns = [(index, convert) for index, convert in enumerate(converters) if convert]
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                if convert_columns:
+                    rows = [list(row) for row in rows]
+                    for row in rows:
+                        for index, convert in convert_columns:
+                            row[index] = convert(row[index])
+                chunks.put(rows)
+                rows = cursor.fetchmany(chunk_size)
+        except sqlite3.Error as ex:
+            log.error('Failed to read table {} for xlsx, error was {}'.format(table_name, str(ex)))
+        finally:
+            if conn:
+                conn.close()
+            chunks.put(None)
+
+    def _EstimateColWidths(self, db_path, table_name, converters):
+        '''Update current sheet's column widths from a sample of rows spread across the table'''
+        conn = None
+        try:
+            conn = sqlite3.connect(db_path)
+            count = conn.execute('SELECT COUNT(*) FROM "{}"'.format(table_name)).fetchone()[0]
+            step = max(1, count // self.width_sample_size)
+            query = 'SELECT * FROM "{}" WHERE rowid % {} = 0 LIMIT {}'.format(table_name, step, self.width_sample_size)
+            for row in conn.execute(query):
+                row = [convert(value) if convert else value for convert, value in zip(converters, row)]
+                self.current_sheet_info.StoreColWidth(tuple(map(str, row)))
+        except sqlite3.Error as ex:
+            log.error('Failed to sample table {} for xlsx column widths, error was {}'.format(table_name, str(ex)))
+        finally:
+            if conn:
+                conn.close()
+
+    def WriteDeferredRows(self, rows):
+        '''Like WriteRows(), but column widths are not computed here (they are 
+           estimated beforehand) and per cell type dispatch is precomputed'''
+        NUMBER, DATE, OTHER = 1, 2, 3
+        kinds = [NUMBER if col_type in (DataType.INTEGER, DataType.REAL) else (DATE if col_type == DataType.DATE else OTHER) \
+                    for col_type in self.col_types]
+        for row in rows:
+            if self.row_index > self.max_allowed_rows:
+                info = self.current_sheet_info
+                try:
+                    self.CreateSheet(info.name)
+                    self.AddHeaders(info.column_info)
+                    self.current_sheet_info.col_width_list = list(info.col_width_list)
+                except xlsxwriter.exceptions.XlsxWriterException as ex:
+                    log.exception('Error trying to add sheet for overflow data (>1 million rows)')
+            sheet = self.sheet
+            row_index = self.row_index
+            for column_index, value in enumerate(row):
+                if value is None or value == '':
+                    continue
+                kind = kinds[column_index]
+                try:
+                    if kind == NUMBER and not isinstance(value, str):
+                        sheet.write_number(row_index, column_index, value, self.num_format)
+                    elif kind == DATE and isinstance(value, datetime.datetime):
+                        sheet.write_datetime(row_index, column_index, value, self.date_format)
+                    else:
+                        sheet.write(row_index, column_index, value if isinstance(value, str) else str(value))
+                except (TypeError, ValueError, xlsxwriter.exceptions.XlsxWriterException):
+                    log.exception('Error writing data:{} of type:{} in excel row:{} '.format(str(value), str(type(value)), row_index))
+            self.row_index += 1
+        self.current_sheet_info.max_row_index = self.row_index - 1
+
+    def WriteDeferredSheets(self):
+        '''Creates all deferred sheets from their sqlite tables. While a chunk of
+           rows is being written to the sheet, the next one is read & converted 
+           in a separate thread.'''
+        for sheet_name, db_path, table_name, column_info in self.deferred_sheets:
+            log.debug('Creating xlsx sheet for table {}'.format(table_name))
+            self.CreateSheet(sheet_name)
+            self.AddHeaders(column_info)
+            converters = self._GetDbValueConverters(column_info)
+            self._EstimateColWidths(db_path, table_name, converters)
+            chunks = queue.Queue(2)
+            reader = threading.Thread(target=self._ReadDbTable, args=(db_path, table_name, converters, chunks), daemon=True)
+            reader.start()
+            rows = chunks.get()
+            while rows is not None:
+                self.WriteDeferredRows(rows)
+                rows = chunks.get()
+            reader.join()
+        self.deferred_sheets = []
+
     def Beautify(self):
         '''Set column widths, auto filter and freeze top row'''
         for sheet_info in self.sheet_info_list:
@@ -763,6 +1340,10 @@ class ExcelWriter:
             sheet.autofilter(0, 0, sheet_info.max_row_index, sheet_info.max_col_index)
 
     def CommitAndCloseFile(self):
+        if self.deferred_sheets:
+            for db_path in set(x[1] for x in self.deferred_sheets): # Rows must be in db, before they can be read
+                SqliteWriterService.GetService(db_path).Commit(wait=True)
+            self.WriteDeferredSheets()
         self.Beautify()
         if self.workbook != None:
             self.workbook.close()
@@ -834,6 +1415,7 @@ class ChunkedDataWriter:
                 self.writer = DataWriter(output_params, data_name, data_type_info, source_file)
             try:
                 self.writer.WriteRows(data_list)
+                self.writer.EndBatch() # Each batch becomes a parquet row group
                 ret = True
             except (OSError, xlsxwriter.exceptions.XlsxWriterException, sqlite3.Error) as ex:
                 log.error ("Failed to write row data")
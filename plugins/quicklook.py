@@ -8,19 +8,21 @@
 '''
 
 import logging
+import collections
+import mmap
 import os
 import sqlite3
-from itertools import chain, zip_longest
 
 from PIL import Image
 
 from plugins.helpers.common import *
 from plugins.helpers.macinfo import *
+from plugins.helpers.process_pool import GetWorkerCount, ProcessPool
 from plugins.helpers.writer import *
 
 __Plugin_Name = "QUICKLOOK" # Cannot have spaces, and must be all caps!
 __Plugin_Friendly_Name = "QuickLook Thumbnail Cache"
-__Plugin_Version = "1.1"
+__Plugin_Version = "1.2"
 __Plugin_Description = "Parses QuickLook Thumbnail Cache data"
 __Plugin_Author = "Jack Farley - BlackStone Discovery"
 __Plugin_Author_Email = "jfarley@blackstonediscovery.com - jfarley248@gmail.com"
@@ -100,76 +102,128 @@ def OpenDb(inputPath):
     return None
 
 
-def openSingle(path):
+def saveThumb(thumb, width, height, raw_mode, export_file):
     """
+    Writes out one thumbnail as a png file, this runs in the worker processes
 
-    :param path: Path of file to open, use in standalone mode
-    :return: handle to file
+    :param thumb: Raw pixel data carved from thumbnails.data
+    :return: Error message, or empty string on success
     """
-    handle = open(path, "rb")
-    return handle
-
-def openDeadbox(path, mac_info):
-    """
-
-    :param path: Path in image to file
-    :param mac_info: mac_info object
-    :return: handle to file
+    try:
+        if len(thumb) < width * height * 4:
+            thumb += b'\0' * (width * height * 4 - len(thumb))
+        # Pillow does the BGRA -> RGBA swizzle while unpacking
+        img = Image.frombuffer('RGBA', (width, height), thumb, 'raw', raw_mode, 0, 1)
+        img.save(export_file)
+    except (ValueError, OSError) as ex:
+        return str(ex)
+    return ''
+
+def getThumbnailFolder(export, user_name):
+    # Parse via mac_info
+    if type(export) is not str:
+        return os.path.join(export.output_params.export_path, __Plugin_Name, "Thumbnails", user_name)
+    # Parse via single plugin
+    return os.path.join(export, __Plugin_Name, "Thumbnails")
+
+class ThumbnailCarver:
     """
-    handle = mac_info.Open(path)
-    return handle
-
-def carveThumb(offset, length, thumbfile, thumbname, width, height, export, user_name, is_BGRA=False):
+    Carves thumbnails out of a thumbnails.data file. The file is read just once (mmap'd 
+    when it is a local file), and thumbnails are saved as png files by a pool of worker
+    processes once all of them have been added.
     """
+    def __init__(self, path_to_thumbnails, export, user_name):
+        """
+        :param path_to_thumbnails: Path of thumbnails.data
+        :param export: Either output directory in single plugin mode or mac_info object
+        """
+        self.file = None
+        self.data = None
+        self.tasks = [] # (offset, length, width, height, raw_mode, export_file)
+        self.used_paths = set()
+        self.export_folder = getThumbnailFolder(export, user_name)
 
-    :param offset: Offset in thumbnails.data for thumbnail
-    :param length: Lenght of data to carve for thumbnail in thumbnails.data
-    :param thumbfile: Source thumbnails.data file to carve from
-    :param thumbname: Name of the file that has the thumbnail
-    :param export: Either output directory in single plugin mode or mac_info object
-    :return: Nothing
-    """
-    global running_on_windows
-    if length is not None:
-
-        # Seek and read thumbnails.data from offsets and lengths found in the index.sqlite
-        thumbfile.seek(offset)
-        thumb = thumbfile.read(length)
-
-        if is_BGRA:
-            thumb = convertBGRA_to_RGBA(thumb)
-
-        # Use the Pillow Library Image to parse and export files as images
-        imgSize = (width, height)
-        img = Image.frombytes('RGBA', imgSize, thumb, decoder_name='raw')
-
-        # Parse via mac_info
-        if type(export) is not str:
-            export_folder = os.path.join(export.output_params.export_path, __Plugin_Name, "Thumbnails", user_name)
-
-        # Parse via single plugin
-        else:
-            export_folder = os.path.join(export, __Plugin_Name, "Thumbnails")
-
-        # Create output directory if doesn't exist
-        if not os.path.exists(export_folder):
-            os.makedirs(export_folder)
-
-        thumbname = CommonFunctions.SanitizeName(thumbname) # remove illegal characters which might cause issues!
-
-        # Set up output file with png extension attached
         try:
-            # Some of the names may have illegal characters in them, filter those out
-            thumbname = CommonFunctions.SanitizeName(thumbname) + " - " + str(width) +  "x" + str(height) + ".png"
-            export_file = os.path.join(export_folder, thumbname)
-            export_file = CommonFunctions.GetNextAvailableFileName(export_file)
-            log.debug("Attempting to copy out thumbnail to file: " + export_file)
-            # fix for very long thumbnail names
-            if running_on_windows and len(export_file) > 260 and export_file[1:3]==':\\':
-                export_file = '\\\\?\\' + export_file
-            img.save(export_file)
-        except (ValueError, OSError) as ex:
-            log.exception('Failed to write out thumbnail ' + thumbname)
+            if type(export) is not str:
+                f = export.Open(path_to_thumbnails)
+                if f:
+                    self.data = f.read()
+                    f.close()
+            else:
+                self.file = open(path_to_thumbnails, "rb")
+                if os.path.getsize(path_to_thumbnails):
+                    self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    self.data = b''
+        except (OSError, ValueError) as ex:
+            log.exception('Failed to read ' + path_to_thumbnails)
+
+    def AddThumb(self, offset, length, thumbname, width, height, is_BGRA=False):
+        """
+        :param offset: Offset in thumbnails.data for thumbnail
+        :param length: Lenght of data to carve for thumbnail in thumbnails.data
+        :param thumbname: Name of the file that has the thumbnail
+        :return: Nothing
+        """
+        global running_on_windows
+        if length is None or not width or not height:
+            return
+
+        # Some of the names may have illegal characters in them, filter those out
+        thumbname = CommonFunctions.SanitizeName(thumbname) + " - " + str(width) +  "x" + str(height) + ".png"
+        export_file = os.path.join(self.export_folder, thumbname)
+        # Files are only written at the end, so names handed out so far are checked too
+        if export_file in self.used_paths or os.path.exists(export_file):
+            filepath_without_ext, ext = os.path.splitext(export_file)
+            index = 1
+            export_file = filepath_without_ext + '{0:02d}'.format(index) + ext
+            while export_file in self.used_paths or os.path.exists(export_file):
+                index += 1
+                export_file = filepath_without_ext + '{0:02d}'.format(index) + ext
+        self.used_paths.add(export_file)
+        # fix for very long thumbnail names
+        if running_on_windows and len(export_file) > 260 and export_file[1:3]==':\\':
+            export_file = '\\\\?\\' + export_file
+        self.tasks.append((offset, length, width, height, 'BGRA' if is_BGRA else 'RGBA', export_file))
+
+    def WriteAll(self):
+        """
+        Writes out all added thumbnails and closes thumbnails.data
+        """
+        if self.tasks and self.data is not None:
+            # Create output directory if doesn't exist
+            if not os.path.exists(self.export_folder):
+                os.makedirs(self.export_folder)
+            max_workers = GetWorkerCount(len(self.tasks))
+            if max_workers > 1:
+                # Only a few thumbnails are carved ahead of the workers, so all of
+                # thumbnails.data is never held in the queue at once
+                errors = []
+                with ProcessPool(max_workers) as executor:
+                    pending = collections.deque()
+                    for offset, length, width, height, raw_mode, export_file in self.tasks:
+                        thumb = self.data[offset:offset + length]
+                        pending.append(executor.submit(saveThumb, thumb, width, height, raw_mode, export_file))
+                        if len(pending) >= max_workers * 8:
+                            errors.append(pending.popleft().result())
+                    while pending:
+                        errors.append(pending.popleft().result())
+            else:
+                errors = [saveThumb(self.data[offset:offset + length], width, height, raw_mode, export_file) \
+                            for offset, length, width, height, raw_mode, export_file in self.tasks]
+            num_failed = 0
+            for task, error in zip(self.tasks, errors):
+                if error:
+                    log.error('Failed to write out thumbnail {}, error was {}'.format(task[5], error))
+                    num_failed += 1
+            log.info('{} thumbnails written to {}'.format(len(self.tasks) - num_failed, self.export_folder))
+        self.tasks = []
+        if self.data is not None and type(self.data) is mmap.mmap:
+            self.data.close()
+        self.data = None
+        if self.file:
+            self.file.close()
+            self.file = None
 
 def parseDb(c, quicklook_array, source, path_to_thumbnails, export, user_name):
     """
@@ -194,15 +248,7 @@ def parseDb(c, quicklook_array, source, path_to_thumbnails, export, user_name):
     try:
         c.execute(thumbnail_query)
         data = c.fetchall()
-        thumbfile = None
-        if len(data):
-            # Export the thumbnails.data file via mac_info
-            if type(export) is not str:
-                thumbfile = openDeadbox(path_to_thumbnails, export)
-
-            # Export thumbnails.data via single plugin
-            else:
-                thumbfile = openSingle(path_to_thumbnails)
+        carver = ThumbnailCarver(path_to_thumbnails, export, user_name) if len(data) else None
 
         # Iterate through the rows returned by the above SQL statment and create QuickLook object based off it,
         # then appends to array
@@ -233,36 +279,43 @@ def parseDb(c, quicklook_array, source, path_to_thumbnails, export, user_name):
             quicklook_array.append(ql)
 
             # Carve out thumbnail
-            carveThumb(bitmapdata_location, bitmapdata_length, thumbfile, file_name, computed_width, height, export, user_name)
+            carver.AddThumb(bitmapdata_location, bitmapdata_length, file_name, computed_width, height)
 
-        if thumbfile:
-            thumbfile.close()
+        if carver:
+            carver.WriteAll()
 
     # Catch SQLite3 exceptions
     except sqlite3.Error as e:
         log.exception("Exception while executing query for QuickLook cache. Exception was: " + str(e))
 
 
-def findParents(c, CNID, full_path):
-    inode_query_unformat = """
-    SELECT Parent_CNID from Combined_Inodes where Combined_Inodes.CNID == {}
+def resolvePaths(mac_info, inodes):
     """
-    inode_query = inode_query_unformat.format(CNID)
-
-    name_query_unformat = """
-    SELECT Name from Combined_Inodes where Combined_Inodes.CNID == {}
+    :param mac_info: mac_info object
+    :param inodes: iNode numbers (fileId) from index.sqlite
+    :return: dictionary of { inode : full path }, looked up with a single JOIN on the APFS db
     """
-
-    if CNID == 2:
-        return
-    else:
-        c.execute(inode_query)
-        parent_CNID = c.fetchone()[0]
-        name_query = name_query_unformat.format(parent_CNID)
-        c.execute(name_query)
-        parent_folder = c.fetchone()[0]
-        full_path[0] =   parent_folder + "/" + full_path[0]
-        findParents(c, parent_CNID, full_path)
+    paths = {}
+    apfs_db_path = mac_info.output_params.apfs_db_path
+    if not inodes or not apfs_db_path:
+        return paths
+    mac_info.RecordApfsDbInput()
+    conn = None
+    try:
+        conn = sqlite3.connect('file:{}?mode=ro'.format(apfs_db_path), uri=True)
+        conn.execute('CREATE TEMP TABLE Thumbnail_Inodes (CNID INTEGER PRIMARY KEY)')
+        conn.executemany('INSERT OR IGNORE INTO temp.Thumbnail_Inodes VALUES (?)', ((inode,) for inode in inodes))
+        # If there are hard links, only one path is used
+        query = 'SELECT t.CNID, MIN(p.Path) FROM temp.Thumbnail_Inodes t '\
+                'INNER JOIN "{}_Paths" p ON p.CNID=t.CNID GROUP BY t.CNID'.format(mac_info.macos_FS.name)
+        for inode, path in conn.execute(query):
+            paths[inode] = path
+    except sqlite3.Error as ex:
+        log.exception("Failed to look up paths for thumbnail iNodes in APFS db")
+    finally:
+        if conn:
+            conn.close()
+    return paths
 
 
 def computeWidth(bitmapFormat):
@@ -309,8 +362,8 @@ def parseDbNewSinglePlug(c, quicklook_array, source, path_to_thumbnails, export)
     """
 
     c.execute(pref_ver_query)
-    log.info("preference version = {}".format(pref_ver))
     pref_ver = int(c.fetchone()[0])
+    log.info("preference version = {}".format(pref_ver))
     if pref_ver >= 11:
         combined_query = pref_v11_query
     else:
@@ -321,12 +374,7 @@ def parseDbNewSinglePlug(c, quicklook_array, source, path_to_thumbnails, export)
 
     # If the statement returned anything, lets parse it further
     if combined_files:
-        # Export thumbnails.data via mac_info
-        if type(export) is not str:
-            thumbfile = openDeadbox(path_to_thumbnails, export)
-        # Export thumbnails.data via single plugin
-        else:
-            thumbfile = openSingle(path_to_thumbnails)
+        carver = ThumbnailCarver(path_to_thumbnails, export, '')
         unknown_count = 0
         for entries in combined_files:
             # Carve out thumbnails with no iNode
@@ -341,22 +389,12 @@ def parseDbNewSinglePlug(c, quicklook_array, source, path_to_thumbnails, export)
             fs_id = "N/A"
             inode = entries[0]
             row_id = "N/A"
-            carveThumb(bitmapdata_location, bitmapdata_length, thumbfile, name, computed_width, height, export, '', True)
+            carver.AddThumb(bitmapdata_location, bitmapdata_length, name, computed_width, height, True)
             unknown_count += 1
             ql = QuickLook("UNKNOWN", "UNKNOWN", hit_count, last_hit_date, version,
                             bitmapdata_location, bitmapdata_length, computed_width, height, fs_id, inode, row_id, source)
             quicklook_array.append(ql)
-        if thumbfile:
-            thumbfile.close()
-
-def convertBGRA_to_RGBA(data):
-    if len(data)%4 != 0:
-        print("Problem, got a remainder, trying to pad..!")
-        data += b'\0' * (4 - len(data)%4)
-
-    ret = tuple(chain(*((R,G,B,A) for B,G,R,A in zip_longest(*[iter(data)]*4))))
-    return bytes(ret)
-
+        carver.WriteAll()
 
 def parseDbNew(c, quicklook_array, source, path_to_thumbnails, export, user_name):
     """
@@ -366,10 +404,6 @@ def parseDbNew(c, quicklook_array, source, path_to_thumbnails, export, user_name
         :return: Nothing, fills the quicklook array
     """
 
-    inode_query = """
-    SELECT Name from Combined_Inodes where Combined_Inodes.CNID == {}
-    """
-
     pref_ver_query = """
         SELECT value FROM preferences WHERE key == 'version' LIMIT 1;
     """
@@ -409,8 +443,10 @@ def parseDbNew(c, quicklook_array, source, path_to_thumbnails, export, user_name
 
     # If the statement returned anything, lets parse it further
     if combined_files:
-        # Export the thumbnails.data file via mac_info
-        thumbfile = openDeadbox(path_to_thumbnails, export)
+        carver = ThumbnailCarver(path_to_thumbnails, export, user_name)
+        # Resolve all iNodes to paths at once
+        has_db = bool(export.output_params.apfs_db_path)
+        paths = resolvePaths(export, set(entries[0] for entries in combined_files))
         unknown_count = 0
         for entries in combined_files:
             bitmapdata_location = entries[8]
@@ -424,20 +460,8 @@ def parseDbNew(c, quicklook_array, source, path_to_thumbnails, export, user_name
             inode = entries[0]
             row_id = "N/A"
 
-            # Format the inode_query for our specific iNode number so we can find the filename
-            apfs_query = inode_query.format(inode)
-
-            # Create cursor to the APFS db created by mac_apt
-            if hasattr(export, 'apfs_db'): # Check if this is from mounted disk
-                apfs_c = export.apfs_db.conn.cursor()
-                apfs_c.row_factory = sqlite3.Row
-                cursor = apfs_c.execute(apfs_query)
-                test_row = cursor.fetchone()
-                has_db = True
-            else:
-                has_db = False
-                test_row = None
-            if test_row is None:
+            path = paths.get(inode, None)
+            if path is None:
                 if has_db:
                     log.warning("No file matches iNode: " + str(inode) + "!!")
                     log.warning("This file will be outputted as Unknown" + str(unknown_count))
@@ -447,27 +471,23 @@ def parseDbNew(c, quicklook_array, source, path_to_thumbnails, export, user_name
                 name = f"Unknown-{unknown_count}-{inode}"
 
                 log.debug("Carving an unknown thumbnail, this is unknown number: " + str(unknown_count))
-                carveThumb(bitmapdata_location, bitmapdata_length, thumbfile, name, computed_width, height, export, user_name, True)
+                carver.AddThumb(bitmapdata_location, bitmapdata_length, name, computed_width, height, True)
                 unknown_count += 1
                 ql = QuickLook("UNKNOWN", "UNKNOWN", hit_count, last_hit_date, version, bitmapdata_location,
                                 bitmapdata_length, computed_width, height, fs_id, inode, row_id, source)
                 quicklook_array.append(ql)
 
             else:
-                for row in test_row:
-                    log.debug("File matching iNode: " + str(inode) + " is: " + row)
-                    full_path = [""]
-                    findParents(apfs_c, inode, full_path)
+                folder, name = os.path.split(path)
+                log.debug("File matching iNode: " + str(inode) + " is: " + path)
 
-                    ql = QuickLook(full_path[0], row, hit_count, last_hit_date, version, bitmapdata_location,
-                                    bitmapdata_length, computed_width, height, fs_id, inode, row_id, source)
-                    quicklook_array.append(ql)
+                ql = QuickLook(folder, name, hit_count, last_hit_date, version, bitmapdata_location,
+                                bitmapdata_length, computed_width, height, fs_id, inode, row_id, source)
+                quicklook_array.append(ql)
 
-                    # Carve out thumbnails
-                    log.debug("Carving thumbnail: " + str(full_path[0]) + row + " from thumbnails.data file")
-                    carveThumb(bitmapdata_location, bitmapdata_length, thumbfile, row, computed_width, height, export, user_name, True)
-        if thumbfile:
-            thumbfile.close()
+                # Carve out thumbnails
+                carver.AddThumb(bitmapdata_location, bitmapdata_length, name, computed_width, height, True)
+        carver.WriteAll()
 
 def findDb(mac_info):
     log.debug("Finding QuickLook databases and caches in user cache dirs")
@@ -533,7 +553,7 @@ def Plugin_Start(mac_info):
             parseDb(c, quicklook_array, quicklook_db_path, thumbnail_file, mac_info, user)
         else:
             log.debug("QuickLook data from Mac OS 10.15+ found... Processing")
-            if not hasattr(mac_info, 'apfs_db') or isinstance(mac_info, ZipMacInfo): # Check if this is from mounted disk or zip file
+            if not mac_info.output_params.apfs_db_path or isinstance(mac_info, ZipMacInfo): # Check if this is from mounted disk or zip file
                 log.warning("Since the APFS database is not available (MOUNTED/ZIP mode?), file inodes won't be resolved to paths.")
             parseDbNew(c, quicklook_array, quicklook_db_path, thumbnail_file, mac_info, user)
 
@@ -18,7 +18,7 @@ import nska_deserialize as nd
 
 # import plugins.helpers.ccl_bplist as ccl_bplist
 # from plugins.helpers import macinfo
-from plugins.helpers.common import CommonFunctions
+from plugins.helpers.common import ArtifactReadJobs, CommonFunctions
 from plugins.helpers.macinfo import *
 from plugins.helpers.writer import *
 
@@ -165,9 +165,15 @@ def ReadSafariPlist(plist, safari_items, source, user):
     except KeyError: # Not found
         pass
 
-def ProcessSafariPlist(mac_info, source_path, user, safari_items, read_plist_function, safari_profile=SafariProfile('', '', '')):
+def ProcessSafariPlist(jobs, mac_info, source_path, user, safari_items, read_plist_function, safari_profile=SafariProfile('', '', '')):
+    '''Exports and reads plist now, parsing is queued in jobs'''
     mac_info.ExportFile(source_path, __Plugin_Name, user + "_", False)
-    success, plist, error = mac_info.ReadPlist(source_path)
+    if not jobs.AddFile(safari_items, mac_info, source_path,
+                        lambda items, f: ReadSafariPlistFile(f, source_path, user, items, read_plist_function, safari_profile)):
+        log.info('Failed to open plist: {}'.format(source_path))
+
+def ReadSafariPlistFile(f, source_path, user, safari_items, read_plist_function, safari_profile):
+    success, plist, error = CommonFunctions.ReadPlist(f)
     if success:
         if read_plist_function in (ReadExtensionsPlist, ):
             read_plist_function(plist, safari_items, source_path, user, safari_profile)
@@ -175,7 +181,6 @@ def ProcessSafariPlist(mac_info, source_path, user, safari_items, read_plist_fun
             read_plist_function(plist, safari_items, source_path, user)
     else:
         log.info('Failed to open plist: {}'.format(source_path))
-    pass
 
 def ReadHistoryDb(conn, safari_items, source_path, user, safari_profile=SafariProfile('', '', '')):
     try:
@@ -395,7 +400,7 @@ def ReadSafariTabSnapshotsDb(conn: sqlite3.Connection, safari_items: list[Safari
         log.exception(f"Sqlite error in {source_path}")
 
 
-def ProcessTabSnapshotsFolder(mac_info: MacInfo, folder_path: str, user: str, safari_items: list[SafariItem]) -> None:
+def ProcessTabSnapshotsFolder(jobs: ArtifactReadJobs, mac_info: MacInfo, folder_path: str, user: str, safari_items: list[SafariItem]) -> None:
     if mac_info.IsValidFilePath(folder_path + '/Metadata.db'):
         log.debug(f"Exporting Safari TabSnapshots from {folder_path}")
         files_list = mac_info.ListItemsInFolder(folder_path, EntryType.FILES, include_dates=False)
@@ -406,7 +411,7 @@ def ProcessTabSnapshotsFolder(mac_info: MacInfo, folder_path: str, user: str, sa
             log.debug(f"Exporting TabSnapshots: {png_file}")
             mac_info.ExportFile(folder_path + '/' + png_file, __Plugin_Name + '/TabSnapshots', user + '_', False)
 
-        ReadDbFromImage(mac_info, folder_path + '/Metadata.db', user, safari_items, ReadSafariTabSnapshotsDb, 'Safari TabSnapshots')
+        ReadDbFromImage(jobs, mac_info, folder_path + '/Metadata.db', user, safari_items, ReadSafariTabSnapshotsDb, 'Safari TabSnapshots')
 
 
 def ReadExtensionsPlist(plist, safari_items, source_path, user, safari_profile=SafariProfile('', '', '')):
@@ -608,7 +613,7 @@ def ReadRecentlyClosedTabsPlist(plist, safari_items, source_path, user):
     except KeyError as ex:
         log.error('ClosedTabOrWindowPersistentStates not found or unable to parse. Error was {}'.format(str(ex)))
 
-def ProcessSafariFolder(mac_info, folder_path, user, safari_items, safari_profiles={'': SafariProfile('', '', '')}):
+def ProcessSafariFolder(jobs, mac_info, folder_path, user, safari_items, safari_profiles={'': SafariProfile('', '', '')}):
     files_list = [ ['History.plist', ReadHistoryPlist] , ['Downloads.plist', ReadDownloadsPlist], 
                     ['Bookmarks.plist', ReadBookmarksPlist], ['TopSites.plist', ReadTopSitesPlist], 
                     ['LastSession.plist', ReadLastSessionPlist], ['Extensions/Extensions.plist', ReadExtensionsPlist],
@@ -616,7 +621,7 @@ def ProcessSafariFolder(mac_info, folder_path, user, safari_items, safari_profil
     for item in files_list:
         source_path = folder_path + '/' + item[0]
         if mac_info.IsValidFilePath(source_path):
-            ProcessSafariPlist(mac_info, source_path, user, safari_items, item[1])
+            ProcessSafariPlist(jobs, mac_info, source_path, user, safari_items, item[1])
         else:
             log.debug('Safari File not found : {}'.format(source_path))
 
@@ -626,31 +631,26 @@ def ProcessSafariFolder(mac_info, folder_path, user, safari_items, safari_profil
         else:
             history_db_path = folder_path + '/History.db'
         # Yosemite onwards there is History.db
-        ReadDbFromImage(mac_info, history_db_path, user, safari_items, ReadHistoryDb, 'safari history', safari_profile)
+        ReadDbFromImage(jobs, mac_info, history_db_path, user, safari_items, ReadHistoryDb, 'safari history', safari_profile)
 
     # CloudTabs.db, SafariTabs.db, BrowserState.db are used as common databases for all profiles
-    ReadDbFromImage(mac_info, folder_path + '/CloudTabs.db', user, safari_items, ReadCloudTabsDb, 'safari CloudTabs')
-    ReadDbFromImage(mac_info, folder_path + '/SafariTabs.db', user, safari_items, ReadSafariTabsDb, 'safari Tabs')
-    ReadDbFromImage(mac_info, folder_path + '/BrowserState.db', user, safari_items, ReadBrowserStateDb, 'safari BrowserState')
+    ReadDbFromImage(jobs, mac_info, folder_path + '/CloudTabs.db', user, safari_items, ReadCloudTabsDb, 'safari CloudTabs')
+    ReadDbFromImage(jobs, mac_info, folder_path + '/SafariTabs.db', user, safari_items, ReadSafariTabsDb, 'safari Tabs')
+    ReadDbFromImage(jobs, mac_info, folder_path + '/BrowserState.db', user, safari_items, ReadBrowserStateDb, 'safari BrowserState')
 
-def ReadDbFromImage(mac_info, source_path, user, safari_items, processing_func, description, safari_profile=SafariProfile('', '', '')):
+def ReadDbFromImage(jobs, mac_info, source_path, user, safari_items, processing_func, description, safari_profile=SafariProfile('', '', '')):
     if mac_info.IsValidFilePath(source_path) and mac_info.GetFileSize(source_path, 0) > 0:
         if safari_profile.profile_uuid:
             prefix = user + "_" + safari_profile.profile_name + '_'
         else:
             prefix = user + '_'
         mac_info.ExportFile(source_path, __Plugin_Name, prefix)
-        try:
-            sqlite = SqliteWrapper(mac_info)
-            conn = sqlite.connect(source_path)
-            if conn:
-                if processing_func in (ReadHistoryDb, ):
-                    processing_func(conn, safari_items, source_path, user, safari_profile)
-                else:
-                    processing_func(conn, safari_items, source_path, user)
-            conn.close()
-        except (sqlite3.Error, OSError) as ex:
-            log.exception ("Failed to open {} database '{}', is it a valid SQLITE DB?".format(description, source_path))
+        if processing_func in (ReadHistoryDb, ):
+            parse_function = lambda items, conn: processing_func(conn, items, source_path, user, safari_profile)
+        else:
+            parse_function = lambda items, conn: processing_func(conn, items, source_path, user)
+        if not jobs.AddDb(safari_items, mac_info, source_path, parse_function):
+            log.error("Failed to open {} database '{}', is it a valid SQLITE DB?".format(description, source_path))
 
 def Plugin_Start(mac_info):
     '''Main Entry point function for plugin'''
@@ -663,6 +663,7 @@ def Plugin_Start(mac_info):
                             '{}/Library/Containers/com.apple.Safari/Data/Library/Safari/{}WebExtensions/Extensions.plist')
     user_safari_tabsnapshots_path = '{}/Library/Containers/com.apple.Safari/Data/Library/Caches/com.apple.Safari/TabSnapshots'
     processed_paths = []
+    jobs = ArtifactReadJobs()
     for user in mac_info.users:
         user_name = user.user_name
         if user.home_dir == '/private/var/empty': continue # Optimization, nothing should be here!
@@ -672,20 +673,20 @@ def Plugin_Start(mac_info):
         for user_safari_plist_path in user_safari_plist_paths:
             source_path = user_safari_plist_path.format(user.home_dir)
             if mac_info.IsValidFilePath(source_path):
-                ProcessSafariPlist(mac_info, source_path, user_name, safari_items, ReadSafariPlist)
+                ProcessSafariPlist(jobs, mac_info, source_path, user_name, safari_items, ReadSafariPlist)
             #else:
             #    if not user_name.startswith('_'):
             #        log.debug('File not found: {}'.format(source_path))
 
         source_path = user_safari_path.format(user.home_dir)
         if mac_info.IsValidFolderPath(source_path):
-            ProcessSafariFolder(mac_info, source_path, user_name, safari_items)
+            ProcessSafariFolder(jobs, mac_info, source_path, user_name, safari_items)
 
         # Safari 17 supports multi profiles
         source_path = user_safari_path_15.format(user.home_dir)
         safari_profiles = GetSafariProfiles(mac_info, source_path)
         if mac_info.IsValidFolderPath(source_path):
-            ProcessSafariFolder(mac_info, source_path, user_name, safari_items, safari_profiles)
+            ProcessSafariFolder(jobs, mac_info, source_path, user_name, safari_items, safari_profiles)
 
         for ext_path in user_safari_extensions:
             for safari_profile in safari_profiles.values():
@@ -694,10 +695,11 @@ def Plugin_Start(mac_info):
                 else:
                     source_path = ext_path.format(user.home_dir, '')
                 if mac_info.IsValidFilePath(source_path):
-                    ProcessSafariPlist(mac_info, source_path, user_name, safari_items, ReadExtensionsPlist, safari_profile)
+                    ProcessSafariPlist(jobs, mac_info, source_path, user_name, safari_items, ReadExtensionsPlist, safari_profile)
 
         source_path = user_safari_tabsnapshots_path.format(user.home_dir)
-        ProcessTabSnapshotsFolder(mac_info, source_path, user_name, safari_items)
+        ProcessTabSnapshotsFolder(jobs, mac_info, source_path, user_name, safari_items)
+    jobs.Finish()
 
     if len(safari_items) > 0:
         PrintAll(safari_items, mac_info.output_params, '')
@@ -785,20 +787,22 @@ def Plugin_Start_Standalone(input_files_list, output_params):
 def Plugin_Start_Ios(ios_info):
     '''Entry point for ios_apt plugin'''
     safari_items = []
+    jobs = ArtifactReadJobs()
     for app in ios_info.apps:
         if app.bundle_display_name.lower() == "safari":
             log.debug(f'Safari version {app.bundle_version} found at {app.sandbox_path}')
             safari_plist_path = f'{app.sandbox_path}/Library/Preferences/com.apple.mobilesafari.plist'
 
             if ios_info.IsValidFilePath(safari_plist_path):
-                ProcessSafariPlist(ios_info, safari_plist_path, 'mobile', safari_items, ReadSafariPlist)
+                ProcessSafariPlist(jobs, ios_info, safari_plist_path, 'mobile', safari_items, ReadSafariPlist)
             break
     source_path = '/private/var/mobile/Library/Safari'
     if ios_info.IsValidFolderPath(source_path):
-        ReadDbFromImage(ios_info, source_path + '/History.db', 'mobile', safari_items, ReadHistoryDb, 'safari History')
-        ReadDbFromImage(ios_info, source_path + '/CloudTabs.db', 'mobile', safari_items, ReadCloudTabsDb, 'safari CloudTabs')
-        ReadDbFromImage(ios_info, source_path + '/SafariTabs.db', 'mobile', safari_items, ReadSafariTabsDb, 'safari Tabs')
-        ReadDbFromImage(ios_info, source_path + '/BrowserState.db', 'mobile', safari_items, ReadBrowserStateDb, 'safari BrowserState')
+        ReadDbFromImage(jobs, ios_info, source_path + '/History.db', 'mobile', safari_items, ReadHistoryDb, 'safari History')
+        ReadDbFromImage(jobs, ios_info, source_path + '/CloudTabs.db', 'mobile', safari_items, ReadCloudTabsDb, 'safari CloudTabs')
+        ReadDbFromImage(jobs, ios_info, source_path + '/SafariTabs.db', 'mobile', safari_items, ReadSafariTabsDb, 'safari Tabs')
+        ReadDbFromImage(jobs, ios_info, source_path + '/BrowserState.db', 'mobile', safari_items, ReadBrowserStateDb, 'safari BrowserState')
+    jobs.Finish()
     if len(safari_items) > 0:
         PrintAll(safari_items, ios_info.output_params, '')
     else:
@@ -11,6 +11,7 @@
    files.
 '''
 
+import collections
 import io
 import nska_deserialize as nd
 import os
@@ -20,6 +21,7 @@ import struct
 from Crypto.Cipher import AES
 from plugins.helpers.common import CommonFunctions
 from plugins.helpers.macinfo import *
+from plugins.helpers.process_pool import GetWorkerCount, ProcessPool
 from plugins.helpers.writer import *
 
 import logging
@@ -65,7 +67,45 @@ def PrintAll(saved_states, output_params, source_path):
 
     WriteList("Saved state information", "SavedState", data_list, saved_info, output_params, source_path)
 
-def ProcessFolder(mac_info, saved_states, user, folder_path):
+class AdditionalTitleDecoder:
+    '''Decrypts and decodes data.data of each app in worker processes, while
+       the next app's files are read from the image. Results are applied to the
+       saved states in the order they were added.'''
+
+    def __init__(self):
+        self.max_workers = GetWorkerCount(os.cpu_count() or 1)
+        self.executor = ProcessPool(self.max_workers) if self.max_workers > 1 else None
+        self.pending = collections.deque() # [ (saved_state, titles, future), .. ]
+
+    @staticmethod
+    def _Apply(saved_state, titles, new_titles):
+        for title in new_titles:
+            titles.add(title)
+        saved_state.window_title = '\n'.join(titles)
+
+    def _ApplyOldest(self):
+        saved_state, titles, future = self.pending.popleft()
+        try:
+            self._Apply(saved_state, titles, future.result())
+        except Exception:
+            log.exception(f'Error reading data.data for {saved_state.bundle}')
+
+    def Add(self, saved_state, titles, windows_plist, all_data, data_path, bundle):
+        if self.executor is None:
+            self._Apply(saved_state, titles, find_additional_titles(windows_plist, all_data, data_path, bundle))
+            return
+        self.pending.append((saved_state, titles,
+                             self.executor.submit(find_additional_titles, windows_plist, all_data, data_path, bundle)))
+        if len(self.pending) >= self.max_workers * 2:
+            self._ApplyOldest()
+
+    def Finish(self):
+        while self.pending:
+            self._ApplyOldest()
+        if self.executor:
+            self.executor.shutdown()
+
+def ProcessFolder(mac_info, saved_states, user, folder_path, title_decoder):
     files_list = mac_info.ListItemsInFolder(folder_path, EntryType.FILES, include_dates=True)
     bundle = os.path.basename(folder_path)
     data_path = ''
@@ -100,18 +140,19 @@ def ProcessFolder(mac_info, saved_states, user, folder_path):
                             else:
                                 dock_items.add(name)
 
-                if data_path:
-                    all_data_file = mac_info.Open(data_path)
-                    if all_data_file:
-                        all_data = all_data_file.read()
-                        find_additional_titles(plist, all_data, titles, data_path, bundle)
-                    else:
-                        log.error('Failed to open data.data file - {}'.format(data_path)) 
             else:
                 log.error(f'Failed to read plist {file_path}, error was {error}')
 
-            saved_states.append(SavedState('\n'.join(titles), '\n'.join(dock_items), bundle, file_entry['dates']['m_time'], user, file_path))
-            
+            saved_state = SavedState('\n'.join(titles), '\n'.join(dock_items), bundle, file_entry['dates']['m_time'], user, file_path)
+            saved_states.append(saved_state)
+            if success and data_path:
+                all_data_file = mac_info.Open(data_path)
+                if all_data_file:
+                    all_data = all_data_file.read()
+                    title_decoder.Add(saved_state, titles, plist, all_data, data_path, bundle)
+                else:
+                    log.error('Failed to open data.data file - {}'.format(data_path)) 
+
             break
 
 def get_decoded_plist_data(data):
@@ -147,18 +188,14 @@ def get_decoded_plist_data(data):
         log.warning('Plist seems empty!')
     return (name, None)
 
-def get_key_and_title_for_window_id(plist, ns_window_id):
-    key = None
-    title = ''
+def get_keys_and_titles(plist):
+    '''Returns { window_id : (key, title) }, first entry is used if a window_id repeats'''
+    keys_and_titles = {}
     for item in plist:
         w_id = item.get('NSWindowID', None)
-        if w_id == ns_window_id:
-            key = item.get('NSDataKey', None)
-            title = item.get('NSTitle', '')
-            if key == None:
-                log.error("Error fetching key, key was not found for windowID={}!".format(ns_window_id))
-            break
-    return key, title
+        if w_id not in keys_and_titles:
+            keys_and_titles[w_id] = (item.get('NSDataKey', None), item.get('NSTitle', ''))
+    return keys_and_titles
 
 def decrypt(enc_data, key, iv):
     '''Decrypts the data given encrypted data, key and IV'''
@@ -170,24 +207,30 @@ def decrypt(enc_data, key, iv):
         log.exception('Decryption error:')
     return b''
 
-def find_additional_titles(windows_plist, all_data, titles, input_path, bundle_name):
+def find_additional_titles(windows_plist, all_data, input_path, bundle_name):
+    '''Returns list of window titles found in data.data, in the order found'''
+    titles = []
     iv = struct.pack("<IIII", 0, 0, 0, 0)
+    keys_and_titles = get_keys_and_titles(windows_plist)
 
     pos = 0
-    # Parsing data.data
+    # Parsing data.data, records are sliced from a memoryview to avoid copies
+    all_data = memoryview(all_data)
     size_data = len(all_data)
     while (pos + 16) < size_data:
-        magic = all_data[pos:pos+8]
-        ns_window_id, rec_length = struct.unpack(">II", all_data[pos+8:pos+16])
+        magic = bytes(all_data[pos:pos+8])
+        ns_window_id, rec_length = struct.unpack_from(">II", all_data, pos+8)
         pos += 16
         rec_length -= 16
         if (pos + rec_length) <= size_data:
             enc_data = all_data[pos:pos + rec_length]
             if magic != b"NSCR1000":
                 log.error("Unknown header:" + str(magic))
-                return
-                
-            key, title = get_key_and_title_for_window_id(windows_plist, ns_window_id)
+                return titles
+
+            key, title = keys_and_titles.get(ns_window_id, (None, ''))
+            if key is None and ns_window_id in keys_and_titles:
+                log.error("Error fetching key, key was not found for windowID={}!".format(ns_window_id))
 
             if key:
                 dec_data = decrypt(enc_data, key, iv)
@@ -216,10 +259,11 @@ def find_additional_titles(windows_plist, all_data, titles, input_path, bundle_n
                             if restorationID:
                                 embedded_ns_title += f" -> {restorationID}"
                         if embedded_ns_title:
-                            titles.add(embedded_ns_title)
+                            titles.append(embedded_ns_title)
             else:
                 log.debug(f'key not found for window_id={ns_window_id} for {bundle_name}.{ns_window_id}.{pos}, title={title}')
         pos += rec_length
+    return titles
 
 def Plugin_Start(mac_info):
     '''Main Entry point function for plugin'''
@@ -228,6 +272,7 @@ def Plugin_Start(mac_info):
     saved_state_container_path = '{}/Library/Containers' #{}/Data/Library/Saved Application State'
     processed_paths = []
     processed_saved_state_paths = set()
+    title_decoder = AdditionalTitleDecoder()
     for user in mac_info.users:
         user_name = user.user_name
         if user.home_dir == '/private/var/empty': continue # Optimization, nothing should be here!
@@ -241,14 +286,14 @@ def Plugin_Start(mac_info):
                 file_path = source_path + '/' + file_entry['name']
                 if file_entry['type'] == EntryType.FOLDERS:
                     processed_saved_state_paths.add(file_path)
-                    ProcessFolder(mac_info, saved_states, user_name, file_path)
+                    ProcessFolder(mac_info, saved_states, user_name, file_path, title_decoder)
                 else:
                     # Must be an alias (symlink)
                     if mac_info.IsSymbolicLink(file_path):
                         target_path = mac_info.ReadSymLinkTargetPath(file_path)
                         processed_saved_state_paths.add(target_path)
                         if  mac_info.IsValidFolderPath(target_path):
-                            ProcessFolder(mac_info, saved_states, user_name, target_path)
+                            ProcessFolder(mac_info, saved_states, user_name, target_path, title_decoder)
                         else:
                             if mac_info.IsValidFilePath(target_path):
                                 log.warning(f'Symlink target path was not a folder! Symlink file={file_path}, target={target_path}')
@@ -267,9 +312,10 @@ def Plugin_Start(mac_info):
                         if target_folder not in processed_saved_state_paths:
                             processed_saved_state_paths.add(target_folder)
                             log.debug(f'Processing saved state info for container {target_folder}')
-                            ProcessFolder(mac_info, saved_states, user_name, target_folder)
+                            ProcessFolder(mac_info, saved_states, user_name, target_folder, title_decoder)
                         #else:
                         #    log.debug(f'container already processed{target_folder}')
+    title_decoder.Finish()
 
     if len(saved_states) > 0:
         PrintAll(saved_states, mac_info.output_params, '')
@@ -7,6 +7,7 @@
    
 '''
 
+import contextlib
 import logging
 import os
 
@@ -48,8 +49,9 @@ def bswap64(x: int) -> int:
         ((x & 0x00000000000000FF) << 56)
     return x
     
-def ProcessStoreItem(item, id_as_hex, flip_id_endianness):
-    '''Reads a single store item and processes it for output. Returns dictionary'''
+def ProcessStoreItem(item, id_as_hex, flip_id_endianness, column_index=None):
+    '''Reads a single store item and processes it for output. Returns dictionary, or
+       if column_index { column_name : index } is provided, a list in column order'''
     try:
         data_dict = {}
         id = item.id
@@ -83,22 +85,44 @@ def ProcessStoreItem(item, id_as_hex, flip_id_endianness):
                     v = ', '.join([str(x) for x in v])
             data_dict[k] = v
 
-        return data_dict
+        if column_index is None:
+            return data_dict
+        row = [''] * len(column_index)
+        for k, v in data_dict.items():
+            index = column_index.get(k, None)
+            if index is not None: # else not a column
+                row[index] = v
+        return row
     except (OSError, KeyError, ValueError) as ex:
         log.exception ("Failed while processing row data before writing")
 
-def ProcessStoreItems(store_items, store):
-    global writer
-    try:
-        data_list = []
+class StoreItemWriter:
+    '''Converts parsed store items to rows (lists) and writes them out 
+       in large batches, which go to sqlite as a single executemany()'''
+    batch_size = 20000
+
+    def __init__(self, data_writer, column_info):
+        self.writer = data_writer
+        self.column_index = { col[0]: index for index, col in enumerate(column_info) }
+        self.rows = []
+
+    def ProcessStoreItems(self, store_items, store):
+        '''For use as process_items_func in SpotlightStore.ParseMetadataBlocks()'''
+        flip_id_endianness = getattr(store, 'flip_id_endianness', False)
         for item in store_items:
-            data = ProcessStoreItem(item, store.is_ios_store, 
-                                    store.flip_id_endianness if hasattr(store, 'flip_id_endianness') else False)
-            if data:
-                data_list.append(data)
-        writer.WriteRows(data_list)
-    except (OSError, KeyError, ValueError) as ex:
-        log.exception ("Failed to write row data")
+            row = ProcessStoreItem(item, store.is_ios_store, flip_id_endianness, self.column_index)
+            if row:
+                self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.Flush()
+
+    def Flush(self):
+        try:
+            if self.rows:
+                self.writer.WriteRows(self.rows)
+        except (OSError, KeyError, ValueError) as ex:
+            log.exception ("Failed to write row data")
+        self.rows = []
 
 def Get_Column_Info(store):
     '''Returns a list of columns with data types for use with writer''' 
@@ -147,6 +171,7 @@ def CopyOutputParams(output_params):
     op_copy.output_db_path = output_params.output_db_path
     op_copy.export_path = output_params.export_path
     op_copy.export_log_sqlite = output_params.export_log_sqlite
+    op_copy.export_store = output_params.export_store
     op_copy.timezone = output_params.timezone
     return op_copy
 
@@ -208,6 +233,7 @@ def ProcessStoreDb(input_file_path, input_file, output_path, output_params, item
     '''
     items = {}
     global writer
+    out_params = None
     
     output_path_full_paths = os.path.join(output_path, file_name_prefix + '_fullpaths.tsv')
     output_path_data = os.path.join(output_path, file_name_prefix + '_data.txt')
@@ -218,7 +244,7 @@ def ProcessStoreDb(input_file_path, input_file, output_path, output_params, item
             log.info("Creating output folder for spotlight at {}".format(output_path))
             os.makedirs(output_path)
         
-        with open(output_path_data, 'wb') as output_file:
+        with (open(output_path_data, 'wb') if output_params.write_spotlight_data_txt else contextlib.nullcontext()) as output_file:
             output_paths_file = None
             store = spotlight_parser.SpotlightStore(input_file)
             if store.is_ios_store: # The properties, categories and indexes must be stored in external files
@@ -262,14 +288,17 @@ def ProcessStoreDb(input_file_path, input_file, output_path, output_params, item
 
             # set flip_id_endianness in store object for use later
             store.flip_id_endianness = is_boot_volume
+            item_writer = StoreItemWriter(writer, data_type_info)
             total_items_parsed = store.ParseMetadataBlocks(output_file, items, items_to_compare, 
-                                                           process_items_func=ProcessStoreItems)
+                                                           process_items_func=item_writer.ProcessStoreItems)
+            item_writer.Flush()
             writer.FinishWrites()
 
             if total_items_parsed == 0:
                 log.debug('Nothing was parsed from this file!')
             # create Views in ios/user style db
             if store.is_ios_store and (total_items_parsed > 0):
+                writer.sql_writer.Commit(wait=True) # Rows must be in the db, as it is read with another connection
                 create_views_for_ios_db(writer.sql_writer.filepath, writer.sql_writer.table_name)
             
             # Write Paths db as tsv
@@ -284,9 +313,9 @@ def ProcessStoreDb(input_file_path, input_file, output_path, output_params, item
                         WriteFullPaths(items, items_to_compare, output_paths_file, fullpath_writer)
                     else:
                         WriteFullPaths(items, items, output_paths_file, fullpath_writer)
-                    if out_params.write_sql and (total_items_parsed > 0): 
-                        CreateViewAndIndexes(data_type_info, fullpath_writer.sql_writer, file_name_prefix)
-                fullpath_writer.FinishWrites()                
+                fullpath_writer.FinishWrites()
+                if out_params.write_sql and (total_items_parsed > 0): # Once, after all data is loaded
+                    CreateViewAndIndexes(data_type_info, fullpath_writer.sql_writer, file_name_prefix)
             return items
     except spotlight_parser.InvalidFileException as ex:
         # If this is for NSFileProtectionCompleteUnlessOpen/index.spotlightV3/.store.db or 
@@ -297,6 +326,10 @@ def ProcessStoreDb(input_file_path, input_file, output_path, output_params, item
             log.error(str(ex))
     except (KeyError, ValueError, OSError) as ex:
         log.exception(f'Exception processing spotlight store db file -> {str(ex)}')
+    finally:
+        if out_params and out_params.write_sql and (out_params.output_db_path != output_params.output_db_path):
+            # This store had its own <prefix>_spotlight.db, nothing more is written to it
+            SqliteWriterService.StopService(out_params.output_db_path)
 
 def CreateViewAndIndexes(data_type_info, sql_writer, file_name_prefix):
     desired = ['kMDItemContentTypeTree', 'kMDItemContentType', 'kMDItemKind', 'kMDItemMediaTypes', 
@@ -330,23 +363,17 @@ def CreateViewAndIndexes(data_type_info, sql_writer, file_name_prefix):
     else:
         log.error("Failed to create VIEW 'SpotlightDataView-{}'".format(file_name_prefix))
         log.error("Error was : {}".format(error_message))
-    # # creating indexes, commented out for now
-    # log.debug("Trying to add indexes")
-    # query = "CREATE INDEX '{0}_idx_all' ON 'Spotlight-{0}' ({1})".format(file_name_prefix, ", ".join(columns))
-    # success, cursor, error_message = sql_writer.RunQuery(query)
-    # if success:
-    #     log.info("Indexes created for 'Spotlight-{}'".format(file_name_prefix))
-    # else:
-    #     log.error("Failed to create Indexes 'Spotlight-{}'".format(file_name_prefix))
-    #     log.error("Error was : {}".format(error_message))
-
-    # query = "CREATE INDEX '{0}_idx_paths' ON 'Spotlight-{0}-paths' (ID, FullPath)".format(file_name_prefix, ", ".join(columns))
-    # success, cursor, error_message = sql_writer.RunQuery(query)
-    # if success:
-    #     log.info("Indexes created for 'Spotlight-{}'".format(file_name_prefix))
-    # else:
-    #     log.error("Failed to create Indexes 'Spotlight-{}'".format(file_name_prefix))
-    #     log.error("Error was : {}".format(error_message))
+    # Indexes for the view's join, created after the bulk load as that is much faster
+    log.debug("Trying to add indexes")
+    for index_name, table_name in (('idx_id', 'Spotlight-{}'), ('idx_paths_id', 'Spotlight-{}-paths')):
+        table_name = table_name.format(file_name_prefix)
+        query = "CREATE INDEX IF NOT EXISTS '{0}_{1}' ON '{2}' (ID)".format(file_name_prefix, index_name, table_name)
+        success, cursor, error_message = sql_writer.RunQuery(query, writing=True)
+        if success:
+            log.info("Index created for '{}'".format(table_name))
+        else:
+            log.error("Failed to create Index for '{}'".format(table_name))
+            log.error("Error was : {}".format(error_message))
 
 def WriteFullPaths(items, all_items, output_paths_file, fullpath_writer, is_boot_volume=False):
     '''
@@ -358,7 +385,7 @@ def WriteFullPaths(items, all_items, output_paths_file, fullpath_writer, is_boot
     for k,v in list(items.items()):
         name = v[2]
         if name:
-            fullpath = spotlight_parser.RecursiveGetFullPath(v, all_items, suppress_error_messages=(True if is_boot_volume else False))
+            fullpath = spotlight_parser.GetFullPath(v, all_items, suppress_error_messages=(True if is_boot_volume else False))
             to_write = str(k) + '\t' + fullpath + '\r\n'
             output_paths_file.write(to_write.encode('utf-8', 'backslashreplace'))
             path_list.append([k, fullpath])
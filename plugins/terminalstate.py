@@ -90,16 +90,14 @@ def get_decoded_plist_data(data):
         log.warning('Plist seems empty!')
     return (name, None)
 
-def get_key_for_window_id(plist, ns_window_id):
-    key = None
+def get_keys(plist):
+    '''Returns { window_id : key }, first entry is used if a window_id repeats'''
+    keys = {}
     for item in plist:
         w_id = item.get('NSWindowID', None)
-        if w_id == ns_window_id:
-            key = item.get('NSDataKey', None)
-            if key == None:
-                log.error("Error fetching key, key was not found for windowID={}!".format(ns_window_id))
-            break
-    return key
+        if w_id not in keys:
+            keys[w_id] = item.get('NSDataKey', None)
+    return keys
 
 def decrypt(enc_data, key, iv):
     '''Decrypts the data given encrypted data, key and IV'''
@@ -164,12 +162,14 @@ def Process(windows_plist, all_data, terminals, user, data_source):
     iv = struct.pack("<IIII", 0, 0, 0, 0)
 
     if windows_plist:
+        keys = get_keys(windows_plist)
         pos = 0
-        # Parsing data.data
+        # Parsing data.data, records are sliced from a memoryview to avoid copies
+        all_data = memoryview(all_data)
         size_data = len(all_data)
         while (pos + 16) < size_data:
-            magic = all_data[pos:pos+8]
-            ns_window_id, rec_length = struct.unpack(">II", all_data[pos+8:pos+16])
+            magic = bytes(all_data[pos:pos+8])
+            ns_window_id, rec_length = struct.unpack_from(">II", all_data, pos+8)
             pos += 16
             rec_length -= 16
             if (pos + rec_length) <= size_data:
@@ -177,7 +177,9 @@ def Process(windows_plist, all_data, terminals, user, data_source):
                 if magic != b"NSCR1000":
                     log.error("Unknown header:" + str(magic))
 
-                key = get_key_for_window_id(windows_plist, ns_window_id)
+                key = keys.get(ns_window_id, None)
+                if key is None and ns_window_id in keys:
+                    log.error("Error fetching key, key was not found for windowID={}!".format(ns_window_id))
 
                 if key:
                     dec_data = decrypt(enc_data, key, iv)
@@ -7,23 +7,57 @@
 
 '''
 import logging
+import os
 
 from plugins.helpers.macinfo import *
+from plugins.helpers.unifiedlog import UnifiedLogReader
+from plugins.helpers.writer import *
 
 __Plugin_Name = "UNIFIEDLOGEXPORT" # Cannot have spaces, and must be all caps!
 __Plugin_Friendly_Name = "UnifiedLog Export"
-__Plugin_Version = "1.0"
-__Plugin_Description = "Export all UnifiedLog files along with DSC files required for extraction"
+__Plugin_Version = "1.1"
+__Plugin_Description = "Export all UnifiedLog files along with DSC files required for extraction, and parse the tracev3 logs"
 __Plugin_Author = "Yogesh Khatri"
 __Plugin_Author_Email = "yogesh@swiftforensics.com"
 
-__Plugin_Modes = "MACOS"
-__Plugin_ArtifactOnly_Usage = ''
+__Plugin_Modes = "MACOS,ARTIFACTONLY"
+__Plugin_ArtifactOnly_Usage = 'Provide a .logarchive folder, or a folder with the contents of both '\
+                              '/private/var/db/diagnostics and /private/var/db/uuidtext (such as '\
+                              'the Export/UNIFIEDLOGEXPORT folder from a previous run)'
 
 log = logging.getLogger('MAIN.' + __Plugin_Name) # Do not rename or remove this ! This is the logger object
 
 #---- Do not change the variable names in above section ----#
 
+log_info = [ ('Time',DataType.DATE),('Continuous_Time',DataType.INTEGER),('Boot_UUID',DataType.TEXT),
+             ('Thread_ID',DataType.INTEGER),('PID',DataType.INTEGER),('EUID',DataType.INTEGER),
+             ('Type',DataType.TEXT),('Activity_ID',DataType.INTEGER),('Process',DataType.TEXT),
+             ('Library',DataType.TEXT),('Subsystem',DataType.TEXT),('Category',DataType.TEXT),
+             ('Message',DataType.TEXT),('Format_String',DataType.TEXT),('Source',DataType.TEXT)
+           ]
+
+def ParseUnifiedLogs(logs_folder, output_params, source):
+    '''Parses all tracev3 files in logs_folder (laid out like a .logarchive) and 
+       writes out the log entries. Chunksets are decoded in parallel.'''
+    data_writer = ChunkedDataWriter()
+    reader = UnifiedLogReader(logs_folder)
+    rows = []
+    total_logs = 0
+    for chunkset_rows in reader.IterRows():
+        rows.extend(chunkset_rows)
+        if len(rows) >= 100000:
+            data_writer.WriteListPartial("unified logs", "UnifiedLogs", rows, log_info, output_params, source)
+            total_logs += len(rows)
+            rows = []
+    if rows:
+        data_writer.WriteListPartial("unified logs", "UnifiedLogs", rows, log_info, output_params, source)
+        total_logs += len(rows)
+    if total_logs > 0:
+        log.info(f'{total_logs} unified log entries found')
+        data_writer.FinishWrites()
+    else:
+        log.info('No unified log entries found')
+
 def Plugin_Start(mac_info):
     '''Main Entry point function for plugin'''
     version_info = mac_info.GetVersionDictionary()
@@ -43,11 +77,11 @@ def Plugin_Start(mac_info):
     if mac_info.IsValidFolderPath(traceV3_path):
         for item in mac_info.ListItemsInFolder(traceV3_path, EntryType.FILES_AND_FOLDERS, True):
             if item['type'] == EntryType.FILES:
-                mac_info.ExportFile(f'{traceV3_path}/{item['name']}', __Plugin_Name, '', False, True)
+                mac_info.ExportFile(f'{traceV3_path}/{item["name"]}', __Plugin_Name, '', False, True)
             elif item['type'] == EntryType.FOLDERS:
-                mac_info.ExportFolder(f'{traceV3_path}/{item['name']}', __Plugin_Name, True)
+                mac_info.ExportFolder(f'{traceV3_path}/{item["name"]}', __Plugin_Name, True)
             else:
-                log.warning(f'{traceV3_path}/{item['name']} ignored, was neither a file or folder!')
+                log.warning(f'{traceV3_path}/{item["name"]} ignored, was neither a file or folder!')
         log.info('Logs exported.')
     else:
         log.info(f'Unified Logging folder {traceV3_path} not found!')
@@ -56,17 +90,31 @@ def Plugin_Start(mac_info):
     if mac_info.IsValidFolderPath(uuidtext_folder_path):
         for item in mac_info.ListItemsInFolder(uuidtext_folder_path, EntryType.FILES_AND_FOLDERS, True):
             if item['type'] == EntryType.FILES:
-                mac_info.ExportFile(f'{uuidtext_folder_path}/{item['name']}', __Plugin_Name, '', False, True)
+                mac_info.ExportFile(f'{uuidtext_folder_path}/{item["name"]}', __Plugin_Name, '', False, True)
             elif item['type'] == EntryType.FOLDERS:
-                mac_info.ExportFolder(f'{uuidtext_folder_path}/{item['name']}', __Plugin_Name, True)
+                mac_info.ExportFolder(f'{uuidtext_folder_path}/{item["name"]}', __Plugin_Name, True)
             else:
-                log.warning(f'{uuidtext_folder_path}/{item['name']} ignored, was neither a file or folder!')
+                log.warning(f'{uuidtext_folder_path}/{item["name"]} ignored, was neither a file or folder!')
     else:
         log.info(f'Unified Logging folder {uuidtext_folder_path} not found!')
 
-    log.info(f'Unified logs exported to the Export/{__Plugin_Name} folder merging contents of both' + \
-             f'{traceV3_path} and {traceV3_path}, use a tool like macos-UnifiedLogs to parse.')
-    log.info('https://github.com/mandiant/macos-UnifiedLogs')
+    log.info(f'Unified logs exported to the Export/{__Plugin_Name} folder merging contents of both ' + \
+             f'{traceV3_path} and {uuidtext_folder_path}')
+
+    if mac_info.output_params.export_store:
+        log.info('Exported files are in the export store, so unified logs will not be parsed now. Extract them with '\
+                 f'extract_exported_files.py and run this plugin in artifact-only mode on the {__Plugin_Name} folder.')
+        return
+    ParseUnifiedLogs(os.path.join(mac_info.output_params.export_path, __Plugin_Name), mac_info.output_params, traceV3_path)
+
+def Plugin_Start_Standalone(input_files_list, output_params):
+    log.info("Module Started as standalone")
+    for input_path in input_files_list:
+        log.debug("Input folder passed was: " + input_path)
+        if os.path.isdir(input_path):
+            ParseUnifiedLogs(input_path, output_params, input_path)
+        else:
+            log.error(f'Input path {input_path} is not a folder')
 
 if __name__ == '__main__':
     print ("This plugin is a part of a framework and does not run independently on its own!")
\ No newline at end of file
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Plugins are imported as top level modules (like plugin.py does), helpers as plugins.helpers.*
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (repo_folder, os.path.join(repo_folder, 'plugins')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
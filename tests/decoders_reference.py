@@ -0,0 +1,125 @@
+'''
+   The per-item loops that plugins/helpers/decoders.py replaced, as they were
+   in apfs_reader.py, spotlight_parser.py, fsevents.py, ccl_bplist.py and
+   quicklook.py. Used as the reference for parity tests and benchmarks.
+'''
+import struct
+from itertools import chain, zip_longest
+
+def Fletcher64(data, block_size):
+    cnt = block_size//4 - 2
+    data = struct.unpack('<{}I'.format(block_size//4), data)
+    data_first_two_dwords = data[0:2]
+    data_rest = data[2:]
+
+    sum1 = 0
+    sum2 = 0
+
+    for k in range(cnt):
+        sum1 += data_rest[k]
+        sum2 += sum1
+
+    sum1 = sum1 % 0xFFFFFFFF
+    sum2 = sum2 % 0xFFFFFFFF
+
+    # process first 2 dwords now
+    sum1 += data_first_two_dwords[0]
+    sum2 += sum1
+    sum1 += data_first_two_dwords[1]
+    sum2 += sum1
+
+    sum1 = sum1 % 0xFFFFFFFF
+    sum2 = sum2 % 0xFFFFFFFF
+
+    return ((sum2) << 32) | (sum1)
+
+def ReadVarSizeNum(data):
+    '''Returns num and bytes_read'''
+    first_byte = data[0]
+    extra = 0
+    use_lower_nibble = True
+    if first_byte == 0:
+        return 0, 1
+    elif (first_byte & 0xF0) == 0xF0: # 4 or more
+        use_lower_nibble = False
+        if (first_byte & 0x0F)==0x0F: extra = 8
+        elif (first_byte & 0x0E)==0x0E: extra = 7
+        elif (first_byte & 0x0C)==0x0C: extra = 6
+        elif (first_byte & 0x08)==0x08: extra = 5
+        else:
+            extra = 4
+            use_lower_nibble = True
+            first_byte -= 0xF0
+    elif (first_byte & 0xE0) == 0xE0:
+        extra = 3
+        first_byte -= 0xE0
+    elif (first_byte & 0xC0) == 0xC0:
+        extra = 2
+        first_byte -=0xC0
+    elif (first_byte & 0x80) == 0x80:
+        extra = 1
+        first_byte -= 0x80
+
+    if extra:
+        num = 0
+        num += sum(data[x] << (extra - x) * 8 for x in range(1, extra + 1))
+        if use_lower_nibble:
+            num = num + (first_byte << (extra*8))
+        return num, extra + 1
+    return first_byte, extra + 1
+
+def ReadCString(buffer, buffer_size, start_pos):
+    '''
+    Reads null-terminated string starting at start_pos in buffer.
+    Returns tuple (string, end_pos)
+    '''
+    string = ""
+    end_pos = buffer[start_pos:].find(b'\0')
+    if end_pos == -1: # Null not found
+        end_pos = len(buffer)
+        string = buffer[start_pos:].decode("utf-8", "backslashreplace")
+    else:
+        string = buffer[start_pos:start_pos + end_pos].decode("utf-8", "backslashreplace")
+    end_pos += start_pos
+
+    return string, end_pos + 1
+
+def IterCStringRecords(buffer, pos, end, record_format):
+    '''The fsevents record loop, yields (record_pos, string, unpacked_values)'''
+    record_size = struct.calcsize(record_format)
+    while pos < end:
+        record_pos = pos
+        log_filepath, pos = ReadCString(buffer, len(buffer), pos)
+        values = struct.unpack(record_format, buffer[pos:pos + record_size])
+        pos += record_size
+        yield record_pos, log_filepath, values
+
+def DecodeMultibyteInt(b, signed=True):
+    if len(b) == 1:
+        fmt = ">B" # Always unsigned?
+    elif len(b) == 2:
+        fmt = ">h"
+    elif len(b) == 3:
+        if signed:
+            return ((b[0] << 16) | struct.unpack(">H", b[1:])[0]) - ((b[0] >> 7) * 2 * 0x800000)
+        else:
+            return (b[0] << 16) | struct.unpack(">H", b[1:])[0]
+    elif len(b) == 4:
+        fmt = ">i"
+    elif len(b) == 8:
+        fmt = ">q"
+    else:
+        raise ValueError("Cannot decode multibyte int of length {0}".format(len(b)))
+
+    if signed and len(b) > 1:
+        return struct.unpack(fmt.lower(), b)[0]
+    else:
+        return struct.unpack(fmt.upper(), b)[0]
+
+def UnpackBigEndianUints(data, item_size, count):
+    '''The bplist collection refs loop'''
+    return [DecodeMultibyteInt(data[x * item_size : (x + 1) * item_size], False) for x in range(count)]
+
+def ConvertBGRAtoRGBA(data):
+    ret = tuple(chain(*((R,G,B,A) for B,G,R,A in zip_longest(*[iter(data)]*4))))
+    return bytes(ret)
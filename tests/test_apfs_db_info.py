@@ -0,0 +1,29 @@
+'''
+   Tests for the snapshot info saved in the APFS db by helpers/apfs_reader.py
+'''
+import os
+import types
+
+from plugins.helpers.apfs_reader import ApfsDbInfo
+from plugins.helpers.writer import SqliteWriter
+
+def test_snapshot_info(tmp_path):
+    writer = SqliteWriter()
+    writer.OpenSqliteDb(os.path.join(tmp_path, 'apfs.db'))
+    db_info = ApfsDbInfo(writer)
+    assert db_info.GetSnapshotInfo('snap') is None # db not created with a snapshot
+    snapshot_vol = types.SimpleNamespace(uuid='UUID-1', name='Vol_1_Snap_100',
+                                         snapshot=types.SimpleNamespace(name='snap', xid=100, time_created=0))
+    db_info.WriteSnapshotInfo([snapshot_vol], 'snap')
+    assert db_info.GetSnapshotInfo('snap') == { 'UUID-1': (100, 'Vol_1_Snap_100') }
+    assert db_info.GetSnapshotInfo('other') is None
+    writer.CloseDb()
+
+def test_snapshot_not_found_is_saved(tmp_path):
+    writer = SqliteWriter()
+    writer.OpenSqliteDb(os.path.join(tmp_path, 'apfs.db'))
+    db_info = ApfsDbInfo(writer)
+    db_info.WriteSnapshotInfo([], 'missing')
+    assert db_info.GetSnapshotInfo('missing') == {} # searched, but no volume had it, so the db can be reused
+    assert db_info.GetSnapshotInfo('other') is None
+    writer.CloseDb()
@@ -0,0 +1,78 @@
+'''
+   Tests for building the Paths table from DirEntries in helpers/apfs_reader.py,
+   against the recursive query used earlier.
+'''
+import collections
+import logging
+import os
+import random
+import types
+
+from plugins.helpers.apfs_reader import ApfsFileSystemParser
+from plugins.helpers.writer import DataType, SqliteWriter
+
+recursive_query = 'WITH RECURSIVE under_root(path,name,cnid) AS ( VALUES(\'\',\'root\',2) UNION ALL '\
+                  'SELECT under_root.path || \'/\' || d.name, d.name, d.cnid FROM "vol_DirEntries" d '\
+                  'JOIN under_root ON d.parent_cnid=under_root.cnid ORDER BY 1 ) SELECT CNID, Path FROM under_root'
+
+def BuildPaths(tmp_path, dir_entries, batch_size=100000):
+    '''dir_entries is list of (cnid, parent_cnid, name), returns (rows from populate_paths_table, writer)'''
+    writer = SqliteWriter()
+    writer.OpenSqliteDb(os.path.join(tmp_path, 'apfs.db'))
+    writer.CreateTable(collections.OrderedDict([('CNID', DataType.INTEGER), ('Parent_CNID', DataType.INTEGER), ('Name', DataType.TEXT)]), 'vol_DirEntries')
+    writer.WriteRows([list(x) for x in dir_entries], 'vol_DirEntries')
+    writer.CreateTable(collections.OrderedDict([('CNID', DataType.INTEGER), ('Path', DataType.TEXT)]), 'vol_Paths')
+    parser = types.SimpleNamespace(name='vol', dbo=writer)
+    ApfsFileSystemParser.populate_paths_table(parser, batch_size)
+    rows = sorted(writer.conn.execute('SELECT CNID, Path FROM vol_Paths').fetchall())
+    return rows, writer
+
+def RecursiveQueryPaths(writer):
+    return sorted([(cnid, path or '/') for cnid, path in writer.conn.execute(recursive_query).fetchall()])
+
+def test_hard_links_and_orphans(tmp_path, caplog):
+    dir_entries = [ (2, 1, 'root'), (3, 1, 'private-dir'), (30, 3, 'in_private'),
+                    (10, 2, 'Users'), (11, 10, 'a'), (12, 11, 'file.txt'), (13, 11, 'linked_folder'),
+                    (14, 13, 'x'), (15, 14, 'y'), (16, 13, 'z'), (17, 10, 'b'),
+                    (13, 17, 'linked_folder_2'), # folder hard link, its contents are under both
+                    (12, 17, 'file_link'),       # file hard link
+                    (14, 2, 'x_link'),           # hard link to a folder inside a linked folder
+                    (40, 99, 'orphan'), (41, 40, 'orphan_child'), (50, 98, 'orphan_2') ]
+    with caplog.at_level(logging.DEBUG):
+        rows, writer = BuildPaths(tmp_path, dir_entries, batch_size=3)
+    assert rows == RecursiveQueryPaths(writer)
+    assert (15, '/Users/b/linked_folder_2/x/y') in rows and (15, '/x_link/y') in rows
+    assert '3 DirEntries in vol are orphans (not reachable from root), in 2 orphaned subtree(s) and 0 detached folder cycle(s)' in caplog.text
+    writer.CloseDb()
+
+def test_cycles(tmp_path, caplog):
+    dir_entries = [ (2, 1, 'root'), (10, 2, 'a'), (11, 10, 'b'), (10, 11, 'a_again'), (12, 11, 'c'),
+                    (20, 21, 'p'), (21, 20, 'q'), (22, 21, 'r'), (23, 22, 'under_detached_cycle'), # detached cycle
+                    (30, 30, 'self') ]
+    with caplog.at_level(logging.DEBUG):
+        rows, writer = BuildPaths(tmp_path, dir_entries)
+    assert rows == [(2, '/'), (10, '/a'), (10, '/a/b/a_again'), (11, '/a/b'), (12, '/a/b/c')]
+    assert 'Folder cnid=10 at /a/b/a_again is its own ancestor' in caplog.text
+    assert '5 DirEntries in vol are orphans (not reachable from root), in 0 orphaned subtree(s) and 2 detached folder cycle(s)' in caplog.text
+    writer.CloseDb()
+
+def test_random_trees(tmp_path):
+    rng = random.Random(31)
+    for run in range(5):
+        folders = [2]
+        dir_entries = [(2, 1, 'root')]
+        for cnid in range(16, 400):
+            parent = rng.choice(folders)
+            dir_entries.append((cnid, parent, 'item{}'.format(cnid)))
+            if rng.random() < 0.3:
+                folders.append(cnid)
+        for _ in range(5): # folder hard links, to a folder created later, so no cycles
+            parent = rng.choice(folders[:len(folders) // 2])
+            cnid = rng.choice([x for x in folders if x > parent])
+            dir_entries.append((cnid, parent, 'link{}'.format(cnid)))
+        dir_entries.append((1000, 999, 'orphan'))
+        rng.shuffle(dir_entries)
+        rows, writer = BuildPaths(os.path.join(tmp_path), dir_entries, batch_size=rng.choice((7, 100000)))
+        assert rows == RecursiveQueryPaths(writer)
+        writer.CloseDb()
+        os.remove(os.path.join(tmp_path, 'apfs.db'))
@@ -0,0 +1,91 @@
+'''
+   Parity tests for plugins/helpers/decoders.py against the earlier
+   implementations (in decoders_reference.py), on random input.
+'''
+import random
+import struct
+
+import pytest
+
+import decoders_reference as reference
+from plugins.helpers import decoders
+
+@pytest.fixture
+def rng():
+    return random.Random(27)
+
+def RandomBytes(rng, size):
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+@pytest.mark.parametrize('block_size', [8, 4096, 16384, 65536])
+def test_fletcher64(rng, monkeypatch, use_numpy, block_size):
+    if use_numpy and not decoders.numpy_available:
+        pytest.skip('numpy not installed')
+    monkeypatch.setattr(decoders, 'numpy_available', use_numpy)
+    blocks = [RandomBytes(rng, block_size) for _ in range(3)]
+    blocks.append(b'\xFF' * block_size) # largest sums
+    blocks.append(bytes(block_size))
+    for block in blocks:
+        assert decoders.Fletcher64(block, block_size) == reference.Fletcher64(block, block_size)
+    # A block with its checksum set, as stored in APFS, verifies to 0
+    sum1 = sum2 = 0
+    for word in struct.unpack('<{}I'.format(block_size//4 - 2), blocks[0][8:]):
+        sum1 = (sum1 + word) % 0xFFFFFFFF
+        sum2 = (sum2 + sum1) % 0xFFFFFFFF
+    check1 = 0xFFFFFFFF - ((sum1 + sum2) % 0xFFFFFFFF)
+    check2 = 0xFFFFFFFF - ((sum1 + check1) % 0xFFFFFFFF)
+    block = struct.pack('<II', check1, check2) + blocks[0][8:]
+    assert reference.Fletcher64(block, block_size) == 0
+    assert decoders.Fletcher64(block, block_size) == 0
+
+def test_read_var_size_num(rng):
+    for first_byte in range(256):
+        for _ in range(20):
+            data = bytes([first_byte]) + RandomBytes(rng, 8)
+            assert decoders.ReadVarSizeNum(data) == reference.ReadVarSizeNum(data)
+            padded = b'\x01\x02' + data + b'\x03'
+            assert decoders.ReadVarSizeNumAt(padded, 2, 2 + len(data)) == reference.ReadVarSizeNum(data)
+    # Too short to hold the number
+    for data in (b'\x80', b'\xC0\x01', b'\xFF' + bytes(7)):
+        with pytest.raises(IndexError):
+            reference.ReadVarSizeNum(data)
+        with pytest.raises(IndexError):
+            decoders.ReadVarSizeNum(data)
+
+@pytest.mark.parametrize('record_format', ['<QI', '<QIq', '<QIqi'])
+def test_iter_cstring_records(rng, record_format):
+    record_struct = struct.Struct(record_format)
+    buffer = b''
+    for index in range(300):
+        path = '/'.join(rng.choice(['Users', 'private', 'var', 'café', '文件', 'x' * 50])
+                        for _ in range(rng.randint(0, 6)))
+        raw_path = path.encode('utf8')
+        if index % 50 == 7:
+            raw_path += b'\xFF\xFE' # invalid utf8
+        buffer += raw_path + b'\0' + RandomBytes(rng, record_struct.size)
+    end = len(buffer)
+    buffer += RandomBytes(rng, 100) # junk after the records, as in fsevents buffers
+    expected = list(reference.IterCStringRecords(buffer, 0, end, record_format))
+    assert len(expected) == 300
+    assert list(decoders.IterCStringRecords(buffer, 0, end, record_struct)) == expected
+    # Truncated last record
+    buffer = b'/a\0' + bytes(record_struct.size) + b'/b\0' + bytes(record_struct.size - 1)
+    with pytest.raises(struct.error):
+        list(reference.IterCStringRecords(buffer, 0, len(buffer), record_format))
+    with pytest.raises(struct.error):
+        list(decoders.IterCStringRecords(buffer, 0, len(buffer), record_struct))
+
+@pytest.mark.parametrize('item_size', [1, 2, 3, 4, 8])
+def test_unpack_big_endian_uints(rng, item_size):
+    for count in (0, 1, 2, 17, 1000):
+        data = RandomBytes(rng, item_size * count)
+        assert list(decoders.UnpackBigEndianUints(data, item_size, count)) == \
+               reference.UnpackBigEndianUints(data, item_size, count)
+    data = b'\xFF' * item_size * 3
+    assert list(decoders.UnpackBigEndianUints(data, item_size, 3)) == [(1 << (item_size * 8)) - 1] * 3
+
+def test_convert_bgra_to_rgba(rng):
+    for size in (0, 4, 4 * 64 * 64):
+        data = RandomBytes(rng, size)
+        assert decoders.ConvertBGRAtoRGBA(data) == reference.ConvertBGRAtoRGBA(data)
@@ -0,0 +1,122 @@
+'''
+   Tests for the export store in helpers/export_store.py, and exporting
+   files into it with MacInfo.ExportFile()
+'''
+import collections
+import os
+import random
+
+import pytest
+
+from plugins.helpers.export_store import ExportStore, ExportStoreReader
+from plugins.helpers.macinfo import MountedMacInfo, OutputParams
+from plugins.helpers.writer import DataType, SqliteWriter
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(ExportStore, 'chunk_size', 1024)
+    monkeypatch.setattr(ExportStore, 'max_buffered_size', 4096)
+
+def WriteInPieces(store_file, data, rng):
+    pos = 0
+    while pos < len(data):
+        size = rng.choice((1, 100, 1023, 1024, 1500, 5000))
+        store_file.write(data[pos:pos + size])
+        pos += size
+
+def ReadAll(export_path, sha256):
+    reader = ExportStoreReader(export_path)
+    assert reader.Open()
+    try:
+        return reader.Read(sha256)
+    finally:
+        reader.Close()
+
+def test_store_files(tmp_path, small_chunks):
+    rng = random.Random(40)
+    export_path = str(tmp_path)
+    store = ExportStore(export_path, 'zlib')
+    assert store.Open()
+    files = { 'empty': b'', 'small': rng.randbytes(700), 'one_chunk': rng.randbytes(1024),
+              'buffered': b'abc' * 1000, 'large': rng.randbytes(10000) + b'\0' * 3000 }
+    hashes = {}
+    for name, data in files.items():
+        store_file = store.CreateFile(os.path.join(export_path, 'PLUGIN', name))
+        WriteInPieces(store_file, data, rng)
+        assert store_file.tell() == len(data)
+        hashes[name] = store_file.Finish()
+    pack_size = store.pack_offset
+    # Duplicates are not stored again, even when already written out (large file)
+    for name in ('small', 'large'):
+        store_file = store.CreateFile(os.path.join(export_path, 'PLUGIN', name + '_copy'))
+        WriteInPieces(store_file, files[name], rng)
+        assert store_file.Finish() == hashes[name]
+    assert store.pack_offset == pack_size
+    # Failed extraction of a large file, with another file written in between
+    failed_file = store.CreateFile(os.path.join(export_path, 'PLUGIN', 'failed'))
+    failed_file.write(rng.randbytes(6000))
+    pack_size_with_failed = store.pack_offset
+    assert pack_size_with_failed > pack_size
+    other_file = store.CreateFile(os.path.join(export_path, 'PLUGIN', 'other'))
+    other_file.write(rng.randbytes(6000))
+    failed_file.Discard() # Not at the end of the pack, left unused
+    other_data = rng.randbytes(200)
+    other_file.Discard()
+    assert store.pack_offset == pack_size_with_failed
+    other_file.write(other_data)
+    hashes['other'] = other_file.Finish()
+    files['other'] = other_data
+    store.Close()
+    assert store.files_added == 8 and store.files_deduplicated == 2
+    for name, data in files.items():
+        assert ReadAll(export_path, hashes[name]) == data
+
+def test_reopened_store_keeps_used_paths(tmp_path):
+    export_path = str(tmp_path)
+    file_path = os.path.join(export_path, 'PLUGIN', 'file.db')
+    store = ExportStore(export_path, 'zlib')
+    assert store.Open()
+    assert store.GetNextAvailableFileName(file_path) == file_path
+    store_file = store.CreateFile(file_path)
+    store_file.write(b'data')
+    store_file.Finish()
+    store.Close()
+
+    store = ExportStore(export_path, 'zlib')
+    assert store.Open()
+    assert store.GetNextAvailableFileName(file_path) == os.path.join(export_path, 'PLUGIN', 'file01.db')
+    store.Close()
+
+def test_export_file_to_store(tmp_path, small_chunks):
+    rng = random.Random(41)
+    root_path = os.path.join(tmp_path, 'root')
+    os.makedirs(os.path.join(root_path, 'Users'))
+    files = { 'a.bin': rng.randbytes(9000), 'b.txt': b'hello' }
+    for name, data in files.items():
+        with open(os.path.join(root_path, 'Users', name), 'wb') as f:
+            f.write(data)
+    output_params = OutputParams()
+    output_params.output_path = str(tmp_path)
+    output_params.export_path = os.path.join(tmp_path, 'Export')
+    output_params.export_store = ExportStore(output_params.export_path, 'zlib')
+    assert output_params.export_store.Open()
+    export_log_path = SqliteWriter.CreateSqliteDb(os.path.join(tmp_path, 'Exported_Files_Log.db'))
+    output_params.export_log_sqlite = SqliteWriter()
+    output_params.export_log_sqlite.OpenSqliteDb(export_log_path)
+    output_params.export_log_sqlite.CreateTable(collections.OrderedDict([('SourcePath', DataType.TEXT), ('ExportPath', DataType.TEXT),
+                                            ('InodeModifiedTime', DataType.DATE), ('ModifiedTime', DataType.DATE),
+                                            ('CreatedTime', DataType.DATE), ('AccessedTime', DataType.DATE),
+                                            ('SHA256', DataType.TEXT)]), 'ExportedFileInfo')
+    mac_info = MountedMacInfo(root_path, output_params)
+    assert mac_info.ExportFile('/Users/a.bin', 'PLUGIN', '', False)
+    assert mac_info.ExportFile('/Users/a.bin', 'PLUGIN', '', False)
+    assert mac_info.ExportFile('/Users/b.txt', 'PLUGIN', '', False)
+    assert not mac_info.ExportFile('/Users/missing', 'PLUGIN', '', False)
+    output_params.export_store.Close()
+    success, cursor, error_message = output_params.export_log_sqlite.RunQuery('SELECT SourcePath, ExportPath, SHA256 FROM ExportedFileInfo')
+    rows = cursor.fetchall()
+    output_params.export_log_sqlite.CloseDb()
+    assert [row[:2] for row in rows] == [('/Users/a.bin', 'PLUGIN/a.bin'), ('/Users/a.bin', 'PLUGIN/a01.bin'), ('/Users/b.txt', 'PLUGIN/b.txt')]
+    for source_path, export_path_rel, sha256 in rows:
+        assert ReadAll(output_params.export_path, sha256) == files[os.path.basename(source_path)]
+    assert not os.path.exists(os.path.join(output_params.export_path, 'PLUGIN'))
@@ -0,0 +1,50 @@
+'''
+   Tests for the mounted folder inode -> path index in helpers/inode_index.py
+'''
+import os
+
+from plugins.helpers.inode_index import InodePathIndex
+
+def CreateTree(tmp_path):
+    sys_root = os.path.join(tmp_path, 'sys')
+    data_root = os.path.join(tmp_path, 'data')
+    os.makedirs(os.path.join(sys_root, 'System', 'Library'))
+    os.makedirs(os.path.join(data_root, 'Users', 'admin'))
+    for path in (os.path.join(sys_root, 'System', 'Library', 'a.plist'), os.path.join(data_root, 'Users', 'admin', 'b.txt')):
+        with open(path, 'wb') as f:
+            f.write(b'x')
+    return sys_root, data_root
+
+def test_paths_per_root(tmp_path):
+    sys_root, data_root = CreateTree(tmp_path)
+    output_path = os.path.join(tmp_path, 'out')
+    os.makedirs(output_path)
+    index = InodePathIndex(output_path, [(sys_root, '/'), (data_root, '/System/Volumes/Data')])
+    sys_inode = os.stat(os.path.join(sys_root, 'System', 'Library', 'a.plist')).st_ino
+    data_inode = os.stat(os.path.join(data_root, 'Users', 'admin', 'b.txt')).st_ino
+    folder_inode = os.stat(os.path.join(data_root, 'Users', 'admin')).st_ino
+    assert index.GetPath(sys_inode) == '/System/Library/a.plist'
+    assert index.GetPath(data_inode) == '/System/Volumes/Data/Users/admin/b.txt'
+    assert index.GetPath(data_inode, 1) == '/System/Volumes/Data/Users/admin/b.txt'
+    assert index.GetPath(data_inode, 0) == ''
+    assert index.GetParentInode(data_inode) == folder_inode
+
+    # Separately mounted volumes may reuse inode numbers, the same inode in both roots
+    index.conn.execute('INSERT INTO Inodes VALUES (?,?,?,?)', (0, data_inode, 2, '/other_file'))
+    index.conn.commit()
+    assert index.GetPath(data_inode) == '' # Not known which one is meant
+    assert index.GetPath(data_inode, 0) == '/other_file'
+    assert index.GetPath(data_inode, 1) == '/System/Volumes/Data/Users/admin/b.txt'
+    index.Close()
+
+def test_index_is_reused(tmp_path):
+    sys_root, data_root = CreateTree(tmp_path)
+    roots = [(sys_root, '/'), (data_root, '/System/Volumes/Data')]
+    index = InodePathIndex(tmp_path, roots)
+    assert index.Open()
+    index.conn.execute("UPDATE Inodes SET Path='/marker' WHERE Root=0 AND Path='/'")
+    index.conn.commit()
+    index.Close()
+    index = InodePathIndex(tmp_path, roots)
+    assert index.GetPath(os.stat(sys_root).st_ino, 0) == '/marker'
+    index.Close()
@@ -0,0 +1,50 @@
+'''
+   Tests for the statx created time lookups of MountedMacInfo in helpers/macinfo.py
+'''
+import os
+import sys
+import types
+
+import pytest
+
+from plugins.helpers import macinfo
+from plugins.helpers.macinfo import MountedMacInfo, OutputParams
+
+pytestmark = pytest.mark.skipif(sys.platform != 'linux', reason='statx is only used on linux')
+
+def GetMacInfo(tmp_path, num_files):
+    root_path = os.path.join(tmp_path, 'root')
+    os.makedirs(os.path.join(root_path, 'Users'))
+    for index in range(num_files):
+        with open(os.path.join(root_path, 'Users', 'file_{}'.format(index)), 'wb') as f:
+            f.write(b'x')
+    output_params = OutputParams()
+    output_params.output_path = str(tmp_path)
+    return MountedMacInfo(root_path, output_params)
+
+def FakeStatx(monkeypatch, btime):
+    '''Replaces statx, returns list of paths it was called for'''
+    calls = []
+    def statx(path):
+        calls.append(path)
+        return types.SimpleNamespace(stx_mask=macinfo.STATX_BTIME if btime else 0, get_btime=lambda: btime)
+    monkeypatch.setattr(macinfo, 'statx', statx)
+    return calls
+
+def test_statx_not_called_when_filesystem_has_no_btime(tmp_path, monkeypatch):
+    mac_info = GetMacInfo(tmp_path, 5)
+    calls = FakeStatx(monkeypatch, 0) # Like FUSE
+    items = mac_info.ListItemsInFolder('/Users', include_dates=True)
+    assert len(items) == 5
+    assert len(calls) == 1
+    mtime = os.stat(os.path.join(mac_info.macos_root_folder, 'Users', 'file_0')).st_mtime
+    item = [x for x in items if x['name'] == 'file_0'][0]
+    assert item['dates']['cr_time'] == item['dates']['m_time'] == macinfo.CommonFunctions.ReadUnixTime(mtime)
+
+def test_statx_btime_is_cached(tmp_path, monkeypatch):
+    mac_info = GetMacInfo(tmp_path, 5)
+    calls = FakeStatx(monkeypatch, 1600000000)
+    for _ in range(3):
+        items = mac_info.ListItemsInFolder('/Users', include_dates=True)
+        assert all(x['dates']['cr_time'] == macinfo.CommonFunctions.ReadUnixTime(1600000000) for x in items)
+    assert len(calls) == 5
@@ -0,0 +1,106 @@
+'''
+   Tests for skipping unchanged plugins & re-exporting their earlier output
+   in helpers/run_manifest.py
+'''
+import datetime
+import os
+import sqlite3
+
+import openpyxl
+
+from plugins.helpers.macinfo import OutputParams
+from plugins.helpers.run_manifest import RunManifest
+from plugins.helpers.writer import DataType, DataWriter, ExcelWriter, SqliteWriter
+
+column_info = [('Name', DataType.TEXT), ('Date', DataType.DATE), ('Data', DataType.BLOB)]
+row = ['a', datetime.datetime(2021, 5, 6, 7, 8, 9), b'\x01\x02']
+
+def GetOutputParams(output_path, run):
+    output_params = OutputParams()
+    output_params.output_path = str(output_path)
+    output_params.export_path = os.path.join(output_path, 'Export')
+    output_params.write_sql = True
+    output_params.output_db_path = SqliteWriter.CreateSqliteDb(os.path.join(output_path, 'mac_apt_{}.db'.format(run)))
+    output_params.write_xlsx = True
+    output_params.xlsx_writer = ExcelWriter()
+    output_params.xlsx_writer.CreateXlsxFile(os.path.join(output_path, 'mac_apt_{}.xlsx'.format(run)))
+    output_params.apfs_db_path = os.path.join(output_path, 'APFS_Volumes.db')
+    output_params.run_manifest = RunManifest(str(output_path), 'MOUNTED', str(output_path))
+    return output_params
+
+def WriteVolumesInfo(db_path, num_files):
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE IF NOT EXISTS Volumes_Info (Name TEXT, Files INTEGER)')
+    conn.execute('DELETE FROM Volumes_Info')
+    conn.execute('INSERT INTO Volumes_Info VALUES (?, ?)', ('Macintosh HD', num_files))
+    conn.commit()
+    conn.close()
+
+def RunPlugins(output_params):
+    run_manifest = output_params.run_manifest
+    # Only writes tables
+    run_manifest.StartPlugin('TABLES', output_params)
+    writer = DataWriter(output_params, 'TABLES', column_info)
+    writer.WriteRow(list(row))
+    writer.FinishWrites()
+    run_manifest.EndPlugin(None, True)
+    # Reads the APFS db
+    run_manifest.StartPlugin('APFSDB', output_params)
+    run_manifest.RecordDbInput(output_params.apfs_db_path, 'Volumes_Info')
+    writer = DataWriter(output_params, 'APFSDB', column_info)
+    writer.WriteRow(list(row))
+    writer.FinishWrites()
+    run_manifest.EndPlugin(None, True)
+    # Writes its own folder
+    run_manifest.StartPlugin('FOLDER', output_params)
+    os.makedirs(os.path.join(output_params.output_path, 'FOLDER_output'), exist_ok=True)
+    run_manifest.EndPlugin(None, True)
+    # Exports a file
+    run_manifest.StartPlugin('EXPORT', output_params)
+    run_manifest.RecordOtherOutput(os.path.join(output_params.export_path, 'EXPORT', 'file'))
+    run_manifest.EndPlugin(None, True)
+
+def test_unchanged_plugins(tmp_path):
+    output_params = GetOutputParams(tmp_path, 1)
+    WriteVolumesInfo(output_params.apfs_db_path, 10)
+    RunPlugins(output_params)
+    output_params.xlsx_writer.CommitAndCloseFile()
+
+    output_params = GetOutputParams(tmp_path, 2)
+    run_manifest = output_params.run_manifest
+    db_path = output_params.output_db_path
+    assert run_manifest.IsPluginUnchanged('TABLES', None, db_path)
+    assert run_manifest.IsPluginUnchanged('APFSDB', None, db_path)
+    assert not run_manifest.IsPluginUnchanged('FOLDER', None, db_path)
+    assert not run_manifest.IsPluginUnchanged('EXPORT', None, db_path)
+    WriteVolumesInfo(output_params.apfs_db_path, 11)
+    assert not run_manifest.IsPluginUnchanged('APFSDB', None, db_path)
+
+    # Folder already exists in this run, plugin is still not skipped later
+    RunPlugins(output_params)
+    output_params.xlsx_writer.CommitAndCloseFile()
+    output_params = GetOutputParams(tmp_path, 3)
+    run_manifest = output_params.run_manifest
+    assert not run_manifest.IsPluginUnchanged('FOLDER', None, output_params.output_db_path)
+    assert not run_manifest.IsPluginUnchanged('EXPORT', None, output_params.output_db_path)
+    output_params.xlsx_writer.CommitAndCloseFile()
+
+def test_re_export_keeps_column_types(tmp_path):
+    output_params = GetOutputParams(tmp_path, 1)
+    RunPlugins(output_params)
+    output_params.xlsx_writer.CommitAndCloseFile()
+
+    output_params = GetOutputParams(tmp_path, 2)
+    assert output_params.run_manifest.ReExportPlugin('TABLES', output_params)
+    output_params.xlsx_writer.CommitAndCloseFile()
+
+    conn = sqlite3.connect(output_params.output_db_path)
+    assert conn.execute('SELECT * FROM TABLES').fetchall() == [('a', '2021-05-06 07:08:09', b'\x01\x02')]
+    assert [x[1:3] for x in conn.execute('PRAGMA table_info(TABLES)')] == [('Name', 'TEXT'), ('Date', 'TEXT'), ('Data', 'BLOB')]
+    conn.close()
+    sheets = []
+    for run in (1, 2):
+        workbook = openpyxl.load_workbook(os.path.join(tmp_path, 'mac_apt_{}.xlsx'.format(run)))
+        sheets.append([[cell.value for cell in sheet_row] for sheet_row in workbook['TABLES'].iter_rows()])
+    assert sheets[0] == sheets[1]
+    assert sheets[1][1][1] == row[1]
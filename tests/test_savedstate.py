@@ -0,0 +1,126 @@
+'''
+   Tests for decoding data.data with the keys from windows.plist, in the
+   SAVEDSTATE and TERMINALSTATE plugins, on synthetic saved state files
+   built here. Expected values are what the earlier decoder (with a
+   linear search of windows.plist for every record) returned for them.
+'''
+import os
+import plistlib
+import struct
+
+from Crypto.Cipher import AES
+
+import savedstate
+import terminalstate
+from plugins.helpers.common import CommonFunctions
+
+UID = plistlib.UID
+KEYS = { 1: b'1' * 16, 2: b'2' * 16, 5: b'5' * 16 }
+
+def KeyedArchive(root):
+    '''Returns an NSKeyedArchiver plist holding root, a dict or list of dicts (of plain values)'''
+    objects = ['$null']
+    def AddObject(value):
+        objects.append(value)
+        return UID(len(objects) - 1)
+    def Add(value):
+        if isinstance(value, dict):
+            uid = AddObject(None)
+            objects[uid.data] = { 'NS.keys': [Add(k) for k in value], 'NS.objects': [Add(v) for v in value.values()],
+                                  '$class': AddObject({ '$classname': 'NSDictionary', '$classes': ['NSDictionary', 'NSObject'] }) }
+            return uid
+        if isinstance(value, list):
+            uid = AddObject(None)
+            objects[uid.data] = { 'NS.objects': [Add(v) for v in value],
+                                  '$class': AddObject({ '$classname': 'NSArray', '$classes': ['NSArray', 'NSObject'] }) }
+            return uid
+        return AddObject(value)
+    top = Add(root)
+    return plistlib.dumps({ '$archiver': 'NSKeyedArchiver', '$version': 100000, '$top': { 'root': top },
+                            '$objects': objects }, fmt=plistlib.FMT_BINARY)
+
+def Record(window_id, name, payload, key=None, magic=b'NSCR1000'):
+    '''Returns an encrypted data.data record'''
+    data = b'\0\0\0\0' + struct.pack('>I', len(name)) + name + b'rchv' + struct.pack('>I', len(payload)) + payload
+    data += b'\0' * (-len(data) % 16)
+    encrypted = AES.new(key or KEYS[window_id], AES.MODE_CBC, bytes(16)).encrypt(data)
+    return magic + struct.pack('>II', window_id, len(encrypted) + 16) + encrypted
+
+def WindowsPlist(path):
+    windows = [ { 'NSWindowID': 1, 'NSDataKey': KEYS[1], 'NSTitle': 'One' },
+                { 'NSWindowID': 2, 'NSDataKey': KEYS[2], 'NSTitle': 'Two' },
+                { 'NSWindowID': 2, 'NSDataKey': b'x' * 16, 'NSTitle': 'Two again' }, # first one is used
+                { 'NSWindowID': 3, 'NSTitle': 'No key' },
+                { 'NSWindowID': 5, 'NSDataKey': KEYS[5], 'NSTitle': 'Five' } ]
+    with open(path, 'wb') as f:
+        plistlib.dump(windows, f, fmt=plistlib.FMT_BINARY)
+    return CommonFunctions.ReadPlist(path)[1]
+
+def Write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def SavedStateData():
+    def Window(title, url):
+        return KeyedArchive({ 'NSTitle': title, 'WindowState': { 'TargetURL': url } })
+    return b''.join([
+        Record(1, b'_NSWindow', Window(' Documents ', 'file:///Users/a/Documents/')),
+        Record(2, b'_NSWindow', Window('Downloads', 'file:///Users/a/Downloads/')),
+        Record(2, b'other', Window('Not a window', '')),
+        Record(3, b'_NSWindow', Window('No key', ''), key=b'3' * 16),
+        Record(9, b'_NSWindow', Window('Unknown window', ''), key=b'9' * 16),
+        Record(5, b'_NSWindow', Window('', 'file:///Applications/')),
+        Record(1, b'_NSWindow', Window(' Documents ', 'file:///Users/a/Documents/')),
+        Record(5, b'_NSWindow', Window('After bad record', ''), magic=b'NSCR9999'),
+        Record(1, b'_NSWindow', Window('Never read', ''))
+        ])
+
+def test_savedstate_titles(tmp_path):
+    windows_plist = WindowsPlist(os.path.join(tmp_path, 'windows.plist'))
+    data = SavedStateData()
+    titles = savedstate.find_additional_titles(windows_plist, data, 'data.data', 'com.apple.finder.savedState')
+    assert titles == [ 'Documents -> file:///Users/a/Documents/', 'Downloads -> file:///Users/a/Downloads/',
+                       ' -> file:///Applications/', 'Documents -> file:///Users/a/Documents/' ]
+    titles = savedstate.find_additional_titles(windows_plist, data, 'data.data', 'com.apple.Safari.savedState')
+    assert titles == [ 'Documents', 'Downloads', 'Documents' ]
+
+def test_savedstate_worker_processes(tmp_path, monkeypatch):
+    windows_plist = WindowsPlist(os.path.join(tmp_path, 'windows.plist'))
+    data = SavedStateData()
+    results = []
+    for cpu_count in (1, 3):
+        monkeypatch.setattr(os, 'cpu_count', lambda: cpu_count)
+        decoder = savedstate.AdditionalTitleDecoder()
+        assert (decoder.executor is None) == (cpu_count == 1)
+        saved_states = []
+        for index in range(8):
+            saved_state = savedstate.SavedState('One', '', 'bundle', None, 'user', 'src')
+            bundle = 'com.apple.finder.savedState' if index % 2 else 'com.apple.Safari.savedState'
+            decoder.Add(saved_state, {'One'}, windows_plist, data, 'data.data', bundle)
+            saved_states.append(saved_state)
+        decoder.Finish()
+        results.append([sorted(x.window_title.split('\n')) for x in saved_states])
+    assert results[0] == results[1]
+    assert results[0][0] == [ 'Documents', 'Downloads', 'One' ]
+
+def test_terminalstate(tmp_path):
+    def Window(title, working_dir, contents):
+        return KeyedArchive([{ 'NSTitle': title, 'TTWindowState': { 'Window Settings': [
+                                { 'Tab Contents': contents, 'Tab Working Directory URL String': working_dir }] } }])
+    windows_plist_path = os.path.join(tmp_path, 'windows.plist')
+    data_path = os.path.join(tmp_path, 'data.data')
+    WindowsPlist(windows_plist_path)
+    Write(data_path, b''.join([
+        Record(1, b'_NSWindow', Window('bash', 'file:///Users/a/', [b'$ ls\n', b'file.txt\n'])),
+        Record(2, b'_NSWindow', Window('zsh', 'file:///tmp/', [b'% pwd\n'])),
+        Record(1, b'_NSWindow', Window('bash', 'file:///Users/a/', [b'$ ls\n', b'file.txt\n'])), # duplicate
+        Record(9, b'_NSWindow', Window('unknown', '', []), key=b'9' * 16),
+        Record(5, b'other', Window('not a window', '', [])),
+        Record(5, b'_NSWindow', Window('top', 'file:///', [b'top\n', 'not bytes']))
+        ]))
+    terminals = []
+    terminalstate.ProcessFile(windows_plist_path, data_path, terminals)
+    assert [(x.title, x.working_dir, x.content, x.source) for x in terminals] == [
+            ('bash', 'file:///Users/a/', '$ ls\nfile.txt\n', data_path),
+            ('zsh', 'file:///tmp/', '% pwd\n', data_path),
+            ('top', 'file:///', 'top\n', data_path) ]
@@ -0,0 +1,165 @@
+'''
+   Tests for helpers/unifiedlog.py, on a small synthetic .logarchive
+   (timesync, uuidtext & tracev3 files) built here.
+'''
+import datetime
+import os
+import plistlib
+import struct
+import uuid
+
+import lz4.block
+import pytest
+
+from plugins.helpers import unifiedlog
+from plugins.helpers.unifiedlog import UnifiedLogReader
+
+BOOT_UUID = uuid.UUID('11111111-2222-3333-4444-555555555555')
+MAIN_UUID = uuid.UUID('AAAAAAAA-BBBB-CCCC-DDDD-EEEEEEEEEEEE')
+SENDER_UUID = uuid.UUID('12345678-9ABC-DEF0-1234-56789ABCDEF0')
+BOOT_TIME = 1700000000 * 1000000000 # ns since 1970
+NUMERATOR, DENOMINATOR = 125, 3
+FIRST_PROC_ID, SECOND_PROC_ID = 0x100, 0x200
+PID, EUID = 321, 501
+SUBSYSTEM_ID = 0x41
+
+format_strings = { 0x10: 'Hello %d %s', 0x40: 'count=%u name=%{public}s' }
+
+def Align8(data):
+    return data + b'\0' * (-len(data) % 8)
+
+def Chunk(tag, data, sub_tag=0):
+    return Align8(struct.pack('<IIQ', tag, sub_tag, len(data)) + data)
+
+def TimesyncFile():
+    boot = struct.pack('<HHI16sIIq', 0xBBB0, 48, 0, BOOT_UUID.bytes, NUMERATOR, DENOMINATOR, BOOT_TIME)
+    boot += b'\0' * (48 - len(boot))
+    # 1 second after boot (in mach ticks), the wall clock was 5 seconds past boot_time
+    sync = struct.pack('<HHIQq8x', 0x7354, 32, 0, 1000000000 * DENOMINATOR // NUMERATOR, BOOT_TIME + 5000000000)
+    return boot + sync
+
+def UuidTextFile():
+    ranges = b''
+    strings = b''
+    for range_start, format_string in sorted(format_strings.items()):
+        string_data = format_string.encode('utf8') + b'\0'
+        ranges += struct.pack('<II', range_start, len(string_data))
+        strings += string_data
+    header = struct.pack('<IIII', 0x66778899, 2, 1, len(format_strings))
+    return header + ranges + strings + b'/usr/bin/testapp\0'
+
+def Catalog():
+    uuids = MAIN_UUID.bytes
+    strings = Align8(b'com.test.subsystem\0general\0')
+    proc = struct.pack('<HHHHQIIIIII', 0, 0, 0, 0xFFFF, FIRST_PROC_ID, SECOND_PROC_ID, PID, EUID, 0, 0, 0)
+    proc += struct.pack('<II', 1, 0) + Align8(struct.pack('<HHH', SUBSYSTEM_ID, 0, 19))
+    header = struct.pack('<HHHHHxxxxxxxxxxxxxx', len(uuids), len(uuids) + len(strings), 1, 0, 0)
+    return Chunk(unifiedlog.CHUNK_CATALOG, header + uuids + strings + proc)
+
+def MessageItems(number, text):
+    string_data = text.encode('utf8') + b'\0'
+    return bytes((0, 2)) + bytes((0x00, 4)) + struct.pack('<i', number) + \
+           bytes((0x22, 4)) + struct.pack('<HH', 0, len(string_data)) + string_data
+
+def FirehoseEntry(format_location, thread_id, time_delta, number, text):
+    flags = unifiedlog.FORMATTER_MAIN_EXE | unifiedlog.FLAG_HAS_SUBSYSTEM
+    data = struct.pack('<I', 0) + struct.pack('<H', SUBSYSTEM_ID) + MessageItems(number, text)
+    return Align8(struct.pack('<BBHIQIHH', unifiedlog.ACTIVITY_NONACTIVITY, 0x01, flags, format_location,
+                              thread_id, time_delta, 0, len(data)) + data)
+
+def Firehose(base_time, entries):
+    data = b''.join(entries)
+    header = struct.pack('<QIBBHHH4xQ', FIRST_PROC_ID, SECOND_PROC_ID, 0, 0, 0, 16 + len(data), 0, base_time)
+    return Chunk(unifiedlog.CHUNK_FIREHOSE, header + data)
+
+def Simpledump(continuous_time, subsystem, message):
+    subsystem = subsystem.encode('utf8') + b'\0'
+    message = message.encode('utf8') + b'\0'
+    data = struct.pack('<QQQQQ16sQ12xII', FIRST_PROC_ID, SECOND_PROC_ID, continuous_time, 77, 0, SENDER_UUID.bytes,
+                       0, len(subsystem), len(message))
+    return Chunk(unifiedlog.CHUNK_SIMPLEDUMP, data + subsystem + message)
+
+def Statedump(continuous_time, title, state):
+    state_data = plistlib.dumps(state, fmt=plistlib.FMT_BINARY)
+    data = struct.pack('<QI4xQQQ8xII', FIRST_PROC_ID, SECOND_PROC_ID, continuous_time, 9, 0, 1, len(state_data))
+    data += b'\0' * (184 - len(data)) + title.encode('utf8').ljust(64, b'\0')
+    return Chunk(unifiedlog.CHUNK_STATEDUMP, data + state_data)
+
+def Chunkset(chunks, compress):
+    data = b''.join(chunks)
+    if compress:
+        compressed = lz4.block.compress(data, store_size=False)
+        block = b'bv41' + struct.pack('<II', len(data), len(compressed)) + compressed
+    else:
+        block = b'bv4-' + struct.pack('<I', len(data)) + data
+    return Chunk(unifiedlog.CHUNK_CHUNKSET, block + b'bv4$')
+
+def TraceV3File(chunksets):
+    boot_info = struct.pack('<II', 0x6102, 16) + BOOT_UUID.bytes
+    header = struct.pack('<II', NUMERATOR, DENOMINATOR) + b'\0' * 32 + boot_info
+    return Chunk(unifiedlog.CHUNK_HEADER, header) + Catalog() + b''.join(chunksets)
+
+def WriteFile(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+@pytest.fixture
+def logs_folder(tmp_path):
+    folder = str(tmp_path)
+    WriteFile(os.path.join(folder, 'timesync', '0000000000000001.timesync'), TimesyncFile())
+    main_hex = MAIN_UUID.hex.upper()
+    WriteFile(os.path.join(folder, main_hex[0:2], main_hex[2:]), UuidTextFile())
+    one_second = 1000000000 * DENOMINATOR // NUMERATOR
+    WriteFile(os.path.join(folder, 'Persist', '0000000000000001.tracev3'), TraceV3File([
+        Chunkset([Firehose(one_second, [FirehoseEntry(0x10, 5, 0, 42, 'world'),
+                                        FirehoseEntry(0x40, 6, 10, 7, 'seven')])], compress=True),
+        Chunkset([Simpledump(one_second, 'com.test.simple', 'simple message')], compress=False)
+        ]))
+    WriteFile(os.path.join(folder, 'Special', '0000000000000002.tracev3'), TraceV3File([
+        Chunkset([Statedump(one_second * 2, 'State title', {'key': 'value'})], compress=True)] +
+        [Chunkset([Firehose(one_second, [FirehoseEntry(0x10, 8, x, x, 'item{}'.format(x)) for x in range(20)])],
+                  compress=bool(index % 2)) for index in range(10)]
+        ))
+    return folder
+
+def ReadRows(logs_folder, max_workers):
+    rows = []
+    for chunkset_rows in UnifiedLogReader(logs_folder, max_workers).IterRows():
+        rows.extend(chunkset_rows)
+    return [dict(zip(unifiedlog.column_names, row)) for row in rows]
+
+def test_firehose(logs_folder):
+    rows = ReadRows(logs_folder, 1)
+    row = rows[0]
+    assert row['Message'] == 'Hello 42 world'
+    assert row['Format_String'] == 'Hello %d %s'
+    assert row['Type'] == 'Info'
+    assert (row['PID'], row['EUID'], row['Thread_ID']) == (PID, EUID, 5)
+    assert row['Process'] == row['Library'] == '/usr/bin/testapp'
+    assert (row['Subsystem'], row['Category']) == ('com.test.subsystem', 'general')
+    assert row['Boot_UUID'] == str(BOOT_UUID).upper()
+    assert row['Source'] == 'Persist/0000000000000001.tracev3'
+    assert row['Time'] == datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=BOOT_TIME // 1000000000 + 5)
+    assert rows[1]['Message'] == 'count=7 name=seven'
+    assert rows[1]['Continuous_Time'] == rows[0]['Continuous_Time'] + 10
+
+def test_simpledump(logs_folder):
+    row = ReadRows(logs_folder, 1)[2]
+    assert row['Type'] == 'Simpledump'
+    assert row['Message'] == 'simple message'
+    assert row['Subsystem'] == 'com.test.simple'
+    assert row['Thread_ID'] == 77
+    assert row['Process'] == '/usr/bin/testapp'
+
+def test_statedump(logs_folder):
+    row = ReadRows(logs_folder, 1)[3]
+    assert row['Type'] == 'Statedump'
+    assert row['Message'] == "State title: {'key': 'value'}"
+    assert row['Activity_ID'] == 9
+    assert row['Source'] == 'Special/0000000000000002.tracev3'
+
+def test_worker_count_does_not_change_output(logs_folder):
+    rows = ReadRows(logs_folder, 1)
+    assert len(rows) == 4 + 10 * 20
+    assert ReadRows(logs_folder, 3) == rows
@@ -0,0 +1,86 @@
+'''
+   Tests for the shared sqlite writer service and the jsonl writer in helpers/writer.py
+'''
+import collections
+import gzip
+import json
+import os
+import sqlite3
+
+import pytest
+
+from plugins.helpers.writer import DataType, JsonlWriter, SharedSqliteWriter, SqliteWriter, SqliteWriterService
+
+column_info = [('Name', DataType.TEXT), ('Size', DataType.INTEGER)]
+
+def test_rows_are_copied_when_queued(tmp_path):
+    db_path = os.path.join(tmp_path, 'out.db')
+    writer = SharedSqliteWriter(db_path)
+    table_name = writer.CreateTable(column_info, 'Files')
+    row = ['a', 1]
+    rows = [row]
+    writer.WriteRows(rows)
+    row[0] = 'changed' # caller reuses its row & list before they are written
+    rows.clear()
+    writer.WriteRow(['b', 2])
+    writer.Commit(wait=True)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT * FROM "{}"'.format(table_name)).fetchall() == [('a', 1), ('b', 2)]
+    conn.close()
+
+def test_run_query_returns_cursor(tmp_path):
+    shared_db_path = os.path.join(tmp_path, 'shared.db')
+    db_path = os.path.join(tmp_path, 'own.db')
+    shared_writer = SharedSqliteWriter(shared_db_path)
+    shared_writer.CreateTable(column_info, 'Files')
+    shared_writer.WriteRows([['a', 1], ['b', 2], ['c', 3]])
+    writer = SqliteWriter()
+    writer.OpenSqliteDb(db_path)
+    writer.CreateTable(collections.OrderedDict(column_info), 'Files')
+    writer.WriteRows([['a', 1], ['b', 2], ['c', 3]])
+    query = 'SELECT Name, Size FROM Files ORDER BY Size'
+    for sql_writer in (shared_writer, writer):
+        success, cursor, error_message = sql_writer.RunQuery(query)
+        assert success and not error_message
+        assert [x[0] for x in cursor.description] == ['Name', 'Size']
+        assert cursor.fetchone() == ('a', 1)
+        assert [tuple(x) for x in cursor] == [('b', 2), ('c', 3)]
+        assert cursor.fetchall() == []
+        success, cursor, error_message = sql_writer.RunQuery(query, return_named_objects=True)
+        assert [row['Name'] for row in cursor.fetchall()] == ['a', 'b', 'c']
+        success, cursor, error_message = sql_writer.RunQuery('SELECT * FROM Missing')
+        assert not success and error_message
+    writer.CloseDb()
+
+def test_queued_rows_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(SqliteWriterService, 'max_queued_rows', 10)
+    db_path = os.path.join(tmp_path, 'bounded.db')
+    writer = SharedSqliteWriter(db_path)
+    service = writer.service
+    table_name = writer.CreateTable(column_info, 'Files')
+    for index in range(20):
+        writer.WriteRows([['a', index]] * 7)
+        assert service.queued_rows <= 10
+    writer.WriteRows([['big', 0]] * 25) # Larger than the bound, still written
+    SqliteWriterService.StopService(db_path)
+    assert not service.thread.is_alive()
+    assert service.queued_rows == 0
+    assert SqliteWriterService.GetService(db_path) is not service
+    SqliteWriterService.StopService(db_path)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT count(*) FROM "{}"'.format(table_name)).fetchone()[0] == 20 * 7 + 25
+    conn.close()
+
+@pytest.mark.parametrize('compression', [None, 'gz'])
+def test_jsonl_bad_values_do_not_lose_batch(tmp_path, compression):
+    writer = JsonlWriter(compression=compression)
+    writer.CreateJsonlFile(os.path.join(tmp_path, 'out.jsonl'))
+    writer.AddHeaders(collections.OrderedDict(column_info))
+    writer.WriteRows([['ok1', 1], ['bad\udcff', 2], ['ok3', 3]]) # lone surrogate can't be encoded as utf-8
+    writer.WriteRows([['ok4', 4], { ('not', 'a', 'str'): 5 }, ['ok6', 6]]) # a row json can't convert
+    writer.Cleanup()
+    opener = gzip.open if compression else open
+    with opener(writer.filepath, 'rt', encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f]
+    assert [(row['Name'], row['Size']) for row in rows] == \
+        [('ok1', 1), ('bad\udcff', 2), ('ok3', 3), ('ok4', 4), ('ok6', 6)]